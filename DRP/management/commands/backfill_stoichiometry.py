@@ -0,0 +1,52 @@
+"""Set the stored stoichiometry of compounds from their formulae."""
+from django.core.management.base import BaseCommand
+from DRP.models import Compound
+from DRP.models.Compound import parseFormula, dumpStoichiometry, repeatsElements
+from DRP.models.querysets import chunked
+
+# The number of compounds to update in each statement
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+
+    """Store the parsed stoichiometry of every compound whose stored stoichiometry is missing or out of date."""
+
+    help = 'Set the stored stoichiometry of every compound from its formula.'
+
+    def add_arguments(self, parser):
+        """Add arguments for the argument parser."""
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Count the compounds which would be updated without updating them.')
+
+    def handle(self, *args, **kwargs):
+        """Handle the call for this command."""
+        # grouped in python rather than by the database, whose collation may not distinguish CO from Co
+        stale = {}
+        malformed = 0
+        repeating = 0
+        for pk, formula, stored in Compound.objects.values_list('pk', 'formula', 'stoichiometry').iterator():
+            try:
+                stoichiometry = dumpStoichiometry(parseFormula(formula))
+            except ValueError:
+                self.stderr.write('Compound {} has the malformed formula {}'.format(pk, formula))
+                malformed += 1
+                stoichiometry = ''
+            else:
+                if repeatsElements(formula):
+                    # summed, except for a repeat ending the formula without a count, which is counted once
+                    self.stderr.write('Compound {} repeats an element in its formula {}; check its stoichiometry {}'.format(
+                        pk, formula, stoichiometry))
+                    repeating += 1
+            if stoichiometry != stored:
+                stale.setdefault(stoichiometry, []).append(pk)
+
+        total = 0
+        for stoichiometry, pks in stale.items():
+            if not kwargs['dry_run']:
+                # updated directly, since saving each compound would recalculate its descriptors
+                for batch in chunked(pks, BATCH_SIZE):
+                    Compound.objects.filter(pk__in=batch).update(stoichiometry=stoichiometry)
+            total += len(pks)
+        self.stdout.write('{} the stoichiometry of {} compounds; {} have malformed formulae and {} repeat elements.'.format(
+            'Would update' if kwargs['dry_run'] else 'Updated', total, malformed, repeating))
@@ -0,0 +1,160 @@
+"""Compare the expanded export row engines on a synthetic set of reactions."""
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.test.utils import override_settings
+from DRP.models import LabGroup, Reaction, Compound, CompoundRole, CompoundQuantity
+from DRP.models import BoolRxnDescriptor, NumRxnDescriptor, OrdRxnDescriptor, CatRxnDescriptor, CategoricalDescriptorPermittedValue
+from DRP.models import BoolRxnDescriptorValue, NumRxnDescriptorValue, OrdRxnDescriptorValue, CatRxnDescriptorValue
+from itertools import chain
+import hashlib
+import random
+import time
+
+SOFTWARE = 'rowEngineBenchmark'
+
+
+class DigestWriter(object):
+
+    """A file-like object which keeps only a digest and the length of what is written to it."""
+
+    def __init__(self):
+        """Initialise the digest."""
+        self.digest = hashlib.md5()
+        self.size = 0
+
+    def write(self, data):
+        """Add data to the digest."""
+        self.digest.update(data)
+        self.size += len(data)
+
+
+class Command(BaseCommand):
+
+    """Build a synthetic database of reactions and compare the expanded export row engines on it."""
+
+    help = 'Compare the rows and pivot expanded export engines on a synthetic set of reactions. Requires TESTING.'
+
+    def add_arguments(self, parser):
+        """Add arguments for the argument parser."""
+        parser.add_argument('-r', '--reactions', type=int, default=3000,
+                            help='Number of synthetic reactions.')
+        parser.add_argument('-d', '--descriptors', type=int, default=564,
+                            help='Number of synthetic reaction descriptors.')
+        parser.add_argument('-c', '--compounds', type=int, default=3,
+                            help='Number of compounds in each reaction.')
+        parser.add_argument('-w', '--whitelist', type=int, default=None,
+                            help='Also compare exports whitelisted to this many descriptors.')
+        parser.add_argument('-s', '--seed', type=int, default=0,
+                            help='Seed for the random values.')
+
+    def handle(self, *args, **kwargs):
+        """Handle the call for this command."""
+        if not settings.TESTING:
+            raise CommandError(
+                'This command writes synthetic data to the database and requires TESTING to be set.')
+        random.seed(kwargs['seed'])
+        try:
+            reactions, descriptors = self.populate(
+                kwargs['reactions'], kwargs['descriptors'], kwargs['compounds'])
+            self.compare(reactions, None)
+            if kwargs['whitelist'] is not None:
+                whitelist = [d.csvHeader for d in random.sample(
+                    descriptors, min(kwargs['whitelist'], len(descriptors)))]
+                self.compare(reactions, whitelist)
+        finally:
+            self.cleanUp()
+
+    def populate(self, reactionCount, descriptorCount, compoundCount):
+        """Create the synthetic lab group, compounds, reactions, descriptors and values."""
+        self.stdout.write('Creating {} reactions with {} descriptors...'.format(
+            reactionCount, descriptorCount))
+        self.labGroup = LabGroup.objects.create(
+            title=SOFTWARE, address='', email='', access_code='')
+        role = CompoundRole.objects.get_or_create(
+            label=SOFTWARE, defaults={'description': SOFTWARE})[0]
+        compounds = []
+        for i in range(20):
+            compound = Compound(abbrev='c{}'.format(i), name='compound {}'.format(
+                i), labGroup=self.labGroup, formula='C{}H2'.format(i + 1))
+            compound.save(calcDescriptors=False)
+            compounds.append(compound)
+
+        Reaction.objects.bulk_create(Reaction(labGroup=self.labGroup, notes='synthetic {}'.format(i))
+                                     for i in range(reactionCount))
+        reactions = Reaction.objects.filter(labGroup=self.labGroup)
+        reactionIds = list(reactions.values_list('pk', flat=True))
+
+        CompoundQuantity.objects.bulk_create(CompoundQuantity(reaction_id=reactionId, compound=compound, role=role, amount=j + 1)
+                                             for reactionId in reactionIds for j, compound in enumerate(random.sample(compounds, compoundCount)))
+
+        for i in range(descriptorCount):
+            kind = ('num', 'num', 'num', 'num', 'num',
+                    'num', 'num', 'bool', 'ord', 'cat')[i % 10]
+            heading = '{}_{}'.format(kind, i)
+            if kind == 'num':
+                descriptor = NumRxnDescriptor.objects.create(
+                    heading=heading, name=heading, calculatorSoftware=SOFTWARE, calculatorSoftwareVersion='0')
+                values = (NumRxnDescriptorValue(reaction_id=reactionId, descriptor=descriptor, value=random.choice((0.0, 0.0, 0.0, None, random.random())))
+                          for reactionId in reactionIds if random.random() > 0.05)
+            elif kind == 'bool':
+                descriptor = BoolRxnDescriptor.objects.create(
+                    heading=heading, name=heading, calculatorSoftware=SOFTWARE, calculatorSoftwareVersion='0')
+                values = (BoolRxnDescriptorValue(reaction_id=reactionId, descriptor=descriptor, value=random.choice((True, False, None)))
+                          for reactionId in reactionIds if random.random() > 0.05)
+            elif kind == 'ord':
+                descriptor = OrdRxnDescriptor.objects.create(heading=heading, name=heading, calculatorSoftware=SOFTWARE,
+                                                             calculatorSoftwareVersion='0', minimum=0, maximum=4)
+                values = (OrdRxnDescriptorValue(reaction_id=reactionId, descriptor=descriptor, value=random.randint(0, 4))
+                          for reactionId in reactionIds if random.random() > 0.05)
+            else:
+                descriptor = CatRxnDescriptor.objects.create(
+                    heading=heading, name=heading, calculatorSoftware=SOFTWARE, calculatorSoftwareVersion='0')
+                permittedValues = [CategoricalDescriptorPermittedValue.objects.create(
+                    descriptor=descriptor, value=v) for v in ('a', 'b', 'c')]
+                values = (CatRxnDescriptorValue(reaction_id=reactionId, descriptor=descriptor, value=random.choice(permittedValues))
+                          for reactionId in reactionIds if random.random() > 0.05)
+            values = list(values)
+            for start in range(0, len(values), 5000):
+                type(values[0]).objects.bulk_create(
+                    values[start:start + 5000])
+
+        descriptors = list(chain(*(descriptorClass.objects.filter(calculatorSoftware=SOFTWARE)
+                                   for descriptorClass in (BoolRxnDescriptor, NumRxnDescriptor, OrdRxnDescriptor, CatRxnDescriptor))))
+        return reactions, descriptors
+
+    def compare(self, reactions, whitelist):
+        """Time an expanded arff and csv export with each engine and check that the output is identical."""
+        self.stdout.write('\nWhitelist: {}'.format(
+            'none' if whitelist is None else '{} descriptors'.format(len(whitelist))))
+        for fmt in ('arff', 'csv'):
+            digests = set()
+            for engine in ('rows', 'pivot'):
+                writer = DigestWriter()
+                with override_settings(REACTION_ROW_ENGINE=engine, FEATURE_MATRIX_DIR=None):
+                    start = time.time()
+                    if fmt == 'arff':
+                        reactions.toArff(
+                            writer, expanded=True, whitelistHeaders=whitelist)
+                    else:
+                        reactions.toCsv(writer, expanded=True,
+                                        whitelistHeaders=whitelist)
+                    elapsed = time.time() - start
+                digests.add(writer.digest.hexdigest())
+                self.stdout.write('{:>5} {:>6}: {:8.2f}s {:>12} bytes'.format(
+                    fmt, engine, elapsed, writer.size))
+            self.stdout.write('{:>5} output identical: {}'.format(
+                fmt, len(digests) == 1))
+
+    def cleanUp(self):
+        """Remove all of the synthetic data."""
+        self.stdout.write('\nRemoving synthetic data...')
+        for valueClass in (BoolRxnDescriptorValue, NumRxnDescriptorValue, OrdRxnDescriptorValue, CatRxnDescriptorValue):
+            valueClass.objects.filter(
+                descriptor__calculatorSoftware=SOFTWARE).delete()
+        Reaction.objects.filter(labGroup__title=SOFTWARE).delete()
+        Compound.objects.filter(labGroup__title=SOFTWARE).delete()
+        for descriptorClass in (BoolRxnDescriptor, NumRxnDescriptor, OrdRxnDescriptor, CatRxnDescriptor):
+            descriptorClass.objects.filter(
+                calculatorSoftware=SOFTWARE).delete()
+        CompoundRole.objects.filter(label=SOFTWARE).delete()
+        LabGroup.objects.filter(title=SOFTWARE).delete()
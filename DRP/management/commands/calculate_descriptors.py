@@ -1,10 +1,66 @@
 """Recalculate the descriptors for all compounds and reactions."""
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.core.cache import caches
 from DRP.models import Reaction, Compound
 from django import db
+from multiprocessing import Pool
+import traceback
 import warnings
 
 
+def _compounds(start, **kwargs):
+    """Return the compounds to calculate descriptors for."""
+    return Compound.objects.order_by('pk').filter(pk__gte=start)
+
+
+def _reactions(start, reactions=False, include_invalid=False, include_non_performed=False, **kwargs):
+    """Return the reactions to calculate descriptors for."""
+    queryset = Reaction.objects.order_by('pk')
+    if reactions:
+        queryset = queryset.filter(pk__gte=start)
+    if not include_invalid:
+        queryset = queryset.exclude(performedreaction__valid=False)
+    if not include_non_performed:
+        queryset = queryset.exclude(performedreaction=None)
+    return queryset
+
+
+def workUnits(queryset, unitSize):
+    """Partition a queryset into (first pk, last pk) ranges of up to unitSize objects each."""
+    pks = list(queryset.values_list('pk', flat=True))
+    return [(pks[i], pks[min(i + unitSize, len(pks)) - 1]) for i in range(0, len(pks), unitSize)]
+
+
+def _initialiseWorker():
+    """Drop any cache connections inherited from the parent process, so that each worker makes its own."""
+    for cache in caches.all():
+        cache.close()
+
+
+def calculateUnit(unit):
+    """
+    Calculate the descriptors for one work unit, returning the unit, the number of objects, any traceback and whether to retry.
+
+    A unit is (kind, first pk, last pk, options), where kind is 'compounds' or 'reactions'.
+    Errors are returned rather than raised so that the other units carry on. Database errors,
+    which are usually locks or deadlocks between workers writing at the same time, are worth retrying.
+    """
+    kind, first, last, options = unit
+    queryset = (_compounds if kind == 'compounds' else _reactions)(**options)
+    queryset = queryset.filter(pk__gte=first, pk__lte=last)
+    try:
+        count = queryset.count()
+        queryset.calculate_descriptors(verbose=options['verbose'], whitelist=options['whitelist'],
+                                       plugins=options['plugins'])
+        return unit, count, None, False
+    except db.OperationalError:
+        return unit, 0, traceback.format_exc(), True
+    except Exception:
+        return unit, 0, traceback.format_exc(), False
+    finally:
+        db.connections.close_all()
+
+
 class Command(BaseCommand):
 
     """Recalculate the descriptors for all compounds and reactions."""
@@ -38,6 +94,10 @@ class Command(BaseCommand):
                            help='Calculate descriptors for invalid reactions also.')
         group.add_argument('--include-non-performed', action='store_true',
                            help='Calculate descriptors for non-performed reactions also.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes to calculate descriptors in (default 1, in this process).')
+        parser.add_argument('--unit-size', type=int, default=500,
+                            help='Number of compounds or reactions in each work unit when using more than one worker.')
 
     def handle(self, *args, **kwargs):
         """Handle the function call."""
@@ -62,16 +122,71 @@ class Command(BaseCommand):
         if kwargs['error_level'] == 3:
             warnings.simplefilter('error')
 
+        selection = {'start': start, 'reactions': only_reactions,
+                     'include_invalid': include_invalid, 'include_non_performed': include_non_performed}
+        if kwargs['workers'] > 1:
+            options = dict(selection, whitelist=whitelist, plugins=plugins, verbose=kwargs['verbosity'] > 1)
+            self.calculateInParallel(options, not only_reactions, not only_compounds,
+                                     kwargs['workers'], kwargs['unit_size'])
+            return
+
         if not only_reactions:
-            Compound.objects.order_by('pk').filter(pk__gte=start).calculate_descriptors(
+            _compounds(**selection).calculate_descriptors(
                 verbose=verbose, whitelist=whitelist, plugins=plugins)
         if not only_compounds:
-            reactions = Reaction.objects.order_by('pk')
-            if only_reactions:
-                reactions = reactions.filter(pk__gte=start)
-            if not include_invalid:
-                reactions = reactions.exclude(performedreaction__valid=False)
-            if not include_non_performed:
-                reactions = reactions.exclude(performedreaction=None)
-            reactions.calculate_descriptors(
+            _reactions(**selection).calculate_descriptors(
                 verbose=verbose, whitelist=whitelist, plugins=plugins)
+
+    def calculateInParallel(self, options, compounds, reactions, workers, unitSize):
+        """
+        Calculate the descriptors in work units of contiguous primary keys, spread across worker processes.
+
+        All of the compounds are done before any of the reactions, whose descriptors depend on them.
+        The first unit of each kind is calculated in this process, so that any descriptors which do not
+        yet exist are created once rather than by several workers at the same time.
+        """
+        kinds = []
+        if compounds:
+            kinds.append(('compounds', _compounds))
+        if reactions:
+            kinds.append(('reactions', _reactions))
+
+        failures = []
+        for kind, selection in kinds:
+            units = [(kind, first, last, options) for first, last in workUnits(selection(**options), unitSize)]
+            if not units:
+                continue
+            self.stdout.write('Calculating descriptors for {} in {} units across {} workers'.format(
+                kind, len(units), workers))
+            retries = []
+            self.report(calculateUnit(units[0]), 1, len(units), failures, retries)
+            # each worker must open its own database connection
+            db.connections.close_all()
+            pool = Pool(processes=workers, initializer=_initialiseWorker)
+            try:
+                for i, result in enumerate(pool.imap_unordered(calculateUnit, units[1:])):
+                    self.report(result, i + 2, len(units), failures, retries)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+            # the values are idempotent, so a unit which hit a lock can be recalculated without the other workers
+            for i, unit in enumerate(retries):
+                self.report(calculateUnit(unit), i + 1, len(retries), failures)
+
+        if failures:
+            raise CommandError('Descriptor calculation failed for {} work units: {}'.format(
+                len(failures), ', '.join('{} {}-{}'.format(kind, first, last) for kind, first, last in failures)))
+
+    def report(self, result, done, total, failures, retries=None):
+        """Report on a finished work unit, recording it if it failed, or in retries if given and it is worth retrying."""
+        unit, count, error, retry = result
+        kind, first, last, options = unit
+        if error is None:
+            self.stdout.write('{} {}-{}: calculated for {} ({}/{})'.format(kind, first, last, count, done, total))
+        elif retry and retries is not None:
+            retries.append(unit)
+            self.stderr.write('{} {}-{}: failed, to be retried ({}/{})\n{}'.format(kind, first, last, done, total, error))
+        else:
+            failures.append((kind, first, last))
+            self.stderr.write('{} {}-{}: failed ({}/{})\n{}'.format(kind, first, last, done, total, error))
@@ -0,0 +1,30 @@
+"""Evict results from the descriptor calculator cache, e.g. after upgrading a calculator."""
+from django.core.management.base import BaseCommand, CommandError
+from DRP.plugins.moldescriptors import calculatorCache
+
+
+class Command(BaseCommand):
+
+    """Delete the cached results of a calculator (or of one version of it), or the whole cache."""
+
+    help = 'Evict results from the descriptor calculator cache.'
+
+    def add_arguments(self, parser):
+        """Add arguments for the argument parser."""
+        parser.add_argument('--calculator',
+                            help='Evict only the results of this calculator, e.g. ChemAxon_cxcalc or DRP_rdkit.')
+        parser.add_argument('--calculator-version',
+                            help='Evict only the results of this version of the calculator.')
+
+    def handle(self, *args, **kwargs):
+        """Handle the call for this command."""
+        if not calculatorCache.enabled():
+            raise CommandError('CALCULATOR_CACHE_DIR is not configured.')
+        if kwargs['calculator'] is None:
+            if kwargs['calculator_version'] is not None:
+                raise CommandError('--calculator-version requires --calculator.')
+            calculatorCache.clear()
+            self.stdout.write('Cleared {}'.format(calculatorCache.cachePath()))
+        else:
+            count = calculatorCache.evict(kwargs['calculator'], kwargs['calculator_version'])
+            self.stdout.write('Evicted {} cached results.'.format(count))
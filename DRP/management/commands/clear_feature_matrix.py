@@ -0,0 +1,17 @@
+"""Delete the cached reaction feature matrix, e.g. after loading data with fixtures or raw SQL."""
+from django.core.management.base import BaseCommand, CommandError
+from DRP.models import featureMatrix
+
+
+class Command(BaseCommand):
+
+    """Delete the cached reaction feature matrix so that it is rebuilt on the next export."""
+
+    help = 'Delete the cached reaction feature matrix so that it is rebuilt on the next export.'
+
+    def handle(self, *args, **kwargs):
+        """Handle the call for this command."""
+        if not featureMatrix.enabled():
+            raise CommandError('FEATURE_MATRIX_DIR is not configured.')
+        featureMatrix.clear()
+        self.stdout.write('Cleared {}'.format(featureMatrix.storeDirectory()))
@@ -0,0 +1,41 @@
+"""Delete stored numeric reaction descriptor values which equal their descriptor's storage default."""
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from DRP.models import NumRxnDescriptor, NumRxnDescriptorValue
+import importlib
+
+
+class Command(BaseCommand):
+
+    """Delete numeric reaction descriptor values which are implied by their descriptor's storage default."""
+
+    help = "Delete numeric reaction descriptor values which equal their descriptor's storage default."
+
+    def add_arguments(self, parser):
+        """Add arguments for the argument parser."""
+        parser.add_argument('--setup-plugins', action='store_true',
+                            help='First create or update the descriptors of the reaction descriptor plugins, so that their storage defaults are set.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Count the values which would be deleted without deleting them.')
+
+    def handle(self, *args, **kwargs):
+        """Handle the call for this command."""
+        if kwargs['setup_plugins']:
+            for plugin in settings.RXN_DESCRIPTOR_PLUGINS:
+                module = importlib.import_module(plugin)
+                if hasattr(module, 'make_dict'):
+                    descriptorDict = module.make_dict()[0]
+                    descriptorDict.initialise(descriptorDict.descDict)
+
+        total = 0
+        for descriptor in NumRxnDescriptor.objects.filter(storageDefault__isnull=False):
+            values = NumRxnDescriptorValue.objects.filter(
+                descriptor=descriptor, value=descriptor.storageDefault)
+            count = values.count()
+            if count:
+                if not kwargs['dry_run']:
+                    values.delete()
+                self.stdout.write('{}: {} values'.format(descriptor.csvHeader, count))
+            total += count
+        self.stdout.write('{} {} values in total.'.format(
+            'Would delete' if kwargs['dry_run'] else 'Deleted', total))
@@ -0,0 +1,42 @@
+"""Delete the molecular descriptors for pH dependent descriptors sampled at single pH values, and the reaction descriptors aggregating them."""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from DRP.models import CompoundRole, NumMolDescriptor, NumRxnDescriptor
+from DRP.plugins.moldescriptors.chemaxon import _pHDependentDescriptors
+import re
+
+
+class Command(BaseCommand):
+
+    """Delete the descriptors superseded by pH curves."""
+
+    help = ('Delete the molecular descriptors for pH dependent descriptors at each reaction pH, and the reaction '
+            'descriptors aggregating them. These values are now held as pH curves.')
+
+    def add_arguments(self, parser):
+        """Add arguments for the argument parser."""
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Count the descriptors which would be deleted without deleting them.')
+
+    @transaction.atomic
+    def handle(self, *args, **kwargs):
+        """Handle the call for this command."""
+        labels = list(CompoundRole.objects.values_list('label', flat=True))
+        molDescriptors = []
+        for heading, d in _pHDependentDescriptors.items():
+            sampled = re.compile(r'^{}_pH\d+(_\d+)?$'.format(re.escape(heading)))
+            molDescriptors += [descriptor for descriptor in NumMolDescriptor.objects.filter(
+                heading__startswith=heading + '_pH', calculatorSoftware=d['calculatorSoftware'])
+                if sampled.match(descriptor.heading)]
+        rxnHeadings = ['{}_{}_{}'.format(label, descriptor.csvHeader, aggregate) for descriptor in molDescriptors
+                       for label in labels for aggregate in ('Max', 'Range', 'gmean_molarity', 'gmean_count')]
+        rxnDescriptors = NumRxnDescriptor.objects.filter(heading__in=rxnHeadings)
+        rxnCount = rxnDescriptors.count()
+
+        for descriptor in molDescriptors:
+            self.stdout.write(descriptor.csvHeader)
+        if not kwargs['dry_run']:
+            rxnDescriptors.delete()
+            NumMolDescriptor.objects.filter(pk__in=[descriptor.pk for descriptor in molDescriptors]).delete()
+        self.stdout.write('{} {} molecular and {} reaction descriptors.'.format(
+            'Would delete' if kwargs['dry_run'] else 'Deleted', len(molDescriptors), rxnCount))
@@ -0,0 +1,46 @@
+"""Render queued csv and arff exports to the private EXPORT_DIR."""
+from django.core.management.base import BaseCommand
+from DRP.models import ExportJob
+from DRP.models.ExportJob import QUEUED, DONE, FAILED
+import time
+
+
+class Command(BaseCommand):
+
+    """Work through the export job queue, rendering each export to its artifact file."""
+
+    help = 'Render queued csv and arff exports to the private EXPORT_DIR.'
+
+    def add_arguments(self, parser):
+        """Add arguments for the argument parser."""
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty rather than waiting for more jobs.')
+        parser.add_argument('--sleep', type=float, default=5,
+                            help='Seconds to wait between checks of an empty queue.')
+        parser.add_argument('--prune', action='store_true',
+                            help='Delete finished jobs (and their artifacts) which have been superseded by later data, then exit.')
+
+    def handle(self, *args, **kwargs):
+        """Handle the call for this command."""
+        if kwargs['prune']:
+            superseded = ExportJob.objects.superseded().filter(state__in=(DONE, FAILED))
+            count = superseded.count()
+            for job in superseded:
+                job.delete()
+            self.stdout.write('Deleted {} superseded export jobs.'.format(count))
+            return
+
+        while True:
+            job = ExportJob.objects.filter(state=QUEUED).order_by('queuedTime').first()
+            if job is None:
+                if kwargs['once']:
+                    break
+                time.sleep(kwargs['sleep'])
+            elif job.claim():
+                self.stdout.write('Rendering export job {}...'.format(job.pk))
+                try:
+                    job.render()
+                except Exception as e:
+                    self.stderr.write('Export job {} failed: {!r}'.format(job.pk, e))
+                else:
+                    self.stdout.write('Wrote {}'.format(job.artifact.name))
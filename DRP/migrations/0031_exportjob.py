@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('DRP', '0030_auto_20160605_2127'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID',
+                                        serialize=False, auto_created=True, primary_key=True)),
+                ('querysetFingerprint', models.CharField(max_length=40)),
+                ('whitelistHash', models.CharField(max_length=40)),
+                ('fileFormat', models.CharField(max_length=4, choices=[
+                 (b'csv', b'csv'), (b'arff', b'arff')])),
+                ('expanded', models.BooleanField(default=False)),
+                ('schemaVersion', models.CharField(max_length=32)),
+                ('dataVersion', models.CharField(max_length=32)),
+                ('reactionIds', models.TextField()),
+                ('whitelist', models.TextField()),
+                ('state', models.CharField(default=b'queued', max_length=7, choices=[
+                 (b'queued', b'Queued'), (b'running', b'Running'), (b'done', b'Done'), (b'failed', b'Failed')])),
+                ('error', models.TextField(blank=True)),
+                ('artifact', models.FileField(
+                    max_length=200, upload_to=b'exports', blank=True)),
+                ('queuedTime', models.DateTimeField(auto_now_add=True)),
+                ('finishedTime', models.DateTimeField(default=None, null=True)),
+                ('requestedBy', models.ForeignKey(blank=True,
+                                                  default=None, to=settings.AUTH_USER_MODEL, null=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='exportjob',
+            unique_together=set([('querysetFingerprint', 'whitelistHash', 'fileFormat',
+                                  'expanded', 'schemaVersion', 'dataVersion')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DRP', '0031_exportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='numrxndescriptor',
+            name='storageDefault',
+            field=models.FloatField(default=None, null=True, blank=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DRP', '0032_numrxndescriptor_storagedefault'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PHCurve',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID',
+                                        serialize=False, auto_created=True, primary_key=True)),
+                ('heading', models.CharField(max_length=200)),
+                ('calculatorSoftware', models.CharField(max_length=100)),
+                ('calculatorSoftwareVersion', models.CharField(max_length=20)),
+                ('pHData', models.BinaryField()),
+                ('valueData', models.BinaryField()),
+                ('compound', models.ForeignKey(
+                    related_name='pHCurves', to='DRP.Compound')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='phcurve',
+            unique_together=set(
+                [('compound', 'heading', 'calculatorSoftware', 'calculatorSoftwareVersion')]),
+        ),
+    ]
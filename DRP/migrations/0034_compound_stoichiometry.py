@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DRP', '0033_phcurve'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compound',
+            name='stoichiometry',
+            field=models.TextField(default='', editable=False, blank=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.core.files.storage import default_storage
+# the ExportJob class shadows its module as an attribute of DRP.models
+from DRP.models.ExportJob import ExportStorage
+
+
+def withdrawPublicArtifacts(apps, schema_editor):
+    """Delete artifacts rendered into MEDIA_ROOT, failing their jobs so that they are rendered again when next requested."""
+    ExportJob = apps.get_model('DRP', 'ExportJob')
+    for job in ExportJob.objects.exclude(artifact=''):
+        if default_storage.exists(job.artifact.name):
+            default_storage.delete(job.artifact.name)
+    ExportJob.objects.exclude(artifact='').update(
+        artifact='', state='failed', error='Withdrawn from MEDIA_ROOT')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DRP', '0034_compound_stoichiometry'),
+    ]
+
+    operations = [
+        migrations.RunPython(withdrawPublicArtifacts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='exportjob',
+            name='artifact',
+            field=models.FileField(storage=ExportStorage(), max_length=200, upload_to=b'', blank=True),
+        ),
+    ]
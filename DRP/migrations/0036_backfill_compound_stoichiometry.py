@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from DRP.models.Compound import storedStoichiometry
+
+# The number of compounds to update in each statement
+BATCH_SIZE = 500
+
+
+def backfillStoichiometry(apps, schema_editor):
+    """Set the stored stoichiometry of every compound from its formula, leaving it empty for malformed formulae."""
+    Compound = apps.get_model('DRP', 'Compound')
+    stale = {}
+    for pk, formula, stored in Compound.objects.values_list('pk', 'formula', 'stoichiometry').iterator():
+        stoichiometry = storedStoichiometry(formula)
+        if stoichiometry != stored:
+            stale.setdefault(stoichiometry, []).append(pk)
+    for stoichiometry, pks in stale.items():
+        for start in range(0, len(pks), BATCH_SIZE):
+            Compound.objects.filter(pk__in=pks[start:start + BATCH_SIZE]).update(stoichiometry=stoichiometry)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DRP', '0035_exportjob_artifact_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfillStoichiometry, migrations.RunPython.noop),
+    ]
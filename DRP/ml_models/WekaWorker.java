@@ -0,0 +1,90 @@
+import java.io.BufferedOutputStream;
+import java.io.BufferedReader;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintWriter;
+import java.io.StringWriter;
+import java.util.ArrayList;
+import java.util.List;
+
+import weka.attributeSelection.ASEvaluation;
+import weka.attributeSelection.AttributeSelection;
+import weka.classifiers.Evaluation;
+
+/**
+ * Runs Weka jobs read a line at a time from standard input, so that the JVM and Weka are loaded once.
+ *
+ * Each request is a job ("classify" or "select"), a class name and the options for that
+ * class's command line, separated by tabs, with backslashes, tabs and newlines escaped as
+ * \\, \t and \n. Each reply is "OK length" or "ERROR length" on a line of its own, followed
+ * by that many bytes of UTF-8: what the command line would have printed, or a stack trace.
+ */
+public class WekaWorker {
+
+    public static void main(String[] args) throws IOException {
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+        OutputStream out = new BufferedOutputStream(new FileOutputStream(FileDescriptor.out));
+        // anything Weka prints for itself must not be mistaken for a reply
+        System.setOut(System.err);
+        String line;
+        while ((line = in.readLine()) != null) {
+            if (line.length() == 0) {
+                continue;
+            }
+            String status;
+            String output;
+            try {
+                output = run(decode(line));
+                status = "OK";
+            } catch (Throwable t) {
+                StringWriter trace = new StringWriter();
+                t.printStackTrace(new PrintWriter(trace));
+                output = trace.toString();
+                status = "ERROR";
+            }
+            byte[] payload = (output == null ? "" : output).getBytes("UTF-8");
+            out.write((status + " " + payload.length + "\n").getBytes("UTF-8"));
+            out.write(payload);
+            out.flush();
+        }
+    }
+
+    /** Run a request, returning the output of the job. */
+    static String run(String[] request) throws Exception {
+        if (request.length < 2) {
+            throw new IllegalArgumentException("A request needs a job and a class name.");
+        }
+        String[] options = new String[request.length - 2];
+        System.arraycopy(request, 2, options, 0, options.length);
+        if (request[0].equals("classify")) {
+            return Evaluation.evaluateModel(request[1], options);
+        } else if (request[0].equals("select")) {
+            ASEvaluation evaluator = (ASEvaluation) Class.forName(request[1]).newInstance();
+            return AttributeSelection.SelectAttributes(evaluator, options);
+        }
+        throw new IllegalArgumentException("Unknown job " + request[0]);
+    }
+
+    /** Split a request line into its unescaped fields. */
+    static String[] decode(String line) {
+        List<String> fields = new ArrayList<String>();
+        StringBuilder field = new StringBuilder();
+        for (int i = 0; i < line.length(); i++) {
+            char c = line.charAt(i);
+            if (c == '\t') {
+                fields.add(field.toString());
+                field.setLength(0);
+            } else if (c == '\\' && i + 1 < line.length()) {
+                char escaped = line.charAt(++i);
+                field.append(escaped == 't' ? '\t' : escaped == 'n' ? '\n' : escaped);
+            } else {
+                field.append(c);
+            }
+        }
+        fields.add(field.toString());
+        return fields.toArray(new String[fields.size()]);
+    }
+}
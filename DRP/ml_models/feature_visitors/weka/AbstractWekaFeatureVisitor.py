@@ -2,8 +2,8 @@
 from django.conf import settings
 import uuid
 from DRP.ml_models.feature_visitors.AbstractFeatureVisitor import AbstractFeatureVisitor, logger
-from django.core.exceptions import ImproperlyConfigured
-import subprocess
+from DRP.ml_models.wekaWorker import runWeka
+import shlex
 import os
 from abc import abstractmethod
 from itertools import chain
@@ -17,7 +17,12 @@ class AbstractWekaFeatureVisitor(AbstractFeatureVisitor):
     wekaOptions = ""
 
     def __init__(self, container, *args, **kwargs):
-        """Specify the modelcontainer which this feature selection process is being performed with."""
+        """
+        Specify the modelcontainer which this feature selection process is being performed with.
+
+        sparse True, given as a keyword argument, will mean that arff files are written in Weka's sparse format.
+        """
+        self.sparse = kwargs.pop('sparse', False)
         super(AbstractWekaFeatureVisitor, self).__init__(*args, **kwargs)
 
         self.container = container
@@ -46,7 +51,7 @@ class AbstractWekaFeatureVisitor(AbstractFeatureVisitor):
             print "Writing arff to {}".format(filepath)
         with open(filepath, "w") as f:
             reactions.toArff(f, expanded=True,
-                             whitelistHeaders=whitelistHeaders)
+                             whitelistHeaders=whitelistHeaders, sparse=self.sparse)
         return filepath
 
     def _readWekaOutput(self, output):
@@ -67,18 +72,8 @@ class AbstractWekaFeatureVisitor(AbstractFeatureVisitor):
         return descriptors
 
     def _runWekaCommand(self, command, verbose=False):
-        """Set the CLASSPATH necessary to use Weka, then runs a shell `command`."""
-        if not settings.WEKA_PATH[self.WEKA_VERSION]:
-            raise ImproperlyConfigured(
-                "'WEKA_PATH' is not set in settings.py!")
-        set_path = "export CLASSPATH=$CLASSPATH:{}; ".format(
-            settings.WEKA_PATH[self.WEKA_VERSION])
-        command = set_path + command
-        logger.debug("Running in Shell:\n{}".format(command))
-        if verbose:
-            print "Running in Shell:\n{}".format(command)
-        output = subprocess.check_output(command, shell=True)
-        return output
+        """Run a Weka attribute selection `command` line (without the java) and return its output."""
+        return runWeka(self.WEKA_VERSION, 'select', shlex.split(command), verbose=verbose)
 
     def train(self, verbose=False):
         """Train the feature selection."""
@@ -94,16 +89,14 @@ class AbstractWekaFeatureVisitor(AbstractFeatureVisitor):
         results_path = os.path.join(settings.TMP_DIR, results_file)
 
         # Currently, we support only one "response" variable.
-        headers = [h for h in reactions.expandedCsvHeaders()
-                   if h in descriptorHeaders]
-        response_index = headers.index(
-            list(self.container.outcomeDescriptors)[0].csvHeader) + 1
+        response_index = reactions.expandedArffHeaderIndex(descriptorHeaders)[
+            list(self.container.outcomeDescriptors)[0].csvHeader] + 1
 
         if self.wekaOptions:
-            command = "java {} -i {} -c {} -- {}".format(
+            command = "{} -i {} -c {} -- {}".format(
                 self.wekaCommand, arff_file, response_index, self.wekaOptions)
         else:
-            command = "java {} -i {} -c {}".format(
+            command = "{} -i {} -c {}".format(
                 self.wekaCommand, arff_file, response_index)
 
         output = self._runWekaCommand(command, verbose=verbose)
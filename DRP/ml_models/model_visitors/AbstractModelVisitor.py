@@ -16,9 +16,26 @@ class AbstractModelVisitor(object):
 
     maxResponseCount = None
 
-    def __init__(self, statsModel):
-        """Standard constructor."""
+    def __init__(self, statsModel, dataset=None):
+        """
+        Standard constructor.
+
+        dataset is an export of the reactions of all the stats models of a container, as
+        returned by exportDataset, from which the visitor may take its reactions rather
+        than exporting them again.
+        """
         self.statsModel = statsModel
+        self.dataset = dataset
+
+    def exportDataset(self, reactions, verbose=False):
+        """
+        Export reactions once for all the stats models of this visitor's container to share.
+
+        Return an object to be passed to each of their visitors as dataset, which must be picklable
+        and have a delete method to discard it once the container is built, or None if the
+        visitor has no use for a shared export, as is the case by default.
+        """
+        return None
 
     @abstractmethod
     def train(self, verbose=False):
@@ -0,0 +1,151 @@
+"""An abstract model visitor for scikit-learn estimators, trained and used in-process."""
+# absolute imports, so that sklearn means scikit-learn rather than this package
+from __future__ import absolute_import
+from DRP.ml_models.model_visitors.AbstractModelVisitor import AbstractModelVisitor, logger
+from DRP.models import rxnDescriptors
+from abc import abstractmethod
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import Imputer, MinMaxScaler
+import numpy as np
+try:
+    import joblib
+except ImportError:
+    from sklearn.externals import joblib
+
+
+class ArrayDataset(object):
+
+    """The array of a set of reactions, from which the arrays of subsets of them are sliced."""
+
+    def __init__(self, values, codebook, reactionIds):
+        """Set up the dataset from an array and its codebook, with a row for each of the reactions with these primary keys in order."""
+        self.values = values
+        self.codebook = codebook
+        self.reactionIds = np.array(sorted(reactionIds), dtype=np.int64)
+
+    def rows(self, reactionIds):
+        """Return the positions of the rows of the reactions with these primary keys, or None if any are not in the dataset."""
+        reactionIds = np.sort(np.array(list(reactionIds), dtype=np.int64))
+        positions = np.searchsorted(self.reactionIds, reactionIds)
+        positions[positions == len(self.reactionIds)] = 0
+        if len(self.reactionIds) == 0 or not (self.reactionIds[positions] == reactionIds).all():
+            return None
+        return positions
+
+    def delete(self):
+        """Let go of the array; there is nothing stored to delete."""
+        self.values = None
+
+
+class AbstractSklearnModelVisitor(AbstractModelVisitor):
+
+    """
+    The abstract visitor class for scikit-learn estimators.
+
+    Reactions are read straight into a numpy array, with boolean and categorical descriptors
+    as integer codes, and missing predictor values are replaced by the mean of the training
+    data, as Weka does. The fitted pipeline and the labels of the response codes are saved
+    to the stats model's output file with joblib.
+    """
+
+    maxResponseCount = 1
+    scaled = False
+    """Whether predictors are scaled to [0, 1] before fitting, as Weka does for distance and kernel based tools."""
+    sampleWeights = True
+    """Whether the estimator's fit method accepts sample weights; if not, BCR weighting is passed to estimator() as class weights."""
+    classWeights = False
+    """Whether the estimator accepts class weights, for BCR weighting where sample weights are not accepted."""
+
+    def __init__(self, BCR=False, *args, **kwargs):
+        """
+        Intialise the visitor.
+
+        BCR True will mean that the visitor optimises on BCR, by weighting each class inversely to its frequency.
+        """
+        self.BCR = BCR
+        if BCR and not (self.sampleWeights or self.classWeights):
+            raise ValueError('{} cannot weight its training data, so cannot optimise on BCR.'.format(type(self).__name__))
+        super(AbstractSklearnModelVisitor, self).__init__(*args, **kwargs)
+
+    @abstractmethod
+    def estimator(self, classWeights=None):
+        """Return a new, unfitted estimator; classWeights is a dictionary of class code to weight where BCR weighting needs one."""
+
+    def _headers(self):
+        """Return the predictor headers and the response descriptor."""
+        predictorHeaders = [d.csvHeader for d in self.statsModel.container.descriptors]
+        # Currently, we support only one "response" variable.
+        response = list(self.statsModel.container.outcomeDescriptors)[0]
+        return predictorHeaders, response
+
+    def _arrays(self, reactions):
+        """Return the predictor matrix, the response vector and the labels of the response codes for reactions, in primary key order."""
+        predictorHeaders, response = self._headers()
+        whitelist = predictorHeaders + [response.csvHeader]
+        rows = self.dataset.rows(reactions.values_list('pk', flat=True)) if self.dataset is not None else None
+        if rows is not None:
+            values, codebook = self.dataset.values[rows], self.dataset.codebook
+        else:
+            values, codebook = reactions.toNPArray(expanded=True, whitelistHeaders=whitelist, codebook=True)
+        index = reactions.expandedArffHeaderIndex(whitelist)
+        predictors = values[:, [index[header] for header in predictorHeaders]]
+        responses = values[:, index[response.csvHeader]]
+        return predictors, responses, codebook.get(response.csvHeader)
+
+    def exportDataset(self, reactions, verbose=False):
+        """Read all of the reactions into one array, from which the array of each training and test set is sliced."""
+        predictorHeaders, response = self._headers()
+        values, codebook = reactions.toNPArray(
+            expanded=True, whitelistHeaders=predictorHeaders + [response.csvHeader], codebook=True)
+        return ArrayDataset(values, codebook, reactions.values_list('pk', flat=True))
+
+    def BCR_weights(self, responses):
+        """Return a dictionary of class code to weight, so that each class carries the same total weight."""
+        return {code: len(responses) / float((responses == code).sum()) for code in np.unique(responses)}
+
+    def train(self, verbose=False):
+        """Fit the estimator to the training set and save it."""
+        predictorHeaders, response = self._headers()
+        if self.BCR and isinstance(response, rxnDescriptors.NumRxnDescriptor):
+            raise TypeError(
+                'Cannot train a classification algorithm to predict a numeric descriptor.')
+        predictors, responses, labels = self._arrays(self.statsModel.trainingSet.reactions.all())
+        # as in Weka, instances with no value for the response are not used
+        known = ~np.isnan(responses)
+        predictors = predictors[known]
+        responses = responses[known]
+
+        weights = self.BCR_weights(responses) if self.BCR else None
+        steps = [('impute', Imputer(strategy='mean'))]
+        if self.scaled:
+            steps.append(('scale', MinMaxScaler()))
+        steps.append(('estimator', self.estimator(weights if (self.BCR and not self.sampleWeights) else None)))
+        pipeline = Pipeline(steps)
+        if verbose:
+            print "Fitting {} to {} reactions".format(type(self).__name__, len(responses))
+        logger.debug("Fitting {} to {} reactions".format(type(self).__name__, len(responses)))
+        if self.BCR and self.sampleWeights:
+            pipeline.fit(predictors, responses, estimator__sample_weight=np.array([weights[code] for code in responses]))
+        else:
+            pipeline.fit(predictors, responses)
+        joblib.dump({'pipeline': pipeline, 'labels': labels}, self.statsModel.outputFile.name)
+
+    def predict(self, reactions, verbose=False):
+        """Create the predictions for these reactions for the model."""
+        response = self._headers()[1]
+        saved = joblib.load(self.statsModel.outputFile.name)
+        predictors = self._arrays(reactions)[0]
+        if verbose:
+            print "Predicting for {} reactions".format(len(predictors))
+        predicted = saved['pipeline'].predict(predictors)
+
+        if isinstance(response, (rxnDescriptors.BoolRxnDescriptor, rxnDescriptors.CatRxnDescriptor)):
+            results = [saved['labels'][int(code)] for code in predicted]
+        elif isinstance(response, rxnDescriptors.OrdRxnDescriptor):
+            results = [int(round(value)) for value in predicted]
+        elif isinstance(response, rxnDescriptors.NumRxnDescriptor):
+            results = [float(value) for value in predicted]
+        else:
+            raise TypeError(
+                "Response descriptor is of invalid type {}".format(type(response)))
+        return {response: tuple(zip(reactions.order_by('pk'), results))}
@@ -0,0 +1,5 @@
+"""Library of scikit-learn model visitors, which train and predict in-process rather than through files and a JVM."""
+from DRP.ml_models.model_visitors.sklearn.visitors import SVM_PUK, KNN, NaiveBayes, J48, LogisticRegression, RandomForest
+from DRP.ml_models.model_visitors.sklearn.visitors import LinearRegression
+
+tools = ("SVM_PUK", "KNN", "NaiveBayes", "J48", "LinearRegression", "LogisticRegression", "RandomForest")
@@ -0,0 +1,115 @@
+"""scikit-learn's model visitor library, mirroring the Weka tools."""
+# absolute imports, so that sklearn means scikit-learn rather than this package
+from __future__ import absolute_import
+from DRP.ml_models.model_visitors.sklearn.AbstractSklearnModelVisitor import AbstractSklearnModelVisitor
+from sklearn import ensemble, linear_model, naive_bayes, neighbors, svm, tree
+import numpy as np
+
+
+class PukKernel(object):
+
+    """The Pearson VII universal kernel, as used by Weka's SMO, as a picklable callable for SVC."""
+
+    def __init__(self, omega=1, sigma=1):
+        """Set the kernel parameters."""
+        self.omega = float(omega)
+        self.sigma = float(sigma)
+
+    def __call__(self, X, Y):
+        """Return the kernel matrix between the rows of X and Y."""
+        squaredDistances = (X ** 2).sum(axis=1)[:, np.newaxis] + (Y ** 2).sum(axis=1)[np.newaxis, :] - 2 * X.dot(Y.T)
+        distances = np.sqrt(np.maximum(squaredDistances, 0))
+        scale = 2 * np.sqrt(2 ** (1 / self.omega) - 1) / self.sigma
+        return 1 / (1 + (scale * distances) ** 2) ** self.omega
+
+
+class J48(AbstractSklearnModelVisitor):
+
+    """An entropy-split decision tree, the nearest equivalent of Weka's J48 implementation of C4.5."""
+
+    def estimator(self, classWeights=None):
+        """Return an entropy decision tree with J48's minimum of two instances per leaf."""
+        return tree.DecisionTreeClassifier(criterion='entropy', min_samples_leaf=2)
+
+
+class KNN(AbstractSklearnModelVisitor):
+
+    """K nearest neighbours classifier."""
+
+    scaled = True
+    sampleWeights = False
+
+    def __init__(self, k=1, *args, **kwargs):
+        """Set the number of neighbours, which defaults to one as in Weka's IBk."""
+        super(KNN, self).__init__(*args, **kwargs)
+        self.k = k
+
+    def estimator(self, classWeights=None):
+        """Return a k nearest neighbours classifier."""
+        return neighbors.KNeighborsClassifier(n_neighbors=self.k)
+
+
+class LinearRegression(AbstractSklearnModelVisitor):
+
+    """Ordinary least squares linear regression for predicting numeric responses, which cannot optimise on BCR."""
+
+    # scikit-learn 0.15's LinearRegression.fit takes no sample weights
+    sampleWeights = False
+
+    def estimator(self, classWeights=None):
+        """Return a linear regression."""
+        return linear_model.LinearRegression()
+
+
+class LogisticRegression(AbstractSklearnModelVisitor):
+
+    """Standard regression for binary outcomes."""
+
+    sampleWeights = False
+    classWeights = True
+
+    def estimator(self, classWeights=None):
+        """Return a logistic regression, with the class weights if there are any."""
+        return linear_model.LogisticRegression(class_weight=classWeights)
+
+
+class NaiveBayes(AbstractSklearnModelVisitor):
+
+    """Gaussian naive Bayes predictor."""
+
+    sampleWeights = False
+
+    def estimator(self, classWeights=None):
+        """Return a Gaussian naive Bayes classifier."""
+        return naive_bayes.GaussianNB()
+
+
+class RandomForest(AbstractSklearnModelVisitor):
+
+    """Random forest classifier."""
+
+    def __init__(self, n_trees=10, *args, **kwargs):
+        """Set the number of trees, which defaults to ten as in Weka."""
+        super(RandomForest, self).__init__(*args, **kwargs)
+        self.n_trees = n_trees
+
+    def estimator(self, classWeights=None):
+        """Return a random forest."""
+        return ensemble.RandomForestClassifier(n_estimators=self.n_trees)
+
+
+class SVM_PUK(AbstractSklearnModelVisitor):
+
+    """PUK Kernel Support Vector Machine."""
+
+    scaled = True
+
+    def __init__(self, puk_omega=1, puk_sigma=1, *args, **kwargs):
+        """Additional setup specific to support vector machines."""
+        super(SVM_PUK, self).__init__(*args, **kwargs)
+        self.puk_omega = puk_omega
+        self.puk_sigma = puk_sigma
+
+    def estimator(self, classWeights=None):
+        """Return a support vector classifier with the PUK kernel."""
+        return svm.SVC(kernel=PukKernel(self.puk_omega, self.puk_sigma))
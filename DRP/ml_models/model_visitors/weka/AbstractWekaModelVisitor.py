@@ -5,12 +5,61 @@ from DRP.models import rxnDescriptors
 from DRP.ml_models.model_visitors.AbstractModelVisitor import AbstractModelVisitor, logger
 from DRP.models.descriptors import BooleanDescriptor, NumericDescriptor, CategoricalDescriptor, OrdinalDescriptor
 from DRP.models.rxnDescriptorValues import BoolRxnDescriptorValue, OrdRxnDescriptorValue, BoolRxnDescriptorValue
-from django.core.exceptions import ImproperlyConfigured
-import subprocess
+from DRP.ml_models.wekaWorker import runWeka
+import shlex
 import os
 from abc import abstractmethod, abstractproperty
 import warnings
-from itertools import chain
+from itertools import chain, izip
+
+
+class ArffDataset(object):
+
+    """
+    An arff file of a set of reactions, from which arff files of subsets of them are sliced.
+
+    The instances of an expanded arff file are in reaction primary key order and its header does
+    not depend on which reactions are in it, so the arff file for a subset is the same header and
+    that subset's data lines, copied without going back to the database.
+    """
+
+    def __init__(self, path, reactionIds, whitelistHeaders=None, sparse=False):
+        """Set up the dataset from the path of the arff file, the primary keys of its reactions and the options it was exported with."""
+        self.path = path
+        self.reactionIds = sorted(reactionIds)
+        """The primary keys of the reactions, in the order of their instances in the file."""
+        self.whitelistHeaders = None if whitelistHeaders is None else list(whitelistHeaders)
+        self.sparse = sparse
+
+    def exports(self, whitelistHeaders, sparse):
+        """Return whether the file is still there and was exported with these headers in this format, so that it can stand in for an export with them."""
+        return ((None if whitelistHeaders is None else list(whitelistHeaders)) == self.whitelistHeaders and sparse == self.sparse and
+                os.path.isfile(self.path))
+
+    def covers(self, reactionIds):
+        """Return whether all of the reactions with these primary keys are in the dataset."""
+        return set(reactionIds).issubset(self.reactionIds)
+
+    def matches(self, reactionIds):
+        """Return whether the dataset is exactly the reactions with these primary keys, so its file can be used as it is."""
+        return sorted(reactionIds) == self.reactionIds
+
+    def write(self, writeable, reactionIds):
+        """Write the arff file of the reactions with these primary keys to a file-like object."""
+        wanted = set(reactionIds)
+        with open(self.path) as f:
+            for line in f:
+                writeable.write(line)
+                if line.strip() == '@data':
+                    break
+            for reactionId, line in izip(self.reactionIds, f):
+                if reactionId in wanted:
+                    writeable.write(line)
+
+    def delete(self):
+        """Delete the arff file."""
+        if os.path.isfile(self.path):
+            os.remove(self.path)
 
 
 class AbstractWekaModelVisitor(AbstractModelVisitor):
@@ -25,8 +74,10 @@ class AbstractWekaModelVisitor(AbstractModelVisitor):
         Intialise the visitor.
 
         BCR True will mean that the visitor optimises on BCR.
+        sparse True, given as a keyword argument, will mean that arff files are written in Weka's sparse format.
         """
         self.BCR = BCR
+        self.sparse = kwargs.pop('sparse', False)
 
         super(AbstractWekaModelVisitor, self).__init__(*args, **kwargs)
 
@@ -39,7 +90,7 @@ class AbstractWekaModelVisitor(AbstractModelVisitor):
                 'Subclasses of AbstractWekaModelVisitor must define wekaCommand')
 
     def _prepareArff(self, reactions, whitelistHeaders, verbose=False):
-        """Write an *.arff file using the provided queryset of reactions."""
+        """Write an *.arff file using the provided queryset of reactions, sliced from the shared dataset where it has them with the same headers and format."""
         logger.debug("Preparing ARFF file...")
         filename = "{}_{}.arff".format(self.statsModel.pk, uuid.uuid4())
         filepath = os.path.join(settings.TMP_DIR, filename)
@@ -49,11 +100,25 @@ class AbstractWekaModelVisitor(AbstractModelVisitor):
             filepath = os.path.join(settings.TMP_DIR, filename)
         if verbose:
             print "Writing arff to {}".format(filepath)
+        if self.dataset is not None and self.dataset.exports(whitelistHeaders, self.sparse):
+            reactionIds = list(reactions.values_list('pk', flat=True))
+        else:
+            reactionIds = None
         with open(filepath, "w") as f:
-            reactions.toArff(f, expanded=True,
-                             whitelistHeaders=whitelistHeaders)
+            if reactionIds is not None and self.dataset.covers(reactionIds):
+                self.dataset.write(f, reactionIds)
+            else:
+                reactions.toArff(f, expanded=True,
+                                 whitelistHeaders=whitelistHeaders, sparse=self.sparse)
         return filepath
 
+    def exportDataset(self, reactions, verbose=False):
+        """Write all of the reactions to one arff file, from which the arff file of each training and test set is sliced."""
+        descriptorHeaders = [d.csvHeader for d in chain(
+            self.statsModel.container.descriptors, self.statsModel.container.outcomeDescriptors)]
+        return ArffDataset(self._prepareArff(reactions, descriptorHeaders, verbose),
+                           reactions.values_list('pk', flat=True), descriptorHeaders, self.sparse)
+
     def _readWekaOutputFile(self, filename, typeConversionFunction):
         """Read a *.out file called `filename` and outputs an ordered list of the predicted values in that file."""
         prediction_index = 2
@@ -67,27 +132,8 @@ class AbstractWekaModelVisitor(AbstractModelVisitor):
         return predictions
 
     def _runWekaCommand(self, command, verbose=False):
-        """Set the CLASSPATH necessary to use Weka, then runs a shell `command`."""
-        if not settings.WEKA_PATH[self.WEKA_VERSION]:
-            raise ImproperlyConfigured(
-                "'WEKA_PATH' is not set in settings.py!")
-        set_path = "export CLASSPATH=$CLASSPATH:{}; ".format(
-            settings.WEKA_PATH[self.WEKA_VERSION])
-        command = set_path + command
-        logger.debug("Running in Shell:\n{}".format(command))
-        if verbose:
-            print "Running in Shell:\n{}".format(command)
-        subprocess.check_output(command, shell=True)
-        # TODO XXX. figure out some way to throw an error if weka errors (sends stuff to stderr. weka does not generate proper return codes)
-        # This broke things in some cases for reasons not clear to me
-        # wekaProc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True, shell=True)
-        # wekaProc.wait()
-        # if wekaProc.returncode == 0:
-        #     res, resErr = wekaProc.communicate()
-        #     if resErr:
-        #         raise RuntimeError("Weka returned an error: {}".format(resErr))
-        # else:
-        #     raise RuntimeError("Weka returned nonzero exit code")
+        """Run a Weka classifier `command` line (without the java) and return its output."""
+        return runWeka(self.WEKA_VERSION, 'classify', shlex.split(command), verbose=verbose)
 
     def BCR_cost_matrix(self, reactions, response):
         """
@@ -171,16 +217,15 @@ class AbstractWekaModelVisitor(AbstractModelVisitor):
 
         # Currently, we support only one "response" variable.
         response = list(self.statsModel.container.outcomeDescriptors)[0]
-        headers = [h for h in reactions.expandedCsvHeaders()
-                   if h in descriptorHeaders]
-        response_index = headers.index(response.csvHeader) + 1
+        response_index = reactions.expandedArffHeaderIndex(
+            descriptorHeaders)[response.csvHeader] + 1
 
         if self.BCR:
             cost_matrix_string = self.BCR_cost_matrix(reactions, response)
-            command = "java weka.classifiers.meta.CostSensitiveClassifier -cost-matrix {} -W {} -t {} -d {} -p 0 -c {} -- {}".format(
+            command = "weka.classifiers.meta.CostSensitiveClassifier -cost-matrix {} -W {} -t {} -d {} -p 0 -c {} -- {}".format(
                 cost_matrix_string, self.wekaCommand, arff_file, filePath, response_index, self.wekaTrainOptions)
         else:
-            command = "java {} -t {} -d {} -p 0 -c {} {}".format(
+            command = "{} -t {} -d {} -p 0 -c {} {}".format(
                 self.wekaCommand, arff_file, filePath, response_index, self.wekaTrainOptions)
         self._runWekaCommand(command, verbose=verbose)
 
@@ -189,25 +234,31 @@ class AbstractWekaModelVisitor(AbstractModelVisitor):
         descriptorHeaders = [d.csvHeader for d in chain(
             self.statsModel.container.descriptors, self.statsModel.container.outcomeDescriptors)]
 
-        arff_file = self._prepareArff(
-            reactions, descriptorHeaders, verbose=verbose)
+        if (self.dataset is not None and self.dataset.exports(descriptorHeaders, self.sparse) and
+                self.dataset.matches(reactions.values_list('pk', flat=True))):
+            # shared by all the stats models of the container, which deletes it once they have voted
+            arff_file = self.dataset.path
+        else:
+            arff_file = self._prepareArff(
+                reactions, descriptorHeaders, verbose=verbose)
         model_file = self.statsModel.outputFile.name
 
         results_file = "{}_{}.out".format(self.statsModel.pk, uuid.uuid4())
         results_path = os.path.join(settings.TMP_DIR, results_file)
 
         # Currently, we support only one "response" variable.
-        headers = [h for h in reactions.expandedCsvHeaders()
-                   if h in descriptorHeaders]
         response = list(self.statsModel.container.outcomeDescriptors)[0]
-        response_index = headers.index(response.csvHeader) + 1
+        response_index = reactions.expandedArffHeaderIndex(
+            descriptorHeaders)[response.csvHeader] + 1
 
         # TODO: Validate this input.
-        command = "java {} -T {} -l {} -p 0 -c {} 1> {}".format(
-            self.wekaCommand, arff_file, model_file, response_index, results_path)
+        command = "{} -T {} -l {} -p 0 -c {}".format(
+            self.wekaCommand, arff_file, model_file, response_index)
         if verbose:
             print "Writing results to {}".format(results_path)
-        self._runWekaCommand(command, verbose=verbose)
+        output = self._runWekaCommand(command, verbose=verbose)
+        with open(results_path, "w") as f:
+            f.write(output)
 
         if isinstance(response, rxnDescriptors.BoolRxnDescriptor):
             typeConversionFunction = booleanConversion
@@ -220,8 +271,9 @@ class AbstractWekaModelVisitor(AbstractModelVisitor):
         else:
             raise TypeError(
                 "Response descriptor is of invalid type {}".format(type(response)))
+        # the instances of an expanded arff file are in primary key order
         results = tuple((reaction, result) for reaction, result in zip(
-            reactions, self._readWekaOutputFile(results_path, typeConversionFunction)))
+            reactions.order_by('pk'), self._readWekaOutputFile(results_path, typeConversionFunction)))
         return {response: results}
 
 
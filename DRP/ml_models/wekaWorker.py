@@ -0,0 +1,184 @@
+"""
+Running Weka jobs, each in a new java process or all of a process's jobs in one long-lived worker.
+
+Starting a JVM and loading Weka's classes costs more than training and testing many
+small models. With WEKA_WORKER set True in the settings, jobs are instead sent to a
+worker (WekaWorker.java, alongside this module) which loads Weka once and then runs a
+job for each line it reads on its standard input. Each process has its own worker, so
+the workers of a parallel model build make up a pool.
+
+The worker is compiled with javac the first time it is needed, so it needs a JDK rather
+than just a Java runtime. If it cannot be compiled, a warning is given and each job is run
+in a new java process as if WEKA_WORKER were not set.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from subprocess import Popen, PIPE
+import subprocess
+import threading
+import atexit
+import uuid
+import os
+import shutil
+import warnings
+import logging
+
+logger = logging.getLogger(__name__)
+
+WORKER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'WekaWorker.java')
+
+_workers = {}
+_workersLock = threading.Lock()
+
+
+class WekaError(RuntimeError):
+
+    """Weka failed to run a job."""
+
+    pass
+
+
+def _encode(fields):
+    """Encode fields as a request line for the worker."""
+    return '\t'.join(field.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n') for field in fields) + '\n'
+
+
+class WekaWorker(object):
+
+    """
+    A long-lived process running Weka jobs sent to it one line at a time.
+
+    command is the command line which starts the worker process. Anything which speaks the
+    same protocol as WekaWorker.java will do, which is how it is tested without Weka.
+    """
+
+    def __init__(self, command):
+        """Set up the worker; the process is started when the first job is run."""
+        self.command = command
+        self._process = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        """Start the worker process."""
+        logger.debug("Starting Weka worker:\n{}".format(' '.join(self.command)))
+        self._process = Popen(self.command, stdin=PIPE, stdout=PIPE, close_fds=True)
+
+    def run(self, job, args):
+        """
+        Run a job and return its output, raising WekaError if it fails.
+
+        job is 'classify' or 'select', and args the java command line for it,
+        starting with the classifier or attribute evaluator class name.
+        """
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                self._start()
+            try:
+                self._process.stdin.write(_encode([job] + list(args)))
+                self._process.stdin.flush()
+                reply = self._process.stdout.readline().split()
+            except IOError:
+                reply = []
+            if len(reply) != 2 or reply[0] not in ('OK', 'ERROR') or not reply[1].isdigit():
+                # the worker has died or is out of step with its requests, so the next job needs a new one
+                self._kill()
+                raise WekaError('The Weka worker failed to run {} {}'.format(job, ' '.join(args)))
+            output = self._process.stdout.read(int(reply[1]))
+        if reply[0] == 'ERROR':
+            raise WekaError('Weka failed to run {} {}:\n{}'.format(job, ' '.join(args), output))
+        return output
+
+    def _kill(self):
+        """Stop the worker process without waiting for it to finish a job."""
+        if self._process is not None:
+            if self._process.poll() is None:
+                self._process.kill()
+            self._process.wait()
+            self._process = None
+
+    def close(self):
+        """Stop the worker process once it has finished its jobs."""
+        with self._lock:
+            if self._process is not None:
+                self._process.stdin.close()
+                self._process.wait()
+                self._process = None
+
+
+def _wekaPath(version):
+    """Return the path to the Weka jar for a version, as set in the settings."""
+    if not settings.WEKA_PATH.get(version):
+        raise ImproperlyConfigured(
+            "'WEKA_PATH' is not set in settings.py!")
+    return settings.WEKA_PATH[version]
+
+
+def _classpath(*paths):
+    """Return the classpath of the environment extended with paths."""
+    return os.pathsep.join(p for p in (os.environ.get('CLASSPATH'),) + paths if p)
+
+
+def _compileWorker(version):
+    """
+    Compile the worker against a version of Weka if it has not been already, returning the directory of its class.
+
+    Return None, with a warning, if the worker cannot be compiled, for instance because there is no javac.
+    """
+    classDir = os.path.join(settings.TMP_DIR, 'wekaWorker_{}'.format(version))
+    classFile = os.path.join(classDir, 'WekaWorker.class')
+    if not os.path.isfile(classFile) or os.path.getmtime(classFile) < os.path.getmtime(WORKER_SOURCE):
+        # compiled elsewhere and moved into place, in case other processes are compiling it too
+        buildDir = os.path.join(settings.TMP_DIR, 'wekaWorker_{}_{}'.format(version, uuid.uuid4()))
+        os.makedirs(buildDir)
+        try:
+            subprocess.check_call(['javac', '-cp', _classpath(_wekaPath(version)), '-d', buildDir, WORKER_SOURCE])
+            if not os.path.isdir(classDir):
+                os.makedirs(classDir)
+            os.rename(os.path.join(buildDir, 'WekaWorker.class'), classFile)
+        except (OSError, subprocess.CalledProcessError) as e:
+            warnings.warn('Could not compile the Weka worker, which needs a JDK, so each Weka job will start java: {}'.format(e))
+            return None
+        finally:
+            shutil.rmtree(buildDir, ignore_errors=True)
+    return classDir
+
+
+def worker(version):
+    """Return this process's worker for a version of Weka, starting one if need be, or None if the worker cannot be compiled."""
+    key = (os.getpid(), version)
+    with _workersLock:
+        if key not in _workers:
+            classDir = _compileWorker(version)
+            # None is remembered too, so that compiling is not tried again for every job
+            _workers[key] = None if classDir is None else WekaWorker(
+                ['java', '-cp', _classpath(_wekaPath(version), classDir), 'WekaWorker'])
+        return _workers[key]
+
+
+@atexit.register
+def closeWorkers():
+    """Stop the workers of this process."""
+    with _workersLock:
+        for (pid, version), w in _workers.items():
+            if pid == os.getpid() and w is not None:
+                w.close()
+            del _workers[(pid, version)]
+
+
+def runWeka(version, job, args, verbose=False):
+    """
+    Run a Weka job and return what its command line would have printed.
+
+    job is 'classify' for a classifier, or 'select' for attribute selection, and args the
+    java command line for it, starting with the classifier or attribute evaluator class name.
+    """
+    logger.debug("Running Weka {}:\n{}".format(job, ' '.join(args)))
+    if verbose:
+        print "Running Weka {}:\n{}".format(job, ' '.join(args))
+    w = worker(version) if getattr(settings, 'WEKA_WORKER', False) else None
+    if w is not None:
+        # the command line prints the output with a newline of its own
+        return w.run(job, args) + '\n'
+    else:
+        env = dict(os.environ, CLASSPATH=_classpath(_wekaPath(version)))
+        return subprocess.check_output(['java'] + list(args), env=env)
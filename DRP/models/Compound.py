@@ -16,52 +16,104 @@ from itertools import chain
 import importlib
 from collections import OrderedDict
 import PerformedReaction
+import dataVersion
+import DRP
 from django.core.validators import RegexValidator
 from decimal import Decimal
+import json
+import re
 
 descriptorPlugins = [importlib.import_module(plugin) for
                      plugin in settings.MOL_DESCRIPTOR_PLUGINS]
 # This prevents a cyclic dependency problem
 
 
-def elementsFormatValidator(molFormula):
-    """A validator for molecular formulae."""
-    elements = {}
-    inBrackets = False
-    currentElement = ''
-    for char in molFormula:
-        if inBrackets:
-            if currentElement not in elements:
-                elements[currentElement] = {'stoichiometry': 0}
-            if char in (str(x) for x in range(0, 10)) or char == '.':
-                strStoichiometry += char
-            elif char == '}':
-                inBrackets = False
-                elements[currentElement][
-                    'stoichiometry'] += float(strStoichiometry)
-                currentElement = ''
-                strStoichiometry = ''
-            else:
-                raise ValidationError(
-                    'Invalid molecular formula format.', 'mol_malform')
+# the number of atoms of an element, as written between braces in C_{4}H_{8}
+_countPattern = re.compile(r'^(?:\d+(?:\.\d*)?|\.\d+)$')
+
+
+def _readFormula(formula):
+    """
+    Return the list of (element symbol, count as a Decimal or None) written in a molecular formula, in order.
+
+    Formulae are read as they always have been: an upper case letter starts an element symbol and lower
+    case letters continue it (or start one, at the beginning of the formula or after a count), a count in
+    braces may follow a symbol, and underscores are ignored. Raise ValueError if the formula is malformed.
+    """
+    terms = []
+    element = ''
+    position = 0
+    while position < len(formula):
+        char = formula[position]
+        if char == '{':
+            end = formula.find('}', position)
+            if not element or end == -1 or _countPattern.match(formula[position + 1:end]) is None:
+                raise ValueError('Invalid molecular formula format: {}'.format(formula))
+            terms.append((element, Decimal(formula[position + 1:end])))
+            element = ''
+            position = end + 1
+            continue
+        if char.isupper():
+            if element:
+                terms.append((element, None))
+            element = char
         elif char.isalpha():
-            if char.isupper():
-                if currentElement != '':
-                    if currentElement in elements:
-                        elements[currentElement]['stoichiometry'] += 1
-                    else:
-                        elements[currentElement] = {'stoichiometry': 1}
-                currentElement = char
-            else:
-                currentElement += char
-        elif char == '{':
-            strStoichiometry = ''
-            inBrackets = True
-        elif char == '_':
-            pass
+            element += char
+        elif char != '_':
+            raise ValueError('Invalid molecular formula format: {}'.format(formula))
+        position += 1
+    if element:
+        terms.append((element, None))
+    return terms
+
+
+def parseFormula(formula):
+    """
+    Return a dictionary of element symbol to the number of atoms of that element (as a Decimal) in a molecular formula.
+
+    Repeated elements are summed, except that a repeated element ending the formula without a count
+    is counted once, as the original parser did. Raise ValueError if the formula is malformed.
+    """
+    terms = _readFormula(formula)
+    counts = {}
+    for i, (element, count) in enumerate(terms):
+        if i == len(terms) - 1 and count is None:
+            counts[element] = Decimal(1)
         else:
-            raise ValidationError(
-                'Invalid molecular formula format.', code='mol_malform')
+            counts[element] = counts.get(element, Decimal(0)) + (Decimal(1) if count is None else count)
+    return counts
+
+
+def repeatsElements(formula):
+    """Return True if a molecular formula names an element more than once, so that its stoichiometry depends upon how repeats are counted."""
+    elements = [element for element, count in _readFormula(formula)]
+    return len(elements) != len(set(elements))
+
+
+def dumpStoichiometry(counts):
+    """Return the normalised text stored for a dictionary of element to number of atoms."""
+    return json.dumps({element: '{:f}'.format(Decimal(count).normalize()) for element, count in counts.items()}, sort_keys=True)
+
+
+def storedStoichiometry(formula):
+    """Return the stoichiometry text stored for a molecular formula, which is empty if the formula is malformed."""
+    try:
+        return dumpStoichiometry(parseFormula(formula))
+    except ValueError:
+        return ''
+
+
+def loadStoichiometry(stoichiometry):
+    """Return the dictionary of element to number of atoms (as a Decimal) for stored stoichiometry text."""
+    return {str(element): Decimal(count) for element, count in json.loads(stoichiometry).items()}
+
+
+def elementsFormatValidator(molFormula):
+    """A validator for molecular formulae."""
+    try:
+        parseFormula(molFormula)
+    except ValueError:
+        raise ValidationError('Invalid molecular formula format.', code='mol_malform')
 
 
 class CompoundQuerySet(CsvQuerySet, ArffQuerySet):
@@ -86,7 +138,8 @@ class CompoundQuerySet(CsvQuerySet, ArffQuerySet):
 
     def csvHeaders(self, whitelist=None):
         """Generate the header row information for the CSV."""
-        headers = super(CompoundQuerySet, self).csvHeaders()
+        # the stoichiometry is derived from the formula
+        headers = [header for header in super(CompoundQuerySet, self).csvHeaders() if header != 'stoichiometry']
         m = Compound.objects.all().maxChemicalClassCount()
         headers += ['chemicalClass_{}'.format(x + 1) for x in range(0, m)]
         return headers
@@ -94,6 +147,7 @@ class CompoundQuerySet(CsvQuerySet, ArffQuerySet):
     def arffHeaders(self, whitelist=None):
         """Generate headers for the arff file."""
         headers = super(CompoundQuerySet, self).arffHeaders(whitelist)
+        headers.pop('stoichiometry', None)
         m = Compound.objects.all().maxChemicalClassCount()
         for x in range(0, m):
             label = 'chemicalClass_{0}'.format(x + 1)
@@ -294,6 +348,8 @@ class Compound(models.Model):
         help_text="A formula should be made up of element names. C_{4}H_{8} type notation should be use for subscript digits.",
         validators=[elementsFormatValidator]
     )
+    stoichiometry = models.TextField(blank=True, default='', editable=False)
+    """The number of atoms of each element in the formula as normalised json, set from the formula on save so that it need not be parsed again."""
 
     objects = CompoundManager()
 
@@ -301,6 +357,9 @@ class Compound(models.Model):
         """Instantiate an object."""
         super(Compound, self).__init__(*args, **kwargs)
         self.lazyChemicalClasses = []
+        # the formula whose stoichiometry is stored; read from __dict__ so that deferred fields are not loaded
+        self._stoichiometryFormula = self.__dict__.get('formula') if self.__dict__.get('stoichiometry') else None
+        self._elements = None
 
     def __unicode__(self):
         """Unicode representation of a compound is it's name and abbreviation."""
@@ -340,25 +399,81 @@ class Compound(models.Model):
                 if len(errorList) > 0:
                     raise ValidationError(errorList)
 
+    def _changedFields(self):
+        """Return the names of the fields which differ from those saved in the database."""
+        # the stoichiometry is derived from the formula, so changes to it alone change nothing
+        fields = [field.attname for field in self._meta.concrete_fields if not field.primary_key and field.name != 'stoichiometry']
+        saved = Compound.objects.filter(pk=self.pk).values(*fields).first()
+        if saved is None:
+            return []
+        return [field for field in fields if saved[field] != getattr(self, field)]
+
+    def _savedDescriptorValues(self):
+        """Return a dictionary of (value class, descriptor pk) to value for the molecular descriptor values saved for this compound."""
+        values = {}
+        for valueClass, field in ((BoolMolDescriptorValue, 'value'), (NumMolDescriptorValue, 'value'),
+                                  (OrdMolDescriptorValue, 'value'), (CatMolDescriptorValue, 'value_id')):
+            for descriptorId, value in valueClass.objects.filter(compound=self).values_list('descriptor_id', field):
+                values[(valueClass, descriptorId)] = value
+        return values
+
+    def _savedPHCurves(self):
+        """Return a dictionary of identity to the (pH, value) data of the pH curves saved for this compound."""
+        return {curve.identity: (bytes(curve.pHData), bytes(curve.valueData))
+                for curve in DRP.models.PHCurve.objects.filter(compound=self)}
+
+    @staticmethod
+    def _changedPHCurves(before, after):
+        """Return the identities of the pH curves which differ between two sets of saved curves."""
+        return [identity for identity in set(before) | set(after) if before.get(identity) != after.get(identity)]
+
+    @staticmethod
+    def _changedDescriptors(before, after):
+        """Return the molecular descriptors whose values differ between two sets of saved descriptor values."""
+        changed = {}
+        for valueClass, descriptorId in set(before) | set(after):
+            if before.get((valueClass, descriptorId)) != after.get((valueClass, descriptorId)) or \
+                    ((valueClass, descriptorId) in before) != ((valueClass, descriptorId) in after):
+                changed.setdefault(valueClass, []).append(descriptorId)
+        return list(chain(*(valueClass._meta.get_field('descriptor').rel.to.objects.filter(pk__in=descriptorIds)
+                            for valueClass, descriptorIds in changed.items())))
+
     @transaction.atomic
     def save(self, calcDescriptors=True, invalidateReactions=True, *args, **kwargs):
-        """Save the compound, invalidating any consequent objects like reactions and models."""
-        if self.pk is not None and invalidateReactions:
-            for reaction in self.reaction_set.all():
-                reaction.save()  # descriptor recalculation
-                try:
-                    reaction.performedreaction.save()  # invalidate models
-                except PerformedReaction.PerformedReaction.DoesNotExist:
-                    pass  # it doesn't matter
+        """
+        Save the compound, recalculating the reaction descriptors which depend upon whatever changed.
+
+        Only the reaction descriptors derived from changed fields or molecular descriptor values are
+        recalculated, and models are invalidated only for the reactions whose descriptors were.
+        """
+        existing = self.pk is not None
+        changedFields = self._changedFields() if existing and invalidateReactions else []
+        self.stoichiometry = storedStoichiometry(self.formula)
+        self._stoichiometryFormula = self.formula if self.stoichiometry else None
         super(Compound, self).save(*args, **kwargs)
+        changedDescriptors = []
+        changedPHCurves = []
         if self.pk is not None:
             # coping mechanism for compounds loaded from csv files; not to be
             # used by other means
             for lcc in self.lazyChemicalClasses:
                 self.chemicalClasses.add(lcc)
             if calcDescriptors:  # not generally done, but useful for debugging
+                before = self._savedDescriptorValues() if existing and invalidateReactions else {}
+                curvesBefore = self._savedPHCurves() if existing and invalidateReactions else {}
                 for descriptorPlugin in descriptorPlugins:
                     descriptorPlugin.calculate(self)
+                if existing and invalidateReactions:
+                    changedDescriptors = self._changedDescriptors(before, self._savedDescriptorValues())
+                    changedPHCurves = self._changedPHCurves(curvesBefore, self._savedPHCurves())
+        if existing and invalidateReactions and (changedFields or changedDescriptors or changedPHCurves):
+            reactions = DRP.models.Reaction.objects.filter(
+                pk__in=DRP.models.CompoundQuantity.objects.filter(compound=self).values('reaction'))
+            if reactions.exists():
+                # the compound appears in exports of its reactions
+                dataVersion.bump()
+                reactions.recalculate_descriptors(compoundFields=changedFields, molDescriptors=changedDescriptors,
+                                                  pHCurves=changedPHCurves)
 
     @property
     def descriptorValues(self):
@@ -370,41 +485,17 @@ class Compound(models.Model):
         """
         Return a dictionary of elemental symbols and their stoichiometry.
 
-        Note that this method does not validate the data contained in the database.
+        The stored stoichiometry is used if it is that of the current formula, and otherwise
+        the formula is parsed; either way the result is memoised until the formula changes.
+        Raise ValueError if the formula is malformed.
         """
-        elements = {}
-        inBrackets = False
-        currentElement = ''
-        strStoichiometry = ''
-        for char in self.formula:
-            if inBrackets:
-                if currentElement not in elements:
-                    elements[currentElement] = {'stoichiometry': 0}
-                if char in (str(x) for x in range(0, 10)) or char == '.':
-                    strStoichiometry += char
-                elif char == '}':
-                    inBrackets = False
-                    elements[currentElement][
-                        'stoichiometry'] += Decimal(strStoichiometry)
-                    currentElement = ''
-                    strStoichiometry = ''
-                else:
-                    raise ElementException('Invalid molecular formula format.')
-            elif char.isalpha():
-                if char.isupper():
-                    if currentElement != '':
-                        if currentElement in elements:
-                            elements[currentElement]['stoichiometry'] += 1
-                        else:
-                            elements[currentElement] = {'stoichiometry': 1}
-                    currentElement = char
-                else:
-                    currentElement += char
-            elif char == '{':
-                inBrackets = True
-        if currentElement != '':
-            elements[currentElement] = {'stoichiometry': 1}
-        return elements
+        if self._elements is None or self._elements[0] != self.formula:
+            if self._stoichiometryFormula is not None and self._stoichiometryFormula == self.formula:
+                counts = loadStoichiometry(self.stoichiometry)
+            else:
+                counts = parseFormula(self.formula)
+            self._elements = (self.formula, {element: {'stoichiometry': count} for element, count in counts.items()})
+        return self._elements[1]
 
 
 class ElementsException(Exception):
@@ -7,22 +7,37 @@ from CompoundRole import CompoundRole
 from Reaction import Reaction
 from PerformedReaction import PerformedReaction
 from validators import GreaterThanValidator
+import headerRegistry
 
 
 class CompoundQuantityQuerySet(models.query.QuerySet):
 
     """A queryset representing a collection of compounds quantities."""
 
+    def update(self, **kwargs):
+        """Update the compound quantities, invalidating cached export headers."""
+        rows = super(CompoundQuantityQuerySet, self).update(**kwargs)
+        headerRegistry.bumpSchemaVersion()
+        return rows
+
     def delete(self):
         """Force the re-save of reactions pertinent to these compound quantities on deletion."""
-        reactions = Reaction.objects.filter(compoundquantity_set__in=self)
+        reactions = Reaction.objects.filter(compoundquantity__in=self)
         for reaction in reactions:
             reaction.save()  # recalculate descriptors
             try:
                 reaction.performedreaction.save()
             except PerformedReaction.DoesNotExist:
                 pass  # we don't care about this outcome
-        super(CompdoundQuantityQuerySet, self).delete()
+        super(CompoundQuantityQuerySet, self).delete()
+        headerRegistry.bumpSchemaVersion()
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Create the compound quantities, invalidating cached export headers."""
+        objs = super(CompoundQuantityQuerySet, self).bulk_create(
+            objs, *args, **kwargs)
+        headerRegistry.bumpSchemaVersion()
+        return objs
 
 
 class CompoundQuantityManager(models.Manager):
@@ -47,6 +62,7 @@ class CompoundQuantity(models.Model):
         app_label = 'DRP'
         unique_together = ('reaction', 'role', 'amount')
 
+    objects = CompoundQuantityManager()
     compound = models.ForeignKey(Compound, on_delete=models.PROTECT)
     reaction = models.ForeignKey(Reaction)
     role = models.ForeignKey(CompoundRole)
@@ -56,6 +72,8 @@ class CompoundQuantity(models.Model):
     def save(self, calcDescriptors=False, invalidate_models=True, *args, **kwargs):
         """Re-save associated reactions dependent upon this quantity as this will cause descriptor values to change."""
         super(CompoundQuantity, self).save(*args, **kwargs)
+        # the maximum reactant count, and so the export headers, may have changed
+        headerRegistry.bumpSchemaVersion()
         try:
             self.reaction.performedreaction.save(
                 calcDescriptors=calcDescriptors, invalidate_models=invalidate_models)  # invalidate models
@@ -69,7 +87,8 @@ class CompoundQuantity(models.Model):
             self.reaction.performedreaction.save()  # invalidate models
         except PerformedReaction.DoesNotExist:
             self.reaction.save()  # descriptor recalculation
-        super(CompoundQuantity, self).save()
+        super(CompoundQuantity, self).delete()
+        headerRegistry.bumpSchemaVersion()
 
     def __unicode__(self):
         """Return the compound, amount and reaction as a unicode representation."""
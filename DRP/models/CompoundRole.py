@@ -1,5 +1,6 @@
 """A compound role signifies the role a compound plays in a specific reaction."""
 from django.db import models
+import headerRegistry
 
 
 class CompoundRole(models.Model):
@@ -19,6 +20,16 @@ class CompoundRole(models.Model):
     label = models.CharField(max_length=255, unique=True)
     description = models.TextField()
 
+    def save(self, *args, **kwargs):
+        """Save the role, invalidating cached export headers, which list every role."""
+        super(CompoundRole, self).save(*args, **kwargs)
+        headerRegistry.bumpDefinitionVersion()
+
+    def delete(self, *args, **kwargs):
+        """Delete the role, invalidating cached export headers, which list every role."""
+        super(CompoundRole, self).delete(*args, **kwargs)
+        headerRegistry.bumpDefinitionVersion()
+
     def __unicode__(self):
         """Return the label string for the unicode rep."""
         return self.label
@@ -0,0 +1,200 @@
+"""A module containing the ExportJob class, which records csv and arff exports rendered in the background."""
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+from PerformedReaction import PerformedReaction
+import headerRegistry
+import dataVersion
+import hashlib
+import json
+import os
+import shutil
+import time
+
+FORMAT_CHOICES = (('csv', 'csv'), ('arff', 'arff'))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+STATE_CHOICES = ((QUEUED, 'Queued'), (RUNNING, 'Running'),
+                 (DONE, 'Done'), (FAILED, 'Failed'))
+
+# The number of reactions to include in each IN clause when checking who may see an export
+VISIBILITY_CHUNKSIZE = 500
+
+
+def querysetFingerprint(reactionIds):
+    """Return a fingerprint for a set of reactions, independent of their order."""
+    return hashlib.sha1(','.join(str(pk) for pk in sorted(reactionIds))).hexdigest()
+
+
+def whitelistHash(whitelist):
+    """Return a hash for a whitelist of headers, independent of their order."""
+    return hashlib.sha1('all' if whitelist is None else '\n'.join(sorted(set(whitelist)))).hexdigest()
+
+
+@deconstructible
+class ExportStorage(FileSystemStorage):
+
+    """Storage for export artifacts in EXPORT_DIR, which unlike MEDIA_ROOT is not served to the public."""
+
+    def __init__(self):
+        """Set the storage up without a URL, as its files are served only through the export views."""
+        self.base_url = None
+        self.file_permissions_mode = settings.FILE_UPLOAD_PERMISSIONS
+        self.directory_permissions_mode = settings.FILE_UPLOAD_DIRECTORY_PERMISSIONS
+
+    @property
+    def location(self):
+        """Return the directory given in the settings, which is read as it is needed."""
+        return os.path.abspath(settings.EXPORT_DIR)
+
+
+class ExportJobManager(models.Manager):
+
+    """A manager which finds or queues export jobs."""
+
+    def enqueue(self, reactions, fileFormat, expanded=False, whitelist=None, user=None):
+        """
+        Return the export job for the given performed reactions, queueing a new one if none is current.
+
+        A job is current if it is queued, running or done under the present descriptor schema and
+        reaction data versions; any other job for the same export is superseded.
+        """
+        reactionIds = list(reactions.values_list('pk', flat=True))
+        key = {'querysetFingerprint': querysetFingerprint(reactionIds),
+               'whitelistHash': whitelistHash(whitelist),
+               'fileFormat': fileFormat,
+               'expanded': expanded,
+               'schemaVersion': headerRegistry.schemaVersion(),
+               'dataVersion': dataVersion.current()}
+        try:
+            with transaction.atomic():
+                job, created = self.get_or_create(defaults={'reactionIds': json.dumps(reactionIds),
+                                                            'whitelist': json.dumps(whitelist),
+                                                            'requestedBy': user}, **key)
+        except IntegrityError:
+            # another request queued the same export between our lookup and insert
+            job, created = self.get(**key), False
+        if not created and job.state == FAILED:
+            job.state = QUEUED
+            job.error = ''
+            job.save()
+        return job
+
+    def superseded(self):
+        """Return the jobs which were not queued under the present schema and data versions."""
+        return self.exclude(schemaVersion=headerRegistry.schemaVersion(), dataVersion=dataVersion.current())
+
+
+class ExportJob(models.Model):
+
+    """A csv or arff export of a set of performed reactions, rendered to EXPORT_DIR by the run_export_jobs command."""
+
+    class Meta:
+        app_label = "DRP"
+        unique_together = ('querysetFingerprint', 'whitelistHash', 'fileFormat',
+                           'expanded', 'schemaVersion', 'dataVersion')
+
+    objects = ExportJobManager()
+
+    querysetFingerprint = models.CharField(max_length=40)
+    whitelistHash = models.CharField(max_length=40)
+    fileFormat = models.CharField(max_length=4, choices=FORMAT_CHOICES)
+    expanded = models.BooleanField(default=False)
+    schemaVersion = models.CharField(max_length=32)
+    dataVersion = models.CharField(max_length=32)
+    reactionIds = models.TextField()
+    """A json list of the primary keys of the performed reactions to export."""
+    whitelist = models.TextField()
+    """A json list of the headers to export, or null for every header."""
+    state = models.CharField(
+        max_length=7, choices=STATE_CHOICES, default=QUEUED)
+    error = models.TextField(blank=True)
+    artifact = models.FileField(storage=ExportStorage(), max_length=200, blank=True)
+    requestedBy = models.ForeignKey(User, null=True, blank=True, default=None)
+    queuedTime = models.DateTimeField(auto_now_add=True)
+    finishedTime = models.DateTimeField(null=True, default=None)
+
+    @property
+    def isCurrent(self):
+        """Return True if the reaction data and descriptors have not changed since this job was queued."""
+        return self.schemaVersion == headerRegistry.schemaVersion() and self.dataVersion == dataVersion.current()
+
+    def visibleTo(self, user):
+        """Return True if the user may see every reaction in the export, which is then theirs to download."""
+        if self.expanded and not user.is_staff:
+            return False
+        reactionIds = sorted(set(json.loads(self.reactionIds)))
+        hidden = PerformedReaction.objects.exclude(Q(public=True) | Q(labGroup__in=user.labgroup_set.all()))
+        for start in range(0, len(reactionIds), VISIBILITY_CHUNKSIZE):
+            if hidden.filter(pk__in=reactionIds[start:start + VISIBILITY_CHUNKSIZE]).exists():
+                return False
+        return True
+
+    def claim(self):
+        """Mark a queued job as running, returning False if another worker got to it first."""
+        claimed = ExportJob.objects.filter(
+            pk=self.pk, state=QUEUED).update(state=RUNNING)
+        if claimed:
+            self.state = RUNNING
+        return bool(claimed)
+
+    def render(self):
+        """Render the export to its artifact file, recording any failure on the job."""
+        reactions = PerformedReaction.objects.filter(
+            pk__in=json.loads(self.reactionIds))
+        whitelist = json.loads(self.whitelist)
+        fileName = '{}_{}.{}'.format(
+            self.querysetFingerprint, self.pk, self.fileFormat)
+        path = os.path.join(settings.TMP_DIR, fileName)
+        try:
+            with open(path, 'w') as f:
+                if self.fileFormat == 'arff':
+                    reactions.toArff(
+                        f, expanded=self.expanded, whitelistHeaders=whitelist)
+                else:
+                    reactions.toCsv(
+                        f, expanded=self.expanded, whitelistHeaders=whitelist)
+            with open(path, 'r') as f:
+                self.artifact.save(fileName, File(f), save=False)
+            self.state = DONE
+        except Exception as e:
+            self.state = FAILED
+            self.error = repr(e)
+            raise
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+            self.finishedTime = timezone.now()
+            self.save()
+
+    def copyTo(self, path, poll=1):
+        """
+        Copy the artifact to path, rendering it first in this process if no worker has claimed the job.
+
+        If a worker is already rendering the job, wait for it to finish.
+        """
+        if self.claim():
+            self.render()
+        while self.state in (QUEUED, RUNNING):
+            time.sleep(poll)
+            self.refresh_from_db()
+            if self.claim():
+                self.render()
+        if self.state == FAILED:
+            raise RuntimeError(
+                'Export job {} failed: {}'.format(self.pk, self.error))
+        shutil.copyfile(self.artifact.path, path)
+
+    def delete(self, *args, **kwargs):
+        """Delete the job along with its artifact."""
+        if self.artifact:
+            self.artifact.delete(save=False)
+        super(ExportJob, self).delete(*args, **kwargs)
@@ -2,9 +2,13 @@
 from django.db import models
 from django.conf import settings
 from django.db import transaction
+from django import db
+from django.core.cache import caches
 from django.core.exceptions import ValidationError
 from numpy import average
-from itertools import chain, izip_longest
+from itertools import chain, izip, izip_longest
+from multiprocessing import Pool
+import traceback
 import random
 import datetime
 import importlib
@@ -12,6 +16,8 @@ import os
 from DRP.models.rxnDescriptors import BoolRxnDescriptor, OrdRxnDescriptor, NumRxnDescriptor, CatRxnDescriptor
 from DRP.models.rxnDescriptorValues import BoolRxnDescriptorValue, NumRxnDescriptorValue, OrdRxnDescriptorValue, CatRxnDescriptorValue
 from StatsModel import StatsModel
+from dataSets import DataSet, DataSetRelation
+from PerformedReaction import PerformedReaction
 from DRP.utils import accuracy, BCR, Matthews, confusionMatrixString, confusionMatrixTable
 import json
 import sys
@@ -163,6 +169,28 @@ class OutcomeDescriptorAttribute(object):
         modelContainer.outcomeOrdRxnDescriptors.clear()
 
 
+def _initialiseWorker():
+    """Drop any cache connections inherited from the parent process, so that each worker makes its own."""
+    for cache in caches.all():
+        cache.close()
+
+
+def _trainAndTestStatsModel(args):
+    """
+    Train and test one stats model in a worker process, returning its test set predictions and any traceback.
+
+    args is (stats model pk, verbose, shared dataset). Errors are returned rather than raised so that the other models carry on.
+    """
+    statsModelId, verbose, dataset = args
+    try:
+        statsModel = StatsModel.objects.get(pk=statsModelId)
+        return statsModel.container._trainAndTest(statsModel, verbose=verbose, dataset=dataset), None
+    except Exception:
+        return None, traceback.format_exc()
+    finally:
+        db.connections.close_all()
+
+
 class ModelContainer(models.Model):
 
     """A class for describing a group of statistical models."""
@@ -366,7 +394,7 @@ class ModelContainer(models.Model):
             statsModel.save()
             statsModel.testSets.add(testSet)
 
-    def build(self, verbose=False):
+    def build(self, verbose=False, workers=1):
         """
         Take all options confirmed so far and generate a full model set.
 
@@ -375,6 +403,11 @@ class ModelContainer(models.Model):
 
         Run the tests for the model using the test sets of data, and then saves that information.
 
+        If workers is more than one, the stats models are trained and tested concurrently in that
+        many worker processes, and their predictions are stored by this process as they finish.
+
+        The reactions of all the training and test sets are exported once, and the model visitor
+        takes each set from that export rather than exporting its reactions again.
         """
         if self.built:
             raise RuntimeError(
@@ -387,69 +420,77 @@ class ModelContainer(models.Model):
         # hairy real fast.
         resDict = {}
 
-        num_models = self.statsmodel_set.all().count()
-        num_finished = 0
-        overall_start_time = datetime.datetime.now()
-        for statsModel in self.statsmodel_set.all():
-            visitorOptions = json.loads(self.modelVisitorOptions)
-            modelVisitor = getattr(visitorModules[self.modelVisitorLibrary], self.modelVisitorTool)(
-                statsModel=statsModel, **visitorOptions)
-            # Train the model.
-            statsModel.startTime = datetime.datetime.now()
-            fileName = os.path.join(settings.MODEL_DIR, '{}_{}_{}_{}.model'.format(
-                self.pk, statsModel.pk, self.modelVisitorLibrary, self.modelVisitorTool))
-            statsModel.outputFile = fileName
-            if verbose:
-                print "{} statsModel {}, saving to {}, training...".format(statsModel.startTime, statsModel.pk, fileName)
-            modelVisitor.train(verbose=verbose)
-            statsModel.endTime = datetime.datetime.now()
+        statsModels = list(self.statsmodel_set.all())
+        num_models = len(statsModels)
+        dataset = self._exportDataset(statsModels, verbose=verbose)
+        try:
+            if workers > 1:
+                results = self._trainAndTestInParallel(statsModels, workers, verbose=verbose, dataset=dataset)
+            else:
+                results = ((statsModel, self._trainAndTest(statsModel, verbose=verbose, dataset=dataset))
+                           for statsModel in statsModels)
+            self._storeBuildPredictions(results, resDict, num_models, verbose=verbose)
+        finally:
+            if dataset is not None:
+                dataset.delete()
+
+        if resDict:
             if verbose:
-                print "\t...Trained. Finished at {}. Saving statsModel...".format(statsModel.endTime),
-            statsModel.save()
+                print "Storing overall model predictions...",
+            self._storePredictions(resDict)
             if verbose:
-                print "saved"
+                print "Predictions stored"
 
-            # Test the model.
-            for testSet in statsModel.testSets.all():
-                if testSet.reactions.all().count() != 0:
-                    if verbose:
-                        print "Predicting test set..."
-                    predictions = modelVisitor.predict(
-                        testSet.reactions.all(), verbose=verbose)
-                    if verbose:
-                        print "\t...finished predicting. Storing predictions...",
-                    newResDict = self._storePredictionComponents(
-                        predictions, statsModel)
-
-                    # Update the overall result-dictionary with these new
-                    # counts.
-                    for reaction, responseDict in newResDict.items():
-                        for response, outcomeDict in responseDict.items():
-                            for outcome, count in outcomeDict.items():
-                                if reaction not in resDict:
-                                    resDict[reaction] = {}
-                                if response not in resDict[reaction]:
-                                    resDict[reaction][response] = {}
-
-                                if outcome not in resDict[reaction][response]:
-                                    resDict[reaction][response][
-                                        outcome] = count
-                                resDict[reaction][response][outcome] += count
+        self.built = True
+        if verbose:
+            overall_end_time = datetime.datetime.now()
+            print "Finished at {}".format(overall_end_time)
 
-                    if verbose:
-                        print "predictions stored."
-                        for response in self.outcomeDescriptors:
-                            predDesc = response.predictedDescriptorType.objects.get(
-                                modelContainer=self, statsModel=statsModel, predictionOf=response)
-                            conf_mtrx = predDesc.getConfusionMatrix()
+    def _modelVisitor(self, statsModel, dataset=None):
+        """Return this container's model visitor for a stats model."""
+        visitorOptions = json.loads(self.modelVisitorOptions)
+        return getattr(visitorModules[self.modelVisitorLibrary], self.modelVisitorTool)(
+            statsModel=statsModel, dataset=dataset, **visitorOptions)
+
+    def _exportDataset(self, statsModels, verbose=False):
+        """Export the reactions of all the training and test sets of statsModels once, returning the model visitor's shared dataset."""
+        if not statsModels:
+            return None
+        dataSets = set(statsModel.trainingSet_id for statsModel in statsModels)
+        dataSets.update(DataSet.objects.filter(
+            testSetsFor__in=statsModels).values_list('pk', flat=True))
+        reactions = PerformedReaction.objects.filter(
+            pk__in=DataSetRelation.objects.filter(dataSet__in=dataSets).values('reaction'))
+        if verbose:
+            print "Exporting {} reactions for {} stats models...".format(reactions.count(), len(statsModels))
+        return self._modelVisitor(statsModels[0]).exportDataset(reactions, verbose=verbose)
 
-                            print "Confusion matrix for {}:".format(predDesc.heading)
-                            print confusionMatrixString(conf_mtrx)
-                            print "Accuracy: {:.3}".format(accuracy(conf_mtrx))
-                            print "BCR: {:.3}".format(BCR(conf_mtrx))
+    def _storeBuildPredictions(self, results, resDict, num_models, verbose=False):
+        """Store the test set predictions of each (stats model, test predictions) in results, adding their votes to resDict."""
+        num_finished = 0
+        overall_start_time = datetime.datetime.now()
+        for statsModel, testPredictions in results:
+            for predictions in testPredictions:
+                if verbose:
+                    print "\t...finished predicting. Storing predictions...",
+                newResDict = self._storePredictionComponents(
+                    predictions, statsModel)
+
+                # Update the overall result-dictionary with these new
+                # counts.
+                self._addVotes(resDict, newResDict)
+
+                if verbose:
+                    print "predictions stored."
+                    for response in self.outcomeDescriptors:
+                        predDesc = response.predictedDescriptorType.objects.get(
+                            modelContainer=self, statsModel=statsModel, predictionOf=response)
+                        conf_mtrx = predDesc.getConfusionMatrix()
 
-                elif verbose:
-                    print "Test set is empty."
+                        print "Confusion matrix for {}:".format(predDesc.heading)
+                        print confusionMatrixString(conf_mtrx)
+                        print "Accuracy: {:.3}".format(accuracy(conf_mtrx))
+                        print "BCR: {:.3}".format(BCR(conf_mtrx))
 
             if verbose:
                 num_finished += 1
@@ -460,17 +501,82 @@ class ModelContainer(models.Model):
                 print "{}. {} of {} models built.".format(end_time, num_finished, num_models)
                 print "Elapsed model building time: {}. Expected completion time: {}".format(elapsed, expected_finish)
 
-        if resDict:
-            if verbose:
-                print "Storing overall model predictions...",
-            self._storePredictions(resDict)
-            if verbose:
-                print "Predictions stored"
-
-        self.built = True
+    def _trainAndTest(self, statsModel, verbose=False, dataset=None):
+        """Train a stats model and return its predictions for each of its non-empty test sets."""
+        modelVisitor = self._modelVisitor(statsModel, dataset)
+        # Train the model.
+        statsModel.startTime = datetime.datetime.now()
+        fileName = os.path.join(settings.MODEL_DIR, '{}_{}_{}_{}.model'.format(
+            self.pk, statsModel.pk, self.modelVisitorLibrary, self.modelVisitorTool))
+        statsModel.outputFile = fileName
         if verbose:
-            overall_end_time = datetime.datetime.now()
-            print "Finished at {}".format(overall_end_time)
+            print "{} statsModel {}, saving to {}, training...".format(statsModel.startTime, statsModel.pk, fileName)
+        modelVisitor.train(verbose=verbose)
+        statsModel.endTime = datetime.datetime.now()
+        if verbose:
+            print "\t...Trained. Finished at {}. Saving statsModel...".format(statsModel.endTime),
+        statsModel.save()
+        if verbose:
+            print "saved"
+
+        # Test the model.
+        testPredictions = []
+        for testSet in statsModel.testSets.all():
+            if testSet.reactions.all().count() != 0:
+                if verbose:
+                    print "Predicting test set..."
+                testPredictions.append(modelVisitor.predict(
+                    testSet.reactions.all(), verbose=verbose))
+            elif verbose:
+                print "Test set is empty."
+        return testPredictions
+
+    def _trainAndTestInParallel(self, statsModels, workers, verbose=False, dataset=None):
+        """
+        Generate (stats model, test set predictions) for each of statsModels, trained and tested in worker processes.
+
+        Results are generated in the order of statsModels, so that votes are counted in the
+        same order as a sequential build. If any stats model fails, RuntimeError is raised
+        with the tracebacks once the others have finished.
+        """
+        if transaction.get_connection().in_atomic_block:
+            raise RuntimeError(
+                'A model container cannot be built in parallel inside a transaction, since the workers could not see its stats models.')
+        # each worker must open its own database connection
+        db.connections.close_all()
+        pool = Pool(processes=workers, initializer=_initialiseWorker)
+        failures = []
+        try:
+            for statsModel, (testPredictions, error) in izip(statsModels, pool.imap(
+                    _trainAndTestStatsModel, [(statsModel.pk, verbose, dataset) for statsModel in statsModels])):
+                if error is None:
+                    # the worker saved the training times and output file
+                    yield StatsModel.objects.get(pk=statsModel.pk), testPredictions
+                else:
+                    failures.append((statsModel.pk, error))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        if failures:
+            raise RuntimeError('Building failed for stats models {}:\n{}'.format(
+                ', '.join(str(pk) for pk, error in failures), '\n'.join(error for pk, error in failures)))
+
+    @staticmethod
+    def _addVotes(resDict, newResDict):
+        """Add the votes of a component model in newResDict to the overall votes in resDict."""
+        for reaction, responseDict in newResDict.items():
+            for response, outcomeDict in responseDict.items():
+                for outcome, count in outcomeDict.items():
+                    if reaction not in resDict:
+                        resDict[reaction] = {}
+                    if response not in resDict[reaction]:
+                        resDict[reaction][response] = {}
+
+                    if outcome not in resDict[reaction][response]:
+                        resDict[reaction][response][
+                            outcome] = count
+                    resDict[reaction][response][outcome] += count
 
     def _storePredictionComponents(self, predictions, statsModel, resDict=None):
         """
@@ -560,58 +666,58 @@ class ModelContainer(models.Model):
         return finalPredictions
 
     def predict(self, reactions, verbose=False):
-        """Make predictions from the voting for a set of provided reactions."""
+        """
+        Make predictions from the voting for a set of provided reactions.
+
+        The reactions are exported once, and every stats model predicts from that export.
+        """
         if self.built:
             resDict = {}
 
-            num_models = self.statsmodel_set.all().count()
+            statsModels = list(self.statsmodel_set.all())
+            num_models = len(statsModels)
             num_finished = 0
             overall_start_time = datetime.datetime.now()
-            for model in self.statsmodel_set.all():
-                visitorOptions = json.loads(self.modelVisitorOptions)
-                modelVisitor = getattr(visitorModules[self.modelVisitorLibrary], self.modelVisitorTool)(
-                    statsModel=model, **visitorOptions)
-                if verbose:
-                    print "statsModel {}, saved at {}, predicting...".format(model.pk, model.outputFile)
-                predictions = modelVisitor.predict(reactions, verbose=verbose)
-                if verbose:
-                    print "\t...finished predicting. Storing predictions...",
-                newResDict = self._storePredictionComponents(
-                    predictions, model)
-
-                # Update the overall result-dictionary with these new counts.
-                for reaction, responseDict in newResDict.items():
-                    for response, outcomeDict in responseDict.items():
-                        for outcome, count in outcomeDict.items():
-                            if reaction not in resDict:
-                                resDict[reaction] = {}
-                            if response not in resDict[reaction]:
-                                resDict[reaction][response] = {}
+            # every stats model predicts from the same export of the reactions
+            dataset = self._modelVisitor(statsModels[0]).exportDataset(
+                reactions, verbose=verbose) if statsModels else None
+            try:
+                for model in statsModels:
+                    modelVisitor = self._modelVisitor(model, dataset)
+                    if verbose:
+                        print "statsModel {}, saved at {}, predicting...".format(model.pk, model.outputFile)
+                    predictions = modelVisitor.predict(reactions, verbose=verbose)
+                    if verbose:
+                        print "\t...finished predicting. Storing predictions...",
+                    newResDict = self._storePredictionComponents(
+                        predictions, model)
 
-                            if outcome not in resDict[reaction][response]:
-                                resDict[reaction][response][outcome] = count
-                            resDict[reaction][response][outcome] += count
+                    # Update the overall result-dictionary with these new counts.
+                    self._addVotes(resDict, newResDict)
 
-                if verbose:
-                    print "predictions stored."
-                    for response in self.outcomeDescriptors:
-                        predDesc = response.predictedDescriptorType.objects.get(
-                            modelContainer=self, statsModel=model, predictionOf=response)
-                        conf_mtrx = predDesc.getConfusionMatrix(
-                            reactions=reactions)
+                    if verbose:
+                        print "predictions stored."
+                        for response in self.outcomeDescriptors:
+                            predDesc = response.predictedDescriptorType.objects.get(
+                                modelContainer=self, statsModel=model, predictionOf=response)
+                            conf_mtrx = predDesc.getConfusionMatrix(
+                                reactions=reactions)
 
-                        print "Confusion matrix for {}:".format(predDesc.heading)
-                        print confusionMatrixString(conf_mtrx)
-                        print "Accuracy: {:.3}".format(accuracy(conf_mtrx))
-                        print "BCR: {:.3}".format(BCR(conf_mtrx))
-                        print "Matthews: {:.3}".format(Matthews(conf_mtrx))
-                    num_finished += 1
-                    end_time = datetime.datetime.now()
-                    elapsed = (end_time - overall_start_time)
-                    expected_finish = datetime.timedelta(seconds=(elapsed.total_seconds(
-                    ) * (num_models / float(num_finished)))) + overall_start_time
-                    print "{}. Predictions from {} of {} models.".format(end_time, num_finished, num_models)
-                    print "Elapsed prediction time: {}. Expected completion time: {}".format(elapsed, expected_finish)
+                            print "Confusion matrix for {}:".format(predDesc.heading)
+                            print confusionMatrixString(conf_mtrx)
+                            print "Accuracy: {:.3}".format(accuracy(conf_mtrx))
+                            print "BCR: {:.3}".format(BCR(conf_mtrx))
+                            print "Matthews: {:.3}".format(Matthews(conf_mtrx))
+                        num_finished += 1
+                        end_time = datetime.datetime.now()
+                        elapsed = (end_time - overall_start_time)
+                        expected_finish = datetime.timedelta(seconds=(elapsed.total_seconds(
+                        ) * (num_models / float(num_finished)))) + overall_start_time
+                        print "{}. Predictions from {} of {} models.".format(end_time, num_finished, num_models)
+                        print "Elapsed prediction time: {}. Expected completion time: {}".format(elapsed, expected_finish)
+            finally:
+                if dataset is not None:
+                    dataset.delete()
 
             return self._storePredictions(resDict)
         else:
@@ -0,0 +1,115 @@
+"""A module containing the PHCurve class, which holds the values of a pH dependent molecular descriptor across a range of pH."""
+from django.db import models
+import numpy as np
+
+
+def interpolate(pHs, values, at):
+    """
+    Return the values of a curve linearly interpolated at each of the pH values in at.
+
+    Points with no value are skipped, and nan is returned outside the range of the remaining points.
+    """
+    pHs = np.asarray(pHs, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    at = np.asarray(at, dtype=np.float64)
+    known = ~np.isnan(values)
+    pHs = pHs[known]
+    values = values[known]
+    if not len(pHs):
+        missing = np.empty(at.shape)
+        missing.fill(np.nan)
+        return missing
+    return np.interp(at, pHs, values, left=np.nan, right=np.nan)
+
+
+class PHCurveQuerySet(models.query.QuerySet):
+
+    """A queryset of pH curves."""
+
+    def write(self, compoundIds, identities, curves):
+        """
+        Make the stored curves of the given identities for compoundIds exactly those in curves.
+
+        identities are (heading, calculatorSoftware, calculatorSoftwareVersion) tuples, and curves
+        a dictionary of (compound pk, identity) to (pHs, values). Curves which have not changed
+        are left alone. Return the number of curves written or deleted.
+        """
+        compoundIds = set(compoundIds)
+        identities = set(identities)
+        stored = {}
+        if compoundIds and identities:
+            for curve in self.filter(compound__in=compoundIds, heading__in=set(identity[0] for identity in identities)):
+                if curve.identity in identities:
+                    stored[(curve.compound_id, curve.identity)] = curve
+
+        wanted = {}
+        for (compoundId, identity), (pHs, values) in curves.items():
+            if compoundId in compoundIds and identity in identities:
+                wantedCurve = PHCurve(compound_id=compoundId, heading=identity[0], calculatorSoftware=identity[1],
+                                      calculatorSoftwareVersion=identity[2])
+                wantedCurve.setPoints(pHs, values)
+                wanted[(compoundId, identity)] = wantedCurve
+
+        changed = [key for key, wantedCurve in wanted.items() if key not in stored or
+                   (bytes(stored[key].pHData), bytes(stored[key].valueData)) != (wantedCurve.pHData, wantedCurve.valueData)]
+        stale = [curve.pk for key, curve in stored.items() if key not in wanted or key in changed]
+        if stale:
+            self.filter(pk__in=stale).delete()
+        if changed:
+            self.bulk_create([wanted[key] for key in changed])
+        return len(changed) + len([key for key in stored if key not in wanted])
+
+
+class PHCurve(models.Model):
+
+    """
+    The values of a pH dependent molecular descriptor for a compound, at each of a range of pH.
+
+    A curve replaces a separate molecular descriptor for each sampled pH, and reaction
+    descriptors at the reaction pH are interpolated from it. The pH and values are held
+    as arrays of little endian float64, with nan where no value could be calculated.
+    """
+
+    class Meta:
+        app_label = 'DRP'
+        unique_together = ('compound', 'heading', 'calculatorSoftware', 'calculatorSoftwareVersion')
+
+    objects = PHCurveQuerySet.as_manager()
+
+    compound = models.ForeignKey('Compound', related_name='pHCurves')
+    heading = models.CharField(max_length=200)
+    """The heading of the pH dependent descriptor."""
+    calculatorSoftware = models.CharField(max_length=100)
+    calculatorSoftwareVersion = models.CharField(max_length=20)
+    pHData = models.BinaryField()
+    valueData = models.BinaryField()
+
+    @property
+    def identity(self):
+        """Return the (heading, calculatorSoftware, calculatorSoftwareVersion) of the descriptor."""
+        return (self.heading, self.calculatorSoftware, self.calculatorSoftwareVersion)
+
+    @property
+    def pHs(self):
+        """Return the array of pH at which values were calculated."""
+        return np.frombuffer(bytes(self.pHData), dtype='<f8')
+
+    @property
+    def values(self):
+        """Return the array of values, with nan where none could be calculated."""
+        return np.frombuffer(bytes(self.valueData), dtype='<f8')
+
+    def setPoints(self, pHs, values):
+        """Set the curve from sequences of pH and of the values at those pH (None for no value), sorted by pH."""
+        values = [np.nan if value is None else value for value in values]
+        order = np.argsort(np.asarray(pHs, dtype=np.float64), kind='mergesort')
+        self.pHData = np.asarray(pHs, dtype='<f8')[order].tostring()
+        self.valueData = np.asarray(values, dtype='<f8')[order].tostring()
+
+    def at(self, pHs):
+        """Return the values interpolated at each of pHs."""
+        return interpolate(self.pHs, self.values, pHs)
+
+    def __unicode__(self):
+        """Return the heading and compound as the unicode rep."""
+        return u'{} pH curve for {}'.format(self.heading, self.compound)
@@ -1,19 +1,27 @@
 """A module containing only the Reaction class."""
 from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from LabGroup import LabGroup
 from Compound import Compound
 from querysets import CsvQuerySet, ArffQuerySet, MultiQuerySet
 from descriptors import BooleanDescriptor, NumericDescriptor, CategoricalDescriptor, OrdinalDescriptor
 from rxnDescriptorValues import BoolRxnDescriptorValue, NumRxnDescriptorValue, OrdRxnDescriptorValue, CatRxnDescriptorValue
 from rxnDescriptors import BoolRxnDescriptor, NumRxnDescriptor, OrdRxnDescriptor, CatRxnDescriptor
-from itertools import chain
+from itertools import chain, izip
 from CompoundRole import CompoundRole
 from collections import OrderedDict
 import DRP
 import importlib
 from django.conf import settings
-import gc
 from django.db.models.functions import Concat
+from descriptors import CategoricalDescriptorPermittedValue
+import numpy as np
+import featureMatrix
+import headerRegistry
+import dataVersion
+from arrayBuilder import ArrayBuilder
+from pivotRows import PivotRowEngine
 
 descriptorPlugins = [importlib.import_module(plugin) for
                      plugin in settings.RXN_DESCRIPTOR_PLUGINS]
@@ -36,14 +44,50 @@ class ReactionQuerySet(CsvQuerySet, ArffQuerySet):
             return 0
         return m
 
+    def globalMaxReactantCount(self):
+        """Return the maximum number of compounds in any reaction from the header registry."""
+        return headerRegistry.cached(self.model, 'maxReactantCount', None, lambda: Reaction.objects.all().maxReactantCount())
+
     def _getCompoundQuantityHeaderOrder(self, i):
         """Return the headers for compound quantities for csv or similar creation, in order."""
         return ['compound_{}'.format(i), 'compound_{}_role'.format(i), 'compound_{}_amount'.format(i)]
 
     def csvHeaders(self, whitelist=None):
+        """Return the header row information for the CSV from the header registry."""
+        return headerRegistry.cached(self.model, 'csvHeaders', whitelist, lambda: self._csvHeaders(whitelist))
+
+    def arffHeaders(self, whitelist=None):
+        """Return headers for the arff file from the header registry."""
+        return headerRegistry.cached(self.model, 'arffHeaders', whitelist, lambda: self._arffHeaders(whitelist))
+
+    def expandedArffHeaders(self, whitelist=None):
+        """Return headers for the expanded Arff file from the header registry."""
+        return headerRegistry.cached(self.model, 'expandedArffHeaders', whitelist, lambda: self._expandedArffHeaders(whitelist))
+
+    def expandedCsvHeaders(self, whitelist=None):
+        """Return the expanded header for the csv from the header registry."""
+        return headerRegistry.cached(self.model, 'expandedCsvHeaders', whitelist, lambda: self._expandedCsvHeaders(whitelist))
+
+    def expandedArffHeaderIndex(self, whitelist=None):
+        """Return a dictionary of each header to its (zero based) attribute position in the expanded Arff file."""
+        return headerRegistry.cached(self.model, 'expandedArffHeaderIndex', whitelist,
+                                     lambda: {header: i for i, header in enumerate(self.expandedArffHeaders(whitelist))})
+
+    def storageDefaults(self, whitelist=None):
+        """Return a dictionary of csvHeader to storage default for the numeric descriptors which have one, from the header registry."""
+        return headerRegistry.cached(self.model, 'storageDefaults', whitelist, lambda: self._storageDefaults(whitelist))
+
+    def _storageDefaults(self, whitelist=None):
+        """Generate the dictionary of csvHeader to storage default."""
+        descriptors = NumRxnDescriptor.objects.filter(storageDefault__isnull=False)
+        if whitelist is not None:
+            descriptors = descriptors.filter(csvHeader__in=whitelist)
+        return {descriptor.csvHeader: descriptor.storageDefault for descriptor in descriptors}
+
+    def _csvHeaders(self, whitelist=None):
         """Generate the header row information for the CSV."""
         headers = super(ReactionQuerySet, self).csvHeaders(whitelist)
-        m = Reaction.objects.all().maxReactantCount()
+        m = self.globalMaxReactantCount()
         for i in range(0, m):
             h = self._getCompoundQuantityHeaderOrder(i)
             if whitelist is None or h in whitelist:
@@ -51,10 +95,10 @@ class ReactionQuerySet(CsvQuerySet, ArffQuerySet):
 
         return headers
 
-    def arffHeaders(self, whitelist=None):
+    def _arffHeaders(self, whitelist=None):
         """Generate headers for the arff file."""
         headers = super(ReactionQuerySet, self).arffHeaders(whitelist)
-        m = Reaction.objects.all().maxReactantCount()
+        m = self.globalMaxReactantCount()
         for i in range(0, m):
             compound_label = 'compound_{}'.format(i)
             if whitelist is None or compound_label in whitelist:
@@ -71,14 +115,16 @@ class ReactionQuerySet(CsvQuerySet, ArffQuerySet):
 
         return headers
 
-    def expandedArffHeaders(self, whitelist=None):
-        """Return headers for the expanded Arff file."""
+    def _expandedArffHeaders(self, whitelist=None):
+        """Generate headers for the expanded Arff file."""
         headers = self.arffHeaders(whitelist)
+        descriptors = self.descriptors if whitelist is None else self.descriptors.filter(
+            csvHeader__in=whitelist)
         headers.update(OrderedDict(((d.csvHeader, d.arffHeader)
-                                    for d in self.descriptors.filter(csvHeader__in=whitelist))))
+                                    for d in descriptors)))
         return headers
 
-    def expandedCsvHeaders(self, whitelist=None):
+    def _expandedCsvHeaders(self, whitelist=None):
         """Generate the expanded header for the csv."""
         if whitelist is not None:
             return self.csvHeaders(whitelist) + [d.csvHeader for d in self.descriptors.filter(csvHeader__in=whitelist)]
@@ -99,9 +145,54 @@ class ReactionQuerySet(CsvQuerySet, ArffQuerySet):
                              CatRxnDescriptor.objects.all()
                              )
 
+    def _featureMatrixColumns(self, whitelist=None):
+        """Return (descriptor, value type) pairs for the descriptors which appear in expanded rows."""
+        columns = []
+        for valueType, descriptorClass in (('bool', BoolRxnDescriptor), ('num', NumRxnDescriptor),
+                                           ('ord', OrdRxnDescriptor), ('cat', CatRxnDescriptor)):
+            descriptors = descriptorClass.objects.all()
+            if whitelist is not None:
+                descriptors = descriptors.filter(csvHeader__in=whitelist)
+            columns.extend((descriptor, valueType)
+                           for descriptor in descriptors)
+        return columns
+
+    def _featureMatrixRows(self, whitelist=None, chunksize=5000):
+        """Generate expanded rows, reading the descriptor values from the feature matrix cache."""
+        columns = self._featureMatrixColumns(whitelist)
+        keys = [(descriptor.csvHeader, valueType)
+                for descriptor, valueType in columns]
+        permittedValues = {pk: value.encode('utf-8') for pk, value in CategoricalDescriptorPermittedValue.objects.filter(
+            descriptor__in=[d for d, valueType in columns if valueType == 'cat']).values_list('pk', 'value')}
+        decoders = {'bool': bool, 'num': float, 'ord': int,
+                    'cat': lambda v: permittedValues[int(v)]}
+        defaults = self.storageDefaults(whitelist)
+        matrix = featureMatrix.store()
+
+        for batch in self.prefetch_related('compounds').batches(chunksize):
+            values, present = matrix.select([item.pk for item in batch], [
+                                            (descriptor.pk, valueType) for descriptor, valueType in columns])
+            for item, rowValues, rowPresent in izip(batch, values.tolist(), present.tolist()):
+                row = {field.name: getattr(item, field.name)
+                       for field in self.model._meta.fields}
+                for (csvHeader, valueType), value, isPresent in izip(keys, rowValues, rowPresent):
+                    if isPresent:
+                        row[csvHeader] = None if value != value else decoders[
+                            valueType](value)
+                    elif csvHeader in defaults:
+                        row[csvHeader] = defaults[csvHeader]
+                for i, compound in enumerate(item.compounds.all()):
+                    compound_num = 'compound_{}'.format(i)
+                    if whitelist is None or compound_num in whitelist:
+                        row[compound_num] = compound.name
+                yield row
+
     def rows(self, expanded, whitelist=None):
         """Return the 'rows' of information in a format suitable for a python dictwriter."""
-        if expanded:
+        if expanded and featureMatrix.enabled():
+            for row in self._featureMatrixRows(whitelist):
+                yield row
+        elif expanded:
             reactions = self
             if whitelist is not None:
                 # This whole nonsense just grabs the descriptor values we actually want. Let's break it down
@@ -139,10 +230,12 @@ class ReactionQuerySet(CsvQuerySet, ArffQuerySet):
                 reactions = reactions.prefetch_related(
                     'numrxndescriptorvalue_set__descriptor')
             reactions = reactions.prefetch_related('compounds')
+            defaults = self.storageDefaults(whitelist)
 
             for item in reactions.batch_iterator():
                 row = {field.name: getattr(item, field.name)
                        for field in self.model._meta.fields}
+                row.update(defaults)
                 if whitelist is not None:
                     row.update(
                         {dv.descCsvHeader: dv.value for dv in item.filtered_boolvals})
@@ -171,26 +264,57 @@ class ReactionQuerySet(CsvQuerySet, ArffQuerySet):
             for row in super(ReactionQuerySet, self).rows(expanded):
                 yield row
 
-    # From https://djangosnippets.org/snippets/1949/
-    def batch_iterator(self, chunksize=5000):
+    def rowTuples(self, headers, expanded=False, whitelist=None):
         """
-        Iterate over a Django Queryset ordered by the primary key.
+        Generate a tuple of values for each row, in the order of headers.
 
-        This method loads a maximum of chunksize (default: 5000) rows in it's
-        memory at the same time while django normally would load all rows in it's
-        memory. Using the iterator() method only causes it to not preload all the
-        classes.
+        Setting REACTION_ROW_ENGINE to 'pivot' builds expanded rows with the streaming SQL pivot engine.
+        """
+        if expanded and getattr(settings, 'REACTION_ROW_ENGINE', 'rows') == 'pivot':
+            return iter(PivotRowEngine(self, headers))
+        else:
+            return super(ReactionQuerySet, self).rowTuples(headers, expanded, whitelist)
 
-        Note that the implementation of the iterator does not support ordered query sets.
+    def toNPArray(self, expanded=False, whitelistHeaders=None, missing=np.nan, dtype=np.float64, codebook=False):
         """
-        pk = 0
-        last_pk = self.order_by('-pk')[0].pk
-        queryset = self.order_by('pk')
-        while pk < last_pk:
-            for row in queryset.filter(pk__gt=pk)[:chunksize]:
-                pk = row.pk
-                yield row
-            gc.collect()
+        Return a float numpy array with a row for each reaction, in primary key order.
+
+        Boolean and categorical columns are held as integer codes. If codebook is True, a tuple of the array
+        and a dictionary of header to the list of labels for the codes in that column is returned instead.
+        Where every column is a numeric, ordinal or boolean descriptor, the array is sliced
+        directly out of the feature matrix cache.
+        """
+        if not isinstance(missing, (int, long, float)):
+            raise ValueError('Reaction arrays are typed, so missing must be numeric.')
+        if expanded:
+            headers = self.expandedArffHeaders(whitelistHeaders)
+        else:
+            headers = self.arffHeaders(whitelistHeaders)
+        builder = ArrayBuilder(self, headers.keys(), dtype, expanded=expanded)
+
+        values = None
+        if expanded and featureMatrix.enabled():
+            defaults = self.storageDefaults(whitelistHeaders)
+            columns = {descriptor.csvHeader: (descriptor.pk, valueType) for descriptor,
+                       valueType in self._featureMatrixColumns(whitelistHeaders) if valueType != 'cat'}
+            if all(header in columns for header in headers):
+                values, present = featureMatrix.store().select(list(self.order_by(
+                    'pk').values_list('pk', flat=True)), [columns[header] for header in headers])
+                values = values.astype(dtype, copy=False)
+                for j, header in enumerate(headers):
+                    if header in defaults:
+                        values[~present[:, j], j] = defaults[header]
+        if values is None:
+            values = builder.build()
+        if missing == missing:
+            values[np.isnan(values)] = missing
+        return (values, builder.codebook()) if codebook else values
+
+    def update(self, **kwargs):
+        """Update the reactions, starting a new data version."""
+        rows = super(ReactionQuerySet, self).update(**kwargs)
+        dataVersion.bump()
+        return rows
 
     def calculate_descriptors(self, verbose=False, plugins=None, **kwargs):
         """Force the calculation of reaction descriptors for a group of reactions."""
@@ -204,6 +328,36 @@ class ReactionQuerySet(CsvQuerySet, ArffQuerySet):
                 if verbose:
                     print "Done with plugin: {}\n".format(plugin)
 
+    def recalculate_descriptors(self, compoundFields=(), molDescriptors=(), pHCurves=(), verbose=False, invalidate_models=True):
+        """
+        Recalculate only the reaction descriptors derived from the given compound fields, molecular descriptors or pH curves.
+
+        pHCurves are the (heading, calculatorSoftware, calculatorSoftwareVersion) identities of pH curves.
+        Each plugin which defines dependentHeadings(compoundFields, molDescriptors, pHCurves) recalculates just
+        the descriptors that returns; any other plugin recalculates all of its descriptors if anything
+        changed. If any descriptors were recalculated the models built on the reactions are invalidated,
+        unless invalidate_models is False. Return True if any descriptors were recalculated.
+        """
+        if not (compoundFields or molDescriptors or pHCurves) or not self.exists():
+            return False
+        recalculated = False
+        for plugin in descriptorPlugins:
+            if hasattr(plugin, 'dependentHeadings'):
+                headings = plugin.dependentHeadings(compoundFields, molDescriptors, pHCurves)
+                if not headings:
+                    continue
+            else:
+                headings = None
+            if verbose:
+                print "Recalculating {} descriptors for plugin: {}".format(
+                    'all' if headings is None else len(headings), plugin)
+            plugin.calculate_many(self, verbose=verbose, whitelist=headings)
+            recalculated = True
+        if recalculated and invalidate_models:
+            for reaction in DRP.models.PerformedReaction.objects.filter(pk__in=self.values('pk')):
+                reaction.save()  # invalidate models
+        return recalculated
+
 
 class ReactionManager(models.Manager):
 
@@ -239,15 +393,24 @@ class Reaction(models.Model):
     def save(self, calcDescriptors=False, *args, **kwargs):
         """Custom save method gives the option to recalculate the descriptors."""
         super(Reaction, self).save(*args, **kwargs)
+        dataVersion.bump()
         if calcDescriptors and self.calcDescriptors:
             for plugin in descriptorPlugins:
                 plugin.calculate(self)
 
     @property
     def descriptorValues(self):
-        """Return all the descriptor values for this reaction. This should be turned into a multiqueryset."""
+        """Return all the descriptor values for this reaction as a multiqueryset."""
         return MultiQuerySet(self.boolrxndescriptorvalue_set.all(), self.numrxndescriptorvalue_set.all(), self.ordrxndescriptorvalue_set.all(), self.catrxndescriptorvalue_set.all())
 
     def __unicode__(self):
         """Return the unicode representation of the reaction."""
         return "Reaction_{}".format(self.id)
+
+
+@receiver(post_delete, sender=Reaction)
+def reactionDeleted(sender, instance, **kwargs):
+    """Forget the cached feature matrix row of a deleted reaction, however it came to be deleted."""
+    featureMatrix.forget([instance.pk])
+    headerRegistry.bumpSchemaVersion()
+    dataVersion.bump()
@@ -18,6 +18,7 @@ from Reaction import Reaction
 from PerformedReaction import PerformedReaction
 from Compound import Compound
 from CompoundQuantity import CompoundQuantity
+from PHCurve import PHCurve
 from RecommendedReaction import RecommendedReaction
 from StatsModel import StatsModel
 from ChemicalClass import ChemicalClass
@@ -26,3 +27,4 @@ from CompoundRole import CompoundRole
 from ModelContainer import ModelContainer
 from MetricContainer import MetricContainer
 from FeatureSelectionContainer import FeatureSelectionContainer
+from ExportJob import ExportJob
@@ -0,0 +1,194 @@
+"""
+A builder which fills a preallocated, typed numpy array with reaction data.
+
+The array is allocated once, at its final size, and filled a column (or, for
+descriptor values, a value type) at a time from streamed values_list queries,
+so peak memory stays close to the size of the finished array. Boolean and
+categorical columns are held as integer codes, described by a codebook, and
+missing values are left as nan.
+"""
+import numpy as np
+from django.db import connections, models
+from pivotRows import _cursor
+
+# The number of rows to fetch from each cursor at a time
+FETCH_SIZE = 5000
+
+
+def _chunks(queryset, fetchSize=FETCH_SIZE):
+    """Generate the rows of a values_list queryset in lists of up to fetchSize rows, streamed from the database."""
+    sql, params = queryset.query.sql_with_params()
+    connection, cursor = _cursor(connections[queryset.db])
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(fetchSize)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+        if connection is not None:
+            connection.close()
+
+
+class ArrayBuilder(object):
+
+    """
+    Builds a reactions x headers float array for a queryset of reactions, with rows in primary key order.
+
+    Numeric and ordinal values are stored as they are. Boolean values are stored as
+    0 (False) or 1 (True), and categorical descriptors, compound names and non-numeric
+    reaction fields are stored as the index of their label in the codebook, a dictionary
+    of header to the list of labels for that column. Numeric descriptors with no stored
+    value take their storage default. Compound names are only filled in for expanded
+    arrays, as only expanded rows carry them. Headers which are neither
+    reaction fields, descriptors nor compound names are left entirely missing.
+    """
+
+    def __init__(self, reactions, headers, dtype=np.float64, fetchSize=FETCH_SIZE, expanded=True):
+        """Set up the builder for a queryset of reactions and the headers to be output."""
+        if np.dtype(dtype).kind != 'f':
+            raise ValueError(
+                'Arrays of reaction data must have a floating point dtype so that missing values can be held as nan.')
+        self.reactions = reactions
+        self.headers = list(headers)
+        self.dtype = dtype
+        self.fetchSize = fetchSize
+        self.expanded = expanded
+        self.positions = {header: i for i, header in enumerate(self.headers)}
+        self._codebook = None
+
+    def _descriptorColumns(self, descriptorClass):
+        """Return a dictionary of descriptor pk to header position for descriptors of the given class in the headers."""
+        return {pk: self.positions[csvHeader] for pk, csvHeader in
+                descriptorClass.objects.filter(csvHeader__in=self.headers).values_list('pk', 'csvHeader')}
+
+    def _fieldColumns(self):
+        """Return (field, position) pairs for the reaction fields in the headers."""
+        return [(field, self.positions[field.name]) for field in self.reactions.model._meta.fields
+                if field.name in self.positions]
+
+    def _compoundColumns(self):
+        """Return (compound index, position) pairs for the compound name headers, of which there are none unless expanded."""
+        if not self.expanded:
+            return []
+        return [(int(header[len('compound_'):]), position) for header, position in self.positions.items()
+                if header.startswith('compound_') and header[len('compound_'):].isdigit()]
+
+    @staticmethod
+    def _isNumericField(field):
+        return isinstance(field, (models.AutoField, models.IntegerField, models.FloatField, models.DecimalField))
+
+    @staticmethod
+    def _isBooleanField(field):
+        return isinstance(field, (models.BooleanField, models.NullBooleanField))
+
+    def codebook(self):
+        """Return a dictionary of header to the list of labels which the codes in that column index."""
+        if self._codebook is None:
+            # imported here to avoid a circular import
+            from CompoundQuantity import CompoundQuantity
+            from descriptors import CategoricalDescriptorPermittedValue
+            from rxnDescriptors import BoolRxnDescriptor, CatRxnDescriptor
+
+            codebook = {}
+            for pk, position in self._descriptorColumns(BoolRxnDescriptor).items():
+                codebook[self.headers[position]] = [False, True]
+            catColumns = self._descriptorColumns(CatRxnDescriptor)
+            # the same order as the nominal values in the descriptor's arff header
+            for descriptorId, value in CategoricalDescriptorPermittedValue.objects.filter(
+                    descriptor__in=catColumns.keys()).order_by('pk').values_list('descriptor_id', 'value'):
+                codebook.setdefault(self.headers[catColumns[descriptorId]], []).append(value)
+            for descriptorId, position in catColumns.items():
+                codebook.setdefault(self.headers[position], [])
+
+            for field, position in self._fieldColumns():
+                if self._isBooleanField(field):
+                    codebook[field.name] = [False, True]
+                elif not self._isNumericField(field):
+                    codebook[field.name] = sorted(set(self.reactions.exclude(**{field.attname: None}).values_list(
+                        field.attname, flat=True)))
+
+            compoundColumns = self._compoundColumns()
+            if compoundColumns:
+                names = sorted(set(CompoundQuantity.objects.filter(reaction__in=self.reactions.values('pk')).values_list(
+                    'compound__name', flat=True)))
+                for i, position in compoundColumns:
+                    codebook[self.headers[position]] = names
+            self._codebook = codebook
+        return self._codebook
+
+    def build(self):
+        """Return the array, with nan wherever a value is missing."""
+        # imported here to avoid a circular import
+        from CompoundQuantity import CompoundQuantity
+        from descriptors import CategoricalDescriptorPermittedValue
+        from rxnDescriptors import BoolRxnDescriptor, NumRxnDescriptor, OrdRxnDescriptor, CatRxnDescriptor
+        from rxnDescriptorValues import BoolRxnDescriptorValue, NumRxnDescriptorValue, OrdRxnDescriptorValue, CatRxnDescriptorValue
+
+        reactionIds = np.fromiter(self.reactions.order_by('pk').values_list(
+            'pk', flat=True), dtype=np.int64)
+        matrix = np.empty((len(reactionIds), len(self.headers)), dtype=self.dtype)
+        matrix.fill(np.nan)
+        if not len(reactionIds):
+            return matrix
+        reactionPks = self.reactions.values('pk')
+        codebook = self.codebook()
+
+        # reactions with no stored value for a descriptor take its storage default
+        for header, default in self.reactions.storageDefaults(self.headers).items():
+            matrix[:, self.positions[header]] = default
+
+        for field, position in self._fieldColumns():
+            values = self.reactions.order_by('pk').values_list(field.attname, flat=True)
+            if self._isNumericField(field) or self._isBooleanField(field):
+                column = np.fromiter(((np.nan if v is None else v) for v in values), dtype=self.dtype,
+                                     count=len(reactionIds))
+            else:
+                codes = {label: code for code, label in enumerate(codebook[field.name])}
+                column = np.fromiter(((np.nan if v is None else codes[v]) for v in values), dtype=self.dtype,
+                                     count=len(reactionIds))
+            matrix[:, position] = column
+
+        catColumns = self._descriptorColumns(CatRxnDescriptor)
+        catCodes = {}
+        counts = {}
+        for pk, descriptorId in CategoricalDescriptorPermittedValue.objects.filter(
+                descriptor__in=catColumns.keys()).order_by('pk').values_list('pk', 'descriptor_id'):
+            catCodes[pk] = counts.get(descriptorId, 0)
+            counts[descriptorId] = catCodes[pk] + 1
+        valueTypes = (
+            (BoolRxnDescriptorValue, self._descriptorColumns(BoolRxnDescriptor), None),
+            (NumRxnDescriptorValue, self._descriptorColumns(NumRxnDescriptor), None),
+            (OrdRxnDescriptorValue, self._descriptorColumns(OrdRxnDescriptor), None),
+            (CatRxnDescriptorValue, catColumns, catCodes),
+        )
+        for model, columns, codes in valueTypes:
+            if not columns:
+                continue
+            qs = model.objects.filter(reaction__in=reactionPks, descriptor__in=columns.keys()).values_list(
+                'reaction_id', 'descriptor_id', 'value')
+            for chunk in _chunks(qs, self.fetchSize):
+                rows = np.searchsorted(reactionIds, [reactionId for reactionId, descriptorId, value in chunk])
+                cols = [columns[descriptorId] for reactionId, descriptorId, value in chunk]
+                if codes is None:
+                    values = [np.nan if value is None else value for reactionId, descriptorId, value in chunk]
+                else:
+                    values = [np.nan if value is None else codes[value] for reactionId, descriptorId, value in chunk]
+                matrix[rows, cols] = values
+
+        compoundColumns = dict(self._compoundColumns())
+        if compoundColumns:
+            codes = {label: code for code, label in enumerate(codebook[self.headers[compoundColumns.values()[0]]])}
+            qs = CompoundQuantity.objects.filter(reaction__in=reactionPks).order_by(
+                'reaction', 'pk').values_list('reaction_id', 'compound__name')
+            lastReactionId = None
+            for chunk in _chunks(qs, self.fetchSize):
+                for reactionId, name in chunk:
+                    i = i + 1 if reactionId == lastReactionId else 0
+                    lastReactionId = reactionId
+                    if i in compoundColumns:
+                        matrix[np.searchsorted(reactionIds, reactionId), compoundColumns[i]] = codes[name]
+
+        return matrix
@@ -0,0 +1,40 @@
+"""
+A version stamp for the reaction data behind exports, held in the configured django cache.
+
+The version is replaced whenever a reaction or any of its descriptor values is
+saved, updated or deleted, so anything generated from reaction data can be
+recorded against the version it was generated under and discarded once that
+version is no longer current.
+"""
+from django.core.cache import cache
+import transactionHooks
+import uuid
+
+DATA_VERSION_KEY = 'DRP.dataVersion'
+
+
+def current():
+    """Return the current data version, starting a new one if the cache does not hold one."""
+    version = cache.get(DATA_VERSION_KEY)
+    if version is None:
+        cache.add(DATA_VERSION_KEY, uuid.uuid4().hex, None)
+        # if the cache is unavailable every call gets a new version, so nothing is ever reused
+        version = cache.get(DATA_VERSION_KEY) or uuid.uuid4().hex
+    return version
+
+
+def bump():
+    """
+    Start a new data version, now and again once the transaction has ended.
+
+    Another process may generate something from the data committed before the
+    transaction and record it against the new version, so the version is
+    replaced again once the change is visible to other processes (or rolled back).
+    """
+    _newVersion()
+    transactionHooks.atEnd('DRP.dataVersion.bump', _newVersion)
+
+
+def _newVersion():
+    """Replace the data version now."""
+    cache.set(DATA_VERSION_KEY, uuid.uuid4().hex, None)
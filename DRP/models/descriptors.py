@@ -5,13 +5,15 @@ Reaction and Molecular Descriptors should inherit from these
 classes.
 """
 
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
 from django.db.models.functions import Concat
+import headerRegistry
+from querysets import BatchIteratorMixin
 
 
-class DescriptorQuerySet(models.query.QuerySet):
+class DescriptorQuerySet(BatchIteratorMixin, models.query.QuerySet):
 
     """A queryset to manage a queryset or any of the subtypes thereof."""
 
@@ -20,6 +22,51 @@ class DescriptorQuerySet(models.query.QuerySet):
         model = Descriptor if model is None else model
         super(DescriptorQuerySet, self).__init__(model=model, **kwargs)
 
+    def update(self, **kwargs):
+        """Update the descriptors, invalidating cached export headers."""
+        rows = super(DescriptorQuerySet, self).update(**kwargs)
+        headerRegistry.bumpDefinitionVersion()
+        return rows
+
+    def delete(self):
+        """Delete the descriptors, invalidating cached export headers."""
+        super(DescriptorQuerySet, self).delete()
+        headerRegistry.bumpDefinitionVersion()
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Create the descriptors, invalidating cached export headers."""
+        objs = super(DescriptorQuerySet, self).bulk_create(
+            objs, *args, **kwargs)
+        headerRegistry.bumpDefinitionVersion()
+        return objs
+
+    def define(self, definitions):
+        """
+        Return a dictionary of key to descriptor for a dictionary of key to descriptor definition.
+
+        A definition is a dictionary of field values including the heading, calculatorSoftware and
+        calculatorSoftwareVersion which identify the descriptor. Existing descriptors are loaded with
+        one query; only those which are missing, or whose other fields differ, are written.
+        """
+        existing = {(descriptor.heading, descriptor.calculatorSoftware, descriptor.calculatorSoftwareVersion): descriptor
+                    for descriptor in self.filter(calculatorSoftware__in=set(args['calculatorSoftware'] for args in definitions.values()))}
+        descriptors = {}
+        for key, args in definitions.items():
+            descriptor = existing.get((args['heading'], args['calculatorSoftware'], args['calculatorSoftwareVersion']))
+            if descriptor is None:
+                # descriptors use multi-table inheritance, so cannot be bulk created
+                descriptor = self.create(**args)
+                descriptor.csvHeader = '{}_{}_{}'.format(
+                    descriptor.heading, descriptor.calculatorSoftware, descriptor.calculatorSoftwareVersion)
+            else:
+                changes = {field: value for field, value in args.items() if getattr(descriptor, field) != value}
+                if changes:
+                    self.filter(pk=descriptor.pk).update(**changes)
+                    for field, value in changes.items():
+                        setattr(descriptor, field, value)
+            descriptors[key] = descriptor
+        return descriptors
+
 
 class DescriptorManager(models.Manager):
 
@@ -31,6 +78,10 @@ class DescriptorManager(models.Manager):
         """Generate and appropriately subtype the queryset."""
         return DescriptorQuerySet(model=self.model).annotate(csvHeader=Concat('heading', models.Value('_'), 'calculatorSoftware', models.Value('_'), 'calculatorSoftwareVersion'))
 
+    def define(self, definitions):
+        """Return a dictionary of key to descriptor for a dictionary of key to descriptor definition, writing only what has changed."""
+        return self.get_queryset().define(definitions)
+
 
 class Descriptor(models.Model):
 
@@ -98,6 +149,16 @@ class Descriptor(models.Model):
         """
         return'@attribute {} ' .format(self.csvHeader)
 
+    def save(self, *args, **kwargs):
+        """Save the descriptor, invalidating cached export headers."""
+        super(Descriptor, self).save(*args, **kwargs)
+        headerRegistry.bumpDefinitionVersion()
+
+    def delete(self, *args, **kwargs):
+        """Delete the descriptor, invalidating cached export headers."""
+        super(Descriptor, self).delete(*args, **kwargs)
+        headerRegistry.bumpDefinitionVersion()
+
     def __unicode__(self):
         """Unicode represenation of a descriptor is it's name."""
         return self.name
@@ -132,6 +193,17 @@ class CategoricalDescriptorPermittedValue(models.Model):
         related_name='permittedValues'
     )
 
+    def save(self, *args, **kwargs):
+        """Save the permitted value, invalidating cached export headers."""
+        super(CategoricalDescriptorPermittedValue, self).save(*args, **kwargs)
+        headerRegistry.bumpDefinitionVersion()
+
+    def delete(self, *args, **kwargs):
+        """Delete the permitted value, invalidating cached export headers."""
+        super(CategoricalDescriptorPermittedValue,
+              self).delete(*args, **kwargs)
+        headerRegistry.bumpDefinitionVersion()
+
     def __unicode__(self):
         """Return the literal value the instance represents."""
         return self.value
@@ -271,3 +343,40 @@ class Predictable(models.Model):
                 pred.modelContainer = modelContainer
                 pred.statsModel = modelComponent
                 return pred
+
+
+@transaction.atomic
+def defineDescriptors(descDict, descriptorClasses):
+    """
+    Return a dictionary of heading to descriptor for a plugin's dictionary of heading to descriptor definition.
+
+    Each definition has a 'type', which descriptorClasses maps to its descriptor class, and
+    categorical definitions a list of 'permittedValues'. One query is made for each type of
+    descriptor and one for the permitted values, and only missing or changed definitions are written.
+    """
+    definitions = {}
+    permittedValues = {}
+    for heading, definition in descDict.items():
+        if definition['type'] not in descriptorClasses:
+            raise RuntimeError("Invalid descriptor type provided")
+        args = definition.copy()
+        del args['type']
+        args['heading'] = heading
+        if definition['type'] == 'cat':
+            permittedValues[heading] = args.pop('permittedValues')
+        definitions.setdefault(definition['type'], {})[heading] = args
+
+    descriptors = {}
+    for descriptorType, typeDefinitions in definitions.items():
+        descriptors.update(descriptorClasses[descriptorType].objects.define(typeDefinitions))
+
+    if permittedValues:
+        existing = set(CategoricalDescriptorPermittedValue.objects.filter(
+            descriptor__in=[descriptors[heading].pk for heading in permittedValues]).values_list('descriptor_id', 'value'))
+        missing = [CategoricalDescriptorPermittedValue(descriptor=descriptors[heading], value=value)
+                   for heading, values in permittedValues.items() for value in values
+                   if (descriptors[heading].pk, unicode(value)) not in existing]
+        if missing:
+            CategoricalDescriptorPermittedValue.objects.bulk_create(missing)
+            headerRegistry.bumpDefinitionVersion()
+    return descriptors
@@ -0,0 +1,317 @@
+"""
+An on-disk, memory-mapped columnar cache of reaction descriptor values.
+
+Each reaction descriptor is held in its own column file, indexed by a reaction id
+index shared between all of the columns, so that exports can read whole columns
+of values without going back to the four descriptor value tables.
+"""
+import os
+import fcntl
+import shutil
+import hashlib
+import numpy as np
+from django.conf import settings
+import transactionHooks
+
+# The number of reactions to include in each IN clause when refreshing columns
+REFRESH_CHUNKSIZE = 1000
+
+# States held in the 'loaded' column files
+STALE = 0
+ABSENT = 1
+PRESENT = 2
+
+# The file of reaction ids forgotten since the columns were last updated
+JOURNAL = 'forgotten.journal'
+
+
+def enabled():
+    """Return True if a directory for the feature matrix has been configured."""
+    return getattr(settings, 'FEATURE_MATRIX_DIR', None) is not None
+
+
+def storeDirectory():
+    """Return the store directory for the configured database, so that databases never share cached values."""
+    db = settings.DATABASES['default']
+    key = hashlib.sha1('{}:{}:{}'.format(db.get('HOST', ''), db.get(
+        'PORT', ''), db.get('NAME', ''))).hexdigest()[:16]
+    return os.path.join(settings.FEATURE_MATRIX_DIR, key)
+
+
+def valueModels():
+    """Return the value model class for each value type; imported here to avoid a circular import."""
+    from rxnDescriptorValues import BoolRxnDescriptorValue, NumRxnDescriptorValue, OrdRxnDescriptorValue, CatRxnDescriptorValue
+    return {'bool': BoolRxnDescriptorValue,
+            'num': NumRxnDescriptorValue,
+            'ord': OrdRxnDescriptorValue,
+            'cat': CatRxnDescriptorValue}
+
+
+_store = None
+
+
+def store():
+    """Return this process's feature matrix for the configured database, brought up to date with the changes other processes have made to it."""
+    global _store
+    directory = storeDirectory()
+    if _store is None or _store.directory != directory:
+        _store = FeatureMatrix(directory)
+    else:
+        _store.refresh()
+    return _store
+
+
+def invalidate(cells):
+    """
+    Mark (reactionId, descriptorId) cells as stale so that they are reloaded on their next read.
+
+    The cells are invalidated at once, so that reads in this transaction see its writes, and again once
+    the transaction has ended, since another process may have cached their old values in the meantime.
+    """
+    if enabled():
+        cells = list(cells)
+        if cells:
+            _invalidate(cells)
+            transactionHooks.atEnd('DRP.featureMatrix.invalidate', _invalidate, cells)
+
+
+def _invalidate(cells):
+    """Mark cells as stale now."""
+    store().invalidate(cells)
+
+
+def forget(reactionIds):
+    """
+    Mark every cached value for the given reactions as stale, now and once the transaction has ended.
+
+    The reactions are appended to a journal, which is applied to every column the next
+    time the store is used, so that deleting many reactions one at a time (as a cascaded
+    delete does) costs one small write per reaction rather than a pass over every column.
+    """
+    if enabled():
+        reactionIds = list(reactionIds)
+        if reactionIds:
+            _forget(reactionIds)
+            transactionHooks.atEnd('DRP.featureMatrix.forget', _forget, reactionIds)
+
+
+def _forget(reactionIds):
+    """Append reactions to the journal now."""
+    directory = storeDirectory()
+    _makeDirectory(directory)
+    with open(os.path.join(directory, JOURNAL), 'ab') as journal:
+        fcntl.flock(journal, fcntl.LOCK_EX)
+        try:
+            np.array(reactionIds, dtype=np.int64).tofile(journal)
+        finally:
+            fcntl.flock(journal, fcntl.LOCK_UN)
+
+
+def invalidateColumns(descriptorIds):
+    """Mark every cached value of the given descriptors as stale, now and once the transaction has ended."""
+    if enabled():
+        descriptorIds = list(descriptorIds)
+        if descriptorIds:
+            _invalidateColumns(descriptorIds)
+            transactionHooks.atEnd('DRP.featureMatrix.invalidateColumns', _invalidateColumns, descriptorIds)
+
+
+def _invalidateColumns(descriptorIds):
+    """Mark columns as stale now."""
+    store().invalidateColumns(set(descriptorIds))
+
+
+def _makeDirectory(directory):
+    """Create a directory unless it already exists."""
+    try:
+        os.makedirs(directory)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+
+
+def clear():
+    """Delete the store for the configured database."""
+    if enabled() and os.path.isdir(storeDirectory()):
+        shutil.rmtree(storeDirectory())
+
+
+class FeatureMatrix(object):
+
+    """
+    A columnar store of reaction descriptor values, with one memory-mapped file per descriptor.
+
+    Every descriptor has a float64 'values' column holding the value for each
+    reaction in the index (categorical values are held as the primary key of the
+    permitted value) and a uint8 'loaded' column recording whether that cell is
+    stale, known to be absent from the database or present in it. Columns are
+    lazily grown to the length of the index, and cells are loaded from the
+    database the first time they are read after being invalidated.
+    """
+
+    def __init__(self, directory=None):
+        """Open (and if necessary create) the store."""
+        self.directory = storeDirectory() if directory is None else directory
+        _makeDirectory(self.directory)
+        self._loadIndex()
+        self._applyJournal()
+
+    @property
+    def _indexPath(self):
+        return os.path.join(self.directory, 'reactions.index')
+
+    def _columnPath(self, descriptorId, kind):
+        return os.path.join(self.directory, '{}.{}'.format(descriptorId, kind))
+
+    def _loadIndex(self):
+        """Read the reaction id index from disk."""
+        if os.path.exists(self._indexPath):
+            self.reactionIds = np.fromfile(self._indexPath, dtype=np.int64)
+        else:
+            self.reactionIds = np.zeros(0, dtype=np.int64)
+        # where an id has been appended twice by competing processes the last entry wins
+        self.positions = {reactionId: i for i,
+                          reactionId in enumerate(self.reactionIds.tolist())}
+
+    def refresh(self):
+        """Reload the index if another process has extended it, and apply the journal."""
+        _makeDirectory(self.directory)
+        size = os.path.getsize(self._indexPath) if os.path.exists(self._indexPath) else 0
+        if size != self.reactionIds.nbytes:
+            self._loadIndex()
+        self._applyJournal()
+
+    def _applyJournal(self):
+        """Forget the reactions recorded in the journal, then empty it."""
+        path = os.path.join(self.directory, JOURNAL)
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, 'r+b') as journal:
+                fcntl.flock(journal, fcntl.LOCK_EX)
+                try:
+                    self.forget(np.fromfile(journal, dtype=np.int64).tolist())
+                    journal.truncate(0)
+                finally:
+                    fcntl.flock(journal, fcntl.LOCK_UN)
+
+    def _extendIndex(self, reactionIds):
+        """Append any reactions not yet in the index."""
+        new = sorted(set(reactionIds).difference(self.positions))
+        if new:
+            with open(self._indexPath, 'ab') as index:
+                fcntl.flock(index, fcntl.LOCK_EX)
+                try:
+                    np.array(new, dtype=np.int64).tofile(index)
+                finally:
+                    fcntl.flock(index, fcntl.LOCK_UN)
+            self._loadIndex()
+
+    def _column(self, descriptorId, kind):
+        """Return a memory map of one column file, grown to the length of the index."""
+        dtype = np.float64 if kind == 'values' else np.uint8
+        length = len(self.reactionIds)
+        path = self._columnPath(descriptorId, kind)
+        size = length * np.dtype(dtype).itemsize
+        if not os.path.exists(path) or os.path.getsize(path) < size:
+            with open(path, 'ab') as column:
+                column.truncate(size)
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r+', shape=(length,))
+
+    def select(self, reactionIds, columns):
+        """
+        Return the values of the given columns for the given reactions.
+
+        columns should be a sequence of (descriptorId, valueType) pairs, where valueType is one
+        of 'bool', 'num', 'ord' or 'cat'. Returns a tuple of a reactions x columns float64 array of values
+        (nan where missing) and a boolean array of the same shape, which is True where a value row exists in
+        the database. Stale cells are refreshed from the database before being returned.
+        """
+        self._extendIndex(reactionIds)
+        rows = np.array([self.positions[reactionId]
+                         for reactionId in reactionIds], dtype=np.intp)
+        values = np.empty((len(rows), len(columns)))
+        present = np.empty((len(rows), len(columns)), dtype=bool)
+
+        valueColumns = {}
+        loadedColumns = {}
+        staleDescriptors = {}
+        staleRows = {}
+        for descriptorId, valueType in columns:
+            if descriptorId in valueColumns:
+                continue
+            valueColumns[descriptorId] = self._column(descriptorId, 'values')
+            loadedColumns[descriptorId] = self._column(descriptorId, 'loaded')
+            stalePositions = rows[loadedColumns[descriptorId][rows] == STALE]
+            if len(stalePositions):
+                # marked as loaded before querying, so an invalidation that arrives mid-refresh is not lost
+                valueColumns[descriptorId][stalePositions] = np.nan
+                loadedColumns[descriptorId][stalePositions] = ABSENT
+                staleDescriptors.setdefault(valueType, set()).add(descriptorId)
+                staleRows.setdefault(valueType, set()).update(
+                    stalePositions.tolist())
+
+        for valueType, model in valueModels().items():
+            if valueType in staleDescriptors:
+                self._refresh(model, staleDescriptors[valueType], staleRows[
+                              valueType], valueColumns, loadedColumns)
+
+        for j, (descriptorId, valueType) in enumerate(columns):
+            values[:, j] = valueColumns[descriptorId][rows]
+            present[:, j] = loadedColumns[descriptorId][rows] == PRESENT
+
+        for column in valueColumns.values() + loadedColumns.values():
+            if isinstance(column, np.memmap):
+                column.flush()
+
+        return values, present
+
+    def _refresh(self, model, descriptorIds, rows, valueColumns, loadedColumns):
+        """Load the values of the given descriptors for the reactions at the given index rows."""
+        reactionIds = self.reactionIds[sorted(rows)].tolist()
+        found = {}
+        for start in range(0, len(reactionIds), REFRESH_CHUNKSIZE):
+            chunk = reactionIds[start:start + REFRESH_CHUNKSIZE]
+            for reactionId, descriptorId, value in model.objects.filter(reaction_id__in=chunk, descriptor_id__in=descriptorIds).values_list('reaction_id', 'descriptor_id', 'value'):
+                position = self.positions[reactionId]
+                valueColumns[descriptorId][position] = np.nan if value is None else value
+                found.setdefault(descriptorId, []).append(position)
+        for descriptorId, positions in found.items():
+            positions = np.array(positions, dtype=np.intp)
+            loaded = loadedColumns[descriptorId]
+            # cells invalidated while we were reading must stay stale
+            positions = positions[loaded[positions] != STALE]
+            loaded[positions] = PRESENT
+
+    def invalidate(self, cells):
+        """Mark (reactionId, descriptorId) cells as stale."""
+        byDescriptor = {}
+        for reactionId, descriptorId in cells:
+            position = self.positions.get(reactionId)
+            if position is not None:
+                byDescriptor.setdefault(descriptorId, []).append(position)
+        for descriptorId, positions in byDescriptor.items():
+            if os.path.exists(self._columnPath(descriptorId, 'loaded')):
+                loaded = self._column(descriptorId, 'loaded')
+                loaded[positions] = STALE
+                loaded.flush()
+
+    def forget(self, reactionIds):
+        """Mark every column as stale for the given reactions."""
+        positions = [self.positions[reactionId]
+                     for reactionId in reactionIds if reactionId in self.positions]
+        if positions:
+            for fileName in os.listdir(self.directory):
+                descriptorId, kind = os.path.splitext(fileName)
+                if kind == '.loaded':
+                    loaded = self._column(descriptorId, 'loaded')
+                    loaded[positions] = STALE
+                    loaded.flush()
+
+    def invalidateColumns(self, descriptorIds):
+        """Mark every cell of the given descriptors' columns as stale."""
+        for descriptorId in descriptorIds:
+            if os.path.exists(self._columnPath(descriptorId, 'loaded')):
+                loaded = self._column(descriptorId, 'loaded')
+                loaded[:] = STALE
+                loaded.flush()
@@ -0,0 +1,85 @@
+"""
+A registry of export headers, cached both in process and in the configured django cache.
+
+Building the headers for an expanded export means finding the largest number of
+compounds in any reaction and listing every compound role and descriptor, none
+of which changes from one export to the next unless descriptors, their permitted
+values, compound roles or compound quantities do. Headers are therefore cached
+against a schema version, which is replaced whenever any of those change.
+
+Descriptor plugins build their dictionaries of reaction descriptors from the compound
+roles and molecular descriptors alone, so those are memoised against a separate
+definition version, which is only replaced when descriptors, their permitted values or
+compound roles change.
+"""
+from django.core.cache import cache
+import hashlib
+import uuid
+import copy
+
+SCHEMA_VERSION_KEY = 'DRP.headerRegistry.schemaVersion'
+DEFINITION_VERSION_KEY = 'DRP.headerRegistry.definitionVersion'
+
+_local = {}
+_localVersion = [None]
+
+
+def _version(key):
+    """Return the current version held under key, starting a new one if the cache does not hold one."""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        # if the cache is unavailable every call gets a new version, so nothing is ever reused
+        version = cache.get(key) or uuid.uuid4().hex
+    return version
+
+
+def schemaVersion():
+    """Return the current schema version, starting a new one if the cache does not hold one."""
+    return _version(SCHEMA_VERSION_KEY)
+
+
+def bumpSchemaVersion():
+    """Start a new schema version, invalidating every cached header."""
+    cache.set(SCHEMA_VERSION_KEY, uuid.uuid4().hex, None)
+    _local.clear()
+
+
+def definitionVersion():
+    """Return the current version of the descriptor and compound role definitions."""
+    return _version(DEFINITION_VERSION_KEY)
+
+
+def bumpDefinitionVersion():
+    """Start new definition and schema versions, after a change to descriptors, their permitted values or compound roles."""
+    cache.set(DEFINITION_VERSION_KEY, uuid.uuid4().hex, None)
+    bumpSchemaVersion()
+
+
+def _whitelistKey(whitelist):
+    """Return a short, order independent key for a whitelist."""
+    if whitelist is None:
+        return 'all'
+    return hashlib.sha1('\n'.join(sorted(set(whitelist)))).hexdigest()
+
+
+def cached(model, name, whitelist, compute):
+    """
+    Return a copy of the value of name for the model and whitelist under the current schema version.
+
+    compute is called to generate the value if neither the process nor the django cache holds it.
+    """
+    version = schemaVersion()
+    if _localVersion[0] != version:
+        _local.clear()
+        _localVersion[0] = version
+    key = 'DRP.headerRegistry.{}.{}.{}.{}.{}'.format(
+        version, model._meta.app_label, model._meta.model_name, name, _whitelistKey(whitelist))
+    if key not in _local:
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            cache.set(key, value)
+        _local[key] = value
+    # callers are free to modify what they are given
+    return copy.copy(_local[key])
@@ -5,22 +5,31 @@ from descriptorValues import CategoricalDescriptorValue, BooleanDescriptorValue,
 from django.core.exceptions import ValidationError
 import PerformedReaction
 import DRP.models
+from querysets import BatchIteratorMixin
 
 
-class MolDescriptorValueQuerySet(models.query.QuerySet):
+def recalculateReactions(compoundIds, descriptors):
+    """Recalculate the reaction descriptors derived from molecular descriptors for the reactions involving the compounds."""
+    DRP.models.Reaction.objects.filter(pk__in=DRP.models.CompoundQuantity.objects.filter(
+        compound__in=compoundIds).values('reaction')).recalculate_descriptors(molDescriptors=descriptors)
+
+
+class MolDescriptorValueQuerySet(BatchIteratorMixin, models.query.QuerySet):
 
     """Class to represent a group of Molecular Descriptor Values."""
 
     def delete(self, recalculate_reactions=True):
         """Deletion of a queryset of Descriptor Values should change calculations which arise from them."""
         if recalculate_reactions:
-            compounds = set(d.compound for d in self)
+            compoundIds = set()
+            descriptorIds = set()
+            for compoundId, descriptorId in self.values_list('compound_id', 'descriptor_id'):
+                compoundIds.add(compoundId)
+                descriptorIds.add(descriptorId)
+            descriptors = list(self.model._meta.get_field('descriptor').rel.to.objects.filter(pk__in=descriptorIds))
         super(MolDescriptorValueQuerySet, self).delete()
         if recalculate_reactions:
-            for reaction in DRP.models.Reaction.objects.filter(compounds__in=compounds):
-                reaction.save()  # recalculate descriptors
-            for reaction in DRP.models.PerformedReaction.objects.filter(compounds__in=compounds):
-                reaction.save()  # invalidate models
+            recalculateReactions(compoundIds, descriptors)
 
 
 class MolDescriptorValueManager(models.Manager):
@@ -44,16 +53,10 @@ class MolDescriptorValue(models.Model):
     compound = models.ForeignKey('DRP.Compound')
 
     def delete(self, recalculate_reactions=True):
-        """Delete this compound and recalculate each reaction which it is involvedin."""
-        reactions = set(self.compound.reaction_set.all())
+        """Delete this value and recalculate the reaction descriptors derived from it for each reaction the compound is involved in."""
         super(MolDescriptorValue, self).delete()
         if recalculate_reactions:
-            for reaction in reactions:
-                reaction.save()  # recalculate descriptors
-                try:
-                    reaction.performedreaction.save()
-                except PerformedReaction.PerformedReaction.DoesNotExist:
-                    pass  # we don't care
+            recalculateReactions([self.compound_id], [self.descriptor])
 
     def __unicode__(self):
         """Return the name, compound and value as the unicode rep."""
@@ -0,0 +1,165 @@
+"""
+A row engine which pivots reaction descriptor values into rows in the database's own order.
+
+Rather than prefetching descriptor values per batch of reactions, one query is
+issued per value type, ordered by (reaction, descriptor), and read through a
+cursor which streams from the server. The streams are merge-joined against the
+reactions in primary key order, so memory use does not grow with the size of
+the export.
+"""
+from django.db import connections
+from querysets import ABSENT
+
+# The number of rows to fetch from each cursor at a time
+FETCH_SIZE = 5000
+
+
+def _cursor(connection):
+    """
+    Return a (connection, cursor) pair for streaming a query.
+
+    On MySQL, a server-side cursor holds its connection until it has been read to the end,
+    so each stream is given a connection of its own; elsewhere the shared connection is used.
+    A new connection cannot see the changes of a transaction which has not been committed,
+    so within one the shared connection is used on MySQL too, and its results are buffered.
+    """
+    if connection.vendor == 'mysql' and not connection.in_atomic_block and connection.get_autocommit():
+        import MySQLdb.cursors
+        raw = connection.get_new_connection(
+            connection.get_connection_params())
+        return raw, raw.cursor(MySQLdb.cursors.SSCursor)
+    else:
+        return None, connection.cursor()
+
+
+class _Stream(object):
+
+    """A stream of (reaction_id, ...) tuples ordered by reaction_id, which can be consumed a reaction at a time."""
+
+    def __init__(self, queryset, fetchSize=FETCH_SIZE):
+        """Execute the query for the queryset."""
+        sql, params = queryset.query.sql_with_params()
+        self.connection, self.cursor = _cursor(connections[queryset.db])
+        self.cursor.execute(sql, params)
+        self.fetchSize = fetchSize
+        self.buffer = []
+        self.index = 0
+        self._advance()
+
+    def _advance(self):
+        """Move the head of the stream on by one row."""
+        if self.index >= len(self.buffer):
+            self.buffer = self.cursor.fetchmany(
+                self.fetchSize) if self.cursor is not None else []
+            self.index = 0
+        if self.index < len(self.buffer):
+            self.head = self.buffer[self.index]
+            self.index += 1
+        else:
+            self.head = None
+            self.close()
+
+    def take(self, reactionId):
+        """Return all the rows at the head of the stream which belong to the given reaction."""
+        while self.head is not None and self.head[0] < reactionId:
+            self._advance()
+        rows = []
+        while self.head is not None and self.head[0] == reactionId:
+            rows.append(self.head)
+            self._advance()
+        return rows
+
+    def close(self):
+        """Release the cursor and any connection opened for it."""
+        if self.cursor is not None:
+            self.cursor.close()
+            self.cursor = None
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class PivotRowEngine(object):
+
+    """Generates expanded reaction rows as tuples in header order from one streamed query per value type."""
+
+    def __init__(self, reactions, headers, fetchSize=FETCH_SIZE):
+        """Set up the engine for a queryset of reactions and the headers to be output."""
+        self.reactions = reactions
+        self.headers = list(headers)
+        self.fetchSize = fetchSize
+
+    def _descriptorColumns(self, descriptorClass):
+        """Return a dictionary of descriptor pk to header position for descriptors of the given class in the headers."""
+        positions = {header: i for i, header in enumerate(self.headers)}
+        return {pk: positions[csvHeader] for pk, csvHeader in
+                descriptorClass.objects.filter(csvHeader__in=self.headers).values_list('pk', 'csvHeader')}
+
+    def __iter__(self):
+        """Generate a tuple for each reaction, ordered by primary key."""
+        # imported here to avoid a circular import
+        from CompoundQuantity import CompoundQuantity
+        from descriptors import CategoricalDescriptorPermittedValue
+        from rxnDescriptors import BoolRxnDescriptor, NumRxnDescriptor, OrdRxnDescriptor, CatRxnDescriptor
+        from rxnDescriptorValues import BoolRxnDescriptorValue, NumRxnDescriptorValue, OrdRxnDescriptorValue, CatRxnDescriptorValue
+
+        if not self.reactions.exists():
+            return
+
+        positions = {header: i for i, header in enumerate(self.headers)}
+        fields = [(field.name, positions[field.name]) for field in self.reactions.model._meta.fields
+                  if field.name in positions]
+        related = [field.name for field in self.reactions.model._meta.fields
+                   if field.is_relation and field.name in positions]
+        reactionPks = self.reactions.values('pk')
+
+        catColumns = self._descriptorColumns(CatRxnDescriptor)
+        permittedValues = {pk: value.encode('utf-8') for pk, value in CategoricalDescriptorPermittedValue.objects.filter(
+            descriptor__in=catColumns.keys()).values_list('pk', 'value')}
+        valueTypes = (
+            (BoolRxnDescriptorValue, self._descriptorColumns(
+                BoolRxnDescriptor), lambda v: None if v is None else bool(v)),
+            (NumRxnDescriptorValue, self._descriptorColumns(
+                NumRxnDescriptor), lambda v: v),
+            (OrdRxnDescriptorValue, self._descriptorColumns(
+                OrdRxnDescriptor), lambda v: v),
+            (CatRxnDescriptorValue, catColumns,
+             lambda v: None if v is None else permittedValues[v]),
+        )
+
+        streams = []
+        compounds = None
+        try:
+            for model, columns, convert in valueTypes:
+                if columns:
+                    qs = model.objects.filter(reaction__in=reactionPks, descriptor__in=columns.keys()).order_by(
+                        'reaction', 'descriptor').values_list('reaction_id', 'descriptor_id', 'value')
+                    streams.append((_Stream(qs, self.fetchSize), columns, convert))
+            compoundColumns = [(int(header[len('compound_'):]), position) for header, position in positions.items()
+                               if header.startswith('compound_') and header[len('compound_'):].isdigit()]
+            compounds = _Stream(CompoundQuantity.objects.filter(reaction__in=reactionPks).order_by(
+                'reaction', 'pk').values_list('reaction_id', 'compound__name'), self.fetchSize) if compoundColumns else None
+
+            # reactions with no stored value for a descriptor take its storage default
+            blank = [ABSENT] * len(self.headers)
+            for header, default in self.reactions.storageDefaults(self.headers).items():
+                blank[positions[header]] = default
+
+            for item in self.reactions.select_related(*related).batch_iterator(self.fetchSize):
+                row = list(blank)
+                for name, position in fields:
+                    row[position] = getattr(item, name)
+                for stream, columns, convert in streams:
+                    for reactionId, descriptorId, value in stream.take(item.pk):
+                        row[columns[descriptorId]] = convert(value)
+                if compounds is not None:
+                    names = [name for reactionId, name in compounds.take(item.pk)]
+                    for i, position in compoundColumns:
+                        if i < len(names):
+                            row[position] = names[i]
+                yield tuple(row)
+        finally:
+            for stream, columns, convert in streams:
+                stream.close()
+            if compounds is not None:
+                compounds.close()
@@ -1,10 +1,34 @@
 """A module for turning querysets into csv files or output."""
 import csv
 import numpy as np
-from django.db import models
+from django.db import models, connections
+from django.core.exceptions import FieldError
+from django.db.models.sql.datastructures import EmptyResultSet
 import abc
 from collections import OrderedDict
 from itertools import islice, chain
+from StringIO import StringIO
+
+# The default number of rows in each chunk of a streamed export
+EXPORT_CHUNK_SIZE = 500
+# The default number of rows to fetch at a time when iterating over a queryset in batches
+BATCH_SIZE = 5000
+
+ABSENT = object()
+"""Placeholder in row tuples for a header which has no entry in the row at all (as opposed to a value of None)."""
+
+
+def _drain(buf):
+    """Return the contents of a StringIO buffer and empty it."""
+    data = buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    return data
+
+
+def _isZero(v):
+    """Return True if v is a numeric (not boolean) value equal to zero."""
+    return isinstance(v, (int, long, float)) and not isinstance(v, bool) and v == 0
 
 
 class MultiQuerySet(object):
@@ -14,8 +38,11 @@ class MultiQuerySet(object):
 
     For any method called on it, it calls the corresponding method on each of its querysets.
     Be careful that this makes sense for the given querysets.
-    For some queryset methods, this doesn't make sense (like order_by) and more work is needed.
-    Not all of these are implemented.
+
+    Where the querysets are plain model querysets on the same database, counting, iterating,
+    ordering and slicing are done with a single UNION ALL query over the columns of all of the
+    models, so ordering and slicing happen in the database. Otherwise the querysets are counted
+    and iterated one after another, and order_by is not available.
     Partially stolen from here: http://stackoverflow.com/questions/431628/how-to-combine-2-or-more-querysets-in-a-django-view
     and partially inspired from this: http://ramenlabs.com/2010/12/08/how-to-quack-like-a-queryset/
     """
@@ -27,9 +54,11 @@ class MultiQuerySet(object):
     qs_methods = ['filter', 'exclude', 'annotate', 'order_by', 'reverse', 'distinct', 'values', 'values_list', 'dates', 'datetimes',
                   'none', 'all', 'select_related', 'prefetch_related', 'extra', 'defer', 'only', 'using', 'select_for_update', 'raw']
 
-    def __init__(self, *args):
+    def __init__(self, *args, **kwargs):
         """Initialise the multiqueryset."""
         self.querysets = args
+        self.ordering = kwargs.get('ordering', ())
+        self._result_cache = None
 
     def __getattr__(self, name):
         """Deal with all names that are not defined explicitly."""
@@ -43,33 +72,209 @@ class MultiQuerySet(object):
                 "This queryset method does not return a queryset and therefore cannot be passed through to underlying querysets.")
 
         def _map_attr(*args, **kwargs):
-            return MultiQuerySet(*[getattr(qs, name)(*args, **kwargs) for qs in self.querysets])
+            return MultiQuerySet(*[getattr(qs, name)(*args, **kwargs) for qs in self.querysets], ordering=self.ordering)
 
         return _map_attr
 
-    def order_by(self, *args):
+    def _unionable(self):
+        """Return True if the querysets can be combined into a single UNION ALL query."""
+        for qs in self.querysets:
+            if not isinstance(qs, models.query.QuerySet) or isinstance(qs, models.query.ValuesQuerySet):
+                return False
+            query = qs.query
+            if query.low_mark or query.high_mark is not None or query.distinct or query.select_related or \
+                    query.extra or query.group_by is not None or query.deferred_loading[0]:
+                return False
+        return len(set(qs.db for qs in self.querysets)) == 1
+
+    def _columns(self):
+        """
+        Return the columns of the union as a list of ((name, database type), (field name, output field)) pairs.
+
+        Each concrete field and annotation gets a column, shared between those querysets
+        which have one of the same name and database type. The primary key always has a column of its own.
+        """
+        columns = OrderedDict([(('pk', 'pk'), ('pk', models.IntegerField()))])
+        for qs in self.querysets:
+            for field in qs.model._meta.concrete_fields:
+                columns.setdefault((field.attname, field.get_internal_type()), (field.name, field))
+            for name, annotation in qs.query.annotation_select.items():
+                columns.setdefault((name, annotation.output_field.get_internal_type()),
+                                   (name, annotation.output_field))
+        return columns.items()
+
+    @staticmethod
+    def _position(name, columns):
+        """Return the position in the union of the column for a field or annotation name, for ordering by it."""
+        if name == 'pk':
+            return 2
+        positions = [i + 2 for i, ((attname, internalType), (fieldName, field)) in enumerate(columns)
+                     if name in (attname, fieldName)]
+        if not positions:
+            raise FieldError('Cannot order a multiqueryset by {}'.format(name))
+        if len(positions) > 1:
+            raise FieldError(
+                'Cannot order a multiqueryset by {}, which has different types in different querysets'.format(name))
+        return positions[0]
+
+    def _parts(self, columns):
+        """
+        Return (queryset number, sql, params, compiler, converters) for the select from each non-empty queryset.
+
+        Each select has the queryset number as its first column, followed by the union columns.
+        """
+        parts = []
+        for i, qs in enumerate(self.querysets):
+            fields = {('pk', 'pk'): models.F('pk')}
+            for field in qs.model._meta.concrete_fields:
+                fields[(field.attname, field.get_internal_type())] = models.F(field.name)
+            for name, annotation in qs.query.annotation_select.items():
+                fields[(name, annotation.output_field.get_internal_type())] = models.F(name)
+            projected = qs.annotate(mqs_queryset=models.Value(i, output_field=models.IntegerField()))
+            names = ['mqs_queryset']
+            # one annotation at a time, so that the columns are selected in the same order for every queryset
+            for j, (key, (name, field)) in enumerate(columns):
+                names.append('mqs_{}'.format(j))
+                projected = projected.annotate(
+                    **{names[-1]: fields.get(key, models.Value(None, output_field=field))})
+            projected = projected.values_list(*names)
+            projected.query.clear_ordering(force_empty=True)
+            compiler = projected.query.get_compiler(projected.db)
+            try:
+                sql, params = compiler.as_sql()
+            except EmptyResultSet:
+                continue
+            if [compiler.annotation_col_map[name] for name in names] != range(len(names)):
+                raise RuntimeError(
+                    'The columns of a multiqueryset were not selected in a consistent order.')
+            converters = compiler.get_converters([expression for expression, colSql, alias in compiler.select])
+            parts.append((i, sql, params, compiler, converters))
+        return parts
+
+    def _union(self, columns):
+        """Return the sql, params and parts of the UNION ALL of the querysets, or None for the sql if every queryset is empty."""
+        parts = self._parts(columns)
+        if not parts:
+            return None, (), parts
+        sql = 'SELECT * FROM ({}) AS multiqueryset'.format(
+            ' UNION ALL '.join(partSql for i, partSql, params, compiler, converters in parts))
+        params = tuple(chain(*(params for i, partSql, params, compiler, converters in parts)))
+        return sql, params, parts
+
+    def _execute(self, sql, params):
+        """Execute sql against the database of the querysets, returning all of the rows."""
+        cursor = connections[self.querysets[0].db].cursor()
+        try:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def _instance(self, qs, values):
+        """Return a model instance for qs from a dictionary of union column key to value."""
+        fields = qs.model._meta.concrete_fields
+        # to_python, as the database may not report the type of a column of a union (e.g. booleans from sqlite)
+        instance = qs.model.from_db(qs.db, [field.attname for field in fields],
+                                    [field.to_python(values[(field.attname, field.get_internal_type())]) for field in fields])
+        for name, annotation in qs.query.annotation_select.items():
+            setattr(instance, name, values[(name, annotation.output_field.get_internal_type())])
+        # as django does for related managers, so that (e.g.) value.reaction needs no query
+        for field, related in qs._known_related_objects.items():
+            if getattr(instance, field.attname) in related:
+                setattr(instance, field.name, related[getattr(instance, field.attname)])
+        return instance
+
+    def _fetch(self, start=None, stop=None):
+        """Return the model instances of the querysets in a list, ordered and sliced in the database."""
+        columns = self._columns()
+        sql, params, parts = self._union(columns)
+        if sql is None:
+            return []
+        # ties, and multiquerysets with no ordering, go in queryset then primary key order, as chaining the querysets would
+        sql += ' ORDER BY {}'.format(', '.join(
+            ['{} {}'.format(self._position(o.lstrip('-'), columns), 'DESC' if o.startswith('-') else 'ASC')
+             for o in self.ordering] + ['1 ASC', '2 ASC']))
+        if stop is not None:
+            sql += ' LIMIT {}'.format(max(stop - (start or 0), 0))
+        elif start:
+            sql += ' LIMIT {}'.format(connections[self.querysets[0].db].ops.no_limit_value())
+        if start:
+            sql += ' OFFSET {}'.format(start)
+
+        compilers = {i: (compiler, converters) for i, partSql, partParams, compiler, converters in parts}
+        keys = [key for key, column in columns]
+        instances = []
+        byQueryset = {}
+        for row in self._execute(sql, params):
+            compiler, converters = compilers[row[0]]
+            if converters:
+                row = compiler.apply_converters(row, converters)
+            qs = self.querysets[row[0]]
+            instance = self._instance(qs, dict(zip(keys, row[1:])))
+            byQueryset.setdefault(row[0], []).append(instance)
+            instances.append(instance)
+        for i, queryInstances in byQueryset.items():
+            if self.querysets[i]._prefetch_related_lookups:
+                models.query.prefetch_related_objects(
+                    queryInstances, self.querysets[i]._prefetch_related_lookups)
+        return instances
+
+    def order_by(self, *fieldNames):
         """
-        Not implemented because it's a pain and we don't (yet) need it.
+        Return a multiqueryset ordered by the given fields or annotations, across all of the querysets.
 
-        See here for an example of how to do so: http://ramenlabs.com/2010/12/08/how-to-quack-like-a-queryset/
+        Only possible where the querysets can be combined into a single query.
         """
-        raise NotImplementedError(
-            "No order_by implemented for querysetset. File a feature request if you need this feature.")
+        if not self._unionable():
+            raise NotImplementedError(
+                "order_by is only implemented for multiquerysets of plain querysets on the same database.")
+        return MultiQuerySet(*self.querysets, ordering=fieldNames)
 
     def count(self):
-        """Perform a count for all subquerysets and returns the number of records as an integer."""
-        return sum(qs.count() for qs in self.querysets)
+        """Return the number of records in all of the subquerysets as an integer."""
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        if not self._unionable():
+            return sum(qs.count() for qs in self.querysets)
+        sql, params, parts = self._union(self._columns())
+        if sql is None:
+            return 0
+        return self._execute('SELECT COUNT(*) FROM ({}) AS multiquerysetcount'.format(sql), params)[0][0]
 
     def _clone(self):
         """Return a clone of this queryset chain."""
-        return self.__class__(*self.querysets)
+        return self.__class__(*self.querysets, ordering=self.ordering)
 
     def _all(self):
         """Iterate records in all subquerysets."""
-        return chain(*self.querysets)
+        if self._result_cache is None:
+            if self._unionable():
+                self._result_cache = self._fetch()
+            else:
+                return chain(*self.querysets)
+        return iter(self._result_cache)
+
+    def __iter__(self):
+        """Iterate over the records in all of the subquerysets."""
+        return self._all()
+
+    def __len__(self):
+        """Return the number of records in all of the subquerysets."""
+        return self.count()
 
     def __getitem__(self, ndx):
         """Retrieve an item or slice from the chained set of results from all subquerysets."""
+        if self._result_cache is None and self._unionable():
+            if isinstance(ndx, slice):
+                if (ndx.start or 0) < 0 or (ndx.stop or 0) < 0:
+                    raise ValueError('Negative indexing is not supported.')
+                return self._fetch(ndx.start, ndx.stop)[::ndx.step or 1]
+            if ndx < 0:
+                raise ValueError('Negative indexing is not supported.')
+            result = self._fetch(ndx, ndx + 1)
+            if not result:
+                raise IndexError('multiqueryset index out of range')
+            return result[0]
         if isinstance(ndx, slice):
             return list(islice(self._all(), ndx.start, ndx.stop, ndx.step or 1))
         else:
@@ -77,10 +282,145 @@ class MultiQuerySet(object):
 
     def exists(self):
         """Determine if any query result exists."""
-        return any(qs.exists() for qs in self.querysets)
+        if self._result_cache is not None:
+            return bool(self._result_cache)
+        if not self._unionable():
+            return any(qs.exists() for qs in self.querysets)
+        sql, params, parts = self._union(self._columns())
+        if sql is None:
+            return False
+        return bool(self._execute('{} LIMIT 1'.format(sql), params))
+
+
+def batched(items, chunksize=BATCH_SIZE):
+    """Iterate over items in batches if they are a queryset which supports it, or plainly otherwise."""
+    if hasattr(items, 'batch_iterator'):
+        return items.batch_iterator(chunksize)
+    return iter(items)
+
+
+def chunked(items, chunksize=BATCH_SIZE):
+    """Generate items in lists of up to chunksize, fetching them a chunk at a time if they are a queryset which supports it."""
+    if hasattr(items, 'batches'):
+        for chunk in items.batches(chunksize):
+            yield chunk
+    else:
+        items = iter(items)
+        while True:
+            chunk = list(islice(items, chunksize))
+            if not chunk:
+                break
+            yield chunk
+
+
+def itemCount(items):
+    """Return the number of items without evaluating them if they are a queryset."""
+    if isinstance(items, models.query.QuerySet):
+        return items.count()
+    return len(items)
+
+
+class BatchIteratorMixin(object):
+
+    """
+    A queryset mixin for iterating over large querysets a chunk at a time using keyset pagination.
+
+    Each chunk is fetched with a query which continues from the last row of the one
+    before, rather than with an offset, so every chunk costs the same however far
+    through the queryset it is. Prefetches are made per chunk, covering only its rows.
+    """
+
+    def _batchOrdering(self, ordering):
+        """Return the ordering as (field name, attribute name, descending) triples, refusing any which is not unique."""
+        ordering = list(ordering) if ordering is not None else ['pk']
+        meta = self.model._meta
+        keys = []
+        for o in ordering:
+            name = o.lstrip('-')
+            if '__' in name:
+                raise ValueError(
+                    'Batch orderings may only use fields of the model itself, not {}'.format(name))
+            field = meta.pk if name == 'pk' else meta.get_field(name)
+            if field.null:
+                raise ValueError(
+                    'Batch orderings may not use the nullable field {}'.format(name))
+            keys.append((name, field.attname, o.startswith('-')))
+        names = set(meta.pk.name if name == 'pk' else name for name, attname, descending in keys)
+        uniqueSets = [{field.name} for field in meta.fields if field.unique]
+        for model in [self.model] + meta.get_parent_list():
+            uniqueSets.extend(set(together) for together in model._meta.unique_together)
+        if not any(unique <= names for unique in uniqueSets):
+            # rows tied on every key could be skipped or repeated at the edge of a chunk
+            raise ValueError(
+                'Batch orderings must be unique, so must include the primary key, a unique field or a unique_together set, not {}'.format(
+                    ', '.join(ordering)))
+        return keys
+
+    def batches(self, chunksize=BATCH_SIZE, ordering=None):
+        """
+        Generate the queryset as lists of up to chunksize model instances.
+
+        ordering is a sequence of field names as for order_by (default: the primary key), on fields
+        of the model itself which are never null. It must be unique, so must include the primary key,
+        a unique field or all of the fields of one of the model's unique_together sets.
+        """
+        keys = self._batchOrdering(ordering)
+        queryset = self.order_by(
+            *(('-' if descending else '') + name for name, attname, descending in keys))
+        last = None
+        while True:
+            chunkQueryset = queryset
+            if last is not None:
+                # rows which come after the last one: equal on a prefix of the keys and past it on the next
+                after = models.Q()
+                for i, (name, attname, descending) in enumerate(keys):
+                    clause = models.Q(**{'{}__{}'.format(name, 'lt' if descending else 'gt'): last[i]})
+                    for j, (prefixName, prefixAttname, prefixDescending) in enumerate(keys[:i]):
+                        clause &= models.Q(**{prefixName: last[j]})
+                    after |= clause
+                chunkQueryset = chunkQueryset.filter(after)
+            chunk = list(chunkQueryset[:chunksize])
+            if not chunk:
+                break
+            yield chunk
+            if len(chunk) < chunksize:
+                break
+            last = [getattr(chunk[-1], attname) for name, attname, descending in keys]
+
+    def batch_iterator(self, chunksize=BATCH_SIZE, ordering=None, afterChunk=None):
+        """
+        Iterate over the queryset a chunk of at most chunksize rows at a time.
+
+        If afterChunk is given it is called with each chunk once all of its items have been
+        consumed, so that bulk writers can flush their work a chunk at a time. See batches for ordering.
+        """
+        for chunk in self.batches(chunksize, ordering):
+            for item in chunk:
+                yield item
+            if afterChunk is not None:
+                afterChunk(chunk)
+
+
+class RowQuerySet(BatchIteratorMixin, models.query.QuerySet):
+
+    """A queryset which can generate rows of its data as tuples in a given header order."""
+
+    __metaclass__ = abc.ABCMeta
+
+    def rowTuples(self, headers, expanded=False, whitelist=None):
+        """
+        Generate a tuple of values for each row, in the order of headers.
+
+        Headers with no entry in the row are given as ABSENT.
+        This implementation builds the tuples from rows(), but subclasses may provide faster engines.
+        """
+        rows = self.rows(expanded) if whitelist is None else self.rows(
+            expanded, whitelist)
+        for row in rows:
+            yield tuple(row.get(key, ABSENT) for key in headers)
 
 
-class CsvQuerySet(models.query.QuerySet):
+class CsvQuerySet(RowQuerySet):
 
     """This queryset permits the output of the data from a model as a csv."""
 
@@ -112,17 +452,26 @@ class CsvQuerySet(models.query.QuerySet):
         'expandedValues', which should be a dictionary like object of values, using fieldNames as keys as output
         by fetchExpandedHeaders.
         """
+        for chunk in self.csvChunks(expanded, whitelistHeaders, missing):
+            writeable.write(chunk)
+
+    def csvChunks(self, expanded=False, whitelistHeaders=None, missing="?", chunkSize=EXPORT_CHUNK_SIZE):
+        """Generate the csv data as strings of up to chunkSize rows, for streaming responses."""
         if expanded:
             headers = self.expandedCsvHeaders(whitelistHeaders)
         else:
             headers = self.csvHeaders(whitelistHeaders)
 
-        writer = csv.DictWriter(writeable, fieldnames=headers, restval=missing)
+        buf = StringIO()
+        writer = csv.writer(buf)
 
-        writer.writeheader()
-        for row in self.rows(expanded):
-            writer.writerow({k: row.get(k, missing)
-                             for k in row.keys() if k in headers})
+        writer.writerow(headers)
+        yield _drain(buf)
+        for i, row in enumerate(self.rowTuples(headers, expanded), 1):
+            writer.writerow([(missing if v is ABSENT else v) for v in row])
+            if i % chunkSize == 0:
+                yield _drain(buf)
+        yield _drain(buf)
 
     def rows(self, expanded):
         """Generate a dictionary, representative of a row in the csv module's dictwriter."""
@@ -130,7 +479,7 @@ class CsvQuerySet(models.query.QuerySet):
             yield {field.name: getattr(item, field.name) for field in self.model._meta.fields}
 
 
-class ArffQuerySet(models.query.QuerySet):
+class ArffQuerySet(RowQuerySet):
 
     """This queryset class permits data from a model to be output as a .arff file."""
 
@@ -174,23 +523,51 @@ class ArffQuerySet(models.query.QuerySet):
                         field.name, ','.join(value_set))
         return headers
 
-    def toArff(self, writeable, expanded=False, relationName='relation', whitelistHeaders=None, missing="?"):
-        """Output to an arff file-like object."""
-        writeable.write(
+    def toArff(self, writeable, expanded=False, relationName='relation', whitelistHeaders=None, missing="?", sparse=False):
+        """
+        Output to an arff file-like object.
+
+        If sparse is True, instances are written in Weka's sparse {index value, ...} format,
+        leaving out numeric attributes with a value of 0.
+        """
+        for chunk in self.arffChunks(expanded, relationName, whitelistHeaders, missing, sparse):
+            writeable.write(chunk)
+
+    def arffChunks(self, expanded=False, relationName='relation', whitelistHeaders=None, missing="?", sparse=False,
+                   chunkSize=EXPORT_CHUNK_SIZE):
+        """Generate the arff file as strings of up to chunkSize instances, for streaming responses."""
+        buf = StringIO()
+        buf.write(
             '%arff file generated by the Dark Reactions Project provided by Haverford College\n')
-        writeable.write('\n@relation {}\n'.format(relationName))
+        buf.write('\n@relation {}\n'.format(relationName))
         if expanded:
             headers = self.expandedArffHeaders(whitelistHeaders)
         else:
             headers = self.arffHeaders(whitelistHeaders)
 
-        writeable.write('\n'.join(headers.values()))
-
-        writeable.write('\n\n@data\n')
-        for row in self.rows(expanded, whitelistHeaders):
-            writeable.write(','.join(('"' + str(row.get(key)) + '"' if (row.get(key)
-                                                                        is not None) else missing) for key in headers.keys()))
-            writeable.write('\n')
+        buf.write('\n'.join(headers.values()))
+
+        buf.write('\n\n@data\n')
+        yield _drain(buf)
+        # in sparse instances an omitted nominal attribute takes its first value, so only numeric zeros can be left out
+        numeric = [header.split()[-1].lower() == 'numeric'
+                   for header in headers.values()]
+        for i, row in enumerate(self.rowTuples(headers.keys(), expanded, whitelistHeaders), 1):
+            if sparse:
+                buf.write('{' + ','.join('{} {}'.format(j, self._arffValue(v, missing)) for j, v in enumerate(row)
+                                         if not (numeric[j] and _isZero(v))) + '}')
+            else:
+                buf.write(','.join(self._arffValue(v, missing)
+                                   for v in row))
+            buf.write('\n')
+            if i % chunkSize == 0:
+                yield _drain(buf)
+        yield _drain(buf)
+
+    @staticmethod
+    def _arffValue(v, missing):
+        """Format a single value for an arff file."""
+        return '"' + str(v) + '"' if (v is not None and v is not ABSENT) else missing
 
     def toNPArray(self, expanded=False, whitelistHeaders=None, missing=np.nan):
         """Return a numpy array."""
@@ -200,9 +577,9 @@ class ArffQuerySet(models.query.QuerySet):
         else:
             headers = self.arffHeaders(whitelistHeaders)
 
-        for row in self.rows(expanded):
-            matrix.append([(row.get(key) if (row.get(key) is not None)
-                            else missing) for key in headers.keys()])
+        for row in self.rowTuples(headers.keys(), expanded):
+            matrix.append([(v if (v is not None and v is not ABSENT)
+                            else missing) for v in row])
 
         return np.array(matrix)
 
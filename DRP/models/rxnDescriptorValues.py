@@ -1,19 +1,59 @@
 """A module containign only the DescriptorValue class."""
 from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from descriptorValues import CategoricalDescriptorValue, OrdinalDescriptorValue, BooleanDescriptorValue, NumericDescriptorValue
 from rxnDescriptors import CatRxnDescriptor, NumRxnDescriptor, BoolRxnDescriptor, OrdRxnDescriptor
+from descriptors import CategoricalDescriptorPermittedValue
 import dataSets
+import featureMatrix
+import dataVersion
+from querysets import BatchIteratorMixin
 # Needed to allow for circular dependency.
 import importlib
 import DRP.models
 pr = importlib.import_module("DRP.models.PerformedReaction")
 
 
-class RxnDescriptorValueQuerySet(models.query.QuerySet):
+def withoutStorageDefaults(values):
+    """Return the numeric reaction descriptor values which need storing, leaving out those equal to their descriptor's storage default."""
+    return [v for v in values if not v.descriptor.isStorageDefault(v.value)]
+
+
+class RxnDescriptorValueQuerySet(BatchIteratorMixin, models.query.QuerySet):
 
     """A queryset which represents a collection of concrete values of a Reaction Descriptor."""
 
-    pass
+    def _featureMatrixCells(self):
+        """Return the (reaction, descriptor) cells of the cached feature matrix which these values occupy."""
+        if featureMatrix.enabled():
+            return list(self.values_list('reaction_id', 'descriptor_id'))
+        return []
+
+    def update(self, **kwargs):
+        """Update the values, invalidating the cached feature matrix cells."""
+        cells = self._featureMatrixCells()
+        rows = super(RxnDescriptorValueQuerySet, self).update(**kwargs)
+        featureMatrix.invalidate(cells)
+        dataVersion.bump()
+        return rows
+
+    def delete(self):
+        """Delete the values, invalidating the cached feature matrix cells."""
+        cells = self._featureMatrixCells()
+        super(RxnDescriptorValueQuerySet, self).delete()
+        featureMatrix.invalidate(cells)
+        dataVersion.bump()
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Create the values, invalidating the cached feature matrix cells."""
+        objs = super(RxnDescriptorValueQuerySet, self).bulk_create(
+            objs, *args, **kwargs)
+        featureMatrix.invalidate((v.reaction_id, v.descriptor_id)
+                                 for v in objs)
+        dataVersion.bump()
+        return objs
+
     # TODO XXX This breaks because queryset has no attribute descriptor.
     # def delete(self):
     # trainingModels = DRP.models.StatsModel.objects.filter(descriptors=self.descriptor, testset__in=dataSets.TestSet.objects.filter(reactions__in=set(v.reaction.performedreaction for v in self)))
@@ -42,6 +82,19 @@ class RxnDescriptorValue(models.Model):
     objects = RxnDescriptorValueManager()
     reaction = models.ForeignKey("DRP.Reaction", unique=False)
 
+    def save(self, *args, **kwargs):
+        """Save the value, invalidating its cached feature matrix cell."""
+        super(RxnDescriptorValue, self).save(*args, **kwargs)
+        featureMatrix.invalidate([(self.reaction_id, self.descriptor_id)])
+        dataVersion.bump()
+
+    def delete(self, *args, **kwargs):
+        """Delete the value, invalidating its cached feature matrix cell."""
+        cell = (self.reaction_id, self.descriptor_id)
+        super(RxnDescriptorValue, self).delete(*args, **kwargs)
+        featureMatrix.invalidate([cell])
+        dataVersion.bump()
+
     # def save(self, *args, **kwargs):
     # if self.pk is not None:
     # pass
@@ -109,3 +162,20 @@ class OrdRxnDescriptorValue(OrdinalDescriptorValue, RxnDescriptorValue):
         app_label = "DRP"
         verbose_name = 'Ordinal Reaction Descriptor Value'
         unique_together = ('reaction', 'descriptor')
+
+
+@receiver(post_delete, sender=CatRxnDescriptor)
+@receiver(post_delete, sender=OrdRxnDescriptor)
+@receiver(post_delete, sender=NumRxnDescriptor)
+@receiver(post_delete, sender=BoolRxnDescriptor)
+def descriptorDeleted(sender, instance, **kwargs):
+    """Invalidate the cached feature matrix column of a deleted descriptor, whose values have been deleted with it."""
+    featureMatrix.invalidateColumns([instance.pk])
+    dataVersion.bump()
+
+
+@receiver(post_delete, sender=CategoricalDescriptorPermittedValue)
+def permittedValueDeleted(sender, instance, **kwargs):
+    """Invalidate the cached feature matrix column of a descriptor whose values may have been deleted along with a permitted value."""
+    featureMatrix.invalidateColumns([instance.descriptor_id])
+    dataVersion.bump()
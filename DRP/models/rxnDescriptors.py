@@ -1,4 +1,5 @@
 """A module containing the reactions descriptors."""
+from django.db import models
 from descriptors import CategoricalDescriptor, OrdinalDescriptor, BooleanDescriptor
 from descriptors import CategoricalDescriptorPermittedValue, NumericDescriptor, Predictable, DescriptorManager
 import rxnDescriptorValues
@@ -120,6 +121,9 @@ class NumRxnDescriptor(NumericDescriptor, Predictable):
 
     objects = DescriptorManager()
 
+    storageDefault = models.FloatField(null=True, blank=True, default=None)
+    """A value which is never stored; a reaction with no stored value for this descriptor implicitly takes it, even one for which it was never calculated."""
+
     def __init__(self, *args, **kwargs):
         """Initialise a new instance of a reaction descriptor."""
         super(NumRxnDescriptor, self).__init__(*args, **kwargs)
@@ -157,12 +161,19 @@ class NumRxnDescriptor(NumericDescriptor, Predictable):
         qs = rxnDescriptorValues.NumRxnDescriptorValue.objects.filter(
             descriptor=self, reaction=reaction)
 
-        if qs.exists():
+        if self.isStorageDefault(value):
+            qs.delete()
+            return None
+        elif qs.exists():
             qs.exclude(value=value).update(value=value)
             return None
         else:
             return rxnDescriptorValues.NumRxnDescriptorValue(descriptor=self, reaction=reaction, value=value)
 
+    def isStorageDefault(self, value):
+        """Return True if value is this descriptor's storage default, and so should not be stored."""
+        return self.storageDefault is not None and value is not None and value == self.storageDefault
+
     def createPredictionDescriptor(self, *args, **kwargs):
         """Create a new predicted descriptor which matches this one's parameters."""
         pred = super(NumRxnDescriptor, self).createPredictionDescriptor(
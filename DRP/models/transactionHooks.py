@@ -0,0 +1,65 @@
+"""
+Calling functions once the transaction they were queued in has ended, as Django 1.8 has no transaction.on_commit.
+
+Writes made inside an atomic block are not seen by other processes until the outermost
+block commits, so caches shared between processes must be invalidated again once it has.
+The functions queued on a connection are called once its outermost atomic block has
+committed or rolled back; either way the data is then what other processes will read.
+"""
+from django.db import transaction
+from collections import OrderedDict
+
+HOOKS_ATTRIBUTE = 'drpTransactionHooks'
+
+
+def atEnd(key, function, items=None):
+    """
+    Call function once the outermost atomic block of the default connection ends, or now if there is none.
+
+    If items is given, function is called with a list of the items queued under key during the
+    transaction; otherwise it is called with no arguments. Either way it is called once per key.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        if items is None:
+            function()
+        else:
+            function(list(items))
+        return
+    _watch(connection)
+    hooks = getattr(connection, HOOKS_ATTRIBUTE)
+    if key not in hooks:
+        hooks[key] = (function, None if items is None else [])
+    if items is not None:
+        hooks[key][1].extend(items)
+
+
+def _watch(connection):
+    """Wrap the connection's commit, rollback and close so that they call the queued functions once the outermost atomic block has ended."""
+    if hasattr(connection, HOOKS_ATTRIBUTE):
+        return
+    setattr(connection, HOOKS_ATTRIBUTE, OrderedDict())
+    for name in ('commit', 'rollback', 'close'):
+        setattr(connection, name, _ending(connection, getattr(connection, name)))
+
+
+def _ending(connection, method):
+    """Return method, followed by calling the queued functions if the connection is no longer in an atomic block."""
+    def ending(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        finally:
+            if not connection.in_atomic_block:
+                _run(connection)
+    return ending
+
+
+def _run(connection):
+    """Call and forget the functions queued on a connection."""
+    hooks = getattr(connection, HOOKS_ATTRIBUTE)
+    while hooks:
+        key, (function, items) = hooks.popitem(last=False)
+        if items is None:
+            function()
+        else:
+            function(items)
@@ -0,0 +1,101 @@
+"""
+A writer which brings stored descriptor values into line with newly calculated ones, writing only what changed.
+
+Recalculating descriptors used to delete every value and insert it again, which
+rewrites the table and its indexes even when nothing has changed. Instead, the
+writer loads the stored values for a chunk of owners (compounds or reactions),
+works out which values are new, changed or no longer calculated, and applies
+just those as batched inserts, CASE updates and deletes.
+"""
+from django.db import models
+
+# The number of rows to insert, update or delete in each statement
+BATCH_SIZE = 500
+
+
+class ValueWriter(object):
+
+    """
+    Writes the values of one descriptor value class for a fixed set of descriptors.
+
+    The counts attribute holds the number of values inserted, updated, deleted and
+    left unchanged by every write so far.
+    """
+
+    def __init__(self, model, descriptors, batchSize=BATCH_SIZE):
+        """Set up the writer for a descriptor value class; descriptors of other types are ignored."""
+        self.model = model
+        self.ownerField = 'reaction' if any(field.name == 'reaction' for field in model._meta.fields) else 'compound'
+        self.valueField = model._meta.get_field('value')
+        descriptorClass = model._meta.get_field('descriptor').rel.to
+        self.descriptorIds = set(descriptor.pk for descriptor in descriptors if isinstance(descriptor, descriptorClass))
+        self.batchSize = batchSize
+        self.counts = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+
+    def _prepared(self, value):
+        """Return a value in the form in which it is compared with the stored one."""
+        return self.valueField.get_prep_value(value)
+
+    def _delete(self, pks):
+        """Delete the values with the given primary keys."""
+        queryset = self.model.objects.filter(pk__in=pks)
+        if self.ownerField == 'compound':
+            # the values are being replaced, so reactions are recalculated by the plugins in their turn
+            queryset.delete(recalculate_reactions=False)
+        else:
+            queryset.delete()
+
+    def write(self, owners, values):
+        """
+        Make the stored values of the writer's descriptors for owners exactly those in values.
+
+        values are unsaved model instances; any stored value for one of the owners and
+        descriptors which is not among them is deleted. Return the counts for this write.
+        """
+        ownerAttname = self.ownerField + '_id'
+        ownerIds = set(owner.pk for owner in owners)
+        wanted = {}
+        for value in values:
+            if value.descriptor_id in self.descriptorIds:
+                wanted[(getattr(value, ownerAttname), value.descriptor_id)] = value
+
+        stored = {}
+        if ownerIds and self.descriptorIds:
+            for pk, ownerId, descriptorId, storedValue in self.model.objects.filter(
+                    **{self.ownerField + '__in': ownerIds, 'descriptor__in': self.descriptorIds}).values_list(
+                    'pk', ownerAttname, 'descriptor_id', self.valueField.attname):
+                stored[(ownerId, descriptorId)] = (pk, storedValue)
+
+        inserts = []
+        updates = []
+        unchanged = 0
+        for key, value in wanted.items():
+            newValue = getattr(value, self.valueField.attname)
+            if key not in stored:
+                inserts.append(value)
+            elif self._prepared(stored[key][1]) == self._prepared(newValue):
+                unchanged += 1
+            else:
+                updates.append((stored[key][0], newValue))
+        deletes = [pk for key, (pk, storedValue) in stored.items() if key not in wanted]
+
+        for start in range(0, len(deletes), self.batchSize):
+            self._delete(deletes[start:start + self.batchSize])
+        for start in range(0, len(updates), self.batchSize):
+            batch = updates[start:start + self.batchSize]
+            self.model.objects.filter(pk__in=[pk for pk, batchValue in batch]).update(**{
+                self.valueField.name: models.Case(
+                    *[models.When(pk=pk, then=models.Value(batchValue)) for pk, batchValue in batch],
+                    output_field=self.valueField)})
+        if inserts:
+            self.model.objects.bulk_create(inserts, batch_size=self.batchSize)
+
+        counts = {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(deletes), 'unchanged': unchanged}
+        for key, count in counts.items():
+            self.counts[key] += count
+        return counts
+
+    def report(self):
+        """Return a one line summary of the counts."""
+        return '{}: {inserted} inserted, {updated} updated, {deleted} deleted, {unchanged} unchanged'.format(
+            self.model._meta.verbose_name_plural, **self.counts)
@@ -0,0 +1,126 @@
+"""
+An on-disk cache of the results of external descriptor calculators.
+
+Compounds are duplicated between lab groups, and a full recalculation asks the
+calculators again about structures whose results cannot have changed. Results are
+therefore kept in a SQLite file under CALCULATOR_CACHE_DIR, keyed by the structure
+the calculator was given, the calculator and its version, and the command run.
+Results depend on nothing in the database, so one cache is shared by every database.
+"""
+import os
+import json
+import sqlite3
+from django.conf import settings
+
+# The number of keys to look up in each query
+FETCH_SIZE = 500
+# Bumped whenever what results are keyed by changes, so that results cached under the old keys are dropped
+KEY_VERSION = 1
+
+
+def enabled():
+    """Return True if a directory for the calculator cache has been configured."""
+    return getattr(settings, 'CALCULATOR_CACHE_DIR', None) is not None
+
+
+def cachePath():
+    """Return the path of the cache file."""
+    return os.path.join(settings.CALCULATOR_CACHE_DIR, 'results.sqlite3')
+
+
+def _connect():
+    """Open (and if necessary create) the cache file."""
+    try:
+        os.makedirs(settings.CALCULATOR_CACHE_DIR)
+    except OSError:
+        if not os.path.isdir(settings.CALCULATOR_CACHE_DIR):
+            raise
+    # several calculate_descriptors workers may share the file
+    connection = sqlite3.connect(cachePath(), timeout=60)
+    connection.execute('CREATE TABLE IF NOT EXISTS result (structure TEXT NOT NULL, calculator TEXT NOT NULL, '
+                       'version TEXT NOT NULL, command TEXT NOT NULL, value TEXT NOT NULL, '
+                       'PRIMARY KEY (structure, calculator, version, command))')
+    with connection:
+        if connection.execute('PRAGMA user_version').fetchone()[0] < KEY_VERSION:
+            connection.execute('DELETE FROM result')
+            connection.execute('PRAGMA user_version = {}'.format(KEY_VERSION))
+    return connection
+
+
+def evict(calculator, version=None):
+    """Delete the cached results of a calculator, or of one version of it, returning the number deleted."""
+    if not enabled() or not os.path.exists(cachePath()):
+        return 0
+    connection = _connect()
+    try:
+        with connection:
+            if version is None:
+                cursor = connection.execute('DELETE FROM result WHERE calculator = ?', (calculator,))
+            else:
+                cursor = connection.execute('DELETE FROM result WHERE calculator = ? AND version = ?',
+                                            (calculator, version))
+        return cursor.rowcount
+    finally:
+        connection.close()
+
+
+def clear():
+    """Delete the cache file."""
+    if enabled() and os.path.exists(cachePath()):
+        os.remove(cachePath())
+
+
+class CalculatorCache(object):
+
+    """
+    The cached results of one version of one calculator.
+
+    Results may be any json serialisable value. If no cache directory is configured,
+    every lookup misses and nothing is stored. The hits and misses attributes count
+    the (structure, command) results looked up so far.
+    """
+
+    def __init__(self, calculator, version):
+        """Open the cache for a calculator and version."""
+        self.calculator = calculator
+        self.version = str(version)
+        self.hits = 0
+        self.misses = 0
+        self.connection = _connect() if enabled() else None
+
+    def get(self, structures, commands):
+        """Return a dictionary of (structure, command) to the cached result, for those of the structures and commands which are cached."""
+        structures = sorted(set(structure for structure in structures if structure is not None))
+        commands = set(commands)
+        results = {}
+        if self.connection is not None:
+            for start in range(0, len(structures), FETCH_SIZE):
+                batch = structures[start:start + FETCH_SIZE]
+                for structure, command, value in self.connection.execute(
+                        'SELECT structure, command, value FROM result WHERE calculator = ? AND version = ? '
+                        'AND structure IN ({})'.format(', '.join('?' * len(batch))),
+                        [self.calculator, self.version] + batch):
+                    if command in commands:
+                        results[(structure, command)] = json.loads(value)
+        self.hits += len(results)
+        self.misses += len(structures) * len(commands) - len(results)
+        return results
+
+    def put(self, results):
+        """Store a dictionary of (structure, command) to result."""
+        if self.connection is not None and results:
+            with self.connection:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO result (structure, calculator, version, command, value) VALUES (?, ?, ?, ?, ?)',
+                    [(structure, self.calculator, self.version, command, json.dumps(value))
+                     for (structure, command), value in results.items() if structure is not None])
+
+    def close(self):
+        """Close the cache file."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def report(self):
+        """Return a one line summary of the hits and misses."""
+        return '{} {} cache: {} hits, {} misses'.format(self.calculator, self.version, self.hits, self.misses)
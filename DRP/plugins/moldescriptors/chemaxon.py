@@ -5,11 +5,19 @@ Requires cxcalc (part of JChem) to be installed and licensed.
 """
 import DRP
 from utils import setup
+from DRP.models.querysets import chunked, itemCount
+from DRP.models.valueWriter import ValueWriter
+from calculatorCache import CalculatorCache
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from collections import OrderedDict
 from subprocess import Popen, PIPE
 from itertools import chain
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from tempfile import mkdtemp
+import os
+import shutil
 import warnings
 
 # The version of ChemAxon currently in use.
@@ -21,6 +29,9 @@ CHEMAXON_VERSION = '16.5'
 calculatorSoftware = 'ChemAxon_cxcalc'
 # number of values to create at a time. Should probably be <= 5000
 create_threshold = 5000
+# number of compounds to pass to each run of cxcalc, and the number of runs at a time
+cxcalc_batch_size = 100
+cxcalc_workers = 4
 
 
 # The descriptor versions correspond to either the first ChemAxon version in which they were used
@@ -179,191 +190,318 @@ cxcalcCommands = OrderedDict()
 for key in _descriptorDict.keys():
     cxcalcCommands[key] = key
 
+# The pH at which the curves of pH dependent descriptors are calculated.
+# Values at the pH of a reaction are interpolated between them.
+pH_curve_points = [i / 2.0 for i in range(29)]
 
-def setup_pHdependentDescriptors(_descriptorDict):
-    """Set up for calculation of pH dependent descriptors."""
-    pH_vals = DRP.models.NumRxnDescriptorValue.objects.filter(descriptor__heading='reaction_pH', reaction__performedreaction__valid=True).exclude(
-        value=None).order_by('value').values_list('value', flat=True).distinct()
-    for descriptor, d in _pHDependentDescriptors.items():
-        for pH in pH_vals:
-            pH_string = str(pH).replace('.', '_')  # R compatibility
-            d_copy = d.copy()
-            d_copy['name'] += ' at pH {}'.format(pH_string)
-            _descriptorDict[descriptor + '_pH{}'.format(pH_string)] = d_copy
-
-    descriptorDict = setup(_descriptorDict)
-
-    _cxcalcpHCommandStems = {
-        'avgpol_pH{}': 'avgpol -H {}',
-        'molpol_pH{}': 'molpol -H {}',
-        'vanderwaals_pH{}': 'vdwsa -H {}',
-        'asa_pH{}': 'molecularsurfacearea -t ASA -H {}',
-        'asa+_pH{}': 'molecularsurfacearea -t ASA+ -H {}',
-        'asa-_pH{}': 'molecularsurfacearea -t ASA- -H {}',
-        'asa_hydrophobic_pH{}': 'molecularsurfacearea -t ASA_H -H {}',
-        'asa_polar_pH{}': 'molecularsurfacearea -t ASA_P -H {}',
-        'hbda_acc_pH{}': 'acceptorcount -H {}',
-        'hbda_don_pH{}': 'donorcount -H {}',
-        'polar_surface_area_pH{}': 'polarsurfacearea -H {}',
-    }
-
-    for key, command in _cxcalcpHCommandStems.items():
-        for pH in pH_vals:
-            pH_string = str(pH).replace('.', '_')  # R compatibility
-            cxcalcCommands[key.format(pH_string)] = command.format(pH)
+_cxcalcpHCommandStems = {
+    'avgpol': 'avgpol -H {}',
+    'molpol': 'molpol -H {}',
+    'vanderwaals': 'vdwsa -H {}',
+    'asa': 'molecularsurfacearea -t ASA -H {}',
+    'asa+': 'molecularsurfacearea -t ASA+ -H {}',
+    'asa-': 'molecularsurfacearea -t ASA- -H {}',
+    'asa_hydrophobic': 'molecularsurfacearea -t ASA_H -H {}',
+    'asa_polar': 'molecularsurfacearea -t ASA_P -H {}',
+    'hbda_acc': 'acceptorcount -H {}',
+    'hbda_don': 'donorcount -H {}',
+    'polar_surface_area': 'polarsurfacearea -H {}',
+}
 
-    if len(cxcalcCommands) != len(_descriptorDict):
-        raise RuntimeError(
-            "Need the same number of cxcalc commands as descriptors being calculated")
+if set(_cxcalcpHCommandStems) != set(_pHDependentDescriptors):
+    raise RuntimeError(
+        "Need a cxcalc command for every pH dependent descriptor")
 
-    return descriptorDict
+descriptorDict = setup(_descriptorDict)
 
 
-def delete_descriptors(compound_set, descriptorDict, cxcalcCommands):
-    """Bulk deletion of descriptors."""
-    DRP.models.NumMolDescriptorValue.objects.filter(descriptor__in=[descriptorDict[ck] for ck in cxcalcCommands.keys() if _descriptorDict[ck]['type'] == 'num'],
-                                                    compound__in=compound_set).delete(recalculate_reactions=False)
-    DRP.models.OrdMolDescriptorValue.objects.filter(descriptor__in=[descriptorDict[ck] for ck in cxcalcCommands.keys() if _descriptorDict[ck]['type'] == 'ord'],
-                                                    compound__in=compound_set).delete(recalculate_reactions=False)
-    DRP.models.BoolMolDescriptorValue.objects.filter(descriptor__in=[descriptorDict[ck] for ck in cxcalcCommands.keys() if _descriptorDict[ck]['type'] == 'bool'],
-                                                     compound__in=compound_set).delete(recalculate_reactions=False)
+def curveIdentity(heading):
+    """Return the (heading, calculatorSoftware, calculatorSoftwareVersion) by which the pH curves of a pH dependent descriptor are stored."""
+    d = _pHDependentDescriptors[heading]
+    return (heading, d['calculatorSoftware'], d['calculatorSoftwareVersion'])
 
 
-def calculate_many(compound_set, verbose=False, whitelist=None):
-    """Bulk calculation of descriptors."""
-    if verbose:
-        print "Creating descriptor dictionary"
-    descriptorDict = setup_pHdependentDescriptors(_descriptorDict)
+def _commands(whitelist=None):
+    """Return the cxcalc commands for the whitelisted descriptors, and those for the whitelisted pH curves keyed by (heading, pH)."""
     if whitelist is not None:
         filtered_cxcalcCommands = {k: cxcalcCommands[
             k] for k in cxcalcCommands.keys() if k in whitelist}
     else:
         filtered_cxcalcCommands = cxcalcCommands
-    if verbose:
-        print "Deleting old descriptor values."
-    delete_descriptors(compound_set, descriptorDict, cxcalcCommands)
+    curveCommands = OrderedDict()
+    for heading, stem in sorted(_cxcalcpHCommandStems.items()):
+        if whitelist is None or heading in whitelist:
+            for pH in pH_curve_points:
+                curveCommands[(heading, pH)] = stem.format(pH)
+    return filtered_cxcalcCommands, curveCommands
 
-    num_to_create = []
-    ord_to_create = []
-    for i, compound in enumerate(compound_set):
-        if verbose:
-            print "{}; Compound {} ({}/{})".format(compound, compound.pk, i + 1, len(compound_set))
-        num_to_create, ord_to_create = _calculate(
-            compound, descriptorDict, filtered_cxcalcCommands, verbose=verbose, num_to_create=num_to_create, ord_to_create=ord_to_create)
-        if len(num_to_create) > create_threshold:
-            if verbose:
-                print 'Creating {} numeric values'.format(len(num_to_create))
-            DRP.models.NumMolDescriptorValue.objects.bulk_create(num_to_create)
-            num_to_create = []
-        if len(ord_to_create) > create_threshold:
+
+def _writers(descriptorDict, cxcalcCommands):
+    """Return writers for the numeric and ordinal values of the descriptors calculated by cxcalcCommands."""
+    descriptors = [descriptorDict[ck] for ck in cxcalcCommands.keys()]
+    return (ValueWriter(DRP.models.NumMolDescriptorValue, descriptors),
+            ValueWriter(DRP.models.OrdMolDescriptorValue, descriptors))
+
+
+def calculate_many(compound_set, verbose=False, whitelist=None):
+    """Bulk calculation of descriptors, writing only the values which have changed."""
+    filtered_cxcalcCommands, curveCommands = _commands(whitelist)
+    numWriter, ordWriter = _writers(descriptorDict, filtered_cxcalcCommands)
+
+    compoundCount = itemCount(compound_set) if verbose else None
+    i = 0
+    curveCount = 0
+    cache = CalculatorCache(calculatorSoftware, CHEMAXON_VERSION)
+    pool = ThreadPool(cxcalc_workers)
+    try:
+        for compounds in chunked(compound_set, create_threshold):
             if verbose:
-                print 'Creating {} ordinal values'.format(len(Ord_to_create))
-            DRP.models.OrdMolDescriptorValue.objects.bulk_create(ord_to_create)
-            ord_to_create = []
+                print "Calculating for compounds {}-{} of {}".format(i + 1, i + len(compounds), compoundCount)
+            i += len(compounds)
+            curveCount += _write(compounds, filtered_cxcalcCommands, curveCommands,
+                                 cache, pool.imap_unordered, numWriter, ordWriter)
+    finally:
+        pool.close()
+        pool.join()
+        cache.close()
 
     if verbose:
-        print 'Creating {} numeric values'.format(len(num_to_create))
-    DRP.models.NumMolDescriptorValue.objects.bulk_create(num_to_create)
-    if verbose:
-        print 'Creating {} ordinal values'.format(len(ord_to_create))
-    DRP.models.OrdMolDescriptorValue.objects.bulk_create(ord_to_create)
+        print cache.report()
+        print numWriter.report()
+        print ordWriter.report()
+        print "pH curves: {} written".format(curveCount)
 
 
 def calculate(compound, verbose=False, whitelist=None):
     """Calculate descriptor values."""
-    if verbose:
-        print "Creating descriptor dictionary"
-    descriptorDict = setup_pHdependentDescriptors(_descriptorDict)
-    if whitelist is not None:
-        filtered_cxcalcCommands = {k: cxcalcCommands[
-            k] for k in cxcalcCommands.keys() if k in whitelist}
-    else:
-        filtered_cxcalcCommands = cxcalcCommands
-    if verbose:
-        print "Deleting old descriptor values"
-    delete_descriptors([compound], descriptorDict, cxcalcCommands)
+    filtered_cxcalcCommands, curveCommands = _commands(whitelist)
+    numWriter, ordWriter = _writers(descriptorDict, filtered_cxcalcCommands)
     if verbose:
         print "Creating new descriptor values."
-    num_to_create, ord_to_create = _calculate(
-        compound, descriptorDict, filtered_cxcalcCommands, verbose=verbose)
-
+    cache = CalculatorCache(calculatorSoftware, CHEMAXON_VERSION)
+    try:
+        curveCount = _write([compound], filtered_cxcalcCommands, curveCommands, cache, map, numWriter, ordWriter)
+    finally:
+        cache.close()
     if verbose:
-        print "Creating {} numerical and {} ordinal".format(len(num_to_create), len(ord_to_create))
-    DRP.models.NumMolDescriptorValue.objects.bulk_create(num_to_create)
-    DRP.models.OrdMolDescriptorValue.objects.bulk_create(ord_to_create)
-
-
-def _calculate(compound, descriptorDict, cxcalcCommands, verbose=False, num_to_create=[], ord_to_create=[]):
-    notFound = True
-    if notFound and (compound.smiles is not None and compound.smiles != ''):
-        lecProc = Popen([settings.CHEMAXON_DIR[CHEMAXON_VERSION] + 'cxcalc', compound.smiles,
-                         'leconformer'], stdout=PIPE, stderr=PIPE, close_fds=True)  # lec = lowest energy conformer
-        lecProc.wait()
-        if lecProc.returncode == 0:
-            lec, lecErr = lecProc.communicate()
-            notFound = False
-    if notFound and (compound.INCHI is not None and compound.INCHI != ''):
-        lecProc = Popen([settings.CHEMAXON_DIR[CHEMAXON_VERSION] + 'cxcalc', compound.INCHI,
-                         'leconformer'], stdout=PIPE, stderr=PIPE, close_fds=True)  # lec = lowest energy conformer
-        lecProc.wait()
-        if lecProc.returncode == 0:
-            lec, lecErr = lecProc.communicate()
-            notFound = False
-    if not notFound:
-        # -N ih means leave off the header row and id column
-        calcProc = Popen([settings.CHEMAXON_DIR[CHEMAXON_VERSION] + 'cxcalc', '-N', 'ih', lec] + [x for x in chain(
-            *(command.split(' ') for command in cxcalcCommands.values()))], stdout=PIPE, stderr=PIPE, close_fds=True)
-        calcProc.wait()
-        if calcProc.returncode == 0:
-            res, resErr = calcProc.communicate()
-            if not resErr:
-                resLines = res.split('\n')
-                if len(resLines) == 2:  # last line is blank
-                    resList = resLines[0].split('\t')
-                    commandKeys = cxcalcCommands.keys()
-
-                    if len(resList) == len(commandKeys):
-                        for i in range(len(resList)):
-                            if _descriptorDict[commandKeys[i]]['type'] == 'num':
-                                n = DRP.models.NumMolDescriptorValue(descriptor=descriptorDict[commandKeys[
-                                                                     i]], compound=compound, value=float(resList[i]))
-                                try:
-                                    n.full_clean()
-                                except ValidationError as e:
-                                    warnings.warn('Value {} for compound {} and descriptor {} failed validation. Value set to None. Validation error message: {}'.format(
-                                        n.value, n.compound, n.descriptor, e))
-                                    n.value = None
-                                num_to_create.append(n)
-                            elif _descriptorDict[commandKeys[i]]['type'] == 'ord':
-                                o = DRP.models.OrdMolDescriptorValue(descriptor=descriptorDict[commandKeys[
-                                                                     i]], compound=compound, value=int(resList[i]))
-                                try:
-                                    o.full_clean()
-                                except ValidationError as e:
-                                    warnings.warn('Value {} for compound {} and descriptor {} failed validation. Value set to None. Validation error message: {}'.format(
-                                        o.value, o.compound, o.descriptor, e))
-                                    o.value = None
-                                ord_to_create.append(o)
-                            else:
-                                return ValueError('Descriptor has unrecognized type {}'.format(_descriptorDict[commandKeys[i]]['type']))
-                            # elif _descriptorDict[commandKeys[i]]['type'] == 'bool':
-                                # TODO Not sure whether cxcalc even returns any boolean values, but if it does I don't know how it notates them and they should be coerced correctly
-                                # commenting out this bit since it should be double checked before anyone uses it
-                                # bool_to_create.append(DRP.models.BoolMolDescriptorValue(descriptor=descriptorDict[commandKeys[i]], compound=compound, bool(int(value=resList[i])))
-                            # NOTE: No categorical descriptors are included yet, and since they are more complicated to code I've left it for the moment.
-                            # NOTE: Calculation failure values are not included in the documentation, so I've assumed that it doesn't happen, since we have no way of identifying
-                            # for it other than for the database to push it out
-                            # as a part of validation procedures.
-
-                    else:
-                        raise RuntimeError("Number of cxcalc commands ({}) does not match number of results ({})".format(
-                            len(commandKeys), len(resList)))
-            else:
-                warnings.warn("cxcalc returned error: {}".format(resErr))
+        print cache.report()
+        print numWriter.report()
+        print ordWriter.report()
+        print "pH curves: {} written".format(curveCount)
+
+
+def _write(compounds, cxcalcCommands, curveCommands, cache, mapper, numWriter, ordWriter):
+    """Calculate and write the descriptor values and pH curves of a list of compounds, returning the number of curves written."""
+    allCommands = OrderedDict(cxcalcCommands.items() + curveCommands.items())
+    results = _cachedResults(compounds, allCommands, cache, mapper)
+    num_to_create = []
+    ord_to_create = []
+    curves = {}
+    for compound in compounds:
+        if compound.pk in results:
+            resList = results[compound.pk]
+            if len(resList) != len(allCommands):
+                raise RuntimeError("Number of cxcalc commands ({}) does not match number of results ({})".format(
+                    len(allCommands), len(resList)))
+            _values(compound, descriptorDict, cxcalcCommands, resList[:len(cxcalcCommands)],
+                    num_to_create=num_to_create, ord_to_create=ord_to_create)
+            curves.update(_curves(compound, curveCommands, resList[len(cxcalcCommands):]))
+    numWriter.write(compounds, num_to_create)
+    ordWriter.write(compounds, ord_to_create)
+    return DRP.models.PHCurve.objects.write([compound.pk for compound in compounds],
+                                            set(curveIdentity(heading) for heading, pH in curveCommands.keys()), curves)
+
+
+def _curves(compound, curveCommands, resList):
+    """Return a dictionary of (compound pk, curve identity) to (pHs, values) for a compound's results for curveCommands."""
+    curves = {}
+    for (heading, pH), result in zip(curveCommands.keys(), resList):
+        d = _pHDependentDescriptors[heading]
+        value = float(result)
+        if (d['minimum'] is not None and value < d['minimum']) or (d['maximum'] is not None and value > d['maximum']):
+            warnings.warn('Value {} for compound {} and descriptor {} at pH {} is out of range. Value set to None.'.format(
+                value, compound, heading, pH))
+            value = None
+        pHs, values = curves.setdefault((compound.pk, curveIdentity(heading)), ([], []))
+        pHs.append(pH)
+        values.append(value)
+    return curves
+
+
+def _cachedResults(compounds, cxcalcCommands, cache, mapper):
+    """
+    Return a dictionary of compound pk to cxcalc results, in the order of cxcalcCommands.keys().
+
+    Results are cached by the structure which was passed to cxcalc. They are looked up
+    by the structure a compound is first run with, its smiles or failing that its inchi,
+    and are taken from the cache where every command has been cached for it. The
+    remaining compounds are run once for each (smiles, inchi), in batches mapped over
+    by mapper, and their results are cached.
+    """
+    commands = [cxcalcCommands[k] for k in cxcalcCommands.keys()]
+    structures = {compound.pk: _structures(compound)[1:] for compound in compounds}
+    keys = {pk: smiles or inchi for pk, (smiles, inchi) in structures.items()}
+    cached = cache.get(keys.values(), commands)
+    results = {}
+    pending = {}
+    for compound in compounds:
+        key = keys[compound.pk]
+        if key is not None and all((key, command) in cached for command in commands):
+            results[compound.pk] = [cached[(key, command)] for command in commands]
+        elif key is None or structures[compound.pk] not in pending:
+            pending[compound.pk if key is None else structures[compound.pk]] = compound
+
+    batches = chunked([_structures(compound) for compound in pending.values()], cxcalc_batch_size)
+    calculated = {}
+    for batchResults in mapper(partial(_results, commandArgs=_commandArgs(cxcalcCommands)), batches):
+        calculated.update(batchResults)
+    cache.put({(structure, command): value for pk, (structure, resList) in calculated.items()
+               for command, value in zip(commands, resList)})
+    for compound in compounds:
+        if compound.pk not in results:
+            # compounds sharing their structures share the results of the one which was run
+            pk = compound.pk if keys[compound.pk] is None else pending[structures[compound.pk]].pk
+            if pk in calculated:
+                results[compound.pk] = calculated[pk][1]
+    return results
+
+
+def _structures(compound):
+    """Return the (pk, smiles, inchi) of a compound, with None for any structure it lacks."""
+    return (compound.pk, compound.smiles or None, compound.INCHI or None)
+
+
+def _commandArgs(cxcalcCommands):
+    """Return the cxcalc arguments for the commands, whose results are output in the order of cxcalcCommands.keys()."""
+    return [x for x in chain(*(command.split(' ') for command in cxcalcCommands.values()))]
+
+
+def _cxcalc(args):
+    """Run cxcalc, returning its return code, output and error output."""
+    proc = Popen([settings.CHEMAXON_DIR[CHEMAXON_VERSION] + 'cxcalc'] + args,
+                 stdout=PIPE, stderr=PIPE, close_fds=True)
+    # communicate rather than wait, which can deadlock once a pipe fills
+    out, err = proc.communicate()
+    return proc.returncode, out, err
+
+
+def _run(structures, commandArgs):
+    """
+    Calculate the descriptors for a list of structures with one conformer run and one descriptor run of cxcalc.
+
+    A single structure is passed on the command line; more are passed in files. Return
+    the list of results for each structure, in order, or None and the reason for failure.
+    """
+    directory = None
+    try:
+        if len(structures) == 1:
+            structureArgs = structures
+        else:
+            directory = mkdtemp()
+            structureArgs = [os.path.join(directory, 'structures.smi')]
+            with open(structureArgs[0], 'w') as f:
+                f.write('\n'.join(structures) + '\n')
+        returncode, lec, lecErr = _cxcalc(structureArgs + ['leconformer'])  # lec = lowest energy conformer
+        if returncode != 0:
+            return None, "cxcalc exited with nonzero return code {}".format(returncode)
+        if directory is None:
+            lecArgs = [lec]
+        else:
+            lecArgs = [os.path.join(directory, 'conformers')]
+            with open(lecArgs[0], 'w') as f:
+                f.write(lec)
+        # -N h means leave off the header row, keeping the id column (the index of the structure, from 1)
+        returncode, res, resErr = _cxcalc(['-N', 'h'] + lecArgs + commandArgs)
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory)
+    if returncode != 0:
+        return None, "cxcalc exited with nonzero return code {}".format(returncode)
+    if resErr:
+        return None, "cxcalc returned error: {}".format(resErr)
+    results = [None] * len(structures)
+    for line in res.splitlines():
+        if line:
+            resList = line.split('\t')
+            try:
+                index = int(resList[0]) - 1
+            except ValueError:
+                return None, "cxcalc returned a result without an id: {}".format(line)
+            if not 0 <= index < len(results) or results[index] is not None:
+                return None, "cxcalc returned a result for an unknown structure"
+            results[index] = resList[1:]
+    if any(resList is None for resList in results):
+        return None, "cxcalc returned no result for some structures"
+    return results, None
+
+
+def _results(structures, commandArgs):
+    """
+    Return a dictionary of compound pk to the structure run and its cxcalc results, for a batch of (pk, smiles, inchi) structures.
+
+    The compounds with smiles are run together; if that fails, and for compounds with
+    only an inchi, each compound is run on its own, trying its smiles then its inchi, so
+    that one bad structure only costs its own results.
+    """
+    results = {}
+    batch = [structure for structure in structures if structure[1] is not None]
+    singles = [structure for structure in structures if structure[1] is None]
+    if len(batch) > 1:
+        batchResults, error = _run([smiles for pk, smiles, inchi in batch], commandArgs)
+        if batchResults is None:
+            singles += batch
         else:
-            warnings.warn("cxcalc exited with nonzero return code {}".format(
-                calcProc.returncode))
+            results.update((pk, (smiles, resList)) for (pk, smiles, inchi), resList in zip(batch, batchResults))
     else:
-        warnings.warn("Compound not found")
+        singles += batch
+
+    for pk, smiles, inchi in singles:
+        error = "Compound not found"
+        for structure in (smiles, inchi):
+            if structure is not None:
+                structureResults, error = _run([structure], commandArgs)
+                if structureResults is not None:
+                    results[pk] = (structure, structureResults[0])
+                    break
+        else:
+            warnings.warn(error)
+    return results
+
 
-    return num_to_create, ord_to_create
+def _values(compound, descriptorDict, cxcalcCommands, resList, num_to_create, ord_to_create):
+    """Add the descriptor values for a compound's list of cxcalc results to num_to_create and ord_to_create."""
+    commandKeys = cxcalcCommands.keys()
+    if len(resList) != len(commandKeys):
+        raise RuntimeError("Number of cxcalc commands ({}) does not match number of results ({})".format(
+            len(commandKeys), len(resList)))
+    for i in range(len(resList)):
+        if _descriptorDict[commandKeys[i]]['type'] == 'num':
+            n = DRP.models.NumMolDescriptorValue(descriptor=descriptorDict[commandKeys[
+                                                 i]], compound=compound, value=float(resList[i]))
+            try:
+                n.full_clean()
+            except ValidationError as e:
+                warnings.warn('Value {} for compound {} and descriptor {} failed validation. Value set to None. Validation error message: {}'.format(
+                    n.value, n.compound, n.descriptor, e))
+                n.value = None
+            num_to_create.append(n)
+        elif _descriptorDict[commandKeys[i]]['type'] == 'ord':
+            o = DRP.models.OrdMolDescriptorValue(descriptor=descriptorDict[commandKeys[
+                                                 i]], compound=compound, value=int(resList[i]))
+            try:
+                o.full_clean()
+            except ValidationError as e:
+                warnings.warn('Value {} for compound {} and descriptor {} failed validation. Value set to None. Validation error message: {}'.format(
+                    o.value, o.compound, o.descriptor, e))
+                o.value = None
+            ord_to_create.append(o)
+        else:
+            raise ValueError('Descriptor has unrecognized type {}'.format(_descriptorDict[commandKeys[i]]['type']))
+        # elif _descriptorDict[commandKeys[i]]['type'] == 'bool':
+            # TODO Not sure whether cxcalc even returns any boolean values, but if it does I don't know how it notates them and they should be coerced correctly
+            # commenting out this bit since it should be double checked before anyone uses it
+            # bool_to_create.append(DRP.models.BoolMolDescriptorValue(descriptor=descriptorDict[commandKeys[i]], compound=compound, bool(int(value=resList[i])))
+        # NOTE: No categorical descriptors are included yet, and since they are more complicated to code I've left it for the moment.
+        # NOTE: Calculation failure values are not included in the documentation, so I've assumed that it doesn't happen, since we have no way of identifying
+        # for it other than for the database to push it out
+        # as a part of validation procedures.
@@ -1,7 +1,10 @@
 """DRP calculated descriptors using chemical data from Mathematica."""
-from scipy.stats import gmean
+import numpy as np
 from utils import setup
+from elementTable import ElementTable
 import DRP
+from DRP.models.querysets import chunked, itemCount
+from DRP.models.valueWriter import ValueWriter
 from DRP import chemical_data
 import warnings
 from django.core.exceptions import ValidationError
@@ -33,6 +36,13 @@ for element, info in elements.items():
     if (element == 'Se') or (info['group'] in range(3, 13)) or ((info['group'] > 12) and ((not info['nonmetal']) or info['metalloid'])):
         inorgElements[element] = info
 
+# the element property matrix and stoichiometry vectors, shared by every calculation in this process
+elementTable = ElementTable(elements, inorgAtomicProperties, inorgElements)
+
+groups = range(1, 19)
+periods = range(1, 8)
+valences = range(0, 8)
+
 _descriptorDict = {}
 
 for prop in inorgAtomicProperties:
@@ -63,7 +73,7 @@ for prop in inorgAtomicProperties:
         'minimum': 0,
     }
 
-for group_num in range(1, 19):
+for group_num in groups:
     _descriptorDict['drpInorgAtom_boolean_group_{}'.format(group_num)] = {
         'type': 'bool',
         'name': 'Presence of inorganic elements in group {}'.format(group_num),
@@ -71,7 +81,7 @@ for group_num in range(1, 19):
         'calculatorSoftwareVersion': '1_5',
     }
 
-for period_num in range(1, 8):
+for period_num in periods:
     _descriptorDict['drpInorgAtom_boolean_period_{}'.format(period_num)] = {
         'type': 'bool',
         'name': 'Presence of inorganic elements in period {}'.format(period_num),
@@ -79,7 +89,7 @@ for period_num in range(1, 8):
         'calculatorSoftwareVersion': '1_5',
     }
 
-for valence_num in range(0, 8):
+for valence_num in valences:
     _descriptorDict['drpInorgAtom_boolean_valence_{}'.format(valence_num)] = {
         'type': 'bool',
         'name': 'Presence of inorganic elements with valence {}'.format(valence_num),
@@ -87,7 +97,7 @@ for valence_num in range(0, 8):
         'calculatorSoftwareVersion': '1_5',
     }
 
-for group_num in range(1, 19):
+for group_num in groups:
     _descriptorDict['boolean_group_{}'.format(group_num)] = {
         'type': 'bool',
         'name': 'Presence of elements in group {}'.format(group_num),
@@ -95,7 +105,7 @@ for group_num in range(1, 19):
         'calculatorSoftwareVersion': '1_5',
     }
 
-for period_num in range(1, 8):
+for period_num in periods:
     _descriptorDict['boolean_period_{}'.format(period_num)] = {
         'type': 'bool',
         'name': 'Presence of elements in period {}'.format(period_num),
@@ -119,191 +129,102 @@ def delete_descriptors(compound_set, whitelist=None):
         desc, DRP.models.BoolMolDescriptor)], compound__in=compound_set).delete(recalculate_reactions=False)
 
 
+def _writers(whitelist=None):
+    """Return writers for the numeric and boolean values of the whitelisted descriptors."""
+    descriptors = [descriptorDict[k] for k in descriptorDict.keys() if whitelist is None or k in whitelist]
+    return (ValueWriter(DRP.models.NumMolDescriptorValue, descriptors),
+            ValueWriter(DRP.models.BoolMolDescriptorValue, descriptors))
+
+
 def calculate_many(compound_set, verbose=False, whitelist=None):
-    """Bulk creation of descriptor values."""
-    delete_descriptors(compound_set, whitelist=whitelist)
-    num_vals_to_create = []
-    bool_vals_to_create = []
-    for i, compound in enumerate(compound_set):
+    """Bulk calculation of descriptor values, a chunk of compounds at a time, writing only the values which have changed."""
+    numWriter, boolWriter = _writers(whitelist)
+    compoundCount = itemCount(compound_set) if verbose else None
+    i = 0
+    for compounds in chunked(compound_set, create_threshold):
         if verbose:
-            print "{}; Compound {} ({}/{})".format(compound, compound.pk, i + 1, len(compound_set))
-        num_vals_to_create, bool_vals_to_create = _calculate(
-            compound, num_vals_to_create=num_vals_to_create, bool_vals_to_create=bool_vals_to_create)
-        if len(num_vals_to_create) > create_threshold:
-            if verbose:
-                print 'Creating {} numeric values'.format(len(num_vals_to_create))
-                DRP.models.NumMolDescriptorValue.objects.bulk_create(
-                    num_vals_to_create)
-                num_vals_to_create = []
-        if len(bool_vals_to_create) > create_threshold:
-            if verbose:
-                print 'Creating {} boolean values'.format(len(bool_vals_to_create))
-            DRP.models.BoolMolDescriptorValue.objects.bulk_create(
-                bool_vals_to_create)
-            bool_vals_to_create = []
-
+            print "Calculating for compounds {}-{} of {}".format(i + 1, i + len(compounds), compoundCount)
+        i += len(compounds)
+        num_vals_to_create, bool_vals_to_create = _calculate(compounds, whitelist=whitelist)
+        numWriter.write(compounds, num_vals_to_create)
+        boolWriter.write(compounds, bool_vals_to_create)
     if verbose:
-        print 'Creating {} numeric values'.format(len(num_vals_to_create))
-    DRP.models.NumMolDescriptorValue.objects.bulk_create(num_vals_to_create)
-    if verbose:
-        print 'Creating {} boolean values'.format(len(bool_vals_to_create))
-    DRP.models.BoolMolDescriptorValue.objects.bulk_create(bool_vals_to_create)
+        print numWriter.report()
+        print boolWriter.report()
 
 
-def calculate(compound):
+def calculate(compound, verbose=False, whitelist=None):
     """Calculation of descriptor values."""
-    delete_descriptors([compound])
-    num_vals_to_create, bool_vals_to_create = _calculate(compound)
-    DRP.models.NumMolDescriptorValue.objects.bulk_create(num_vals_to_create)
-    if verbose:
-        print 'Creating {} numeric values'.format(len(num_vals_to_create))
-    DRP.models.NumMolDescriptorValue.objects.bulk_create(num_vals_to_create)
+    numWriter, boolWriter = _writers(whitelist)
+    num_vals_to_create, bool_vals_to_create = _calculate([compound], whitelist=whitelist)
+    numWriter.write([compound], num_vals_to_create)
+    boolWriter.write([compound], bool_vals_to_create)
     if verbose:
-        print 'Creating {} boolean values'.format(len(bool_vals_to_create))
-    DRP.models.BoolMolDescriptorValue.objects.bulk_create(bool_vals_to_create)
+        print numWriter.report()
+        print boolWriter.report()
 
 
-def _calculate(compound, verbose=False, whitelist=None, num_vals_to_create=[], bool_vals_to_create=[]):
+def _wanted(heading, whitelist):
+    """Return True if a heading is to be calculated."""
+    return whitelist is None or heading in whitelist
 
+
+def _calculate(compounds, whitelist=None):
+    """Return the numeric and boolean descriptor values for a list of compounds, calculated for all of them at once."""
     num = DRP.models.NumMolDescriptorValue
     boolVal = DRP.models.BoolMolDescriptorValue
-
-    if any(element in inorgElements for element in compound.elements):
-        inorgElementNormalisationFactor = sum(
-            info['stoichiometry'] for element, info in compound.elements.items() if element in inorgElements)
-        for prop in inorgAtomicProperties:
-            heading = 'drpInorgAtom{}_geom_unw'.format(
-                prop.title().replace('_', ''))
-            if whitelist is None or heading in whitelist:
-                # zero is what scipy does natively. This is just to avoid
-                # warnings that are fine so they don't drown out the real ones
-                if any([(inorgElements[element][prop] == 0) for element, info in compound.elements.items() if element in inorgElements]):
-                    val = 0
-                elif any([(inorgElements[element][prop] < 0) for element, info in compound.elements.items() if element in inorgElements]):
-                    raise ValueError('Cannot take geometric mean of negative values. This descriptor ({}) should not use a geometric mean.'.format(
-                        descriptorDict['drpInorgAtom{}_geom_unw'.format(prop.title().replace('_', ''))]))
-                else:
-                    val = gmean([inorgElements[element][
-                                prop] for element in compound.elements if element in inorgElements])
-                n = num(
-                    compound=compound,
-                    descriptor=descriptorDict[heading],
-                    value=val
-                )
-                try:
-                    n.full_clean()
-                except ValidationError as e:
-                    warnings.warn('Value {} for compound {} and descriptor {} failed validation. Value set to none. Validation error message: {}'.format(
-                        n.value, n.compound, n.descriptor, e.message))
-                    n.value = None
-                num_vals_to_create.append(n)
-
-            heading = 'drpInorgAtom{}_geom_stoich'.format(
-                prop.title().replace('_', ''))
-            if whitelist is None or heading in whitelist:
-                if any([(inorgElements[element][prop] * float(info['stoichiometry'] / inorgElementNormalisationFactor) == 0) for element, info in compound.elements.items() if element in inorgElements]):
-                    val = 0
-                elif any([(inorgElements[element][prop] * float(info['stoichiometry'] / inorgElementNormalisationFactor) < 0) for element, info in compound.elements.items() if element in inorgElements]):
-                    raise ValueError('Cannot take geometric mean of negative values. This descriptor ({}) should not use a geometric mean.'.format(
-                        descriptorDict['drpInorgAtom{}_geom_stoich'.format(prop.title().replace('_', ''))]))
-                else:
-                    val = gmean([inorgElements[element][prop] * float(info['stoichiometry'] / inorgElementNormalisationFactor)
-                                 for element, info in compound.elements.items() if element in inorgElements])
-                n = num(
-                    compound=compound,
-                    descriptor=descriptorDict[heading],
-                    value=val,
-                )
-                try:
-                    n.full_clean()
-                except ValidationError as e:
-                    warnings.warn('Value {} for compound {} and descriptor {} failed validation. Value set to none. Validation error message: {}'.format(
-                        n.value, n.compound, n.descriptor, e.message))
-                    n.value = None
-                num_vals_to_create.append(n)
-
-            heading = 'drpInorgAtom{}_max'.format(
-                prop.title().replace('_', ''))
-            if whitelist is None or heading in whitelist:
-                val = max(inorgElements[element][
-                          prop] for element in compound.elements if element in inorgElements)
-                n = num(
-                    compound=compound,
-                    descriptor=descriptorDict[heading],
-                    value=val
-                )
-                try:
-                    n.full_clean()
-                except ValidationError as e:
-                    warnings.warn('Value {} for compound {} and descriptor {} failed validation. Value set to none. Validation error message: {}'.format(
-                        n.value, n.compound, n.descriptor, e.message))
-                    n.value = None
-                num_vals_to_create.append(n)
-
-            heading = 'drpInorgAtom{}_range'.format(
-                prop.title().replace('_', ''))
-            if whitelist is None or heading in whitelist:
-                val = max(inorgElements[element][prop] for element in compound.elements if element in inorgElements) - min(
-                    inorgElements[element][prop] for element in compound.elements if element in inorgElements)
-                n = num(
-                    compound=compound,
-                    descriptor=descriptorDict[heading],
-                    value=val,
-                )
+    num_vals_to_create = []
+    bool_vals_to_create = []
+    parsed = []
+    for compound in compounds:
+        try:
+            elementTable.stoichiometry(compound)
+        except ValueError as e:
+            warnings.warn('Descriptors for compound {} not calculated: {}'.format(compound, e))
+        else:
+            parsed.append(compound)
+    compounds = parsed
+    stoichiometries = elementTable.stoichiometries(compounds)
+
+    aggregates = elementTable.aggregates(stoichiometries)
+    inorganic = aggregates['inorganic']
+    for k, prop in enumerate(inorgAtomicProperties):
+        stem = 'drpInorgAtom' + prop.title().replace('_', '')
+        for aggregate in ('geom_unw', 'geom_stoich', 'max', 'range'):
+            heading = '{}_{}'.format(stem, aggregate)
+            if not _wanted(heading, whitelist):
+                continue
+            descriptor = descriptorDict[heading]
+            if aggregate.startswith('geom') and aggregates[aggregate.replace('geom', 'negative')][:, k].any():
+                raise ValueError(
+                    'Cannot take geometric mean of negative values. This descriptor ({}) should not use a geometric mean.'.format(descriptor))
+            values = aggregates[aggregate][:, k]
+            for i, compound in enumerate(compounds):
+                if not inorganic[i]:
+                    continue
+                n = num(compound=compound, descriptor=descriptor,
+                        value=None if np.isnan(values[i]) else float(values[i]))
                 try:
-                    n.full_clean()
+                    n.clean()
                 except ValidationError as e:
                     warnings.warn('Value {} for compound {} and descriptor {} failed validation. Value set to none. Validation error message: {}'.format(
                         n.value, n.compound, n.descriptor, e.message))
                     n.value = None
                 num_vals_to_create.append(n)
 
-    # inorganic elements only
-    for group_num in range(1, 19):
-        heading = 'drpInorgAtom_boolean_group_{}'.format(group_num)
-        if whitelist is None or heading in whitelist:
-            bool_vals_to_create.append(boolVal(
-                compound=compound,
-                descriptor=descriptorDict[heading],
-                value=(any(elements[element]['group'] == group_num for element in compound.elements.keys(
-                ) if element in inorgElements))
-            ))
-    for period_num in range(1, 8):
-        heading = 'drpInorgAtom_boolean_period_{}'.format(period_num)
-        if whitelist is None or heading in whitelist:
-            bool_vals_to_create.append(boolVal(
-                compound=compound,
-                descriptor=descriptorDict[heading],
-                value=(any(elements[element]['period'] == period_num for element in compound.elements.keys(
-                ) if element in inorgElements))
-            ))
-    for valence_num in range(0, 8):
-        heading = 'drpInorgAtom_boolean_valence_{}'.format(valence_num)
-        if whitelist is None or heading in whitelist:
-            bool_vals_to_create.append(boolVal(
-                compound=compound,
-                descriptor=descriptorDict[heading],
-                value=(any(elements[element]['valence'] == valence_num for element in compound.elements.keys(
-                ) if element in inorgElements))
-            ))
-    # all elements
-    for group_num in range(1, 19):
-        heading = 'boolean_group_{}'.format(group_num)
-        if whitelist is None or heading in whitelist:
-            bool_vals_to_create.append(boolVal(
-                compound=compound,
-                descriptor=descriptorDict[heading],
-                value=(any(elements[element][
-                       'group'] == group_num for element in compound.elements.keys()))
-            ))
-    for period_num in range(1, 8):
-        heading = 'boolean_period_{}'.format(period_num)
-        if whitelist is None or heading in whitelist:
-            bool_vals_to_create.append(boolVal(
-                compound=compound,
-                descriptor=descriptorDict[heading],
-                value=(any(elements[element][
-                       'period'] == period_num for element in compound.elements.keys()))
-            ))
+    for stem, attribute, levels, inorganicOnly in (
+            ('drpInorgAtom_boolean_group', 'group', groups, True),
+            ('drpInorgAtom_boolean_period', 'period', periods, True),
+            ('drpInorgAtom_boolean_valence', 'valence', valences, True),
+            ('boolean_group', 'group', groups, False),
+            ('boolean_period', 'period', periods, False)):
+        headings = ['{}_{}'.format(stem, level) for level in levels]
+        if not any(_wanted(heading, whitelist) for heading in headings):
+            continue
+        presence = elementTable.presence(stoichiometries, attribute, levels, inorganicOnly=inorganicOnly)
+        for j, heading in enumerate(headings):
+            if _wanted(heading, whitelist):
+                bool_vals_to_create += [boolVal(compound=compound, descriptor=descriptorDict[heading], value=bool(presence[i, j]))
+                                        for i, compound in enumerate(compounds)]
 
     return num_vals_to_create, bool_vals_to_create
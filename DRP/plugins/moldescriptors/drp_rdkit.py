@@ -2,8 +2,13 @@
 # I wanted to name this module rdkit, but then we get name conflicts...
 # lol python
 from utils import setup
+from calculatorCache import CalculatorCache
+from django.core.exceptions import ValidationError
+import rdkit
 import rdkit.Chem
 import DRP
+import warnings
+from DRP.models.querysets import batched, itemCount
 
 calculatorSoftware = 'DRP_rdkit'
 
@@ -18,18 +23,37 @@ pt = rdkit.Chem.GetPeriodicTable()
 
 def calculate_many(compound_set, verbose=False, whitelist=None):
     """Calculate in bulk."""
-    for i, compound in enumerate(compound_set):
-        if verbose:
-            print "{}; Compound {} ({}/{})".format(compound, compound.pk, i + 1, len(compound_set))
-        calculate(compound, verbose=verbose, whitelist=whitelist)
+    compoundCount = itemCount(compound_set) if verbose else None
+    cache = CalculatorCache(calculatorSoftware, rdkit.__version__)
+    try:
+        for i, compound in enumerate(batched(compound_set)):
+            if verbose:
+                print "{}; Compound {} ({}/{})".format(compound, compound.pk, i + 1, compoundCount)
+            calculate(compound, verbose=verbose, whitelist=whitelist, cache=cache)
+    finally:
+        cache.close()
+    if verbose:
+        print cache.report()
 
 
-def calculate(compound, verbose=False, whitelist=None):
-    """Calculate the descriptors from this plugin for a compound."""
+def calculate(compound, verbose=False, whitelist=None, cache=None):
+    """Calculate the descriptors from this plugin for a compound, taking values from the calculator cache where it has them."""
     heading = 'mw'
     if whitelist is None or heading in whitelist:
-        mw = sum(pt.GetAtomicWeight(pt.GetAtomicNumber(str(element))) * float(
-            compound.elements[element]['stoichiometry']) for element in compound.elements)
+        # the descriptor version is part of the command, so that a change of method is not served stale results
+        command = '{} {}'.format(heading, _descriptorDict[heading]['calculatorSoftwareVersion'])
+        # mw is calculated from the formula, so that is what it is cached by
+        structure = compound.formula or None
+        mw = None if cache is None else cache.get([structure], [command]).get((structure, command))
+        if mw is None:
+            try:
+                mw = sum(pt.GetAtomicWeight(pt.GetAtomicNumber(str(element))) * float(info['stoichiometry'])
+                         for element, info in compound.elements.items())
+            except ValueError as e:
+                warnings.warn('Molecular weight for compound {} not calculated: {}'.format(compound, e))
+            else:
+                if cache is not None:
+                    cache.put({(structure, command): mw})
 
         v = DRP.models.NumMolDescriptorValue.objects.update_or_create(
             defaults={'value': mw}, descriptor=descriptorDict[heading], compound=compound)[0]
@@ -0,0 +1,115 @@
+"""
+Element properties held as arrays, for calculating descriptors from the elements of many compounds at once.
+
+The properties of every element are laid out once in an element x property matrix,
+and each compound's formula is parsed once into a stoichiometry vector over the same
+elements, so aggregating a property over the elements of a set of compounds is a
+handful of array operations on a compounds x elements stoichiometry matrix.
+"""
+import numpy as np
+
+# The number of stoichiometry vectors to memoise before the memo is cleared
+MEMO_SIZE = 10000
+
+
+class ElementTable(object):
+
+    """
+    The properties of a set of elements, and the stoichiometry vectors of compounds over those elements.
+
+    Properties which are not known for an element are held as nan, and integer
+    attributes (group, period, valence and so on) which are not known as -1.
+    """
+
+    def __init__(self, elements, properties, inorganic=(), memoSize=MEMO_SIZE):
+        """
+        Set up the table from a dictionary of element to its information, the numeric properties to aggregate, and the inorganic elements.
+
+        At most memoSize stoichiometry vectors are memoised, as a table may live as long as its process.
+        """
+        self.elements = elements
+        self.symbols = sorted(elements)
+        self.columns = {symbol: j for j, symbol in enumerate(self.symbols)}
+        self.properties = list(properties)
+        self.propertyValues = np.array([[np.nan if elements[symbol][prop] is None else elements[symbol][prop]
+                                         for symbol in self.symbols] for prop in self.properties], dtype=np.float64)
+        """A properties x elements array of the value of each property for each element."""
+        self.inorganic = np.array([symbol in inorganic for symbol in self.symbols], dtype=bool)
+        self._attributes = {}
+        self._vectors = {}
+        self.memoSize = memoSize
+
+    def _attribute(self, attribute):
+        """Return an integer array of an attribute of each element, memoised."""
+        if attribute not in self._attributes:
+            self._attributes[attribute] = np.array([-1 if self.elements[symbol][attribute] is None else self.elements[symbol][attribute]
+                                                    for symbol in self.symbols], dtype=np.int64)
+        return self._attributes[attribute]
+
+    def stoichiometry(self, compound):
+        """Return the number of atoms of each element in a compound, memoised by formula so that each formula is parsed once."""
+        if compound.formula not in self._vectors:
+            vector = np.zeros(len(self.symbols), dtype=np.float64)
+            for element, info in compound.elements.items():
+                if element not in self.columns:
+                    raise ValueError('Compound {} contains the unknown element {}'.format(compound, element))
+                vector[self.columns[element]] = float(info['stoichiometry'])
+            if len(self._vectors) >= self.memoSize:
+                self._vectors.clear()
+            self._vectors[compound.formula] = vector
+        return self._vectors[compound.formula]
+
+    def stoichiometries(self, compounds):
+        """Return a compounds x elements array of the stoichiometry of each of a list of compounds."""
+        matrix = np.zeros((len(compounds), len(self.symbols)), dtype=np.float64)
+        for i, compound in enumerate(compounds):
+            matrix[i] = self.stoichiometry(compound)
+        return matrix
+
+    def presence(self, stoichiometries, attribute, levels, inorganicOnly=False):
+        """Return a compounds x levels boolean array of whether each compound has an element (optionally an inorganic one) whose attribute is each level."""
+        present = stoichiometries > 0
+        if inorganicOnly:
+            present &= self.inorganic
+        oneHot = (self._attribute(attribute)[:, np.newaxis] == np.array(levels)).astype(np.int64)
+        return present.astype(np.int64).dot(oneHot) > 0
+
+    def aggregates(self, stoichiometries):
+        """
+        Return aggregates of each property over the inorganic elements of each compound.
+
+        The result is a dictionary of compounds x properties arrays: 'geom_unw' and 'geom_stoich'
+        are the geometric means of the property, unweighted and weighted by the fraction of the
+        inorganic atoms of each element, and 'max' and 'range' the maximum and range. Each is nan
+        where a compound has no inorganic elements, or one of them has no value for the property.
+        Geometric means of values including a negative one (and no zero) are nan too, and
+        flagged in 'negative_unw' and 'negative_stoich'. 'inorganic' says which compounds have inorganic elements.
+        """
+        present = (stoichiometries > 0) & self.inorganic
+        counts = present.sum(axis=1)
+        inorganic = counts > 0
+        mask = present[:, np.newaxis, :]
+        values = self.propertyValues[np.newaxis, :, :]
+        missing = (mask & np.isnan(values)).any(axis=2) | ~inorganic[:, np.newaxis]
+        inorganicAtoms = np.where(present, stoichiometries, 0).sum(axis=1)
+        weights = np.where(present, stoichiometries, 0) / np.where(inorganic, inorganicAtoms, 1)[:, np.newaxis]
+
+        results = {'inorganic': inorganic}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for name, terms in (('unw', values), ('stoich', values * weights[:, np.newaxis, :])):
+                terms = np.where(mask, terms, 1)
+                zero = (mask & (terms == 0)).any(axis=2)
+                negative = (mask & (terms < 0)).any(axis=2)
+                means = np.exp(np.where(terms > 0, np.log(terms), 0).sum(axis=2) / np.maximum(counts, 1)[:, np.newaxis])
+                means[negative] = np.nan
+                # zero is what scipy's gmean gives for any zero term, negative or not
+                means[zero] = 0
+                means[missing] = np.nan
+                results['geom_' + name] = means
+                results['negative_' + name] = negative & ~zero & ~missing
+            maxima = np.where(mask, values, -np.inf).max(axis=2)
+            minima = np.where(mask, values, np.inf).min(axis=2)
+        maxima[missing] = np.nan
+        results['max'] = maxima
+        results['range'] = maxima - np.where(missing, np.nan, minima)
+        return results
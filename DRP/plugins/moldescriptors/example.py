@@ -1,6 +1,7 @@
 """An example molecular descriptor plugin to demonstrate the 'shape' that the API requires."""
 from utils import setup
 import DRP
+from DRP.models.querysets import batched, itemCount
 from django.core.exceptions import ValidationError
 import warnings
 
@@ -37,9 +38,10 @@ def arbValCalc(compound):
 
 def calculate_many(compound_set, verbose=False, whitelist=None):
     """Batch calculation."""
-    for i, compound in enumerate(compound_set):
+    compoundCount = itemCount(compound_set) if verbose else None
+    for i, compound in enumerate(batched(compound_set)):
         if verbose:
-            print "{}; Compound {} ({}/{})".format(compound, compound.pk, i + 1, len(compound_set))
+            print "{}; Compound {} ({}/{})".format(compound, compound.pk, i + 1, compoundCount)
         calculate(compound, verbose=verbose, whitelist=whitelist)
 
 
@@ -1,6 +1,6 @@
 """A utilities module for helping with molecular descriptor plugins."""
 import DRP
-from django.db import transaction
+from DRP.models.descriptors import defineDescriptors
 
 
 class LazyDescDict(object):
@@ -13,60 +13,15 @@ class LazyDescDict(object):
         self.descDict = descDict
         self.initialised = False
 
-    @transaction.atomic
     def initialise(self, descDict):
-        """Initialise the dictionary in a lazy way."""
+        """Initialise the dictionary in a lazy way, with one query for each type of descriptor."""
         if not self.initialised:
-            for k, v in descDict.items():
-                args = v.copy()
-                del args['type']
-                args['heading'] = k
-                fetchArgs = {k: v for k, v in args.items() if k in (
-                    'heading', 'calculatorSoftware', 'calculatorSoftwareVersion')}
-                if v['type'] == 'num':
-                    try:
-                        # why are we setting internal dict then immediately
-                        # resetting it?
-                        self.internalDict[k] = DRP.models.NumMolDescriptor.objects.filter(
-                            **fetchArgs).update(**args)
-                        self.internalDict[
-                            k] = DRP.models.NumMolDescriptor.objects.get(**fetchArgs)
-                    except DRP.models.NumMolDescriptor.DoesNotExist:
-                        self.internalDict[
-                            k] = DRP.models.NumMolDescriptor.objects.create(**args)
-                elif v['type'] == 'bool':
-                    try:
-                        self.internalDict[k] = DRP.models.BoolMolDescriptor.objects.filter(
-                            **fetchArgs).update(**args)
-                        self.internalDict[
-                            k] = DRP.models.BoolMolDescriptor.objects.get(**fetchArgs)
-                    except DRP.models.BoolMolDescriptor.DoesNotExist:
-                        self.internalDict[
-                            k] = DRP.models.BoolMolDescriptor.objects.create(**args)
-                elif v['type'] == 'ord':
-                    try:
-                        self.internalDict[k] = DRP.models.OrdMolDescriptor.objects.filter(
-                            **fetchArgs).update(**args)
-                        self.internalDict[
-                            k] = DRP.models.OrdMolDescriptor.objects.get(**fetchArgs)
-                    except DRP.models.OrdMolDescriptor.DoesNotExist:
-                        self.internalDict[
-                            k] = DRP.models.OrdMolDescriptor.objects.create(**args)
-                elif v['type'] == 'cat':
-                    del args['permittedValues']
-                    try:
-                        DRP.models.CatMolDescriptor.objects.filter(
-                            **fetchArgs).update(**args)
-                        self.internalDict[
-                            k] = DRP.models.CatMolDescriptor.objects.get(**fetchArgs)
-                    except DRP.models.CatMolDescriptor.DoesNotExist:
-                        self.internalDict[
-                            k] = DRP.models.CatMolDescriptor.objects.create(**args)
-                    for permittedValue in v['permittedValues']:
-                        perm = DRP.models.CategoricalDescriptorPermittedValue.objects.get_or_create(
-                            value=permittedValue, descriptor=self.internalDict[k])[0]
-                else:
-                    raise RuntimeError("Invalid descriptor type provided")
+            self.internalDict.update(defineDescriptors(descDict, {
+                'num': DRP.models.NumMolDescriptor,
+                'bool': DRP.models.BoolMolDescriptor,
+                'ord': DRP.models.OrdMolDescriptor,
+                'cat': DRP.models.CatMolDescriptor,
+            }))
             self.initialised = True
 
     def __len__(self):
@@ -0,0 +1,134 @@
+"""
+An in-memory table of the compounds in a set of reactions, for calculating reaction descriptors a set at a time.
+
+The molecular descriptor values of every compound in the reactions are loaded with
+one query per descriptor type into compound x descriptor arrays, and the compound
+quantities of every reaction with one more, so that aggregating over the compounds
+in a reaction needs no further queries. The pH curves of the compounds are resampled
+onto a common grid of pH, so that values at the pH of each reaction can be interpolated
+for every compound in a role at once.
+"""
+import DRP
+import numpy as np
+from DRP.models.PHCurve import interpolate
+from itertools import groupby
+import warnings
+
+# The number of compounds to name in each IN clause when loading descriptor values
+FETCH_SIZE = 1000
+
+
+def _array(rows, columns):
+    """Return a rows x columns float array full of nan."""
+    array = np.empty((rows, columns), dtype=np.float64)
+    array.fill(np.nan)
+    return array
+
+
+class CompoundTable(object):
+
+    """
+    The compound quantities of a set of reactions, and the descriptor values and elements of their compounds.
+
+    Descriptor values are held in float arrays with a row per compound, in the order of
+    compoundIds, and a column per descriptor, in the order of descriptors[kind]. Boolean
+    values are held as 0 or 1, categorical values as the primary key of the permitted value,
+    and missing or null values as nan.
+    """
+
+    kinds = (
+        ('num', 'NumMolDescriptor', 'NumMolDescriptorValue', 'value'),
+        ('ord', 'OrdMolDescriptor', 'OrdMolDescriptorValue', 'value'),
+        ('bool', 'BoolMolDescriptor', 'BoolMolDescriptorValue', 'value'),
+        ('cat', 'CatMolDescriptor', 'CatMolDescriptorValue', 'value_id'),
+    )
+
+    def __init__(self, reactions, elements=(), pHCurves=()):
+        """
+        Load the quantities for the reactions and the descriptor values, stoichiometries (for elements) and pH curves of their compounds.
+
+        pHCurves are the (heading, calculatorSoftware, calculatorSoftwareVersion) identities of the pH curves to load.
+        """
+        self.quantities = {}
+        """A dictionary of reaction pk to the (compound row, role pk, amount) of each of its compound quantities."""
+        quantities = DRP.models.CompoundQuantity.objects.filter(reaction__in=[reaction.pk for reaction in reactions]).order_by(
+            'reaction', 'pk').values_list('reaction_id', 'compound_id', 'role_id', 'amount')
+        quantities = list(quantities)
+        self.compoundIds = sorted(set(compoundId for reactionId, compoundId, roleId, amount in quantities))
+        self.rows = {compoundId: i for i, compoundId in enumerate(self.compoundIds)}
+        for reactionId, reactionQuantities in groupby(quantities, lambda quantity: quantity[0]):
+            self.quantities[reactionId] = [(self.rows[compoundId], roleId, amount)
+                                           for reactionId, compoundId, roleId, amount in reactionQuantities]
+
+        self.descriptors = {}
+        self.values = {}
+        for kind, descriptorClass, valueClass, field in self.kinds:
+            descriptors = list(getattr(DRP.models, descriptorClass).objects.all().order_by('pk'))
+            columns = {descriptor.pk: j for j, descriptor in enumerate(descriptors)}
+            values = _array(len(self.compoundIds), len(descriptors))
+            if descriptors:
+                for start in range(0, len(self.compoundIds), FETCH_SIZE):
+                    for compoundId, descriptorId, value in getattr(DRP.models, valueClass).objects.filter(
+                            compound__in=self.compoundIds[start:start + FETCH_SIZE]).values_list('compound_id', 'descriptor_id', field):
+                        if value is not None:
+                            values[self.rows[compoundId], columns[descriptorId]] = value
+            self.descriptors[kind] = descriptors
+            self.values[kind] = values
+
+        self.elements = list(elements)
+        self.stoichiometry = np.zeros((len(self.compoundIds), len(self.elements)), dtype=np.float64)
+        """The number of atoms of each of elements in each compound, or nan for a compound whose formula is malformed."""
+        if self.elements:
+            # imported here to avoid a circular import
+            from DRP.models.Compound import loadStoichiometry, parseFormula
+            columns = {element: j for j, element in enumerate(self.elements)}
+            for start in range(0, len(self.compoundIds), FETCH_SIZE):
+                for compoundId, formula, stoichiometry in DRP.models.Compound.objects.filter(
+                        pk__in=self.compoundIds[start:start + FETCH_SIZE]).values_list('pk', 'formula', 'stoichiometry'):
+                    # the formula is only parsed for compounds saved before the stoichiometry was stored
+                    try:
+                        counts = loadStoichiometry(stoichiometry) if stoichiometry else parseFormula(formula)
+                    except ValueError as e:
+                        warnings.warn('Elements of compound {} unknown: {}'.format(compoundId, e))
+                        self.stoichiometry[self.rows[compoundId]] = np.nan
+                        continue
+                    for element, count in counts.items():
+                        if element in columns:
+                            self.stoichiometry[self.rows[compoundId], columns[element]] = float(count)
+
+        self.pHCurves = list(pHCurves)
+        """The identities of the pH curves, in the order of the second axis of curveValues."""
+        self.reactionPHs = {}
+        """A dictionary of reaction pk to the reaction pH, for the reactions which have one."""
+        self.pHGrid = np.zeros(0, dtype=np.float64)
+        self.curveValues = np.zeros((len(self.compoundIds), len(self.pHCurves), 0), dtype=np.float64)
+        """The value of each of pHCurves for each compound at each pH in pHGrid, or nan outside the curve's range."""
+        if self.pHCurves:
+            self.reactionPHs = dict(DRP.models.NumRxnDescriptorValue.objects.filter(
+                reaction__in=[reaction.pk for reaction in reactions], descriptor__heading='reaction_pH').values_list('reaction_id', 'value'))
+            columns = {identity: j for j, identity in enumerate(self.pHCurves)}
+            curves = []
+            for start in range(0, len(self.compoundIds), FETCH_SIZE):
+                curves += [curve for curve in DRP.models.PHCurve.objects.filter(
+                    compound__in=self.compoundIds[start:start + FETCH_SIZE],
+                    heading__in=set(identity[0] for identity in self.pHCurves)) if curve.identity in columns]
+            self.pHGrid = np.array(sorted(set(pH for curve in curves for pH in curve.pHs.tolist())), dtype=np.float64)
+            self.curveValues = np.empty((len(self.compoundIds), len(self.pHCurves), len(self.pHGrid)), dtype=np.float64)
+            self.curveValues.fill(np.nan)
+            for curve in curves:
+                self.curveValues[self.rows[curve.compound_id], columns[curve.identity]] = interpolate(
+                    curve.pHs, curve.values, self.pHGrid)
+
+    def pHValues(self, rows, pH):
+        """Return a len(rows) x len(pHCurves) array of the curves of the compounds at the given rows, interpolated at pH."""
+        values = _array(len(rows), len(self.pHCurves))
+        grid = self.pHGrid
+        if pH is None or not len(grid) or pH < grid[0] or pH > grid[-1]:
+            return values
+        curves = self.curveValues[rows]
+        upper = int(np.searchsorted(grid, pH))
+        if grid[upper] == pH:
+            # exactly at a point, so the neighbouring point (which may be missing) plays no part
+            return curves[:, :, upper]
+        t = (pH - grid[upper - 1]) / (grid[upper] - grid[upper - 1])
+        return curves[:, :, upper - 1] * (1 - t) + curves[:, :, upper] * t
@@ -1,13 +1,19 @@
 """Basic reaction descriptors calculation module."""
 import DRP
-from itertools import chain
+from itertools import chain, izip
+import numpy as np
 from numpy import mean, average as wmean
 from scipy.stats import gmean
 from django.db.models import Sum
 from utils import setup
+from DRP.models.querysets import chunked, itemCount
+from DRP.models.rxnDescriptorValues import withoutStorageDefaults
+from DRP.models.valueWriter import ValueWriter
+from DRP.models import headerRegistry
+from compoundTable import CompoundTable
 import xxhash
 import warnings
-from DRP.plugins.moldescriptors.chemaxon import _pHDependentDescriptors
+from DRP.plugins.moldescriptors.chemaxon import _pHDependentDescriptors, curveIdentity
 
 elements = DRP.chemical_data.elements
 
@@ -15,25 +21,75 @@ calculatorSoftware = 'DRP'
 # number of values to create at a time. Should probably be <= 5000
 create_threshold = 5000
 
-_descriptorDict = {}
+_elementDescriptorDict = {}
 
 # The following adds descriptors to the dictionary in an automated way to
 # save on voluminous code
 
 for element in elements:
-    _descriptorDict[element + '_mols'] = {
+    _elementDescriptorDict[element + '_mols'] = {
         'type': 'num',
         'name': 'Mols of {} in a reaction.'.format(element),
         'calculatorSoftware': calculatorSoftware,
         'calculatorSoftwareVersion': '0_02',
         'maximum': None,
         'minimum': 0,
+        'storageDefault': 0,
     }
 
 
-# descriptors for generalised aggregation across compound roles
+_madeDicts = {}
+
+
 def make_dict():
+    """
+    Return the initialised dictionary of descriptors and the reaction pH descriptors.
+
+    Both depend only on the compound roles and molecular descriptors, so their definitions are
+    memoised per process against the definition version and rebuilt only when a definition changes.
+    The descriptors themselves are fetched afresh on each call, and if any has gone, as when it was
+    created in a transaction which was rolled back, the definitions are rebuilt too.
+    """
+    version = headerRegistry.definitionVersion()
+    if version in _madeDicts:
+        descDict, _reaction_pH_Descriptors = _madeDicts[version]
+        descriptors = _fetch(descDict)
+        if descriptors is not None:
+            descriptorDict = setup(descDict)
+            descriptorDict.internalDict.update(descriptors)
+            descriptorDict.initialised = True
+            return descriptorDict, _reaction_pH_Descriptors
+        # anything else cached under this version may also describe the rolled back definitions
+        headerRegistry.bumpDefinitionVersion()
+    descriptorDict, _reaction_pH_Descriptors = _make_dict()
+    descDict = descriptorDict.descDict
+    descriptorDict.initialise(descDict)
+    _madeDicts.clear()
+    # initialising may itself have created descriptors, and so started a new version
+    _madeDicts[headerRegistry.definitionVersion()] = (descDict, _reaction_pH_Descriptors)
+    return descriptorDict, _reaction_pH_Descriptors
+
+
+def _fetch(descDict):
+    """Return a dictionary of heading to descriptor for descDict, with one query for each type, or None if any descriptor is missing."""
+    descriptors = {}
+    for descriptorType, descriptorClass in (('num', DRP.models.NumRxnDescriptor), ('bool', DRP.models.BoolRxnDescriptor)):
+        existing = {(descriptor.heading, descriptor.calculatorSoftwareVersion): descriptor
+                    for descriptor in descriptorClass.objects.filter(calculatorSoftware=calculatorSoftware)}
+        for heading, definition in descDict.items():
+            if definition['type'] == descriptorType:
+                descriptor = existing.get((heading, definition['calculatorSoftwareVersion']))
+                if descriptor is None:
+                    return None
+                descriptors[heading] = descriptor
+    return descriptors
+
+
+# descriptors for generalised aggregation across compound roles
+def _make_dict():
     """Make a dictionary of descriptors based on known patterns."""
+    # start from the element descriptors alone, so that roles and descriptors which have gone are left out
+    _descriptorDict = _elementDescriptorDict.copy()
     _reaction_pH_Descriptors = {}
     weightings = ('molarity', 'count')
     for compoundRole in DRP.models.CompoundRole.objects.all():
@@ -45,6 +101,7 @@ def make_dict():
                 'calculatorSoftwareVersion': '0_02',
                 'maximum': None,
                 'minimum': 0,
+                'storageDefault': 0,
             }
         for descriptor in DRP.models.CatMolDescriptor.objects.all():
             for w in weightings:
@@ -57,6 +114,7 @@ def make_dict():
                         'calculatorSoftwareVersion': '0_02',
                         'maximum': None,
                         'minimum': 0,
+                        'storageDefault': 0,
                     }
         for descriptor in DRP.models.OrdMolDescriptor.objects.all():
             for w in weightings:
@@ -70,6 +128,7 @@ def make_dict():
                         'calculatorSoftwareVersion': '0_02',
                         'maximum': None,
                         'minimum': 0,
+                        'storageDefault': 0,
                     }
         for descriptor in DRP.models.BoolMolDescriptor.objects.all():
             for w in weightings:
@@ -82,6 +141,7 @@ def make_dict():
                         'calculatorSoftwareVersion': '0_02',
                         'maximum': None,
                         'minimum': 0,
+                        'storageDefault': 0,
                     }
 
             _descriptorDict['{}_{}_any'.format(compoundRole.label, descriptor.csvHeader)] = {
@@ -151,6 +211,45 @@ def make_dict():
     descriptorDict = setup(_descriptorDict)
     return descriptorDict, _reaction_pH_Descriptors
 
+
+def _molDescriptorHeadings(label, descriptor):
+    """Return the headings of the descriptors for compound role label which aggregate a molecular descriptor."""
+    csvHeader = '{}_{}_{}'.format(descriptor.heading, descriptor.calculatorSoftware, descriptor.calculatorSoftwareVersion)
+    if isinstance(descriptor, DRP.models.NumericDescriptor):
+        return ['{}_{}_{}'.format(label, csvHeader, aggregate) for aggregate in ('Max', 'Range', 'gmean_molarity', 'gmean_count')]
+    if isinstance(descriptor, DRP.models.OrdinalDescriptor):
+        values = range(descriptor.minimum, descriptor.maximum + 1)
+    elif isinstance(descriptor, DRP.models.BooleanDescriptor):
+        values = (True, False)
+    elif isinstance(descriptor, DRP.models.CategoricalDescriptor):
+        values = [permValue.value for permValue in descriptor.permittedValues.all()]
+    else:
+        return []
+    headings = ['{}_{}_{}_{}'.format(label, csvHeader, value, w) for value in values for w in ('count', 'molarity')]
+    if isinstance(descriptor, DRP.models.BooleanDescriptor):
+        headings.append('{}_{}_any'.format(label, csvHeader))
+    return headings
+
+
+def _pHCurveHeadings(label, identity):
+    """Return the headings of the descriptors for compound role label which aggregate a pH curve at the reaction pH."""
+    return ['{}_{}_pHreaction_{}_{}_{}'.format(label, identity[0], identity[1], identity[2], aggregate)
+            for aggregate in ('Max', 'Range', 'gmean_molarity', 'gmean_count')]
+
+
+def dependentHeadings(compoundFields=(), molDescriptors=(), pHCurves=()):
+    """Return the headings of the descriptors calculated from the given compound fields, molecular descriptors or pH curve identities."""
+    headings = set()
+    if 'formula' in compoundFields:
+        headings.update(element + '_mols' for element in elements)
+    if molDescriptors or pHCurves:
+        for label in DRP.models.CompoundRole.objects.values_list('label', flat=True):
+            for descriptor in molDescriptors:
+                headings.update(_molDescriptorHeadings(label, descriptor))
+            for identity in pHCurves:
+                headings.update(_pHCurveHeadings(label, identity))
+    return headings
+
 # TODO this seems like we're repeating ourselves (below)
 # There's a lot of DRY violation here because I was playing with a few different methods.
 # We should decide which method we want for deletion and work on
@@ -300,7 +399,7 @@ def _delete_values(reaction_set, descriptors_to_delete):
     OrdRxnDescriptor = DRP.models.OrdRxnDescriptor
     CatRxnDescriptor = DRP.models.CatRxnDescriptor
 
-    if len(reaction_set) == 1:
+    if itemCount(reaction_set) == 1:
         rxn = reaction_set[0]
         DRP.models.NumRxnDescriptorValue.objects.filter(reaction=rxn, descriptor__in=[
                                                         desc for desc in descriptors_to_delete if isinstance(desc, NumRxnDescriptor)]).delete()
@@ -321,84 +420,66 @@ def _delete_values(reaction_set, descriptors_to_delete):
                                                         desc for desc in descriptors_to_delete if isinstance(desc, CatRxnDescriptor)]).delete()
 
 
+def _writers(descs_to_write):
+    """Return writers for the numeric and boolean values."""
+    return (ValueWriter(DRP.models.NumRxnDescriptorValue, descs_to_write),
+            ValueWriter(DRP.models.BoolRxnDescriptorValue, descs_to_write))
+
+
+def _pHCurves():
+    """Return the identities of the pH curves aggregated at the reaction pH."""
+    return [curveIdentity(heading) for heading in sorted(_pHDependentDescriptors)]
+
+
 def calculate_many(reaction_set, verbose=False, bulk_delete=False, whitelist=None):
-    """Calculate descriptors for this plugin for an entire set of reactions."""
+    """
+    Calculate descriptors for this plugin for an entire set of reactions.
+
+    Only values which have changed are written. If bulk_delete is True, every old value
+    is deleted before any are calculated, so that they are all inserted afresh.
+    """
     if verbose:
         print "Creating descriptor dictionary"
     descriptorDict, _reaction_pH_Descriptors = make_dict()
-    # We're about to use it and leaving it lazy obscures where time is being
-    # spent
-    descriptorDict.initialise(descriptorDict.descDict)
 
     if whitelist is None:
-        descs_to_delete = descriptorDict.values()
+        descs_to_write = descriptorDict.values()
     else:
-        descs_to_delete = [descriptorDict[k]
-                           for k in descriptorDict.keys() if k in whitelist]
+        descs_to_write = [descriptorDict[k]
+                          for k in descriptorDict.keys() if k in whitelist]
 
     if bulk_delete:
         if verbose:
             print "Deleting all old descriptor values"
-        _delete_values(reaction_set, descs_to_delete)
+        _delete_values(reaction_set, descs_to_write)
 
-    num_vals_to_create = []
-    bool_vals_to_create = []
-    for i, reaction in enumerate(reaction_set):
+    numWriter, boolWriter = _writers(descs_to_write)
+    pHCurves = _pHCurves()
+    reactionCount = itemCount(reaction_set) if verbose else None
+    i = 0
+    for reactions in chunked(reaction_set, create_threshold):
         if verbose:
-            print "{} ({}/{})".format(reaction, i + 1, len(reaction_set))
-        if not bulk_delete:
+            print "Loading compound quantities and descriptor values"
+        table = CompoundTable(reactions, elements, pHCurves)
+        headings = _headings(descriptorDict, table, whitelist)
+
+        num_vals_to_create = []
+        bool_vals_to_create = []
+        for reaction in reactions:
+            i += 1
             if verbose:
-                print "Deleting old descriptor values"
-            _delete_values([reaction], descs_to_delete)
+                print "{} ({}/{})".format(reaction, i, reactionCount)
+            _calculate(reaction, table, headings,
+                       num_vals_to_create=num_vals_to_create, bool_vals_to_create=bool_vals_to_create)
 
         if verbose:
-            print "Calculating new values.".format(reaction, i + 1, len(reaction_set))
-        num_vals_to_create, bool_vals_to_create = _calculate(
-            reaction, descriptorDict, verbose=verbose, whitelist=whitelist, num_vals_to_create=num_vals_to_create, bool_vals_to_create=bool_vals_to_create)
-
-        if len(num_vals_to_create) > create_threshold:
-            if verbose:
-                print "Creating {} Numeric values".format(len(num_vals_to_create))
-            DRP.models.NumRxnDescriptorValue.objects.bulk_create(
-                num_vals_to_create)
-            num_vals_to_create = []
-        if len(bool_vals_to_create) > create_threshold:
-            if verbose:
-                print "Creating {} Boolean values".format(len(bool_vals_to_create))
-            DRP.models.BoolRxnDescriptorValue.objects.bulk_create(
-                bool_vals_to_create)
-            bool_vals_to_create = []
+            print "Writing {} Numeric and {} Boolean values".format(len(num_vals_to_create), len(bool_vals_to_create))
+        numWriter.write(reactions, withoutStorageDefaults(num_vals_to_create))
+        boolWriter.write(reactions, bool_vals_to_create)
 
     if verbose:
-        print "Creating {} Numeric values".format(len(num_vals_to_create))
-    DRP.models.NumRxnDescriptorValue.objects.bulk_create(num_vals_to_create)
-    if verbose:
-        print "Creating {} Boolean values".format(len(bool_vals_to_create))
-    DRP.models.BoolRxnDescriptorValue.objects.bulk_create(bool_vals_to_create)
-
-    if verbose:
-        print "Creating reaction pH values"
-
-    num_vals_to_create = []
-    for i, reaction in enumerate(reaction_set):
-        if verbose:
-            print "{} ({}/{})".format(reaction, i + 1, len(reaction_set))
-
-        if verbose:
-            print "Calculating new values.".format(reaction, i + 1, len(reaction_set))
-        num_vals_to_create = _calculateRxnpH(reaction, descriptorDict, _reaction_pH_Descriptors,
-                                             verbose=verbose, whitelist=whitelist, vals_to_create=num_vals_to_create)
-
-        if len(num_vals_to_create) > create_threshold:
-            if verbose:
-                print "Creating {} Numeric values".format(len(num_vals_to_create))
-            DRP.models.NumRxnDescriptorValue.objects.bulk_create(
-                num_vals_to_create)
-            num_vals_to_create = []
-
-    if verbose:
-        print "Creating {} Numeric values".format(len(num_vals_to_create))
-    DRP.models.NumRxnDescriptorValue.objects.bulk_create(num_vals_to_create)
+        for writer in (numWriter, boolWriter):
+            print writer.report()
 
 
 def calculate(reaction, verbose=False, whitelist=None):
@@ -406,315 +487,188 @@ def calculate(reaction, verbose=False, whitelist=None):
     # Set up the actual descriptor dictionary.
     if verbose:
         print "Creating descriptor dictionary"
-    descriptorDict = make_dict()[0]
+    descriptorDict, _reaction_pH_Descriptors = make_dict()
     if whitelist is None:
-        descs_to_delete = descriptorDict.values()
+        descs_to_write = descriptorDict.values()
     else:
-        descs_to_delete = [k[v]
-                           for k in descriptorDict.keys() if k in whitelist]
-    if verbose:
-        print "Deleting old values"
-    _delete_values([reaction], descs_to_delete)
+        descs_to_write = [descriptorDict[k]
+                          for k in descriptorDict.keys() if k in whitelist]
+    numWriter, boolWriter = _writers(descs_to_write)
     if verbose:
         print "Calculating new values"
+    table = CompoundTable([reaction], elements, _pHCurves())
     num_vals_to_create, bool_vals_to_create = _calculate(
-        reaction, descriptorDict, verbose=verbose, whitelist=whitelist)
+        reaction, table, _headings(descriptorDict, table, whitelist))
 
-    if verbose:
-        print "Creating {} Numeric values".format(len(num_vals_to_create))
-    DRP.models.NumRxnDescriptorValue.objects.bulk_create(num_vals_to_create)
-    if verbose:
-        print "Creating {} Boolean values".format(len(bool_vals_to_create))
-    DRP.models.BoolRxnDescriptorValue.objects.bulk_create(bool_vals_to_create)
+    numWriter.write([reaction], withoutStorageDefaults(num_vals_to_create))
+    boolWriter.write([reaction], bool_vals_to_create)
 
     if verbose:
-        print "Calculating reaction pH values"
-    num_vals_to_create = _calculateRxnpH(reaction, descriptorDict, _reaction_pH_descriptors,
-                                         verbose=verbose, whitelist=whitelist, vals_to_create=num_vals_to_create)
-
-    if verbose:
-        print "Creating {} Numeric values".format(len(num_vals_to_create))
-    DRP.models.NumRxnDescriptorValue.objects.bulk_create(num_vals_to_create)
+        for writer in (numWriter, boolWriter):
+            print writer.report()
+
+
+class _RoleHeadings(object):
+
+    """The reaction descriptors to calculate for a compound role, each of which is None if it is not whitelisted."""
+
+    def __init__(self, compoundRole, table, wanted):
+        """Look up the descriptors for each of the molecular descriptors in the table."""
+        self.pk = compoundRole.pk
+        self.count = wanted('{}_amount_count'.format(compoundRole.label))
+        self.molarity = wanted('{}_amount_molarity'.format(compoundRole.label))
+        self.num = [(j, descriptor,
+                     wanted('{}_{}_{}'.format(compoundRole.label, descriptor.csvHeader, 'Max')),
+                     wanted('{}_{}_{}'.format(compoundRole.label, descriptor.csvHeader, 'Range')),
+                     wanted('{}_{}_{}_{}'.format(compoundRole.label, descriptor.csvHeader, 'gmean', 'molarity')),
+                     wanted('{}_{}_{}_{}'.format(compoundRole.label, descriptor.csvHeader, 'gmean', 'count')))
+                    for j, descriptor in enumerate(table.descriptors['num'])]
+        # aggregates of the pH curves interpolated at the reaction pH, laid out as for num
+        self.pH = [(j, identity) + tuple(wanted(heading) for heading in _pHCurveHeadings(compoundRole.label, identity))
+                   for j, identity in enumerate(table.pHCurves)]
+        self.pH = [headings for headings in self.pH if any(descriptor is not None for descriptor in headings[2:])]
+        # levels are (value in the table, count descriptor, molarity descriptor)
+        self.ord = [(j, [(i, wanted('{}_{}_{}_count'.format(compoundRole.label, descriptor.csvHeader, i)),
+                          wanted('{}_{}_{}_molarity'.format(compoundRole.label, descriptor.csvHeader, i)))
+                         for i in range(descriptor.minimum, descriptor.maximum + 1)])
+                    for j, descriptor in enumerate(table.descriptors['ord'])]
+        self.bool = [(j, [(int(i), wanted('{}_{}_{}_count'.format(compoundRole.label, descriptor.csvHeader, i)),
+                           wanted('{}_{}_{}_molarity'.format(compoundRole.label, descriptor.csvHeader, i)))
+                          for i in (True, False)],
+                      wanted('{}_{}_any'.format(compoundRole.label, descriptor.csvHeader)))
+                     for j, descriptor in enumerate(table.descriptors['bool'])]
+        self.cat = [(j, [(permValue.pk, wanted('{}_{}_{}_count'.format(compoundRole.label, descriptor.csvHeader, permValue.value)),
+                          wanted('{}_{}_{}_molarity'.format(compoundRole.label, descriptor.csvHeader, permValue.value)))
+                         for permValue in descriptor.permittedValues.all()])
+                    for j, descriptor in enumerate(table.descriptors['cat'])]
+
+
+def _headings(descriptorDict, table, whitelist=None):
+    """Return the element and compound role descriptors to calculate for the molecular descriptors in a compound table."""
+    def wanted(heading):
+        return descriptorDict[heading] if whitelist is None or heading in whitelist else None
+
+    elementHeadings = [(j, wanted(element + '_mols')) for j, element in enumerate(table.elements)]
+    roleHeadings = [_RoleHeadings(compoundRole, table, wanted)
+                    for compoundRole in DRP.models.CompoundRole.objects.all()]
+    return [(j, descriptor) for j, descriptor in elementHeadings if descriptor is not None], roleHeadings
+
+
+def _amountAggregate(amounts, mask):
+    """Return the total of the amounts selected by mask, or None if any of them is missing."""
+    selected = [amount for amount, selected in izip(amounts, mask) if selected]
+    if any(amount is None for amount in selected):
+        return None
+    return sum(selected)
+
+
+def _numAggregates(reaction, values, roleAmounts, roleMoles, descriptorHeadings, num_vals_to_create):
+    """
+    Append the maximum, range and geometric means of the numeric values of the compounds in a role.
+
+    values is a compounds x columns array, and descriptorHeadings a list of (column, descriptor,
+    Max, Range, gmean_molarity, gmean_count) tuples. Columns missing a value for any compound are skipped.
+    """
+    num = DRP.models.NumRxnDescriptorValue
+    complete = ~np.isnan(values).any(axis=0)
+    noMoles = roleMoles is None or roleMoles == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        maxima = values.max(axis=0)
+        ranges = maxima - values.min(axis=0)
+        zero = (values == 0).any(axis=0)
+        negative = (values < 0).any(axis=0)
+        countMeans = gmean(values, axis=0)
+        if not noMoles:
+            weights = np.array([[float(amount / roleMoles)] for amount in roleAmounts])
+            molarityMeans = gmean(values * weights, axis=0)
+    for j, descriptor, maxDescriptor, rangeDescriptor, molarityDescriptor, countDescriptor in descriptorHeadings:
+        if not complete[j]:
+            continue
+        if maxDescriptor is not None:
+            num_vals_to_create.append(num(reaction=reaction, descriptor=maxDescriptor, value=float(maxima[j])))
+        if rangeDescriptor is not None:
+            num_vals_to_create.append(num(reaction=reaction, descriptor=rangeDescriptor, value=float(ranges[j])))
+        for meanDescriptor in (molarityDescriptor, countDescriptor):
+            if meanDescriptor is None:
+                continue
+            if noMoles:
+                value = None
+            elif zero[j]:
+                value = 0
+            elif negative[j]:
+                raise ValueError(
+                    'Cannot take geometric mean of negative values. This descriptor ({}) should not use a geometric mean.'.format(descriptor))
+            else:
+                value = float((molarityMeans if meanDescriptor is molarityDescriptor else countMeans)[j])
+            num_vals_to_create.append(num(reaction=reaction, descriptor=meanDescriptor, value=value))
 
 
-def _calculate(reaction, descriptorDict, verbose=False, whitelist=None, num_vals_to_create=[], bool_vals_to_create=[]):
-    """Calculate with the descriptorDict already created and previous descriptor values deleted."""
-    # descriptor Value classes
-    CompoundQuantity = DRP.models.CompoundQuantity
+def _calculate(reaction, table, headings, num_vals_to_create=None, bool_vals_to_create=None):
+    """Calculate with the compound table and headings already created and previous descriptor values deleted."""
     num = DRP.models.NumRxnDescriptorValue
-    cat = DRP.models.CatRxnDescriptorValue
-    perm = DRP.models.CategoricalDescriptorPermittedValue
+    num_vals_to_create = [] if num_vals_to_create is None else num_vals_to_create
+    bool_vals_to_create = [] if bool_vals_to_create is None else bool_vals_to_create
+    elementHeadings, roleHeadings = headings
+    quantities = table.quantities.get(reaction.pk, [])
+    warnedPH = False
 
     # Calculate the elemental molarities
-    allCompoundQuantities = CompoundQuantity.objects.filter(reaction=reaction)
-
-    for element in elements:
-        heading = element + '_mols'
-        if whitelist is None or heading in whitelist:
-            n = num(
-                reaction=reaction,
-                descriptor=descriptorDict[heading],
-            )
-            if any(quantity.amount is None for quantity in allCompoundQuantities):
-                n.value = None
-            else:
-                n.value = float(sum((float(quantity.compound.elements[element]['stoichiometry']) * float(
-                    quantity.amount) if element in quantity.compound.elements else 0) for quantity in allCompoundQuantities))
-
-            num_vals_to_create.append(n)
-
-    for compoundRole in DRP.models.CompoundRole.objects.all():
-        roleQuantities = allCompoundQuantities.filter(role=compoundRole)
-        heading = '{}_amount_count'.format(compoundRole.label)
-        if whitelist is None or heading in whitelist:
+    if elementHeadings:
+        if any(amount is None for row, roleId, amount in quantities):
+            mols = None
+        else:
+            amounts = np.array([float(amount) for row, roleId, amount in quantities]).reshape(-1, 1)
+            mols = (table.stoichiometry[[row for row, roleId, amount in quantities]] * amounts).sum(axis=0)
+        for j, descriptor in elementHeadings:
+            num_vals_to_create.append(num(reaction=reaction, descriptor=descriptor,
+                                          value=None if mols is None or np.isnan(mols[j]) else float(mols[j])))
+
+    for role in roleHeadings:
+        roleRows = [row for row, roleId, amount in quantities if roleId == role.pk]
+        roleAmounts = [amount for row, roleId, amount in quantities if roleId == role.pk]
+        if role.count is not None:
             #  number of species in reaction with this role
-            n = num(
-                reaction=reaction,
-                descriptor=descriptorDict[heading],
-            )
-            n.value = roleQuantities.count()
-            num_vals_to_create.append(n)
+            num_vals_to_create.append(num(reaction=reaction, descriptor=role.count, value=len(roleRows)))
 
         #  moles of reactant filling this role in this reaction
-
-        if any(quantity.amount is None for quantity in roleQuantities):
-            roleMoles = None
-        else:
-            roleMoles = sum(quantity.amount for quantity in roleQuantities)
-        heading = '{}_amount_molarity'.format(compoundRole.label)
-        if whitelist is None or heading in whitelist:
-            n = num(
-                reaction=reaction,
-                descriptor=descriptorDict[heading],
-            )
-            n.value = roleMoles
-            num_vals_to_create.append(n)
-
-        if roleQuantities.exists():
-            for descriptor in DRP.models.NumMolDescriptor.objects.all():
-                descriptorValues = DRP.models.NumMolDescriptorValue.objects.filter(
-                    compound__in=[quantity.compound for quantity in roleQuantities], descriptor=descriptor)
-                # Only do the calculation if the right number of descriptor values are present and all of them are not NULL
-                # TODO XXX this count now takes longer than actually creating the value. Can we remove it? (Same below)
-                # Ah looks like this is silently skipping inorganic properties for organics. That seems like a bad way to do it...
-                # Means I have to silence the warnings below (which previously lead me to a whole bunch of uncalculated stuff.
-                # I really don't like failing silently and it seems to have
-                # gotten us into some trouble
-
-                if descriptorValues.count() == roleQuantities.count() and not any(descriptorValue.value is None for descriptorValue in descriptorValues):
-                    heading = '{}_{}_{}'.format(
-                        compoundRole.label, descriptor.csvHeader, 'Max')
-                    if whitelist is None or heading in whitelist:
-                        n = num(
-                            reaction=reaction,
-                            descriptor=descriptorDict[heading],
-                        )
-                        if any(descriptorValue.value is None for descriptorValue in descriptorValues):
-                            n.value = None
-                        else:
-                            n.value = max(
-                                descriptorValue.value for descriptorValue in descriptorValues)
-                        num_vals_to_create.append(n)
-
-                    heading = '{}_{}_{}'.format(
-                        compoundRole.label, descriptor.csvHeader, 'Range')
-                    if whitelist is None or heading in whitelist:
-                        n = num(
-                            reaction=reaction,
-                            descriptor=descriptorDict[heading],
-                        )
-                        if any(descriptorValue.value is None for descriptorValue in descriptorValues):
-                            n.value = None
-                        else:
-                            n.value = max(descriptorValue.value for descriptorValue in descriptorValues) - min(
-                                descriptorValue.value for descriptorValue in descriptorValues)
-                        num_vals_to_create.append(n)
-
-                    heading = '{}_{}_{}_{}'.format(
-                        compoundRole.label, descriptor.csvHeader, 'gmean', 'molarity')
-                    if whitelist is None or heading in whitelist:
-                        n = num(
-                            reaction=reaction,
-                            descriptor=descriptorDict[heading],
-                        )
-                        if any(descriptorValues.get(compound=quantity.compound).value is None for quantity in roleQuantities) or roleMoles == 0 or roleMoles is None:
-                            n.value = None
-                        elif any(descriptorValues.get(compound=quantity.compound).value == 0 for quantity in roleQuantities):
-                            n.value = 0
-                        elif any(descriptorValues.get(compound=quantity.compound).value < 0 for quantity in roleQuantities):
-                            raise ValueError(
-                                'Cannot take geometric mean of negative values. This descriptor ({}) should not use a geometric mean.'.format(descriptor))
-                        else:
-                            n.value = gmean(list(descriptorValues.get(compound=quantity.compound).value * float(
-                                quantity.amount / roleMoles) for quantity in roleQuantities))
-                        num_vals_to_create.append(n)
-
-                    heading = '{}_{}_{}_{}'.format(
-                        compoundRole.label, descriptor.csvHeader, 'gmean', 'count')
-                    if whitelist is None or heading in whitelist:
-                        n = num(
-                            reaction=reaction,
-                            descriptor=descriptorDict[heading],
-                        )
-                        if any(descriptorValues.get(compound=quantity.compound).value is None for quantity in roleQuantities) or roleMoles == 0 or roleMoles is None:
-                            n.value = None
-                        elif any(descriptorValues.get(compound=quantity.compound).value == 0 for quantity in roleQuantities):
-                            n.value = 0
-                        elif any(descriptorValues.get(compound=quantity.compound).value < 0 for quantity in roleQuantities):
-                            raise ValueError(
-                                'Cannot take geometric mean of negative values. This descriptor ({}) should not use a geometric mean.'.format(descriptor))
-                        else:
-                            n.value = gmean(list(descriptorValues.get(
-                                compound=quantity.compound).value for quantity in roleQuantities))
-                        num_vals_to_create.append(n)
-                # elif descriptorValues.count() != roleQuantities.count():
-                    # warnings.warn("Skipping {} because there are {} descriptorValues and {} roleQuantities".format(descriptor.heading, descriptorValues.count(), roleQuantities.count()))
-                # else:
-                    # warnings.warn("Skipping {} because some descriptorValues are None".format(descriptor.heading))
-            for descriptor in DRP.models.OrdMolDescriptor.objects.all():
-                #  Only do the calculation if the right number of descriptor values are present and all of them are not NULL
-                # TODO XXX this count now takes longer than actually creating
-                # the value. Can we remove it? (Same below)
-                descriptorValues = DRP.models.OrdMolDescriptorValue.objects.filter(
-                    compound__in=[quantity.compound for quantity in roleQuantities], descriptor=descriptor)
-                if descriptorValues.count() == roleQuantities.count() and not any(descriptorValue.value is None for descriptorValue in descriptorValues):
-                    # because Still python...
-                    for i in range(descriptor.minimum, descriptor.maximum + 1):
-                        heading = '{}_{}_{}_count'.format(
-                            compoundRole.label, descriptor.csvHeader, i)
-                        if whitelist is None or heading in whitelist:
-                            n = num(
-                                reaction=reaction,
-                                descriptor=descriptorDict[heading],
-                            )
-                            n.value = sum(
-                                1 for value in descriptorValues if value.value == i)
-                            num_vals_to_create.append(n)
-
-                        heading = '{}_{}_{}_molarity'.format(
-                            compoundRole.label, descriptor.csvHeader, i)
-                        if whitelist is None or heading in whitelist:
-                            n = num(
-                                reaction=reaction,
-                                descriptor=descriptorDict[heading],
-                            )
-                            quantities = roleQuantities.filter(
-                                compound__ordmoldescriptorvalue__value=i, compound__ordmoldescriptorvalue__descriptor__pk=descriptor.pk)
-                            if any(quantity.amount is None for quantity in quantities):
-                                n.value = None
-                            else:
-                                n.value = sum(
-                                    quantity.amount for quantity in quantities)
-                            num_vals_to_create.append(n)
-            for descriptor in DRP.models.BoolMolDescriptor.objects.all():
-                descriptorValues = DRP.models.BoolMolDescriptorValue.objects.filter(
-                    compound__in=[quantity.compound for quantity in roleQuantities], descriptor=descriptor)
-                if descriptorValues.count() == roleQuantities.count() and not any(descriptorValue.value is None for descriptorValue in descriptorValues):
-                    for i in (True, False):  # because Still python...
-                        heading = '{}_{}_{}_count'.format(
-                            compoundRole.label, descriptor.csvHeader, i)
-                        if whitelist is None or heading in whitelist:
-                            n = num(
-                                reaction=reaction,
-                                descriptor=descriptorDict[heading],
-                            )
-                            n.value = sum(
-                                1 for value in descriptorValues if value.value == i)
-                            num_vals_to_create.append(n)
-
-                        heading = '{}_{}_{}_molarity'.format(
-                            compoundRole.label, descriptor.csvHeader, i)
-                        if whitelist is None or heading in whitelist:
-                            n = num(
-                                reaction=reaction,
-                                descriptor=descriptorDict[heading],
-                            )
-                            quantities = roleQuantities.filter(
-                                compound__boolmoldescriptorvalue__value=i, compound__boolmoldescriptorvalue__descriptor__pk=descriptor.pk)
-                            if any(quantity.amount is None for quantity in quantities):
-                                n.value = None
-                            else:
-                                n.value = sum(
-                                    quantity.amount for quantity in quantities)
-                            num_vals_to_create.append(n)
-                    heading = '{}_{}_any'.format(
-                        compoundRole.label, descriptor.csvHeader)
-                    if whitelist is None or heading in whitelist:
-                        b = DRP.models.BoolRxnDescriptorValue(
-                            reaction=reaction,
-                            descriptor=descriptorDict[heading],
-                            value=any(descriptorValues)
-                        )
-                        bool_vals_to_create.append(b)
-
-            for descriptor in DRP.models.CatMolDescriptor.objects.all():
-                descriptorValues = DRP.models.CatMolDescriptorValue.objects.filter(
-                    compound__in=[quantity.compound for quantity in roleQuantities], descriptor=descriptor)
-                if descriptorValues.count() == roleQuantities.count() and not any(descriptorValue.value is None for descriptorValue in descriptorValues):
-                    for permValue in descriptor.permittedValues.all():
-                        heading = '{}_{}_{}_count'.format(
-                            compoundRole.label, descriptor.csvHeader, permValue.value)
-                        if whitelist is None or heading in whitelist:
-                            n = num(
-                                reaction=reaction,
-                                descriptor=descriptorDict[heading],
-                            )
-                            n.value = descriptorValues.filter(
-                                value=permValue).count()
-                            num_vals_to_create.append(n)
-                        heading = '{}_{}_{}_molarity'.format(
-                            compoundRole.label, descriptor.csvHeader, permValue.value)
-                        if whitelist is None or heading in whitelist:
-                            n = num(
-                                reaction=reaction,
-                                descriptor=descriptorDict[heading],
-                            )
-                            quantities = roleQuantities.filter(
-                                compound__catmoldescriptorvalue__value=permValue, compound__catmoldescriptorvalue__descriptor__pk=descriptor.pk)
-                            if any(quantity.amount is None for quantity in quantities):
-                                n.value = None
-                            else:
-                                n.value = sum(
-                                    quantity.amount for quantity in quantities)
-                            num_vals_to_create.append(n)
-    return num_vals_to_create, bool_vals_to_create
-
-
-def _calculateRxnpH(reaction, descriptorDict, _reaction_pH_Descriptors, verbose=False, whitelist=None, vals_to_create=[]):
-    try:
-        reaction_pH = DRP.models.NumRxnDescriptorValue.objects.get(
-            reaction=reaction, descriptor__heading='reaction_pH').value
-    except DRP.models.NumRxnDescriptorValue.DoesNotExist:
-        warnings.warn(
-            'Reaction {} has no pH value. Cannot create reaction pH descriptors'.format(reaction))
-    else:
-        reaction_pH_string = str(reaction_pH).replace(
-            '.', '_')  # R compatibility
-        for heading in _reaction_pH_Descriptors.keys():
-            d = descriptorDict[heading]
-            if reaction_pH is None:
-                pH_descriptor_value = DRP.models.NumRxnDescriptorValue(
-                    descriptor=d, reaction=reaction, value=None)
+        roleMoles = None if any(amount is None for amount in roleAmounts) else sum(roleAmounts)
+        if role.molarity is not None:
+            num_vals_to_create.append(num(reaction=reaction, descriptor=role.molarity, value=roleMoles))
+
+        # Aggregates are only calculated for molecular descriptors with a value for every compound in the role.
+        # This silently skips (e.g.) inorganic properties for organics, and any role listing a compound twice.
+        if not roleRows or len(set(roleRows)) != len(roleRows):
+            continue
+
+        _numAggregates(reaction, table.values['num'][roleRows], roleAmounts, roleMoles, role.num, num_vals_to_create)
+        if role.pH:
+            if reaction.pk not in table.reactionPHs:
+                if not warnedPH:
+                    warnings.warn('Reaction {} has no pH value. Cannot create reaction pH descriptors'.format(reaction))
+                    warnedPH = True
+            elif table.reactionPHs[reaction.pk] is None:
+                for headings in role.pH:
+                    num_vals_to_create += [num(reaction=reaction, descriptor=descriptor, value=None)
+                                           for descriptor in headings[2:] if descriptor is not None]
             else:
-                reaction_pH_descriptor_heading = d.heading.replace(
-                    '_pHreaction_', '_pH{}_'.format(reaction_pH_string))
-                try:
-                    pH_descriptor_value = DRP.models.NumRxnDescriptorValue.objects.get(
-                        descriptor__heading=reaction_pH_descriptor_heading, reaction=reaction).value
-                except DRP.models.NumRxnDescriptorValue.DoesNotExist:
-                    # this creates a ton of warnings about pH and Ox roles because those mostly don't exist
-                    # Not sure that silence wouldn't be better, but I've been burned too many times by silent failure
-                    # Came up with this compromise. The warnings are identical
-                    # so the default python settings squelch them
-                    if heading.startswith('pH_') or heading.startswith('Ox_'):
-                        warnings.warn(
-                            'Could not find descriptor value for a pH or Ox role descriptor.')
-                    else:
-                        warnings.warn('Could not find descriptor value for descriptor {} and reaction {}'.format(
-                            reaction_pH_descriptor_heading, reaction))
-                else:
-                    reaction_pH_dv = DRP.models.NumRxnDescriptorValue(
-                        descriptor=d, reaction=reaction, value=pH_descriptor_value)
-                    vals_to_create.append(reaction_pH_dv)
-
-    return vals_to_create
+                _numAggregates(reaction, table.pHValues(roleRows, table.reactionPHs[reaction.pk]), roleAmounts, roleMoles,
+                               role.pH, num_vals_to_create)
+
+        for kind, descriptorLevels in (('ord', role.ord), ('bool', role.bool), ('cat', role.cat)):
+            values = table.values[kind][roleRows]
+            complete = ~np.isnan(values).any(axis=0)
+            for descriptorHeadings in descriptorLevels:
+                j, levels = descriptorHeadings[:2]
+                if not complete[j]:
+                    continue
+                for level, countDescriptor, molarityDescriptor in levels:
+                    mask = values[:, j] == level
+                    if countDescriptor is not None:
+                        num_vals_to_create.append(num(reaction=reaction, descriptor=countDescriptor, value=int(mask.sum())))
+                    if molarityDescriptor is not None:
+                        num_vals_to_create.append(num(reaction=reaction, descriptor=molarityDescriptor,
+                                                      value=_amountAggregate(roleAmounts, mask)))
+                if kind == 'bool' and descriptorHeadings[2] is not None:
+                    bool_vals_to_create.append(DRP.models.BoolRxnDescriptorValue(
+                        reaction=reaction, descriptor=descriptorHeadings[2], value=bool((values[:, j] == 1).any())))
+    return num_vals_to_create, bool_vals_to_create
@@ -1,6 +1,7 @@
 """Module for calculating reaction hash descriptor."""
 import DRP
 from utils import setup
+from DRP.models.querysets import batched, itemCount
 import xxhash
 
 elements = DRP.chemical_data.elements
@@ -21,6 +22,11 @@ _descriptorDict = {
 descriptorDict = setup(_descriptorDict)
 
 
+def dependentHeadings(compoundFields=(), molDescriptors=(), pHCurves=()):
+    """Return the headings of the descriptors calculated from the given compound fields, molecular descriptors or pH curves."""
+    return {'rxnSpaceHash1'} if 'abbrev' in compoundFields else set()
+
+
 def calculate_many(reaction_set, verbose=False, whitelist=None):
     """Calculate descriptors for this plugin for an entire set of reactions."""
     if verbose:
@@ -29,9 +35,10 @@ def calculate_many(reaction_set, verbose=False, whitelist=None):
     # spent
     descriptorDict.initialise(descriptorDict.descDict)
 
-    for i, reaction in enumerate(reaction_set):
+    reactionCount = itemCount(reaction_set) if verbose else None
+    for i, reaction in enumerate(batched(reaction_set)):
         if verbose:
-            print "Calculating {} ({}/{})".format(reaction, i + 1, len(reaction_set))
+            print "Calculating {} ({}/{})".format(reaction, i + 1, reactionCount)
         _calculate(reaction, descriptorDict,
                    verbose=verbose, whitelist=whitelist)
 
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 import django
-from DRP.models import PerformedReaction, ModelContainer, Descriptor, rxnDescriptorValues, DataSet
+from DRP.models import PerformedReaction, ModelContainer, Descriptor, rxnDescriptorValues, DataSet, ExportJob
 import operator
 import argparse
 from django.db.utils import OperationalError
@@ -17,8 +17,9 @@ def prepareArff(reactions, whitelistHeaders, filepath, verbose=False):
     """Writes an *.arff file using the provided queryset of reactions."""
     if verbose:
         print "Writing arff to {}".format(filepath)
-    with open(filepath, "w") as f:
-        reactions.toArff(f, expanded=True, whitelistHeaders=whitelistHeaders)
+    # reuses the last export of the same reactions and headers if nothing has changed since
+    ExportJob.objects.enqueue(reactions, 'arff', expanded=True,
+                              whitelist=whitelistHeaders).copyTo(filepath)
     return filepath
 
 
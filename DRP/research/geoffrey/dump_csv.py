@@ -1,6 +1,6 @@
 import django
 django.setup()
-from DRP.models import PerformedReaction, DataSet, Descriptor, Compound, Reaction, CompoundQuantity, NumRxnDescriptorValue, CatMolDescriptorValue, OrdMolDescriptorValue, BoolMolDescriptorValue, NumMolDescriptorValue, CatMolDescriptor, OrdMolDescriptor, BoolMolDescriptor, NumMolDescriptor, BoolRxnDescriptorValue
+from DRP.models import PerformedReaction, DataSet, Descriptor, Compound, Reaction, CompoundQuantity, NumRxnDescriptorValue, CatMolDescriptorValue, OrdMolDescriptorValue, BoolMolDescriptorValue, NumMolDescriptorValue, CatMolDescriptor, OrdMolDescriptor, BoolMolDescriptor, NumMolDescriptor, BoolRxnDescriptorValue, ExportJob
 import argparse
 
 
@@ -20,8 +20,9 @@ def dump_csv(file_name, descriptor_headers, reaction_set_name=None):
     whitelist += ['id', 'notes', 'labGroup', 'user', 'performedBy', 'reference', 'valid', 'compound_0', 'compound_0_role', 'compound_0_amount', 'compound_1', 'compound_1_role',
                   'compound_1_amount', 'compound_2', 'compound_2_role', 'compound_2_amount', 'compound_3', 'compound_3_role', 'compound_3_amount', 'compound_4', 'compound_4_role', 'compound_4_amount']
 
-    with open(file_name, 'wb') as f:
-        rxns.toCsv(f, whitelistHeaders=whitelist, expanded=True)
+    # reuses the last export of the same reactions and headers if nothing has changed since
+    ExportJob.objects.enqueue(rxns, 'csv', expanded=True,
+                              whitelist=whitelist).copyTo(file_name)
 
 if __name__ == '__main__':
     django.setup()
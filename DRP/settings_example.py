@@ -35,12 +35,33 @@ TMP_DIR = os.path.join(BASE_DIR, "tmp")
 RESEARCH_DIR = os.path.join(BASE_DIR + "research")
 LOG_DIR = os.path.join(BASE_DIR, "logs")
 MODEL_DIR = os.path.join(BASE_DIR, "models")
+# Rendered reaction exports, which are served only to those who may see their
+# reactions; this must not be inside MEDIA_ROOT.
+EXPORT_DIR = os.path.join(BASE_DIR, "exports")
+# On-disk cache of reaction descriptor values used by expanded exports.
+# Set to None to read straight from the database. Changes made with raw SQL
+# bypass its invalidation, so run clear_feature_matrix after making any.
+FEATURE_MATRIX_DIR = None if TESTING else os.path.join(
+    BASE_DIR, "feature_matrix")
+# Results of external descriptor calculators (e.g. cxcalc) are cached here, keyed by structure
+CALCULATOR_CACHE_DIR = None if TESTING else os.path.join(
+    BASE_DIR, "calculator_cache")
+# How expanded reaction rows are built for exports: 'rows' prefetches descriptor values
+# per batch of reactions, 'pivot' streams one ordered query per descriptor value type.
+REACTION_ROW_ENGINE = 'rows'
+# Csv and arff downloads are streamed in chunks of this many rows,
+# and gzipped on the fly for clients which accept it if EXPORT_GZIP is set.
+EXPORT_CHUNK_SIZE = 500
+EXPORT_GZIP = True
 
 CHEMAXON_DIR = {
 }
 # {version: directory}
 WEKA_PATH = {
     '3.6': '/usr/share/java/weka.jar'}  # default path on Ubuntu
+# run weka jobs in a long-lived java worker for each process, rather than starting java for each one.
+# The worker is compiled with javac, so this needs a JDK; without one, java is started for each job.
+WEKA_WORKER = False
 
 if TESTING:
     MOL_DESCRIPTOR_PLUGINS = ('DRP.plugins.moldescriptors.example',)
@@ -273,7 +294,7 @@ CACHES = {
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 
 STATS_MODEL_LIBS_DIR = "DRP.ml_models.model_visitors"
-STATS_MODEL_LIBS = ("weka",)
+STATS_MODEL_LIBS = ("weka", "sklearn")
 REACTION_DATASET_SPLITTERS_DIR = "DRP.ml_models.splitters"
 REACTION_DATASET_SPLITTERS = (
     "KFoldSplitter", "ExploratorySplitter", "NoSplitter", "RandomSplitter")
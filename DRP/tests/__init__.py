@@ -13,6 +13,30 @@ import CompoundToArff
 # import modelBuildingTests
 # import DataImport
 import modelValidators
+import wekaWorker
+import featureMatrix
+import pivotRows
+import headerRegistry
+import exportJobs
+import valueWriter
+import cxcalc
+import calculatorCache
+import descriptorDict
+import pHCurves
+import elementTable
+import formulae
+import parallelBuild
+import sklearnVisitors
+import arffDataset
+import multiQuerySet
+import rxnDescriptorArrays
+import reactionArrays
+import calculateDescriptors
+import batchIterator
+import streamingExport
+import recalculation
+import storageDefaults
+import sparseArff
 # import splitters
 
 
@@ -27,6 +51,30 @@ suite = unittest.TestSuite([
     CompoundToCsv.suite,
     CompoundToArff.suite,
     modelValidators.suite,
+    wekaWorker.suite,
+    featureMatrix.suite,
+    pivotRows.suite,
+    headerRegistry.suite,
+    exportJobs.suite,
+    valueWriter.suite,
+    cxcalc.suite,
+    calculatorCache.suite,
+    descriptorDict.suite,
+    pHCurves.suite,
+    elementTable.suite,
+    formulae.suite,
+    parallelBuild.suite,
+    sklearnVisitors.suite,
+    arffDataset.suite,
+    multiQuerySet.suite,
+    rxnDescriptorArrays.suite,
+    reactionArrays.suite,
+    calculateDescriptors.suite,
+    batchIterator.suite,
+    streamingExport.suite,
+    recalculation.suite,
+    storageDefaults.suite,
+    sparseArff.suite,
     # splitters.suite,
     fileTests.suite,
 ])
@@ -44,4 +92,28 @@ modules = [
     "CompoundToArff",
     "fileTests",
     "modelValidators",
+    "wekaWorker",
+    "featureMatrix",
+    "pivotRows",
+    "headerRegistry",
+    "exportJobs",
+    "valueWriter",
+    "cxcalc",
+    "calculatorCache",
+    "descriptorDict",
+    "pHCurves",
+    "elementTable",
+    "formulae",
+    "parallelBuild",
+    "sklearnVisitors",
+    "arffDataset",
+    "multiQuerySet",
+    "rxnDescriptorArrays",
+    "reactionArrays",
+    "calculateDescriptors",
+    "batchIterator",
+    "streamingExport",
+    "recalculation",
+    "storageDefaults",
+    "sparseArff",
 ]
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""Tests that the arff files sliced from a shared export are those exported directly, and that Weka's predictions from them are paired with the right reactions."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup
+from DRP.models import PerformedReaction, LabGroup, ModelContainer, DataSet
+from DRP.models import NumRxnDescriptor, NumRxnDescriptorValue, OrdRxnDescriptor, OrdRxnDescriptorValue
+from DRP.ml_models.model_visitors import weka
+from DRP.ml_models.model_visitors.weka.AbstractWekaModelVisitor import ArffDataset
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from StringIO import StringIO
+import tempfile
+import shutil
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+
+class EchoJ48(weka.J48):
+
+    """A J48 visitor whose Weka predictions are the outcomes in the arff file it is given, recording the files."""
+
+    def __init__(self, *args, **kwargs):
+        """Set up the visitor with no arff files given yet."""
+        super(EchoJ48, self).__init__(*args, **kwargs)
+        self.arffFiles = []
+
+    def _runWekaCommand(self, command, verbose=False):
+        """Return Weka's output for a prediction which is the response column of each instance of the -T arff file."""
+        args = command.split()
+        arffFile = args[args.index('-T') + 1]
+        column = int(args[args.index('-c') + 1]) - 1
+        self.arffFiles.append(arffFile)
+        with open(arffFile) as f:
+            instances = [line for line in f.read().split('@data\n', 1)[1].splitlines() if line]
+        lines = ['', '=== Predictions on test data ===', '', ' inst#     actual  predicted error', '']
+        for i, instance in enumerate(instances, 1):
+            value = instance.split(',')[column].strip('"')
+            lines.append('{} {}:{} {}:{}'.format(i, value, value, value, value))
+        return '\n'.join(lines + ['']) + '\n'
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+class Slices(DRPTestCase):
+
+    """Slices the arff files of subsets of reactions from the export of all of them, and predicts from them."""
+
+    def setUp(self):
+        """Create reactions with numeric values, some zero or missing, and a Weka container with them split into folds."""
+        self.directory = tempfile.mkdtemp()
+        self.tmpSettings = override_settings(TMP_DIR=self.directory)
+        self.tmpSettings.enable()
+        labGroup = LabGroup.objects.get(title='narnia')
+        user = User.objects.get(username='Aslan')
+        manual = {'calculatorSoftware': 'manual', 'calculatorSoftwareVersion': '0'}
+        predictor = NumRxnDescriptor.objects.create(name='testNumber', heading='testNumber', **manual)
+        other = NumRxnDescriptor.objects.create(name='otherNumber', heading='otherNumber', **manual)
+        response = OrdRxnDescriptor.objects.create(name='outcome', heading='outcome', minimum=1, maximum=4, **manual)
+        for i in range(12):
+            reaction = PerformedReaction.objects.create(labGroup=labGroup, user=user, reference='R{:02}'.format(i))
+            if i % 5:
+                NumRxnDescriptorValue.objects.create(reaction=reaction, descriptor=predictor, value=(i % 3) * 0.5)
+            NumRxnDescriptorValue.objects.create(reaction=reaction, descriptor=other, value=i)
+            OrdRxnDescriptorValue.objects.create(reaction=reaction, descriptor=response, value=1 + i % 4)
+        self.reactions = PerformedReaction.objects.filter(labGroup=labGroup)
+        self.container = ModelContainer.create('weka', 'J48', NumRxnDescriptor.objects.filter(pk=predictor.pk),
+                                               OrdRxnDescriptor.objects.filter(pk=response.pk), splitter='KFoldSplitter',
+                                               reactions=self.reactions)
+        self.statsModel = self.container.statsmodel_set.all()[0]
+        self.headers = [NumRxnDescriptor.objects.get(pk=predictor.pk).csvHeader, OrdRxnDescriptor.objects.get(pk=response.pk).csvHeader]
+        self.otherHeader = NumRxnDescriptor.objects.get(pk=other.pk).csvHeader
+        self.testReactions = self.statsModel.testSets.all()[0].reactions.all()
+
+    def dataset(self, sparse=False):
+        """Export all of the reactions for the container's visitor."""
+        return self.visitor(sparse=sparse).exportDataset(self.reactions)
+
+    def visitor(self, dataset=None, sparse=False):
+        """Return the container's visitor for its first stats model."""
+        visitor = self.container._modelVisitor(self.statsModel, dataset)
+        visitor.sparse = sparse
+        return visitor
+
+    def prepared(self, visitor, reactions, headers):
+        """Return the contents of the arff file a visitor prepares for reactions."""
+        with open(visitor._prepareArff(reactions, headers)) as f:
+            return f.read()
+
+    def exported(self, reactions, headers, sparse=False):
+        """Return the arff file of reactions exported directly."""
+        f = StringIO()
+        reactions.toArff(f, expanded=True, whitelistHeaders=headers, sparse=sparse)
+        return f.getvalue()
+
+    def test_slice(self):
+        """Test that a slice of a dense export is byte for byte the direct export."""
+        dataset = self.dataset()
+        self.assertTrue(dataset.covers(self.testReactions.values_list('pk', flat=True)))
+        self.assertEqual(self.prepared(self.visitor(dataset), self.testReactions, self.headers),
+                         self.exported(self.testReactions, self.headers))
+
+    def test_sparseSlice(self):
+        """Test that a slice of a sparse export is byte for byte the direct sparse export."""
+        dataset = self.dataset(sparse=True)
+        self.assertEqual(self.prepared(self.visitor(dataset, sparse=True), self.testReactions, self.headers),
+                         self.exported(self.testReactions, self.headers, sparse=True))
+
+    def test_otherFormat(self):
+        """Test that a visitor writing another format exports afresh rather than slicing."""
+        dataset = self.dataset()
+        sparse = self.exported(self.testReactions, self.headers, sparse=True)
+        self.assertNotEqual(sparse, self.exported(self.testReactions, self.headers))
+        self.assertEqual(self.prepared(self.visitor(dataset, sparse=True), self.testReactions, self.headers), sparse)
+
+    def test_otherHeaders(self):
+        """Test that an export with other headers is made afresh rather than sliced."""
+        dataset = self.dataset()
+        headers = self.headers + [self.otherHeader]
+        self.assertEqual(self.prepared(self.visitor(dataset), self.testReactions, headers),
+                         self.exported(self.testReactions, headers))
+
+    def predictions(self, reactions, dataset):
+        """Return the outcome paired with each reaction's pk by an echoing visitor, and the arff files it gave Weka."""
+        visitor = EchoJ48(statsModel=self.statsModel, dataset=dataset)
+        results = visitor.predict(reactions).values()[0]
+        return [(reaction.pk, outcome) for reaction, outcome in results], visitor.arffFiles
+
+    def test_predictionOrder(self):
+        """Test that predictions are paired with reactions in the order of the arff file, whatever the order of the reactions."""
+        expected = sorted(OrdRxnDescriptorValue.objects.filter(reaction__in=self.reactions, descriptor__heading='outcome')
+                          .values_list('reaction_id', 'value'))
+        dataset = self.dataset()
+        for reactions in (self.reactions.order_by('-pk'), self.reactions.order_by('reference')):
+            self.assertEqual(sorted(self.predictions(reactions, dataset)[0]), expected)
+            self.assertEqual(sorted(self.predictions(reactions, None)[0]), expected)
+
+    def test_sharedFile(self):
+        """Test that the shared export is given to Weka only when it has the headers and format of the prediction."""
+        dataset = self.dataset()
+        self.assertEqual(self.predictions(self.reactions, dataset)[1], [dataset.path])
+        pks = self.reactions.values_list('pk', flat=True)
+        for headers, sparse in ((self.headers + [self.otherHeader], False), (self.headers, True)):
+            otherDataset = ArffDataset(dataset.path, pks, headers, sparse)
+            self.assertNotEqual(self.predictions(self.reactions, otherDataset)[1], [dataset.path])
+        dataset.delete()
+        self.assertNotEqual(self.predictions(self.reactions, dataset)[1], [dataset.path])
+
+    def tearDown(self):
+        """Delete the container, its data sets, the reactions and the descriptors."""
+        self.container.delete()
+        DataSet.objects.filter(pk__in=list(DataSet.objects.filter(
+            reactions__labGroup__title='narnia').values_list('pk', flat=True))).delete()
+        self.reactions.delete()
+        NumRxnDescriptor.objects.filter(heading__in=('testNumber', 'otherNumber')).delete()
+        OrdRxnDescriptor.objects.filter(heading='outcome').delete()
+        self.tmpSettings.disable()
+        shutil.rmtree(self.directory)
+
+
+suite = unittest.TestSuite([
+    loadTests(Slices),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
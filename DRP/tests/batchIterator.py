@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""Tests that iterating over a queryset in keyset batches gives every row once, in the queryset's order."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup
+from DRP.models import PerformedReaction, LabGroup, Compound, CompoundRole, CompoundQuantity, NumRxnDescriptor
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+ABBREVIATIONS = ('m', 'c', 'x', 'a', 'q', 'f', 'z')
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+class Batches(DRPTestCase):
+
+    """Iterates in batches over compounds, reactions and descriptors."""
+
+    def setUp(self):
+        """Create compounds whose abbreviations are not in primary key order, reactions using them, and descriptors sharing a heading."""
+        labGroup = LabGroup.objects.get(title='narnia')
+        user = User.objects.get(username='Aslan')
+        role = CompoundRole.objects.create(label='batchRole', description='batchRole')
+        for i, abbrev in enumerate(ABBREVIATIONS):
+            Compound(abbrev=abbrev, name=abbrev, CSID=i + 1, custom=True, formula='H_{2}O', labGroup=labGroup).save(calcDescriptors=False)
+        self.compounds = Compound.objects.filter(labGroup=labGroup)
+        compounds = list(self.compounds.order_by('pk'))
+        for i in range(5):
+            reaction = PerformedReaction.objects.create(labGroup=labGroup, user=user, reference='batch{}'.format(i))
+            for j, compound in enumerate(compounds[i:i + 3]):
+                CompoundQuantity.objects.create(reaction=reaction, compound=compound, role=role, amount=j + 1)
+        self.reactions = PerformedReaction.objects.filter(labGroup=labGroup)
+        for version in ('2', '1', '3'):
+            for software in ('b', 'a'):
+                NumRxnDescriptor.objects.create(heading='batchNumber', name='number', calculatorSoftware=software,
+                                                calculatorSoftwareVersion=version)
+        self.descriptors = NumRxnDescriptor.objects.filter(heading='batchNumber')
+
+    def assertBatches(self, queryset, chunksize, ordering=None):
+        """Assert that the batches of a queryset are chunks of its rows in the order the ordering gives, however it divides them."""
+        expected = [item.pk for item in queryset.order_by(*(ordering or ('pk',)))]
+        chunks = [[item.pk for item in chunk] for chunk in queryset.batches(chunksize, ordering)]
+        self.assertEqual(sum(chunks, []), expected)
+        self.assertEqual([len(chunk) for chunk in chunks],
+                         [min(chunksize, len(expected) - i) for i in range(0, len(expected), chunksize)])
+        self.assertEqual([item.pk for item in queryset.batch_iterator(chunksize, ordering)], expected)
+
+    def test_primaryKey(self):
+        """Test batches in primary key order, including chunks which divide the rows exactly and ones larger than all of them."""
+        for chunksize in (1, 2, 3, 7, 10):
+            self.assertBatches(self.compounds, chunksize)
+
+    def test_uniqueOrdering(self):
+        """Test batches ordered by a unique_together set not including the primary key, across a foreign key and inherited fields."""
+        for chunksize in (1, 2, 3):
+            self.assertBatches(self.compounds, chunksize, ('abbrev', 'labGroup'))
+            self.assertBatches(self.compounds, chunksize, ('labGroup', 'abbrev'))
+            self.assertBatches(self.descriptors, chunksize, ('calculatorSoftwareVersion', 'calculatorSoftware', 'heading'))
+
+    def test_descending(self):
+        """Test batches in descending and mixed orderings."""
+        for chunksize in (1, 2, 3):
+            self.assertBatches(self.compounds, chunksize, ('-pk',))
+            self.assertBatches(self.compounds, chunksize, ('-abbrev', 'labGroup'))
+            self.assertBatches(self.descriptors, chunksize, ('-calculatorSoftwareVersion', 'calculatorSoftware', 'heading'))
+            self.assertBatches(self.descriptors, chunksize, ('calculatorSoftware', '-calculatorSoftwareVersion', 'heading'))
+
+    def test_filtered(self):
+        """Test that a filtered queryset gives only its own rows."""
+        self.assertBatches(self.compounds.exclude(abbrev__in=('c', 'q')), 2, ('abbrev', 'labGroup'))
+
+    def test_notUnique(self):
+        """Test that orderings which are not unique, or which use nullable or related fields, are refused."""
+        for ordering in (('abbrev',), ('-labGroup', 'name'), ()):
+            self.assertRaises(ValueError, list, self.compounds.batches(2, ordering))
+        self.assertRaises(ValueError, list, self.descriptors.batches(2, ('heading', 'calculatorSoftware')))
+        self.assertRaises(ValueError, list, self.reactions.batches(2, ('reference',)))
+        self.assertRaises(ValueError, list, self.reactions.batches(2, ('legacyID',)))
+        self.assertRaises(ValueError, list, self.compounds.batches(2, ('labGroup__title', 'abbrev')))
+
+    def test_prefetch(self):
+        """Test that prefetches are made for each chunk, so that reading them needs no further queries."""
+        with CaptureQueriesContext(connection) as queries:
+            chunks = list(self.reactions.prefetch_related('compounds').batches(2))
+        # a query for each of the three chunks and one for the compounds of each
+        self.assertEqual(len(queries), 6)
+        with CaptureQueriesContext(connection) as queries:
+            compounds = [[compound.abbrev for compound in reaction.compounds.all()] for chunk in chunks for reaction in chunk]
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(compounds, [[compound.abbrev for compound in reaction.compounds.all()]
+                                     for reaction in self.reactions.order_by('pk')])
+
+    def test_afterChunk(self):
+        """Test that afterChunk is called once for each chunk, after all of its items have been consumed."""
+        events = []
+        for item in self.compounds.batch_iterator(3, afterChunk=lambda chunk: events.append([c.pk for c in chunk])):
+            events.append(item.pk)
+        pks = list(self.compounds.order_by('pk').values_list('pk', flat=True))
+        self.assertEqual(events, pks[:3] + [pks[:3]] + pks[3:6] + [pks[3:6]] + pks[6:] + [pks[6:]])
+        events = []
+        for item in self.compounds.batch_iterator(7, afterChunk=events.append):
+            pass
+        self.assertEqual(len(events), 1)
+
+    def test_empty(self):
+        """Test that an empty queryset gives no batches, and afterChunk is never called."""
+        chunks = []
+        for queryset in (self.compounds.none(), self.compounds.filter(abbrev='nothing')):
+            self.assertEqual(list(queryset.batches(2)), [])
+            self.assertEqual(list(queryset.batch_iterator(2, afterChunk=chunks.append)), [])
+        self.assertEqual(chunks, [])
+
+    def tearDown(self):
+        """Delete the reactions, so that the compounds can be deleted along with the lab group, and the descriptors."""
+        CompoundQuantity.objects.filter(reaction__in=self.reactions).delete()
+        self.reactions.delete()
+        CompoundRole.objects.filter(label='batchRole').delete()
+        self.descriptors.delete()
+
+
+suite = unittest.TestSuite([
+    loadTests(Batches),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""Tests that calculating descriptors in work units across worker processes stores what calculating them in this process does."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup
+from DRP.models import PerformedReaction, LabGroup, Compound, CompoundRole, CompoundQuantity
+from DRP.models import BoolMolDescriptorValue, NumMolDescriptorValue, OrdMolDescriptorValue, CatMolDescriptorValue
+from DRP.models import BoolRxnDescriptorValue, NumRxnDescriptorValue, OrdRxnDescriptorValue, CatRxnDescriptorValue
+from DRP.management.commands.calculate_descriptors import workUnits
+from DRP.plugins.moldescriptors import example
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from StringIO import StringIO
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+MOL_VALUE_CLASSES = (BoolMolDescriptorValue, NumMolDescriptorValue, OrdMolDescriptorValue, CatMolDescriptorValue)
+RXN_VALUE_CLASSES = (BoolRxnDescriptorValue, NumRxnDescriptorValue, OrdRxnDescriptorValue, CatRxnDescriptorValue)
+SMILES = ('O', 'CCO', 'CCN', 'OO', 'CC(=O)O', 'NCCN', 'c1ccccc1', 'CCCCCCCCCCCN')
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+class CalculateDescriptors(DRPTestCase):
+
+    """Calculates the descriptors of compounds and of the reactions using them, with and without workers."""
+
+    def setUp(self):
+        """Create compounds, with a gap in their primary keys, and a reaction for each pair of them, none with descriptors yet."""
+        labGroup = LabGroup.objects.get(title='narnia')
+        user = User.objects.get(username='Aslan')
+        role = CompoundRole.objects.create(label='calcRole', description='calcRole')
+        compounds = []
+        for i, smiles in enumerate(SMILES):
+            compound = Compound(abbrev='c{}'.format(i), name='c{}'.format(i), CSID=i + 1, custom=True, smiles=smiles,
+                                formula='H_{2}O', labGroup=labGroup)
+            compound.save(calcDescriptors=False)
+            compounds.append(compound)
+        compounds.pop(2).delete()
+        for i in range(len(compounds) - 1):
+            reaction = PerformedReaction.objects.create(labGroup=labGroup, user=user, reference='calc{}'.format(i))
+            for j, compound in enumerate(compounds[i:i + 2]):
+                CompoundQuantity.objects.create(reaction=reaction, compound=compound, role=role, amount=j + 1)
+        self.compounds = Compound.objects.filter(labGroup=labGroup)
+        self.reactions = PerformedReaction.objects.filter(labGroup=labGroup)
+        self.calculate = example.calculate
+        self.clear()
+
+    def clear(self):
+        """Delete every descriptor value."""
+        for valueClass in MOL_VALUE_CLASSES + RXN_VALUE_CLASSES:
+            valueClass.objects.all().delete()
+
+    def stored(self):
+        """Return the set of (kind, object pk, descriptor heading, value) of every stored descriptor value."""
+        values = set()
+        for kind, valueClasses in (('compound', MOL_VALUE_CLASSES), ('reaction', RXN_VALUE_CLASSES)):
+            for valueClass in valueClasses:
+                field = 'value__value' if valueClass in (CatMolDescriptorValue, CatRxnDescriptorValue) else 'value'
+                values.update((kind,) + row for row in valueClass.objects.values_list(
+                    '{}_id'.format(kind), 'descriptor__heading', field))
+        return values
+
+    def command(self, **options):
+        """Run the command, returning what it wrote to stdout and stderr."""
+        stdout, stderr = StringIO(), StringIO()
+        try:
+            call_command('calculate_descriptors', stdout=stdout, stderr=stderr, **options)
+        except CommandError as error:
+            error.output = stdout.getvalue(), stderr.getvalue()
+            raise
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_workUnits(self):
+        """Test that work units cover every primary key exactly once, in order, with a smaller unit for the remainder."""
+        pks = list(self.compounds.order_by('pk').values_list('pk', flat=True))
+        self.assertEqual(len(pks), 7)
+        for unitSize, sizes in ((3, [3, 3, 1]), (7, [7]), (10, [7]), (1, [1] * 7)):
+            units = workUnits(self.compounds.order_by('pk'), unitSize)
+            covered = [list(self.compounds.filter(pk__gte=first, pk__lte=last).order_by('pk').values_list('pk', flat=True))
+                       for first, last in units]
+            self.assertEqual([len(unit) for unit in covered], sizes)
+            self.assertEqual(sum(covered, []), pks)
+        self.assertEqual(workUnits(self.compounds.none(), 3), [])
+
+    def test_workers(self):
+        """Test that two workers store the same compound and reaction descriptor values as a run in this process."""
+        self.command()
+        serial = self.stored()
+        self.assertTrue(any(kind == 'compound' for kind, pk, heading, value in serial))
+        self.assertEqual(set(pk for kind, pk, heading, value in serial if kind == 'reaction'),
+                         set(self.reactions.values_list('pk', flat=True)))
+        self.clear()
+        self.assertEqual(self.stored(), set())
+        self.command(workers=2, unit_size=2)
+        self.assertEqual(self.stored(), serial)
+
+    def test_failure(self):
+        """Test that a failing work unit is reported without stopping the others, and that the command then fails."""
+        pks = list(self.compounds.order_by('pk').values_list('pk', flat=True))
+        failing = pks[3]
+
+        def calculate(compound, *args, **kwargs):
+            """Fail for one compound, in whichever process calculates it."""
+            if compound.pk == failing:
+                raise RuntimeError('No descriptors for you')
+            return self.calculate(compound, *args, **kwargs)
+
+        # the worker processes are forked, so inherit the replacement
+        example.calculate = calculate
+        try:
+            with self.assertRaises(CommandError) as context:
+                self.command(compounds=True, workers=2, unit_size=2)
+        finally:
+            example.calculate = self.calculate
+        stdout, stderr = context.exception.output
+        self.assertIn('1 work units: compounds {}-{}'.format(pks[2], failing), str(context.exception))
+        self.assertIn('compounds {}-{}: failed'.format(pks[2], failing), stderr)
+        self.assertIn('No descriptors for you', stderr)
+        for first, last in ((pks[0], pks[1]), (pks[4], pks[5]), (pks[6], pks[6])):
+            self.assertIn('compounds {}-{}: calculated for'.format(first, last), stdout)
+        calculated = set(pk for kind, pk, heading, value in self.stored())
+        self.assertTrue(calculated.issuperset(pks[:2] + pks[4:]))
+        self.assertNotIn(failing, calculated)
+
+    def tearDown(self):
+        """Delete the reactions, so that the compounds can be deleted along with the lab group, and restore the plugin."""
+        example.calculate = self.calculate
+        CompoundQuantity.objects.filter(reaction__in=self.reactions).delete()
+        self.reactions.delete()
+        CompoundRole.objects.filter(label='calcRole').delete()
+
+
+suite = unittest.TestSuite([
+    loadTests(CalculateDescriptors),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
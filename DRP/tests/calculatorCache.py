@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""Tests for the keys by which the results of descriptor calculators are cached."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup
+from DRP.models import Compound, LabGroup, NumMolDescriptorValue
+from DRP.plugins.moldescriptors import calculatorCache
+from DRP.plugins.moldescriptors.calculatorCache import CalculatorCache
+from django.test.utils import override_settings
+import tempfile
+import shutil
+import sqlite3
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+
+class CacheTestCase(DRPTestCase):
+
+    """Caches results in a temporary directory."""
+
+    def setUp(self):
+        """Point the calculator cache at a temporary directory."""
+        self.directory = tempfile.mkdtemp()
+        self.cacheSettings = override_settings(CALCULATOR_CACHE_DIR=self.directory)
+        self.cacheSettings.enable()
+
+    def tearDown(self):
+        """Remove the cache."""
+        self.cacheSettings.disable()
+        shutil.rmtree(self.directory)
+
+
+class KeyVersion(CacheTestCase):
+
+    """Opens a cache written under older keys."""
+
+    def test_oldKeys(self):
+        """Test that results cached under an older version of the keys are dropped."""
+        cache = CalculatorCache('calculator', 1)
+        cache.put({('structure', 'command'): 1.0})
+        cache.close()
+        connection = sqlite3.connect(calculatorCache.cachePath())
+        with connection:
+            connection.execute('PRAGMA user_version = {}'.format(calculatorCache.KEY_VERSION - 1))
+        connection.close()
+        cache = CalculatorCache('calculator', 1)
+        self.assertEqual(cache.get(['structure'], ['command']), {})
+        cache.close()
+
+    def test_currentKeys(self):
+        """Test that results cached under the current version of the keys are kept."""
+        cache = CalculatorCache('calculator', 1)
+        cache.put({('structure', 'command'): 1.0})
+        cache.close()
+        cache = CalculatorCache('calculator', 1)
+        self.assertEqual(cache.get(['structure'], ['command']), {('structure', 'command'): 1.0})
+        cache.close()
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+class RdkitMolecularWeight(CacheTestCase):
+
+    """Calculates the molecular weight of compounds sharing an InChI but not a formula."""
+
+    def setUp(self):
+        """Create the compounds without calculating their descriptors."""
+        super(RdkitMolecularWeight, self).setUp()
+        labGroup = LabGroup.objects.get(title='narnia')
+        self.compounds = []
+        for abbrev, formula in (('EtOH', 'C2H6O'), ('CH4', 'CH4')):
+            compound = Compound(abbrev=abbrev, name=abbrev, formula=formula, INCHI='InChI=1S/shared',
+                                custom=True, labGroup=labGroup)
+            compound.save(calcDescriptors=False)
+            self.compounds.append(compound)
+
+    def test_formulaKey(self):
+        """Test that the molecular weight is cached by the formula it is calculated from."""
+        # imported here as the testing settings leave out the plugins which need rdkit
+        from DRP.plugins.moldescriptors import drp_rdkit
+        cache = CalculatorCache(drp_rdkit.calculatorSoftware, drp_rdkit.rdkit.__version__)
+        try:
+            for compound in self.compounds:
+                drp_rdkit.calculate(compound, cache=cache)
+        finally:
+            cache.close()
+        mw = dict(NumMolDescriptorValue.objects.filter(descriptor__heading='mw', compound__in=self.compounds)
+                  .values_list('compound__abbrev', 'value'))
+        self.assertAlmostEqual(mw['EtOH'], 46.069, places=2)
+        self.assertAlmostEqual(mw['CH4'], 16.043, places=2)
+
+    def tearDown(self):
+        """Delete the compounds and the cache."""
+        for compound in self.compounds:
+            compound.delete()
+        super(RdkitMolecularWeight, self).tearDown()
+
+
+suite = unittest.TestSuite([
+    loadTests(KeyVersion),
+    loadTests(RdkitMolecularWeight),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
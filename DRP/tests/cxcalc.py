@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""Tests for running ChemAxon's cxcalc in batches, using a stub cxcalc which needs no licence."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.plugins.moldescriptors import chemaxon
+from DRP.plugins.moldescriptors.calculatorCache import CalculatorCache
+from DRP.models import Compound
+from collections import OrderedDict
+from django.test.utils import override_settings
+import tempfile
+import shutil
+import warnings
+import stat
+import sys
+import os
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+# Logs each run, then for leconformer echoes the structures as their conformers, and otherwise
+# outputs for each structure its id, then the length of the structure plus the index of each command.
+# Any structure containing 'bad' fails the run.
+STUB_CXCALC = r"""#!{}
+import sys
+import os
+args = sys.argv[1:]
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runs.log'), 'a') as log:
+    log.write(repr(args) + '\n')
+
+
+def structures(arg):
+    if os.path.isfile(arg):
+        with open(arg) as f:
+            return f.read().splitlines()
+    return arg.splitlines()
+
+if args[-1] == 'leconformer':
+    lec = [s for arg in args[:-1] for s in structures(arg)]
+else:
+    lec = structures(args[2])
+if any('bad' in s for s in lec):
+    sys.exit(1)
+if args[-1] == 'leconformer':
+    sys.stdout.write('\n'.join(lec) + '\n')
+else:
+    commands = args[3:]
+    for i, s in enumerate(lec):
+        sys.stdout.write('\t'.join([str(i + 1)] + [str(len(s) + j) for j in range(len(commands))]) + '\n')
+""".format(sys.executable)
+
+COMMAND_ARGS = ['refractivity', 'maximalprojectionarea']
+COMMANDS = OrderedDict((('refractivity', 'refractivity'), ('maxprojectionarea', 'maximalprojectionarea')))
+INCHI = 'InChI=1S/CH4/h1H4'
+
+
+def expected(structure):
+    """Return the stub's results for a structure."""
+    return [str(len(structure)), str(len(structure) + 1)]
+
+
+class StubTestCase(DRPTestCase):
+
+    """Installs a stub cxcalc."""
+
+    def setUp(self):
+        """Install the stub in a temporary ChemAxon directory."""
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'cxcalc')
+        with open(path, 'w') as f:
+            f.write(STUB_CXCALC)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        self.chemaxonSettings = override_settings(CHEMAXON_DIR={chemaxon.CHEMAXON_VERSION: self.directory + '/'})
+        self.chemaxonSettings.enable()
+
+    def runs(self):
+        """Return the number of times cxcalc has been run."""
+        with open(os.path.join(self.directory, 'runs.log')) as log:
+            return len(log.read().splitlines())
+
+    def tearDown(self):
+        """Remove the stub."""
+        self.chemaxonSettings.disable()
+        shutil.rmtree(self.directory)
+
+
+class StubCxcalc(StubTestCase):
+
+    """Runs batches of structures through a stub cxcalc."""
+
+    def test_single(self):
+        """Test that a single structure is run on the command line."""
+        self.assertEqual(chemaxon._run(['CCO'], COMMAND_ARGS), ([expected('CCO')], None))
+        self.assertEqual(self.runs(), 2)
+
+    def test_batch(self):
+        """Test that a batch of structures is run with one conformer run and one descriptor run."""
+        results = chemaxon._results([(1, 'CCO', None), (2, 'CCCCO', None), (3, 'C', None)], COMMAND_ARGS)
+        self.assertEqual(results, {1: ('CCO', expected('CCO')), 2: ('CCCCO', expected('CCCCO')), 3: ('C', expected('C'))})
+        self.assertEqual(self.runs(), 2)
+
+    def test_fallback(self):
+        """Test that a failed batch is run a compound at a time, falling back to the inchi of a bad smiles."""
+        inchi = INCHI
+        results = chemaxon._results([(1, 'CCO', None), (2, 'bad', inchi)], COMMAND_ARGS)
+        self.assertEqual(results, {1: ('CCO', expected('CCO')), 2: (inchi, expected(inchi))})
+        # the batch's conformer run, then both runs for CCO, one for bad and both for the inchi
+        self.assertEqual(self.runs(), 6)
+
+    def test_inchiOnly(self):
+        """Test that a compound without a smiles is run on its own, with its inchi."""
+        inchi = INCHI
+        results = chemaxon._results([(1, 'CCO', None), (2, 'CCCO', None), (3, None, inchi)], COMMAND_ARGS)
+        self.assertEqual(results, {1: ('CCO', expected('CCO')), 2: ('CCCO', expected('CCCO')), 3: (inchi, expected(inchi))})
+        self.assertEqual(self.runs(), 4)
+
+    def test_failure(self):
+        """Test that a compound which cannot be run is left out of the results, with a warning."""
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            results = chemaxon._results([(1, 'CCO', None), (2, 'bad', None)], COMMAND_ARGS)
+        self.assertEqual(results, {1: ('CCO', expected('CCO'))})
+        self.assertEqual(len(caught), 1)
+
+
+class CachedCxcalc(StubTestCase):
+
+    """Caches the results of a stub cxcalc."""
+
+    def setUp(self):
+        """Install the stub, and open a calculator cache in its directory."""
+        super(CachedCxcalc, self).setUp()
+        self.cacheSettings = override_settings(CALCULATOR_CACHE_DIR=os.path.join(self.directory, 'cache'))
+        self.cacheSettings.enable()
+        self.cache = CalculatorCache(chemaxon.calculatorSoftware, chemaxon.CHEMAXON_VERSION)
+
+    def cachedResults(self, *compounds):
+        """Return the results for compounds, taking them from the cache where they are cached."""
+        return chemaxon._cachedResults(list(compounds), COMMANDS, self.cache, map)
+
+    def cached(self, structure):
+        """Return the cached results for a structure."""
+        cached = self.cache.get([structure], COMMANDS.values())
+        return [cached[(structure, command)] for command in COMMANDS.values()] if cached else None
+
+    def test_smilesKey(self):
+        """Test that results calculated from a smiles are cached by the smiles, not the inchi."""
+        results = self.cachedResults(Compound(pk=1, smiles='CCO', INCHI=INCHI))
+        self.assertEqual(results, {1: expected('CCO')})
+        self.assertEqual(self.cached('CCO'), expected('CCO'))
+        self.assertIsNone(self.cached(INCHI))
+
+    def test_inchiKey(self):
+        """Test that results calculated from the inchi of a bad smiles are cached by the inchi."""
+        results = self.cachedResults(Compound(pk=1, smiles='CCO', INCHI=''), Compound(pk=2, smiles='bad', INCHI=INCHI))
+        self.assertEqual(results, {1: expected('CCO'), 2: expected(INCHI)})
+        self.assertIsNone(self.cached('bad'))
+        self.assertEqual(self.cached(INCHI), expected(INCHI))
+
+    def test_sharedInchi(self):
+        """Test that a compound with only an inchi is not given the results of another compound's smiles."""
+        self.cachedResults(Compound(pk=1, smiles='CCO', INCHI=INCHI))
+        self.assertEqual(self.cachedResults(Compound(pk=2, smiles='', INCHI=INCHI)), {2: expected(INCHI)})
+
+    def test_hit(self):
+        """Test that cached results are not calculated again."""
+        self.cachedResults(Compound(pk=1, smiles='CCO', INCHI=INCHI))
+        runs = self.runs()
+        self.assertEqual(self.cachedResults(Compound(pk=2, smiles='CCO', INCHI='')), {2: expected('CCO')})
+        self.assertEqual(self.runs(), runs)
+
+    def tearDown(self):
+        """Close the cache and remove the stub."""
+        self.cache.close()
+        self.cacheSettings.disable()
+        super(CachedCxcalc, self).tearDown()
+
+
+suite = unittest.TestSuite([
+    loadTests(StubCxcalc),
+    loadTests(CachedCxcalc),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Tests for the memoised dictionary of descriptors of the drp reaction descriptor plugin."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsCompoundRole
+from DRP.plugins.rxndescriptors import drp
+from DRP.models import CompoundRole, Descriptor
+from django.db import transaction
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+
+class RolledBack(Exception):
+
+    """Raised to roll back a transaction."""
+
+    pass
+
+
+@createsCompoundRole('Org', 'Organic')
+class MadeDicts(DRPTestCase):
+
+    """Makes the dictionary of descriptors inside and outside of transactions."""
+
+    def assertExist(self, descriptorDict):
+        """Assert that every descriptor in the dictionary is in the database."""
+        pks = [descriptor.pk for descriptor in descriptorDict.values()]
+        self.assertEqual(Descriptor.objects.filter(pk__in=pks).count(), len(pks))
+
+    def rolledBack(self, function):
+        """Call function in a transaction which is then rolled back."""
+        with self.assertRaises(RolledBack):
+            with transaction.atomic():
+                function()
+                raise RolledBack()
+
+    def test_memoised(self):
+        """Test that the definitions are reused while no definition changes."""
+        descriptorDict, pHDescriptors = drp.make_dict()
+        self.assertIs(drp.make_dict()[1], pHDescriptors)
+        self.assertEqual(dict(drp.make_dict()[0].items()), dict(descriptorDict.items()))
+        self.assertExist(descriptorDict)
+
+    def test_rolledBackDescriptors(self):
+        """Test that descriptors created in a transaction which was rolled back are created again."""
+        self.rolledBack(drp.make_dict)
+        self.assertExist(drp.make_dict()[0])
+
+    def test_rolledBackRole(self):
+        """Test that descriptors for a compound role created in a transaction which was rolled back are forgotten."""
+        drp.make_dict()
+
+        def createRole():
+            CompoundRole.objects.create(label='Ghost', description='Rolled back')
+            self.assertIn('Ghost_amount_count', drp.make_dict()[0])
+
+        self.rolledBack(createRole)
+        descriptorDict = drp.make_dict()[0]
+        self.assertNotIn('Ghost_amount_count', descriptorDict)
+        self.assertIn('Org_amount_count', descriptorDict)
+        self.assertExist(descriptorDict)
+
+
+suite = unittest.TestSuite([
+    loadTests(MadeDicts),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Tests that the element table aggregates element properties as the compound at a time calculation did."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.models import Compound
+from DRP.plugins.moldescriptors import drp
+from DRP.plugins.moldescriptors.elementTable import ElementTable
+from scipy.stats import gmean
+import numpy as np
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+FORMULAE = ('CuSO_{4}', 'Na_{2}MoO_{4}', 'K_{2}Cr_{2}O_{7}', 'V_{2}O_{5}', 'ZnSe', 'Fe_{3}O_{4}',
+            'PbBiTe_{2}_O_{0.5}', 'C_{6}H_{12}O_{6}')
+
+
+def oldAggregates(compound, prop):
+    """Return the geom_unw, geom_stoich, max and range of a property over the inorganic elements of a compound, as they were calculated one compound at a time."""
+    inorganic = [(element, info) for element, info in compound.elements.items() if element in drp.inorgElements]
+    if not inorganic:
+        return None
+    normalisation = sum(info['stoichiometry'] for element, info in inorganic)
+    values = [drp.inorgElements[element][prop] for element, info in inorganic]
+    weighted = [drp.inorgElements[element][prop] * float(info['stoichiometry'] / normalisation) for element, info in inorganic]
+    return {
+        'geom_unw': 0 if any(value == 0 for value in values) else gmean(values),
+        'geom_stoich': 0 if any(value == 0 for value in weighted) else gmean(weighted),
+        'max': max(values),
+        'range': max(values) - min(values),
+    }
+
+
+class Aggregates(DRPTestCase):
+
+    """Aggregates the properties of the inorganic elements of compounds."""
+
+    def setUp(self):
+        """Set up a table of the drp plugin's elements and properties."""
+        self.table = ElementTable(drp.elements, drp.inorgAtomicProperties, drp.inorgElements)
+        self.compounds = [Compound(formula=formula) for formula in FORMULAE]
+
+    def test_aggregates(self):
+        """Test that the geometric means, maxima and ranges are those calculated one compound at a time."""
+        aggregates = self.table.aggregates(self.table.stoichiometries(self.compounds))
+        for i, compound in enumerate(self.compounds):
+            for k, prop in enumerate(drp.inorgAtomicProperties):
+                expected = oldAggregates(compound, prop)
+                self.assertEqual(aggregates['inorganic'][i], expected is not None)
+                if expected is not None:
+                    for aggregate, value in expected.items():
+                        self.assertAlmostEqual(aggregates[aggregate][i, k], value, places=9,
+                                               msg='{} {} of {}'.format(aggregate, prop, compound.formula))
+
+    def test_zero(self):
+        """Test that a geometric mean including a zero value is zero, as scipy gives."""
+        aggregates = self.table.aggregates(self.table.stoichiometries([Compound(formula='ZnSe')]))
+        k = drp.inorgAtomicProperties.index('electron_affinity')
+        self.assertEqual((aggregates['geom_unw'][0, k], aggregates['geom_stoich'][0, k]), (0, 0))
+
+    def test_negative(self):
+        """Test that a geometric mean including a negative value is flagged."""
+        elements = {symbol: dict(info) for symbol, info in drp.elements.items()}
+        elements['Cu']['hardness'] = -1.0
+        table = ElementTable(elements, drp.inorgAtomicProperties, drp.inorgElements)
+        aggregates = table.aggregates(table.stoichiometries([Compound(formula='CuSO_{4}')]))
+        k = drp.inorgAtomicProperties.index('hardness')
+        self.assertTrue(aggregates['negative_unw'][0, k])
+        self.assertTrue(np.isnan(aggregates['geom_unw'][0, k]))
+
+
+class Memo(DRPTestCase):
+
+    """Memoises the stoichiometry vectors of compounds."""
+
+    def test_memoised(self):
+        """Test that a formula is parsed once."""
+        table = ElementTable(drp.elements, drp.inorgAtomicProperties, drp.inorgElements)
+        vector = table.stoichiometry(Compound(formula='CuSO_{4}'))
+        self.assertIs(table.stoichiometry(Compound(formula='CuSO_{4}')), vector)
+
+    def test_bounded(self):
+        """Test that no more vectors than the memo size are memoised."""
+        table = ElementTable(drp.elements, drp.inorgAtomicProperties, drp.inorgElements, memoSize=3)
+        for formula in FORMULAE:
+            table.stoichiometry(Compound(formula=formula))
+            self.assertLessEqual(len(table._vectors), 3)
+        np.testing.assert_array_equal(table.stoichiometries([Compound(formula=formula) for formula in FORMULAE]),
+                                      ElementTable(drp.elements, drp.inorgAtomicProperties, drp.inorgElements)
+                                      .stoichiometries([Compound(formula=formula) for formula in FORMULAE]))
+
+
+suite = unittest.TestSuite([
+    loadTests(Aggregates),
+    loadTests(Memo),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Tests for the queue of reaction exports rendered in the background."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup, createsPerformedReaction
+from DRP.models import ExportJob, PerformedReaction, dataVersion
+from DRP.models.ExportJob import QUEUED, RUNNING, DONE, FAILED
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from django.db import transaction
+import tempfile
+import shutil
+import os
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+
+@createsUser('Aslan', 'old_magic')
+@createsUser('WhiteQueen', 'turkish_delight')
+@joinsLabGroup('Aslan', 'narnia')
+@createsPerformedReaction('narnia', 'Aslan', 'lamp_post')
+class ExportJobs(DRPTestCase):
+
+    """Queues, renders and authorises exports of a lab group's reactions."""
+
+    def setUp(self):
+        """Render exports into a temporary directory."""
+        self.directory = tempfile.mkdtemp()
+        self.exportSettings = override_settings(EXPORT_DIR=self.directory)
+        self.exportSettings.enable()
+        self.reactions = PerformedReaction.objects.filter(labGroup__title='narnia')
+        self.job = ExportJob.objects.enqueue(self.reactions, 'csv', user=User.objects.get(username='Aslan'))
+
+    def test_enqueue(self):
+        """Test that an export requested again, by anyone, finds the job already queued."""
+        job = ExportJob.objects.enqueue(self.reactions, 'csv', user=User.objects.get(username='WhiteQueen'))
+        self.assertEqual(job.pk, self.job.pk)
+        self.assertEqual(job.state, QUEUED)
+
+    def test_enqueueChanged(self):
+        """Test that an export requested after the reaction data has changed is queued afresh."""
+        dataVersion.bump()
+        job = ExportJob.objects.enqueue(self.reactions, 'csv')
+        self.assertNotEqual(job.pk, self.job.pk)
+        self.assertFalse(ExportJob.objects.get(pk=self.job.pk).isCurrent)
+
+    def test_enqueueMidTransaction(self):
+        """Test that an export queued while a change is being committed is not current once it has been."""
+        with transaction.atomic():
+            PerformedReaction.objects.filter(labGroup__title='narnia').update(notes='changed')
+            # as another process would, seeing the new version but the data committed before it
+            job = ExportJob.objects.enqueue(self.reactions, 'csv')
+            self.assertTrue(job.isCurrent)
+        self.assertFalse(ExportJob.objects.get(pk=job.pk).isCurrent)
+
+    def test_enqueueFailed(self):
+        """Test that an export which failed is queued again when it is next requested."""
+        ExportJob.objects.filter(pk=self.job.pk).update(state=FAILED, error='Boom')
+        job = ExportJob.objects.enqueue(self.reactions, 'csv')
+        self.assertEqual(job.pk, self.job.pk)
+        self.assertEqual((job.state, job.error), (QUEUED, ''))
+
+    def test_claim(self):
+        """Test that a queued job is claimed by only one worker."""
+        self.assertTrue(self.job.claim())
+        self.assertEqual(self.job.state, RUNNING)
+        self.assertFalse(ExportJob.objects.get(pk=self.job.pk).claim())
+
+    def test_render(self):
+        """Test that a rendered export is written to EXPORT_DIR, outside MEDIA_ROOT."""
+        self.job.claim()
+        self.job.render()
+        job = ExportJob.objects.get(pk=self.job.pk)
+        self.assertEqual(job.state, DONE)
+        self.assertIsNotNone(job.finishedTime)
+        self.assertEqual(os.path.dirname(job.artifact.path), self.directory)
+        self.assertFalse(job.artifact.path.startswith(settings.MEDIA_ROOT))
+        with open(job.artifact.path) as f:
+            self.assertIn('lamp_post', f.read())
+
+    def test_visibleToMember(self):
+        """Test that a member of the lab group may see the export, whoever requested it."""
+        self.assertTrue(self.job.visibleTo(User.objects.get(username='Aslan')))
+
+    def test_hiddenFromOthers(self):
+        """Test that a user outside the lab group may not see the export of its private reactions."""
+        self.assertFalse(self.job.visibleTo(User.objects.get(username='WhiteQueen')))
+
+    def test_visiblePublic(self):
+        """Test that anyone may see an export of public reactions."""
+        PerformedReaction.objects.filter(reference='lamp_post').update(public=True)
+        self.assertTrue(self.job.visibleTo(User.objects.get(username='WhiteQueen')))
+
+    def test_expandedHidden(self):
+        """Test that only staff may see an expanded export."""
+        job = ExportJob.objects.enqueue(self.reactions, 'csv', expanded=True)
+        self.assertFalse(job.visibleTo(User.objects.get(username='Aslan')))
+
+    def tearDown(self):
+        """Delete the exports and their directory."""
+        for job in ExportJob.objects.all():
+            job.delete()
+        self.exportSettings.disable()
+        shutil.rmtree(self.directory)
+
+
+suite = unittest.TestSuite([
+    loadTests(ExportJobs),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
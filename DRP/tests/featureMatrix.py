@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""Tests for the on-disk feature matrix cache of reaction descriptor values."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup
+from DRP.models import featureMatrix, PerformedReaction, LabGroup, OrdRxnDescriptor, OrdRxnDescriptorValue
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from django.db import transaction
+import tempfile
+import shutil
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+class CachedValues(DRPTestCase):
+
+    """Reads reaction descriptor values through a feature matrix in a temporary directory."""
+
+    def setUp(self):
+        """Enable the cache and create a reaction with one ordinal descriptor value."""
+        self.directory = tempfile.mkdtemp()
+        self.cacheSettings = override_settings(FEATURE_MATRIX_DIR=self.directory)
+        self.cacheSettings.enable()
+        self.reaction = PerformedReaction.objects.create(labGroup=LabGroup.objects.get(title='narnia'),
+                                                         user=User.objects.get(username='Aslan'), reference='turkish_delight')
+        self.descriptor = OrdRxnDescriptor.objects.create(name='outcome', heading='outcome', minimum=1, maximum=4,
+                                                          calculatorSoftware='manual', calculatorSoftwareVersion='0')
+        self.value = OrdRxnDescriptorValue.objects.create(reaction=self.reaction, descriptor=self.descriptor, value=1)
+        self.cell = ([self.reaction.pk], [(self.descriptor.pk, 'ord')])
+
+    def select(self):
+        """Return the cached value of the cell and whether it is present."""
+        values, present = featureMatrix.store().select(*self.cell)
+        return values[0, 0], present[0, 0]
+
+    def test_read(self):
+        """Test that a value is loaded into the cache, and read back from it."""
+        self.assertEqual(self.select(), (1, True))
+        self.assertEqual(self.select(), (1, True))
+
+    def test_save(self):
+        """Test that saving a value invalidates its cell."""
+        self.select()
+        self.value.value = 2
+        self.value.save()
+        self.assertEqual(self.select(), (2, True))
+
+    def test_update(self):
+        """Test that updating values through a queryset invalidates their cells."""
+        self.select()
+        OrdRxnDescriptorValue.objects.filter(reaction=self.reaction).update(value=3)
+        self.assertEqual(self.select(), (3, True))
+
+    def test_deleteValue(self):
+        """Test that deleting a value invalidates its cell."""
+        self.select()
+        self.value.delete()
+        self.assertFalse(self.select()[1])
+
+    def test_deleteDescriptor(self):
+        """Test that deleting a descriptor invalidates the values deleted along with it."""
+        self.select()
+        self.descriptor.descriptor_ptr.delete()
+        self.assertFalse(self.select()[1])
+
+    def test_deleteReaction(self):
+        """Test that deleting a reaction forgets its cached values."""
+        self.select()
+        PerformedReaction.objects.filter(pk=self.reaction.pk).delete()
+        self.assertFalse(self.select()[1])
+
+    def test_deleteLabGroup(self):
+        """Test that the values of reactions deleted along with their lab group are forgotten."""
+        self.select()
+        LabGroup.objects.filter(title='narnia').delete()
+        self.assertFalse(self.select()[1])
+
+    def cacheOldValue(self, value):
+        """Mark the cell as holding a value, as another process reading the committed value mid-transaction would."""
+        store = featureMatrix.FeatureMatrix()
+        position = store.positions[self.reaction.pk]
+        values = store._column(self.descriptor.pk, 'values')
+        loaded = store._column(self.descriptor.pk, 'loaded')
+        values[position] = value
+        loaded[position] = featureMatrix.PRESENT
+        values.flush()
+        loaded.flush()
+
+    def test_commit(self):
+        """Test that a value cached by another process before the transaction commits is invalidated once it has."""
+        self.select()
+        with transaction.atomic():
+            OrdRxnDescriptorValue.objects.filter(reaction=self.reaction).update(value=3)
+            self.cacheOldValue(1)
+            self.assertEqual(self.select(), (1, True))
+        self.assertEqual(self.select(), (3, True))
+
+    def test_rollback(self):
+        """Test that a value cached from a write which is rolled back is invalidated."""
+        self.select()
+        try:
+            with transaction.atomic():
+                self.value.value = 2
+                self.value.save()
+                self.assertEqual(self.select(), (2, True))
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(self.select(), (1, True))
+
+    def test_nestedCommit(self):
+        """Test that cells are invalidated again only once the outermost atomic block has committed."""
+        self.select()
+        with transaction.atomic():
+            with transaction.atomic():
+                self.value.value = 4
+                self.value.save()
+            self.cacheOldValue(1)
+            self.assertEqual(self.select(), (1, True))
+        self.assertEqual(self.select(), (4, True))
+
+    def test_sharedStore(self):
+        """Test that one store is used per process, and that it reloads its index once another store extends it."""
+        store = featureMatrix.store()
+        self.assertIs(featureMatrix.store(), store)
+        other = PerformedReaction.objects.create(labGroup=self.reaction.labGroup, user=self.reaction.user, reference='lamp_post')
+        featureMatrix.FeatureMatrix().select([other.pk], self.cell[1])
+        self.assertNotIn(other.pk, store.positions)
+        self.assertIs(featureMatrix.store(), store)
+        self.assertIn(other.pk, store.positions)
+
+    def tearDown(self):
+        """Disable the cache and delete its directory."""
+        self.cacheSettings.disable()
+        shutil.rmtree(self.directory)
+
+
+suite = unittest.TestSuite([
+    loadTests(CachedValues),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
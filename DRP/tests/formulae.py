@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""Tests for the parsing of molecular formulae into stoichiometries."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.models import Compound
+from DRP.models.Compound import parseFormula, repeatsElements, storedStoichiometry, loadStoichiometry, elementsFormatValidator
+from DRP.plugins.moldescriptors import drp
+from django.core.exceptions import ValidationError
+from decimal import Decimal
+import warnings
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+WELL_FORMED = ('C_{4}H_{8}', 'CuSO_{4}', 'Na_{2}MoO_{4}', 'C{2}H{4}C{1}', 'CHC', 'C_{2}HC', 'V_{.5}O_{2.}',
+               'cu{2}', 'hO', 'C{2}h', '_C__H_{3}_', '')
+MALFORMED = ('C2H6', '{2}', 'C{}', 'C{1.2.3}', 'C{2', 'C}', 'C H', 'C(OH)_{2}')
+
+
+def originalElements(formula):
+    """Return the stoichiometry of a formula accepted by the original validator, as the original Compound.elements read it."""
+    elements = {}
+    inBrackets = False
+    currentElement = ''
+    strStoichiometry = ''
+    for char in formula:
+        if inBrackets:
+            if currentElement not in elements:
+                elements[currentElement] = {'stoichiometry': 0}
+            if char in (str(x) for x in range(0, 10)) or char == '.':
+                strStoichiometry += char
+            elif char == '}':
+                inBrackets = False
+                elements[currentElement]['stoichiometry'] += Decimal(strStoichiometry)
+                currentElement = ''
+                strStoichiometry = ''
+        elif char.isalpha():
+            if char.isupper():
+                if currentElement != '':
+                    if currentElement in elements:
+                        elements[currentElement]['stoichiometry'] += 1
+                    else:
+                        elements[currentElement] = {'stoichiometry': 1}
+                currentElement = char
+            else:
+                currentElement += char
+        elif char == '{':
+            inBrackets = True
+    if currentElement != '':
+        elements[currentElement] = {'stoichiometry': 1}
+    return {element: Decimal(info['stoichiometry']) for element, info in elements.items()}
+
+
+class ParseFormula(DRPTestCase):
+
+    """Parses molecular formulae."""
+
+    def test_original(self):
+        """Test that well formed formulae have the stoichiometry they always had."""
+        for formula in WELL_FORMED:
+            self.assertEqual(parseFormula(formula), originalElements(formula), formula)
+
+    def test_counts(self):
+        """Test that counts in braces are read as Decimals, and elements without one counted once."""
+        self.assertEqual(parseFormula('Na_{2}MoO_{4}'), {'Na': Decimal(2), 'Mo': Decimal(1), 'O': Decimal(4)})
+        self.assertEqual(parseFormula('V_{.5}O_{2.}'), {'V': Decimal('0.5'), 'O': Decimal(2)})
+
+    def test_lowerCase(self):
+        """Test that a formula starting with a lower case letter is accepted, as it always was."""
+        self.assertEqual(parseFormula('cu{2}'), {'cu': Decimal(2)})
+        elementsFormatValidator('cu{2}')
+
+    def test_repeats(self):
+        """Test that repeated elements are summed, except for a repeat ending the formula without a count."""
+        self.assertEqual(parseFormula('C{2}H{4}C{1}'), {'C': Decimal(3), 'H': Decimal(4)})
+        self.assertEqual(parseFormula('CHCH_{2}'), {'C': Decimal(2), 'H': Decimal(3)})
+        self.assertEqual(parseFormula('C_{2}HC'), {'C': Decimal(1), 'H': Decimal(1)})
+        self.assertTrue(all(repeatsElements(formula) for formula in ('C{2}H{4}C{1}', 'CHCH_{2}', 'C_{2}HC')))
+        self.assertFalse(repeatsElements('CuSO_{4}'))
+
+    def test_malformed(self):
+        """Test that malformed formulae raise ValueError, fail validation and are stored without a stoichiometry."""
+        for formula in MALFORMED:
+            self.assertRaises(ValueError, parseFormula, formula)
+            self.assertRaises(ValidationError, elementsFormatValidator, formula)
+            self.assertEqual(storedStoichiometry(formula), '')
+
+    def test_stored(self):
+        """Test that the stored stoichiometry loads as the parsed one."""
+        for formula in WELL_FORMED:
+            self.assertEqual(loadStoichiometry(storedStoichiometry(formula)), parseFormula(formula))
+
+    def test_elements(self):
+        """Test that a compound's elements are those of its formula."""
+        compound = Compound(formula='CuSO_{4}')
+        self.assertEqual(compound.elements, {element: {'stoichiometry': count} for element, count in parseFormula('CuSO_{4}').items()})
+        compound.formula = 'C2H6'
+        self.assertRaises(ValueError, lambda: compound.elements)
+
+    def test_descriptors(self):
+        """Test that the drp molecular descriptors skip a compound with a malformed formula, with a warning."""
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            num, boolean = drp._calculate([Compound(pk=1, formula='C2H6'), Compound(pk=2, formula='CuSO_{4}')],
+                                          whitelist=['drpInorgAtomHardness_max', 'boolean_period_4'])
+        self.assertEqual(len(caught), 1)
+        self.assertEqual([value.compound.pk for value in num + boolean], [2, 2])
+
+
+suite = unittest.TestSuite([
+    loadTests(ParseFormula),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""Tests that the cached export headers follow changes to compound quantities."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup, createsPerformedReaction, createsCompoundRole
+from DRP.tests.decorators import createsChemicalClass, createsCompound
+from DRP.models import PerformedReaction, Compound, CompoundRole, CompoundQuantity
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+@createsPerformedReaction('narnia', 'Aslan', 'turkish_delight')
+@createsChemicalClass('Org', 'Organic')
+@createsCompound('EtOH', 682, 'Org', 'narnia', custom=True)
+@createsCompound('dmed', 67600, 'Org', 'narnia', custom=True)
+@createsCompoundRole('Org', 'Organic')
+class CompoundQuantities(DRPTestCase):
+
+    """Changes the compound quantities of a reaction through querysets."""
+
+    def setUp(self):
+        """Set up the compound quantities to create."""
+        reaction = PerformedReaction.objects.get(reference='turkish_delight')
+        role = CompoundRole.objects.get(label='Org')
+        self.quantities = [CompoundQuantity(reaction=reaction, compound=Compound.objects.get(abbrev=abbrev), role=role, amount=amount)
+                           for abbrev, amount in (('EtOH', 0.1), ('dmed', 0.2))]
+
+    def maxReactantCount(self):
+        """Return the maximum reactant count, as cached by the header registry."""
+        return PerformedReaction.objects.all().globalMaxReactantCount()
+
+    def test_bulkCreate(self):
+        """Test that bulk creating compound quantities invalidates the cached headers."""
+        self.assertEqual(self.maxReactantCount(), 0)
+        CompoundQuantity.objects.bulk_create(self.quantities)
+        self.assertEqual(self.maxReactantCount(), 2)
+
+    def test_delete(self):
+        """Test that deleting compound quantities through a queryset invalidates the cached headers."""
+        CompoundQuantity.objects.bulk_create(self.quantities)
+        self.assertEqual(self.maxReactantCount(), 2)
+        CompoundQuantity.objects.filter(compound__abbrev='dmed').delete()
+        self.assertEqual(self.maxReactantCount(), 1)
+
+    def test_deleteInstance(self):
+        """Test that deleting a compound quantity deletes it, and invalidates the cached headers."""
+        CompoundQuantity.objects.bulk_create(self.quantities)
+        self.assertEqual(self.maxReactantCount(), 2)
+        CompoundQuantity.objects.get(compound__abbrev='dmed').delete()
+        self.assertFalse(CompoundQuantity.objects.filter(compound__abbrev='dmed').exists())
+        self.assertEqual(self.maxReactantCount(), 1)
+
+
+suite = unittest.TestSuite([
+    loadTests(CompoundQuantities),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
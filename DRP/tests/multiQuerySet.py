@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""Tests that a multiqueryset run as one UNION ALL query gives what chaining its querysets one after another gives."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup
+from DRP.models import PerformedReaction, LabGroup, CategoricalDescriptorPermittedValue
+from DRP.models import BoolRxnDescriptor, NumRxnDescriptor, OrdRxnDescriptor, CatRxnDescriptor
+from DRP.models import BoolRxnDescriptorValue, NumRxnDescriptorValue, OrdRxnDescriptorValue, CatRxnDescriptorValue
+from DRP.models.querysets import MultiQuerySet
+from django.contrib.auth.models import User
+from django.core.exceptions import FieldError
+from django.db import connection
+from django.db.models import F, DecimalField, ExpressionWrapper
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from decimal import Decimal
+from itertools import chain
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+DESCRIPTOR_TYPES = (BoolRxnDescriptor, NumRxnDescriptor, OrdRxnDescriptor, CatRxnDescriptor)
+
+
+def snapshot(instance, annotations=()):
+    """Return the type of an instance with the representation of each of its field values and the given annotations, so that (e.g.) 1 and True differ."""
+    values = [(field.attname, repr(getattr(instance, field.attname))) for field in instance._meta.concrete_fields]
+    values += [(name, repr(getattr(instance, name))) for name in annotations]
+    return type(instance), values
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+class Descriptors(DRPTestCase):
+
+    """Combines querysets of each type of reaction descriptor, which use multi-table inheritance."""
+
+    def setUp(self):
+        """Create descriptors of each type in turn, so that their primary keys interleave, some with null fields."""
+        manual = {'calculatorSoftware': 'manual', 'calculatorSoftwareVersion': '0'}
+        for i in range(3):
+            BoolRxnDescriptor.objects.create(name='flag', heading='mqsFlag{}'.format(i), **manual)
+            NumRxnDescriptor.objects.create(name='number', heading='mqsNumber{}'.format(i), maximum=None if i else 2.5,
+                                            minimum=0.5, **manual)
+            OrdRxnDescriptor.objects.create(name='grade', heading='mqsGrade{}'.format(i), minimum=1, maximum=3 + i, **manual)
+            CatRxnDescriptor.objects.create(name='colour', heading='mqsColour{}'.format(2 - i), **manual)
+        self.querysets = [descriptorType.objects.filter(heading__startswith='mqs') for descriptorType in DESCRIPTOR_TYPES]
+
+    def multi(self):
+        """Return a multiqueryset of the descriptors."""
+        return MultiQuerySet(*self.querysets)
+
+    def chained(self):
+        """Return the descriptors as chaining their querysets in primary key order gives them."""
+        return list(chain(*[qs.order_by('pk') for qs in self.querysets]))
+
+    def assertSame(self, instances, expected):
+        """Assert that two lists of descriptors have the same types, field values and headers, in the same order."""
+        self.assertEqual([snapshot(d, ('csvHeader',)) for d in instances], [snapshot(d, ('csvHeader',)) for d in expected])
+
+    def test_instances(self):
+        """Test that the instances of each descriptor type, with their parent model fields, are those the querysets give."""
+        instances = list(self.multi())
+        self.assertEqual(len(instances), 12)
+        self.assertSame(instances, self.chained())
+        for instance in instances:
+            self.assertEqual(instance.descriptor_ptr.heading, instance.heading)
+
+    def test_nullColumns(self):
+        """Test that columns only some descriptor types have are not set on the others, and that null values stay null."""
+        instances = list(self.multi())
+        numbers = [d for d in instances if isinstance(d, NumRxnDescriptor)]
+        self.assertEqual([d.maximum for d in numbers], [2.5, None, None])
+        self.assertTrue(all(isinstance(d.maximum, int) for d in instances if isinstance(d, OrdRxnDescriptor)))
+        self.assertFalse(any(hasattr(d, 'maximum') for d in instances if isinstance(d, (BoolRxnDescriptor, CatRxnDescriptor))))
+
+    def test_converters(self):
+        """Test that an annotation of one queryset is converted from the database's representation, despite the queryset number column before it."""
+        self.querysets[1] = self.querysets[1].annotate(
+            limit=ExpressionWrapper(F('maximum'), output_field=DecimalField(max_digits=5, decimal_places=2)))
+        instances = list(self.multi())
+        self.assertSame(instances, self.chained())
+        self.assertEqual([snapshot(d, ('limit',)) for d in instances if isinstance(d, NumRxnDescriptor)],
+                         [snapshot(d, ('limit',)) for d in self.querysets[1].order_by('pk')])
+        self.assertEqual([d.limit for d in instances if isinstance(d, NumRxnDescriptor)], [Decimal('2.50'), None, None])
+
+    def test_count(self):
+        """Test counting and checking for descriptors, including where every queryset is empty or some are."""
+        self.assertEqual(self.multi().count(), 12)
+        self.assertEqual(len(self.multi()), 12)
+        self.assertTrue(self.multi().exists())
+        self.assertEqual(self.multi().filter(heading__startswith='mqsF').count(), 3)
+        self.assertTrue(self.multi().filter(heading__startswith='mqsF').exists())
+        self.assertEqual(self.multi().none().count(), 0)
+        self.assertFalse(self.multi().none().exists())
+        self.assertFalse(self.multi().filter(heading='nothing').exists())
+        self.assertEqual(list(self.multi().none()), [])
+
+    def test_slice(self):
+        """Test that slices and indices, made with LIMIT and OFFSET, are those of the chained querysets."""
+        expected = self.chained()
+        for start, stop, step in ((None, 4, None), (2, 5, None), (3, None, None), (5, 40, None), (1, 8, 2), (12, None, None)):
+            self.assertSame(self.multi()[start:stop:step], expected[start:stop:step])
+        self.assertSame([self.multi()[5], self.multi()[11]], [expected[5], expected[11]])
+        self.assertRaises(IndexError, lambda: self.multi()[12])
+        self.assertRaises(ValueError, lambda: self.multi()[-1])
+
+    def test_orderBy(self):
+        """Test ordering across the querysets by a shared column, with ties broken by queryset then primary key."""
+        expected = self.chained()
+        self.assertSame(list(self.multi().order_by('heading')), sorted(expected, key=lambda d: d.heading))
+        self.assertSame(list(self.multi().order_by('-csvHeader')), sorted(expected, key=lambda d: d.csvHeader, reverse=True))
+        self.assertSame(list(self.multi().order_by('-pk')), sorted(expected, key=lambda d: d.pk, reverse=True))
+        self.assertSame(list(self.multi().order_by('name')), sorted(expected, key=lambda d: d.name))
+        self.assertSame(self.multi().order_by('heading')[3:7], sorted(expected, key=lambda d: d.heading)[3:7])
+
+    def test_orderByMixedTypes(self):
+        """Test that ordering by a field with a different type in different querysets is refused."""
+        self.assertRaises(FieldError, list, self.multi().order_by('maximum'))
+        self.assertRaises(FieldError, list, self.multi().order_by('nothing'))
+
+    def tearDown(self):
+        """Delete the descriptors."""
+        for descriptorType in DESCRIPTOR_TYPES:
+            descriptorType.objects.filter(heading__startswith='mqs').delete()
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+class Values(DRPTestCase):
+
+    """Combines querysets of each type of a reaction's descriptor values."""
+
+    def setUp(self):
+        """Create a reaction with boolean, numeric, ordinal and categorical values, some of them null."""
+        manual = {'calculatorSoftware': 'manual', 'calculatorSoftwareVersion': '0'}
+        self.reaction = PerformedReaction.objects.create(labGroup=LabGroup.objects.get(title='narnia'),
+                                                         user=User.objects.get(username='Aslan'), reference='wardrobe',
+                                                         performedDateTime=timezone.now())
+        colour = CatRxnDescriptor.objects.create(name='colour', heading='mqsColour', **manual)
+        colours = [CategoricalDescriptorPermittedValue.objects.create(descriptor=colour, value=value) for value in ('red', 'white')]
+        for i, value in enumerate((True, False, None)):
+            flag = BoolRxnDescriptor.objects.create(name='flag', heading='mqsFlag{}'.format(i), **manual)
+            BoolRxnDescriptorValue.objects.create(reaction=self.reaction, descriptor=flag, value=value)
+        for i, value in enumerate((1.5, None)):
+            number = NumRxnDescriptor.objects.create(name='number', heading='mqsNumber{}'.format(i), **manual)
+            NumRxnDescriptorValue.objects.create(reaction=self.reaction, descriptor=number, value=value)
+        grade = OrdRxnDescriptor.objects.create(name='grade', heading='mqsGrade', minimum=1, maximum=4, **manual)
+        OrdRxnDescriptorValue.objects.create(reaction=self.reaction, descriptor=grade, value=3)
+        CatRxnDescriptorValue.objects.create(reaction=self.reaction, descriptor=colour, value=colours[1])
+        self.reaction = PerformedReaction.objects.get(pk=self.reaction.pk)
+
+    def chained(self, querysets):
+        """Return the values as chaining their querysets in primary key order gives them."""
+        return list(chain(*[qs.order_by('pk') for qs in querysets]))
+
+    def test_values(self):
+        """Test that the values, with booleans and nulls as the database holds them, are those the querysets give."""
+        values = self.reaction.descriptorValues
+        self.assertEqual([snapshot(v) for v in values], [snapshot(v) for v in self.chained(values.querysets)])
+        self.assertEqual([v.value for v in values if isinstance(v, BoolRxnDescriptorValue)], [True, False, None])
+
+    def test_annotations(self):
+        """Test that annotations across a relation are those the querysets give."""
+        values = self.reaction.descriptorValues.annotate(performed=F('reaction__performedreaction__performedDateTime'))
+        instances = list(values)
+        self.assertEqual([snapshot(v, ('performed',)) for v in instances],
+                         [snapshot(v, ('performed',)) for v in self.chained(values.querysets)])
+        self.assertTrue(all(v.performed == self.reaction.performedDateTime for v in instances))
+
+    def test_knownRelated(self):
+        """Test that the reaction of values from its related managers is known without a query."""
+        instances = list(self.reaction.descriptorValues)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(all(v.reaction is self.reaction for v in instances))
+        self.assertEqual(len(queries), 0)
+
+    def test_prefetch(self):
+        """Test that lookups prefetched for one of the querysets are made for its instances."""
+        querysets = [CatRxnDescriptorValue.objects.filter(reaction=self.reaction).prefetch_related('value'),
+                     OrdRxnDescriptorValue.objects.filter(reaction=self.reaction).prefetch_related('descriptor')]
+        instances = list(MultiQuerySet(*querysets))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual([instances[0].value.value, instances[1].descriptor.heading], ['white', 'mqsGrade'])
+        self.assertEqual(len(queries), 0)
+
+    def test_orderBy(self):
+        """Test ordering values by a shared column, and refusing to order by one with a different type in different querysets."""
+        values = self.reaction.descriptorValues
+        self.assertEqual([snapshot(v) for v in values.order_by('-descriptor')],
+                         [snapshot(v) for v in sorted(self.chained(values.querysets), key=lambda v: v.descriptor_id, reverse=True)])
+        self.assertRaises(FieldError, list, values.order_by('value'))
+
+    def tearDown(self):
+        """Delete the reaction and descriptors."""
+        PerformedReaction.objects.filter(pk=self.reaction.pk).delete()
+        for descriptorType in DESCRIPTOR_TYPES:
+            descriptorType.objects.filter(heading__startswith='mqs').delete()
+
+
+suite = unittest.TestSuite([
+    loadTests(Descriptors),
+    loadTests(Values),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""Tests for the pH curves of compounds, and their interpolation at the pH of a reaction."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup, createsPerformedReaction, createsCompoundRole
+from DRP.tests.decorators import createsChemicalClass, createsCompound
+from DRP.models import PerformedReaction, Compound, CompoundRole, CompoundQuantity, PHCurve
+from DRP.models.PHCurve import interpolate
+from DRP.plugins.moldescriptors import chemaxon
+from DRP.plugins.rxndescriptors.compoundTable import CompoundTable
+import numpy as np
+import warnings
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+
+class Interpolation(DRPTestCase):
+
+    """Interpolates the values of curves."""
+
+    def assertValues(self, values, expected):
+        """Assert that an array of values is as expected, with nan where expected is None."""
+        np.testing.assert_allclose(values, [np.nan if value is None else value for value in expected])
+
+    def test_points(self):
+        """Test that the values at the points of a curve are those calculated."""
+        self.assertValues(interpolate([0, 1, 2], [1, 3, 5], [0, 1, 2]), [1, 3, 5])
+
+    def test_between(self):
+        """Test that values between the points of a curve are linearly interpolated."""
+        self.assertValues(interpolate([0, 1, 2], [1, 3, 5], [0.5, 1.25]), [2, 3.5])
+
+    def test_missing(self):
+        """Test that points with no value are interpolated over."""
+        self.assertValues(interpolate([0, 1, 2], [1, np.nan, 5], [1, 1.5]), [3, 4])
+
+    def test_outside(self):
+        """Test that there are no values outside the range of the points with values."""
+        self.assertValues(interpolate([0, 1, 2], [np.nan, 3, 5], [-0.5, 0, 2.5]), [None, None, None])
+
+    def test_noValues(self):
+        """Test that a curve with no values has no values anywhere."""
+        self.assertValues(interpolate([0, 1], [np.nan, np.nan], [0, 0.5]), [None, None])
+
+    def test_unsorted(self):
+        """Test that the points of a curve are sorted by pH when they are set."""
+        curve = PHCurve()
+        curve.setPoints([2, 0, 1], [5, 1, None])
+        self.assertValues(curve.pHs, [0, 1, 2])
+        self.assertValues(curve.values, [1, None, 5])
+        self.assertValues(curve.at([0.5, 1]), [2, 3])
+
+    def test_outOfRange(self):
+        """Test that chemaxon results outside the range of a descriptor are left out of its curve."""
+        curveCommands = chemaxon._commands(['hbda_acc'])[1]
+        results = ['-1' if pH == 3 else str(pH) for heading, pH in curveCommands.keys()]
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            pHs, values = chemaxon._curves(Compound(pk=1), curveCommands, results)[(1, chemaxon.curveIdentity('hbda_acc'))]
+        self.assertEqual(len(caught), 1)
+        self.assertEqual(pHs, chemaxon.pH_curve_points)
+        self.assertIsNone(values[pHs.index(3)])
+        self.assertValues(interpolate(pHs, values, [3]), [3])
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+@createsPerformedReaction('narnia', 'Aslan', 'turkish_delight')
+@createsChemicalClass('Org', 'Organic')
+@createsCompound('EtOH', 682, 'Org', 'narnia', custom=True)
+@createsCompound('dmed', 67600, 'Org', 'narnia', custom=True)
+@createsCompoundRole('Org', 'Organic')
+class ReactionPH(DRPTestCase):
+
+    """Interpolates the curves of the compounds in a reaction at the reaction pH."""
+
+    def setUp(self):
+        """Give the compounds of the reaction curves on chemaxon's pH grid, with a missing point for one."""
+        reaction = PerformedReaction.objects.get(reference='turkish_delight')
+        role = CompoundRole.objects.get(label='Org')
+        self.identity = chemaxon.curveIdentity('avgpol')
+        for abbrev, slope, amount in (('EtOH', 2, 0.1), ('dmed', 3, 0.2)):
+            compound = Compound.objects.get(abbrev=abbrev)
+            CompoundQuantity.objects.create(reaction=reaction, compound=compound, role=role, amount=amount)
+            curve = PHCurve(compound=compound, heading=self.identity[0], calculatorSoftware=self.identity[1],
+                            calculatorSoftwareVersion=self.identity[2])
+            curve.setPoints(chemaxon.pH_curve_points, [None if abbrev == 'dmed' and pH == 3 else slope * pH
+                                                       for pH in chemaxon.pH_curve_points])
+            curve.save()
+        self.table = CompoundTable([reaction], pHCurves=[self.identity])
+        self.rows = [self.table.rows[Compound.objects.get(abbrev=abbrev).pk] for abbrev in ('EtOH', 'dmed')]
+
+    def pHValues(self, pH):
+        """Return the values of the compounds' curves at pH, in the order EtOH, dmed."""
+        return self.table.pHValues(self.rows, pH)[:, 0]
+
+    def test_curvePoints(self):
+        """Test that at every point of chemaxon's pH grid the values are those calculated at that pH."""
+        for pH in chemaxon.pH_curve_points:
+            np.testing.assert_allclose(self.pHValues(pH), [2 * pH, 3 * pH])
+
+    def test_between(self):
+        """Test that values between the points of the grid are linearly interpolated."""
+        np.testing.assert_allclose(self.pHValues(7.2), [14.4, 21.6])
+
+    def test_missing(self):
+        """Test that a point with no value is interpolated from its neighbours."""
+        np.testing.assert_allclose(self.pHValues(3), [6, 9])
+
+    def test_outside(self):
+        """Test that there are no values outside the pH grid, or without a reaction pH."""
+        for pH in (-0.5, 14.5, None):
+            self.assertTrue(np.isnan(self.pHValues(pH)).all())
+
+    def tearDown(self):
+        """Delete the curves and compound quantities."""
+        PHCurve.objects.all().delete()
+        CompoundQuantity.objects.all().delete()
+
+
+suite = unittest.TestSuite([
+    loadTests(Interpolation),
+    loadTests(ReactionPH),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
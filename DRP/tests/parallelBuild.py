@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Tests that building a model container in worker processes gives the same models as building it in this process."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup
+from DRP.models import PerformedReaction, LabGroup, ModelContainer, OrdRxnDescriptor, OrdRxnDescriptorValue
+from DRP.models import NumRxnDescriptor, NumRxnDescriptorValue, PredOrdRxnDescriptor, DataSet
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+import tempfile
+import shutil
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+class ParallelBuild(DRPTestCase):
+
+    """Builds duplicate model containers with and without worker processes."""
+
+    def setUp(self):
+        """Create reactions with a numeric predictor and an ordinal outcome, a container, and a duplicate of it with the same training and test sets."""
+        self.directory = tempfile.mkdtemp()
+        self.modelSettings = override_settings(MODEL_DIR=self.directory)
+        self.modelSettings.enable()
+        labGroup = LabGroup.objects.get(title='narnia')
+        user = User.objects.get(username='Aslan')
+        predictor = NumRxnDescriptor.objects.create(name='testNumber', heading='testNumber',
+                                                    calculatorSoftware='manual', calculatorSoftwareVersion='0')
+        response = OrdRxnDescriptor.objects.create(name='outcome', heading='outcome', minimum=1, maximum=4,
+                                                   calculatorSoftware='manual', calculatorSoftwareVersion='0')
+        for i in range(16):
+            reaction = PerformedReaction.objects.create(labGroup=labGroup, user=user, reference='R{:02}'.format(i))
+            NumRxnDescriptorValue.objects.create(reaction=reaction, descriptor=predictor, value=i * 0.5)
+            OrdRxnDescriptorValue.objects.create(reaction=reaction, descriptor=response, value=1 + (i * 7) % 4)
+        self.serial = ModelContainer.create('sklearn', 'J48', NumRxnDescriptor.objects.filter(pk=predictor.pk),
+                                            OrdRxnDescriptor.objects.filter(pk=response.pk), splitter='KFoldSplitter',
+                                            reactions=PerformedReaction.objects.filter(labGroup=labGroup))
+        self.parallel = self.serial.create_duplicate()
+
+    def predictions(self, container):
+        """Return the predictions of each stats model of a container in training set order, followed by the container's own."""
+        predictions = []
+        components = sorted(container.statsmodel_set.all(), key=lambda statsModel: statsModel.trainingSet_id)
+        for statsModel in components + [None]:
+            descriptor = PredOrdRxnDescriptor.objects.get(modelContainer=container, statsModel=statsModel)
+            predictions.append(sorted(OrdRxnDescriptorValue.objects.filter(
+                descriptor=descriptor.ordrxndescriptor_ptr).values_list('reaction_id', 'value')))
+        return predictions
+
+    def test_workers(self):
+        """Test that two workers build the same stats models and predictions as a build in this process."""
+        self.serial.build()
+        self.parallel.build(workers=2)
+        self.assertTrue(self.parallel.built)
+        self.assertTrue(all(statsModel.outputFile for statsModel in self.parallel.statsmodel_set.all()))
+        serialPredictions = self.predictions(self.serial)
+        self.assertEqual(len(serialPredictions), 5)
+        self.assertTrue(all(serialPredictions))
+        self.assertEqual(self.predictions(self.parallel), serialPredictions)
+
+    def tearDown(self):
+        """Delete the containers, their data sets and models, the reactions and the descriptors."""
+        self.parallel.delete()
+        self.serial.delete()
+        DataSet.objects.filter(pk__in=list(DataSet.objects.filter(
+            reactions__labGroup__title='narnia').values_list('pk', flat=True))).delete()
+        PerformedReaction.objects.filter(labGroup__title='narnia').delete()
+        NumRxnDescriptor.objects.filter(heading='testNumber').delete()
+        OrdRxnDescriptor.objects.filter(heading='outcome').delete()
+        self.modelSettings.disable()
+        shutil.rmtree(self.directory)
+
+
+suite = unittest.TestSuite([
+    loadTests(ParallelBuild),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""Tests for the streaming SQL pivot row engine."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup, createsPerformedReaction, createsOrdRxnDescriptor
+from DRP.models import PerformedReaction, OrdRxnDescriptor, OrdRxnDescriptorValue
+from DRP.models.pivotRows import _cursor
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+@createsPerformedReaction('narnia', 'Aslan', 'turkish_delight')
+@createsPerformedReaction('narnia', 'Aslan', 'lamp_post')
+@createsOrdRxnDescriptor('outcome', 1, 4)
+class PivotRows(DRPTestCase):
+
+    """Builds expanded rows with the pivot engine."""
+
+    def setUp(self):
+        """Set up the headers to export."""
+        self.reactions = PerformedReaction.objects.filter(labGroup__title='narnia')
+        self.headers = ['reference', OrdRxnDescriptor.objects.get(heading='outcome').csvHeader]
+
+    def rows(self, engine):
+        """Return the expanded rows built by an engine."""
+        with override_settings(REACTION_ROW_ENGINE=engine):
+            return list(self.reactions.rowTuples(self.headers, expanded=True))
+
+    def test_matchesRows(self):
+        """Test that the pivot engine builds the same rows as the default engine."""
+        OrdRxnDescriptorValue.objects.create(reaction=PerformedReaction.objects.get(reference='lamp_post'),
+                                             descriptor=OrdRxnDescriptor.objects.get(heading='outcome'), value=3)
+        self.assertEqual(self.rows('pivot'), self.rows('rows'))
+
+    def test_uncommitted(self):
+        """Test that values written in a transaction which has not been committed are exported within it."""
+        with transaction.atomic():
+            OrdRxnDescriptorValue.objects.create(reaction=PerformedReaction.objects.get(reference='turkish_delight'),
+                                                 descriptor=OrdRxnDescriptor.objects.get(heading='outcome'), value=2)
+            streamConnection, cursor = _cursor(connection)
+            cursor.close()
+            self.assertIsNone(streamConnection)
+            self.assertIn(('turkish_delight', 2), self.rows('pivot'))
+
+
+suite = unittest.TestSuite([
+    loadTests(PivotRows),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""Tests that the typed numpy arrays of reactions hold what the rows of their arff export give."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup
+from DRP.models import PerformedReaction, LabGroup, Compound, CompoundRole, CompoundQuantity
+from DRP.models import CategoricalDescriptorPermittedValue
+from DRP.models import BoolRxnDescriptor, NumRxnDescriptor, OrdRxnDescriptor, CatRxnDescriptor
+from DRP.models import BoolRxnDescriptorValue, NumRxnDescriptorValue, OrdRxnDescriptorValue, CatRxnDescriptorValue
+from DRP.models.querysets import ArffQuerySet
+from django.contrib.auth.models import User
+from django.db import models
+from django.test.utils import override_settings
+import numpy as np
+import tempfile
+import shutil
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+MANUAL = {'calculatorSoftware': 'manual', 'calculatorSoftwareVersion': '0'}
+DESCRIPTOR_TYPES = (BoolRxnDescriptor, NumRxnDescriptor, OrdRxnDescriptor, CatRxnDescriptor)
+
+
+def label(value):
+    """Return a value from the rows of a reaction as it is labelled in a codebook."""
+    if isinstance(value, CategoricalDescriptorPermittedValue):
+        return value.value
+    elif isinstance(value, models.Model):
+        return value.pk
+    return value
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+class Arrays(DRPTestCase):
+
+    """Reads reactions with values of each descriptor type, some missing, into arrays."""
+
+    def setUp(self):
+        """Create reactions with boolean, numeric, ordinal and categorical values, some missing, and compounds."""
+        labGroup = LabGroup.objects.get(title='narnia')
+        user = User.objects.get(username='Aslan')
+        flag = BoolRxnDescriptor.objects.create(name='flag', heading='arrFlag', **MANUAL)
+        number = NumRxnDescriptor.objects.create(name='number', heading='arrNumber', **MANUAL)
+        defaulted = NumRxnDescriptor.objects.create(name='defaulted', heading='arrDefaulted', storageDefault=0, **MANUAL)
+        grade = OrdRxnDescriptor.objects.create(name='grade', heading='arrGrade', minimum=1, maximum=4, **MANUAL)
+        colour = CatRxnDescriptor.objects.create(name='colour', heading='arrColour', **MANUAL)
+        # created out of alphabetical order, so that codes follow the permitted values' order rather than the labels'
+        colours = [CategoricalDescriptorPermittedValue.objects.create(descriptor=colour, value=value)
+                   for value in ('white', 'red', 'blue')]
+        role = CompoundRole.objects.create(label='arrRole', description='arrRole')
+        compounds = []
+        for i, name in enumerate(('water', 'ethanol')):
+            compound = Compound(abbrev=name, name=name, CSID=i + 1, custom=True, formula='H_{2}O', labGroup=labGroup)
+            compound.save()
+            compounds.append(compound)
+        for i in range(6):
+            reaction = PerformedReaction.objects.create(labGroup=labGroup, user=user, reference='arr{}'.format(5 - i))
+            if i % 3:
+                BoolRxnDescriptorValue.objects.create(reaction=reaction, descriptor=flag, value=i % 2 == 0)
+            if i != 4:
+                NumRxnDescriptorValue.objects.create(reaction=reaction, descriptor=number, value=i * 1.5 - 2)
+            if i % 2:
+                NumRxnDescriptorValue.objects.create(reaction=reaction, descriptor=defaulted, value=i)
+            OrdRxnDescriptorValue.objects.create(reaction=reaction, descriptor=grade, value=None if i == 2 else 1 + i % 4)
+            if i:
+                CatRxnDescriptorValue.objects.create(reaction=reaction, descriptor=colour, value=colours[i % 3])
+            for j, compound in enumerate(compounds[i % 2:i % 3 + 1]):
+                CompoundQuantity.objects.create(reaction=reaction, compound=compound, role=role, amount=i + j + 1)
+        self.reactions = PerformedReaction.objects.filter(labGroup=labGroup)
+        # csvHeader is annotated by the descriptors' managers
+        self.headers = {d.heading: d.csvHeader for descriptorType in DESCRIPTOR_TYPES
+                        for d in descriptorType.objects.filter(heading__startswith='arr')}
+
+    def original(self, expanded=True, whitelist=None):
+        """Return the rows of the reactions, in primary key order, as the arff export gives them, with None where missing."""
+        reactions = self.reactions.order_by('pk')
+        matrix = ArffQuerySet.toNPArray(reactions, expanded=expanded, whitelistHeaders=whitelist, missing=None)
+        return [[label(value) for value in row] for row in matrix.tolist()]
+
+    def decoded(self, expanded=True, whitelist=None):
+        """Return the array of the reactions with the codes in it replaced by their labels, and None where missing."""
+        values, codebook = self.reactions.toNPArray(expanded=expanded, whitelistHeaders=whitelist, codebook=True)
+        headers = (self.reactions.expandedArffHeaders(whitelist) if expanded else self.reactions.arffHeaders(whitelist)).keys()
+        return [[None if value != value else codebook[header][int(value)] if header in codebook else value
+                 for header, value in zip(headers, row)] for row in values.tolist()]
+
+    def test_descriptors(self):
+        """Test that the values of each descriptor type, their storage defaults and missing values are those of the rows."""
+        self.assertEqual(self.decoded(whitelist=self.headers.values()), self.original(whitelist=self.headers.values()))
+
+    def test_expanded(self):
+        """Test that reaction fields, descriptor values and compound names are those of the rows."""
+        self.assertEqual(self.decoded(), self.original())
+
+    def test_fields(self):
+        """Test that the reaction fields alone are those of the rows."""
+        self.assertEqual(self.decoded(expanded=False), self.original(expanded=False))
+
+    def test_codebook(self):
+        """Test that boolean and categorical columns are held as codes, indexing labels in the descriptors' order."""
+        values, codebook = self.reactions.toNPArray(expanded=True, whitelistHeaders=self.headers.values(), codebook=True)
+        index = self.reactions.expandedArffHeaderIndex(self.headers.values())
+        self.assertEqual(codebook, {self.headers['arrFlag']: [False, True], self.headers['arrColour']: ['white', 'red', 'blue']})
+        colours = values[:, index[self.headers['arrColour']]]
+        self.assertTrue(np.isnan(colours[0]))
+        self.assertEqual(colours[1:].tolist(), [1, 2, 0, 1, 2])
+        self.assertEqual(values.dtype, np.float64)
+        np.testing.assert_array_equal(self.reactions.toNPArray(expanded=True, whitelistHeaders=self.headers.values()), values)
+
+    def test_missing(self):
+        """Test that missing values are nan unless a numeric missing value is given, that non-numeric ones are refused, and the dtype honoured."""
+        values = self.reactions.toNPArray(expanded=True, whitelistHeaders=self.headers.values())
+        filled = self.reactions.toNPArray(expanded=True, whitelistHeaders=self.headers.values(), missing=-1)
+        self.assertTrue(np.isnan(values).any())
+        self.assertEqual(filled.tolist(), np.where(np.isnan(values), -1, values).tolist())
+        for missing in ('?', None, '0'):
+            self.assertRaises(ValueError, self.reactions.toNPArray, expanded=True, whitelistHeaders=self.headers.values(), missing=missing)
+        self.assertEqual(self.reactions.toNPArray(expanded=True, whitelistHeaders=self.headers.values(), dtype=np.float32).dtype, np.float32)
+        self.assertRaises(ValueError, self.reactions.toNPArray, expanded=True, whitelistHeaders=self.headers.values(), dtype=np.int64)
+
+    def test_featureMatrix(self):
+        """Test that an array sliced from the feature matrix, with storage defaults, is that of the rows."""
+        directory = tempfile.mkdtemp()
+        try:
+            with override_settings(FEATURE_MATRIX_DIR=directory):
+                headers = [self.headers[heading] for heading in ('arrFlag', 'arrNumber', 'arrDefaulted', 'arrGrade')]
+                self.assertEqual(self.decoded(whitelist=headers), self.original(whitelist=headers))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_empty(self):
+        """Test that no reactions give an empty array with a column for each header."""
+        values = self.reactions.none().toNPArray(expanded=True, whitelistHeaders=self.headers.values())
+        self.assertEqual(values.shape, (0, len(self.headers)))
+
+    def tearDown(self):
+        """Delete the reactions, so that the compounds can be deleted along with the lab group, and the descriptors."""
+        CompoundQuantity.objects.filter(reaction__in=self.reactions).delete()
+        self.reactions.delete()
+        CompoundRole.objects.filter(label='arrRole').delete()
+        for descriptorType in DESCRIPTOR_TYPES:
+            descriptorType.objects.filter(heading__startswith='arr').delete()
+
+
+suite = unittest.TestSuite([
+    loadTests(Arrays),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""Tests that a change to a compound recalculates only the reaction descriptors which depend upon it."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup
+from DRP.models import PerformedReaction, LabGroup, Compound, CompoundRole, CompoundQuantity
+from DRP.models import NumMolDescriptor, NumMolDescriptorValue
+from DRP.models import NumRxnDescriptorValue, BoolRxnDescriptorValue, OrdRxnDescriptorValue, CatRxnDescriptorValue
+from DRP.models.molDescriptorValues import recalculateReactions
+from DRP.plugins.rxndescriptors import drp
+from django.contrib.auth.models import User
+from django.db.models import ProtectedError
+import importlib
+import warnings
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+MANUAL = {'calculatorSoftware': 'manual', 'calculatorSoftwareVersion': '0'}
+VALUE_CLASSES = (NumRxnDescriptorValue, BoolRxnDescriptorValue, OrdRxnDescriptorValue, CatRxnDescriptorValue)
+# the module, rather than the model of the same name exported from DRP.models
+reactionModule = importlib.import_module('DRP.models.Reaction')
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+class Recalculation(DRPTestCase):
+
+    """Changes the compounds of reactions whose stored descriptors have all been overwritten, and finds which were recalculated."""
+
+    def setUp(self):
+        """Calculate the descriptors of two reactions with the drp plugin too, then overwrite every stored value of the drp plugin's descriptors."""
+        self.plugins = list(reactionModule.descriptorPlugins)
+        if drp not in reactionModule.descriptorPlugins:
+            reactionModule.descriptorPlugins.append(drp)
+        labGroup = LabGroup.objects.get(title='narnia')
+        user = User.objects.get(username='Aslan')
+        roles = {label: CompoundRole.objects.create(label=label, description=label) for label in ('Org', 'Inorg')}
+        self.compounds = {}
+        for abbrev, formula in (('EtOH', 'C_{2}H_{6}O'), ('CuSO4', 'CuSO_{4}'), ('H2O', 'H_{2}O'), ('H2O2', 'H_{2}O_{2}')):
+            self.compounds[abbrev] = Compound(abbrev=abbrev, name=abbrev, CSID=len(self.compounds) + 1, custom=True,
+                                              formula=formula, labGroup=labGroup)
+            self.compounds[abbrev].save()
+        self.weight = NumMolDescriptor.objects.create(heading='weight', name='weight', **MANUAL)
+        for abbrev, value in (('EtOH', 46), ('CuSO4', 160), ('H2O', 18), ('H2O2', 34)):
+            NumMolDescriptorValue.objects.create(compound=self.compounds[abbrev], descriptor=self.weight, value=value)
+        self.refractivity = NumMolDescriptor.objects.create(heading='refractivity', name='Refractivity',
+                                                            calculatorSoftware='ChemAxon', calculatorSoftwareVersion='15_6')
+        self.reactions = {}
+        for reference, quantities in (('both', (('EtOH', 'Org', 0.1), ('CuSO4', 'Inorg', 0.2))), ('water', (('H2O', 'Inorg', 0.3),))):
+            reaction = PerformedReaction.objects.create(labGroup=labGroup, user=user, reference=reference)
+            for abbrev, label, amount in quantities:
+                CompoundQuantity.objects.create(reaction=reaction, compound=self.compounds[abbrev], role=roles[label], amount=amount)
+            self.reactions[reference] = reaction
+        self.reactionSet = PerformedReaction.objects.filter(pk__in=[reaction.pk for reaction in self.reactions.values()])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.reactionSet.calculate_descriptors()
+        # values which are recalculated lose these, whatever they are recalculated as
+        NumRxnDescriptorValue.objects.filter(reaction__in=self.reactionSet, descriptor__calculatorSoftware=drp.calculatorSoftware).update(value=-1)
+        BoolRxnDescriptorValue.objects.filter(reaction__in=self.reactionSet, descriptor__calculatorSoftware=drp.calculatorSoftware).update(value=None)
+        self.before = self.stored()
+
+    def stored(self):
+        """Return a dictionary of (reaction reference, descriptor heading) to the value stored for the reactions."""
+        references = {reaction.pk: reference for reference, reaction in self.reactions.items()}
+        values = {}
+        for valueClass in VALUE_CLASSES:
+            field = 'value_id' if valueClass is CatRxnDescriptorValue else 'value'
+            for reactionId, heading, value in valueClass.objects.filter(reaction__in=self.reactionSet).values_list(
+                    'reaction_id', 'descriptor__heading', field):
+                values[(references[reactionId], heading)] = value
+        return values
+
+    def changed(self):
+        """Return the (reaction reference, descriptor heading) of the values which have been stored, changed or deleted since setUp."""
+        after = self.stored()
+        return set(key for key in set(self.before) | set(after) if self.before.get(key, 'missing') != after.get(key, 'missing'))
+
+    def aggregates(self, reference, label, descriptor):
+        """Return the keys of the aggregates of a numeric molecular descriptor over a role in a reaction."""
+        csvHeader = '{}_{}_{}'.format(descriptor.heading, descriptor.calculatorSoftware, descriptor.calculatorSoftwareVersion)
+        return set((reference, '{}_{}_{}'.format(label, csvHeader, aggregate))
+                   for aggregate in ('Max', 'Range', 'gmean_molarity', 'gmean_count'))
+
+    def test_abbreviation(self):
+        """Test that changing only the abbreviation of a compound recalculates only the reaction space hash of its reactions."""
+        compound = self.compounds['EtOH']
+        compound.abbrev = 'ethanol'
+        compound.save()
+        self.assertEqual(self.changed(), {('both', 'rxnSpaceHash1')})
+
+    def test_newValue(self):
+        """Test that new values of a ChemAxon descriptor recalculate only the role aggregates of that descriptor in the compounds' reactions."""
+        for abbrev, value in (('EtOH', 13), ('CuSO4', 21)):
+            NumMolDescriptorValue.objects.create(compound=self.compounds[abbrev], descriptor=self.refractivity, value=value)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            recalculateReactions([self.compounds['EtOH'].pk, self.compounds['CuSO4'].pk], [self.refractivity])
+        self.assertEqual(self.changed(), self.aggregates('both', 'Org', self.refractivity) | self.aggregates('both', 'Inorg', self.refractivity))
+        self.assertEqual(self.stored()[('both', 'Org_refractivity_ChemAxon_15_6_Max')], 13)
+
+    def test_deleteValue(self):
+        """Test that deleting a molecular descriptor value recalculates only the role aggregates of that descriptor in the compound's reactions."""
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            NumMolDescriptorValue.objects.get(compound=self.compounds['CuSO4'], descriptor=self.weight).delete()
+        self.assertEqual(self.changed(), self.aggregates('both', 'Org', self.weight) | self.aggregates('both', 'Inorg', self.weight))
+        stored = self.stored()
+        self.assertFalse(any(key in stored for key in self.aggregates('both', 'Inorg', self.weight)))
+        self.assertEqual(stored[('both', 'Org_weight_manual_0_Max')], 46)
+
+    def test_deleteValues(self):
+        """Test that deleting molecular descriptor values as a queryset recalculates only the role aggregates of that descriptor in the compounds' reactions."""
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            NumMolDescriptorValue.objects.filter(compound__in=[self.compounds['EtOH'], self.compounds['H2O']], descriptor=self.weight).delete()
+        self.assertEqual(self.changed(), self.aggregates('both', 'Org', self.weight) | self.aggregates('both', 'Inorg', self.weight) |
+                         self.aggregates('water', 'Inorg', self.weight))
+
+    def test_deleteCompound(self):
+        """Test that deleting a compound used in no reaction recalculates nothing, and that one used in a reaction cannot be deleted."""
+        self.compounds['H2O2'].delete()
+        self.assertRaises(ProtectedError, self.compounds['H2O'].delete)
+        self.assertEqual(self.changed(), set())
+
+    def tearDown(self):
+        """Delete the compound quantities, so that the compounds can be deleted along with the lab group, and restore the plugins."""
+        CompoundQuantity.objects.filter(reaction__in=self.reactionSet).delete()
+        reactionModule.descriptorPlugins[:] = self.plugins
+
+
+suite = unittest.TestSuite([
+    loadTests(Recalculation),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""Tests that the drp reaction descriptors calculated from a compound table are those the reaction at a time queries calculated."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup
+from DRP.models import PerformedReaction, LabGroup, Compound, CompoundRole, CompoundQuantity, PHCurve
+from DRP.models import NumMolDescriptor, OrdMolDescriptor, BoolMolDescriptor, CatMolDescriptor, CategoricalDescriptorPermittedValue
+from DRP.models import NumMolDescriptorValue, OrdMolDescriptorValue, BoolMolDescriptorValue, CatMolDescriptorValue
+from DRP.models import NumRxnDescriptor, NumRxnDescriptorValue
+from DRP.plugins.rxndescriptors import drp
+from DRP.plugins.rxndescriptors.compoundTable import CompoundTable
+from DRP.plugins.moldescriptors import chemaxon
+from django.contrib.auth.models import User
+from scipy.stats import gmean
+import numpy as np
+import warnings
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+MANUAL = {'calculatorSoftware': 'manual', 'calculatorSoftwareVersion': '0'}
+
+
+def originalNumAggregates(values, prefix, descriptorValues, amounts, roleMoles):
+    """Add the maximum, range and geometric means of the values of the compounds in a role, as they were calculated a reaction at a time."""
+    values[prefix + '_Max'] = max(descriptorValues)
+    values[prefix + '_Range'] = max(descriptorValues) - min(descriptorValues)
+    for weighting in ('molarity', 'count'):
+        if roleMoles == 0 or roleMoles is None:
+            value = None
+        elif any(value == 0 for value in descriptorValues):
+            value = 0
+        elif weighting == 'molarity':
+            value = gmean([value * float(amount / roleMoles) for value, amount in zip(descriptorValues, amounts)])
+        else:
+            value = gmean(descriptorValues)
+        values['{}_gmean_{}'.format(prefix, weighting)] = value
+
+
+def original(reaction, pHCurves):
+    """
+    Return a dictionary of heading to value of the drp reaction descriptors of a reaction, calculated with a query per aggregate as they used to be.
+
+    The aggregates at the reaction pH used to be read from molecular descriptors at fixed pH, so
+    they are calculated here from each compound's own curve, interpolated at the reaction pH.
+    """
+    values = {}
+    quantities = CompoundQuantity.objects.filter(reaction=reaction)
+    for element in drp.elements:
+        if any(quantity.amount is None for quantity in quantities):
+            values[element + '_mols'] = None
+        else:
+            values[element + '_mols'] = float(sum((float(quantity.compound.elements[element]['stoichiometry']) * float(
+                quantity.amount) if element in quantity.compound.elements else 0) for quantity in quantities))
+    try:
+        pH = NumRxnDescriptorValue.objects.get(reaction=reaction, descriptor__heading='reaction_pH').value
+        hasPH = True
+    except NumRxnDescriptorValue.DoesNotExist:
+        hasPH = False
+
+    for compoundRole in CompoundRole.objects.all():
+        label = compoundRole.label
+        roleQuantities = quantities.filter(role=compoundRole)
+        values['{}_amount_count'.format(label)] = roleQuantities.count()
+        roleMoles = None if any(quantity.amount is None for quantity in roleQuantities) else sum(
+            quantity.amount for quantity in roleQuantities)
+        values['{}_amount_molarity'.format(label)] = roleMoles
+        if not roleQuantities.exists():
+            continue
+        compounds = [quantity.compound for quantity in roleQuantities]
+        amounts = [quantity.amount for quantity in roleQuantities]
+
+        for descriptor in NumMolDescriptor.objects.all():
+            descriptorValues = NumMolDescriptorValue.objects.filter(compound__in=compounds, descriptor=descriptor)
+            if descriptorValues.count() == roleQuantities.count() and not any(v.value is None for v in descriptorValues):
+                originalNumAggregates(values, '{}_{}'.format(label, descriptor.csvHeader),
+                                      [descriptorValues.get(compound=compound).value for compound in compounds], amounts, roleMoles)
+
+        if hasPH and len(set(compounds)) == len(compounds):
+            for identity in pHCurves:
+                prefix = '{}_{}_pHreaction_{}_{}'.format(label, *identity)
+                if pH is None:
+                    for aggregate in ('Max', 'Range', 'gmean_molarity', 'gmean_count'):
+                        values['{}_{}'.format(prefix, aggregate)] = None
+                    continue
+                curves = [PHCurve.objects.filter(compound=compound, heading=identity[0], calculatorSoftware=identity[1],
+                                                 calculatorSoftwareVersion=identity[2]).first() for compound in compounds]
+                curveValues = [np.nan if curve is None else float(curve.at([pH])[0]) for curve in curves]
+                if not any(np.isnan(curveValues)):
+                    originalNumAggregates(values, prefix, curveValues, amounts, roleMoles)
+
+        for descriptor, valueClass, levels in (
+                [(d, OrdMolDescriptorValue, range(d.minimum, d.maximum + 1)) for d in OrdMolDescriptor.objects.all()] +
+                [(d, BoolMolDescriptorValue, (True, False)) for d in BoolMolDescriptor.objects.all()] +
+                [(d, CatMolDescriptorValue, list(d.permittedValues.all())) for d in CatMolDescriptor.objects.all()]):
+            descriptorValues = valueClass.objects.filter(compound__in=compounds, descriptor=descriptor)
+            if descriptorValues.count() != roleQuantities.count() or any(v.value is None for v in descriptorValues):
+                continue
+            byCompound = {v.compound_id: v.value for v in descriptorValues}
+            for level in levels:
+                name = level.value if isinstance(level, CategoricalDescriptorPermittedValue) else level
+                matching = [amount for compound, amount in zip(compounds, amounts) if byCompound[compound.pk] == level]
+                values['{}_{}_{}_count'.format(label, descriptor.csvHeader, name)] = len(matching)
+                values['{}_{}_{}_molarity'.format(label, descriptor.csvHeader, name)] = None if any(
+                    amount is None for amount in matching) else sum(matching)
+            if valueClass is BoolMolDescriptorValue:
+                values['{}_{}_any'.format(label, descriptor.csvHeader)] = any(descriptorValues)
+    return values
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+class Descriptors(DRPTestCase):
+
+    """Calculates the drp reaction descriptors of reactions whose compounds have each type of molecular descriptor."""
+
+    def setUp(self):
+        """Create compounds with molecular descriptor values and pH curves, and reactions of them with and without a pH."""
+        labGroup = LabGroup.objects.get(title='narnia')
+        user = User.objects.get(username='Aslan')
+        roles = {label: CompoundRole.objects.create(label=label, description=label) for label in ('Org', 'Inorg', 'Ox')}
+        compounds = {}
+        for abbrev, formula in (('EtOH', 'C_{2}H_{6}O'), ('dmed', 'C_{4}H_{12}N_{2}'), ('CuSO4', 'CuSO_{4}'), ('H2O', 'H_{2}O')):
+            compounds[abbrev] = Compound(abbrev=abbrev, name=abbrev, CSID=len(compounds) + 1, custom=True, formula=formula, labGroup=labGroup)
+            compounds[abbrev].save()
+
+        weight = NumMolDescriptor.objects.create(heading='arrWeight', name='weight', **MANUAL)
+        charge = NumMolDescriptor.objects.create(heading='arrCharge', name='charge', **MANUAL)
+        size = OrdMolDescriptor.objects.create(heading='arrSize', name='size', minimum=1, maximum=3, **MANUAL)
+        acidic = BoolMolDescriptor.objects.create(heading='arrAcidic', name='acidic', **MANUAL)
+        colour = CatMolDescriptor.objects.create(heading='arrColour', name='colour', **MANUAL)
+        colours = {value: CategoricalDescriptorPermittedValue.objects.create(descriptor=colour, value=value)
+                   for value in ('red', 'white', 'blue')}
+        # the copper sulphate has a zero weight, no charge at all and water a null one
+        for abbrev, weightValue, chargeValue, sizeValue, acidicValue, colourValue in (
+                ('EtOH', 46, 1, 1, True, 'red'), ('dmed', 88, 2, 3, False, 'white'),
+                ('CuSO4', 0, None, 2, True, 'blue'), ('H2O', 18, 'null', 2, False, 'red')):
+            compound = compounds[abbrev]
+            NumMolDescriptorValue.objects.create(compound=compound, descriptor=weight, value=weightValue)
+            if chargeValue is not None:
+                NumMolDescriptorValue.objects.create(compound=compound, descriptor=charge,
+                                                     value=None if chargeValue == 'null' else chargeValue)
+            OrdMolDescriptorValue.objects.create(compound=compound, descriptor=size, value=sizeValue)
+            BoolMolDescriptorValue.objects.create(compound=compound, descriptor=acidic, value=acidicValue)
+            CatMolDescriptorValue.objects.create(compound=compound, descriptor=colour, value=colours[colourValue])
+
+        self.pHCurves = drp._pHCurves()
+        identity = chemaxon.curveIdentity('avgpol')
+        for abbrev, slope in (('EtOH', 2), ('dmed', 3), ('CuSO4', 0.5)):
+            curve = PHCurve(compound=compounds[abbrev], heading=identity[0], calculatorSoftware=identity[1],
+                            calculatorSoftwareVersion=identity[2])
+            curve.setPoints(chemaxon.pH_curve_points, [1 + slope * pH for pH in chemaxon.pH_curve_points])
+            curve.save()
+
+        reactionPH = NumRxnDescriptor.objects.create(heading='reaction_pH', name='reaction pH', **MANUAL)
+        self.reactions = {}
+        # no reaction has an oxidant, and the last lists a compound twice in a role
+        for reference, pH, quantities in (
+                ('both', 7.2, (('EtOH', 'Org', 0.1), ('dmed', 'Org', 0.2), ('CuSO4', 'Inorg', 0.5))),
+                ('noPH', 'none', (('EtOH', 'Org', 0.3), ('H2O', 'Inorg', 0.4))),
+                ('nullPH', None, (('dmed', 'Org', None), ('CuSO4', 'Inorg', 0.25))),
+                ('empty', 3, ()),
+                ('twice', 4.5, (('EtOH', 'Org', 0.1), ('EtOH', 'Org', 0.2), ('CuSO4', 'Inorg', 0.1)))):
+            reaction = PerformedReaction.objects.create(labGroup=labGroup, user=user, reference=reference)
+            if pH != 'none':
+                NumRxnDescriptorValue.objects.create(reaction=reaction, descriptor=reactionPH, value=pH)
+            for abbrev, label, amount in quantities:
+                CompoundQuantity.objects.create(reaction=reaction, compound=compounds[abbrev], role=roles[label], amount=amount)
+            self.reactions[reference] = reaction
+
+    def calculated(self, reaction):
+        """Return a dictionary of heading to value of the drp reaction descriptors of a reaction, calculated from a compound table of all of the reactions."""
+        descriptorDict = drp.make_dict()[0]
+        table = CompoundTable(self.reactions.values(), drp.elements, self.pHCurves)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            numValues, boolValues = drp._calculate(reaction, table, drp._headings(descriptorDict, table))
+        values = {}
+        for value in numValues + boolValues:
+            self.assertNotIn(value.descriptor.heading, values)
+            values[value.descriptor.heading] = value.value
+        return values
+
+    def assertSameValues(self, reference):
+        """Assert that a reaction's descriptors are those calculated a reaction at a time, returning them."""
+        reaction = self.reactions[reference]
+        calculated = self.calculated(reaction)
+        expected = original(reaction, self.pHCurves)
+        self.assertEqual(sorted(calculated), sorted(expected))
+        for heading, value in expected.items():
+            if value is None or calculated[heading] is None:
+                self.assertEqual(calculated[heading], value, heading)
+            else:
+                self.assertAlmostEqual(float(calculated[heading]), float(value), places=9, msg='{}: {} != {}'.format(heading, calculated[heading], value))
+        return calculated
+
+    def test_both(self):
+        """Test a reaction with compounds in two roles and a pH, with a geometric mean including zero."""
+        values = self.assertSameValues('both')
+        self.assertEqual(values['Inorg_arrWeight_manual_0_gmean_count'], 0)
+        self.assertEqual(values['Org_arrColour_manual_0_white_count'], 1)
+        self.assertEqual(float(values['Org_arrAcidic_manual_0_True_molarity']), 0.1)
+        self.assertIn('Org_avgpol_pHreaction_{}_{}_Max'.format(*chemaxon.curveIdentity('avgpol')[1:]), values)
+        self.assertIn('Org_arrCharge_manual_0_Max', values)
+        self.assertNotIn('Inorg_arrCharge_manual_0_Max', values)
+
+    def test_noPH(self):
+        """Test a reaction without a pH, and with a compound whose molecular value is null."""
+        values = self.assertSameValues('noPH')
+        self.assertFalse(any('_pHreaction_' in heading for heading in values))
+        self.assertNotIn('Inorg_arrCharge_manual_0_Max', values)
+
+    def test_nullPH(self):
+        """Test a reaction with a null pH and a compound with no amount."""
+        values = self.assertSameValues('nullPH')
+        self.assertIsNone(values['Org_amount_molarity'])
+        self.assertIsNone(values['Org_avgpol_pHreaction_{}_{}_Max'.format(*chemaxon.curveIdentity('avgpol')[1:])])
+
+    def test_empty(self):
+        """Test a reaction with no compounds, so that every role is empty."""
+        values = self.assertSameValues('empty')
+        self.assertEqual((values['Org_amount_count'], values['Ox_amount_count'], values['Ox_amount_molarity']), (0, 0, 0))
+        self.assertEqual(values['C_mols'], 0)
+
+    def test_twice(self):
+        """Test a reaction listing a compound twice in a role, whose aggregates are skipped."""
+        values = self.assertSameValues('twice')
+        self.assertEqual(values['Org_amount_count'], 2)
+        self.assertNotIn('Org_arrWeight_manual_0_Max', values)
+
+    def tearDown(self):
+        """Delete the compound quantities, so that the compounds can be deleted along with the lab group."""
+        CompoundQuantity.objects.filter(reaction__in=self.reactions.values()).delete()
+
+
+suite = unittest.TestSuite([
+    loadTests(Descriptors),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""Tests that each scikit-learn model visitor trains and predicts through a model container."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup
+from DRP.models import PerformedReaction, LabGroup, ModelContainer, DataSet
+from DRP.models import NumRxnDescriptor, NumRxnDescriptorValue, BoolRxnDescriptor, BoolRxnDescriptorValue
+from DRP.models import OrdRxnDescriptor, OrdRxnDescriptorValue
+from DRP.ml_models.model_visitors import sklearn
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.test.utils import override_settings
+import tempfile
+import shutil
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+REACTION_COUNT = 20
+VALUE_TYPES = {BoolRxnDescriptor: BoolRxnDescriptorValue, OrdRxnDescriptor: OrdRxnDescriptorValue,
+               NumRxnDescriptor: NumRxnDescriptorValue}
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+class Visitors(DRPTestCase):
+
+    """Trains each visitor on all of a set of reactions and predicts their outcomes."""
+
+    def setUp(self):
+        """Create reactions with a numeric predictor, and boolean, ordinal and numeric responses which depend on it."""
+        self.directory = tempfile.mkdtemp()
+        self.modelSettings = override_settings(MODEL_DIR=self.directory)
+        self.modelSettings.enable()
+        labGroup = LabGroup.objects.get(title='narnia')
+        user = User.objects.get(username='Aslan')
+        manual = {'calculatorSoftware': 'manual', 'calculatorSoftwareVersion': '0'}
+        self.predictor = NumRxnDescriptor.objects.create(name='testNumber', heading='testNumber', **manual)
+        self.boolResponse = BoolRxnDescriptor.objects.create(name='outcome', heading='outcome', **manual)
+        self.ordResponse = OrdRxnDescriptor.objects.create(name='grade', heading='grade', minimum=1, maximum=4, **manual)
+        self.numResponse = NumRxnDescriptor.objects.create(name='yield', heading='yield', **manual)
+        self.expected = {self.boolResponse: {}, self.ordResponse: {}, self.numResponse: {}}
+        for i in range(REACTION_COUNT):
+            reaction = PerformedReaction.objects.create(labGroup=labGroup, user=user, reference='R{:02}'.format(i))
+            testNumber = i * 0.5
+            # the boolean outcome is imbalanced, for BCR weighting to matter
+            values = {self.boolResponse: i >= 15, self.ordResponse: 1 + i * 4 // REACTION_COUNT,
+                      self.numResponse: 2 * testNumber + 1}
+            NumRxnDescriptorValue.objects.create(reaction=reaction, descriptor=self.predictor, value=testNumber)
+            BoolRxnDescriptorValue.objects.create(reaction=reaction, descriptor=self.boolResponse, value=values[self.boolResponse])
+            OrdRxnDescriptorValue.objects.create(reaction=reaction, descriptor=self.ordResponse, value=values[self.ordResponse])
+            NumRxnDescriptorValue.objects.create(reaction=reaction, descriptor=self.numResponse, value=values[self.numResponse])
+            for response, value in values.items():
+                self.expected[response][reaction.pk] = value
+        self.reactions = PerformedReaction.objects.filter(labGroup=labGroup)
+
+    def predictions(self, tool, response, **visitorOptions):
+        """Build a container of one stats model of a tool trained on all the reactions, and return its predictions for them by reaction pk."""
+        container = ModelContainer.create('sklearn', tool, NumRxnDescriptor.objects.filter(pk=self.predictor.pk),
+                                          type(response).objects.filter(pk=response.pk), splitter='NoSplitter',
+                                          reactions=self.reactions, visitorOptions=visitorOptions)
+        container.full_clean()
+        container.build()
+        container.predict(self.reactions)
+        predDesc = response.predictedDescriptorType.objects.get(modelContainer=container, statsModel=None)
+        predictions = dict(VALUE_TYPES[type(response)].objects.filter(descriptor_id=predDesc.pk).values_list('reaction_id', 'value'))
+        self.assertEqual(len(predictions), REACTION_COUNT)
+        return predictions
+
+    def assertAccurate(self, tool, response, **visitorOptions):
+        """Assert that a tool predicts at least nine in ten of the outcomes of the reactions it was trained on."""
+        predictions = self.predictions(tool, response, **visitorOptions)
+        correct = sum(predictions[pk] == value for pk, value in self.expected[response].items())
+        self.assertGreaterEqual(correct, 0.9 * REACTION_COUNT, '{} predicted {} of {} correctly'.format(tool, correct, REACTION_COUNT))
+
+    def assertBalanced(self, tool, response, **visitorOptions):
+        """Assert that a tool's mean recall over the classes of the reactions it was trained on is at least eight in ten."""
+        predictions = self.predictions(tool, response, **visitorOptions)
+        recalls = []
+        for outcome in set(self.expected[response].values()):
+            pks = [pk for pk, value in self.expected[response].items() if value == outcome]
+            recalls.append(sum(predictions[pk] == outcome for pk in pks) / float(len(pks)))
+        self.assertGreaterEqual(sum(recalls) / len(recalls), 0.8, '{} had recalls {}'.format(tool, recalls))
+
+    def test_J48(self):
+        """Test the decision tree."""
+        self.assertAccurate('J48', self.boolResponse)
+
+    def test_KNN(self):
+        """Test k nearest neighbours."""
+        self.assertAccurate('KNN', self.boolResponse)
+
+    def test_NaiveBayes(self):
+        """Test Gaussian naive Bayes."""
+        self.assertAccurate('NaiveBayes', self.boolResponse)
+
+    def test_LogisticRegression(self):
+        """Test logistic regression."""
+        self.assertAccurate('LogisticRegression', self.boolResponse)
+
+    def test_RandomForest(self):
+        """Test the random forest."""
+        self.assertAccurate('RandomForest', self.boolResponse)
+
+    def test_SVM_PUK(self):
+        """Test the PUK kernel support vector machine."""
+        self.assertAccurate('SVM_PUK', self.boolResponse)
+
+    def test_ordinal(self):
+        """Test the decision tree on an ordinal response."""
+        self.assertAccurate('J48', self.ordResponse)
+
+    def test_LinearRegression(self):
+        """Test linear regression of a numeric response and of an ordinal one."""
+        predictions = self.predictions('LinearRegression', self.numResponse)
+        for pk, value in self.expected[self.numResponse].items():
+            self.assertAlmostEqual(predictions[pk], value)
+        self.assertAccurate('LinearRegression', self.ordResponse)
+
+    def test_BCR(self):
+        """Test that visitors weighting by sample and by class optimise on BCR."""
+        for tool in ('J48', 'RandomForest', 'SVM_PUK', 'LogisticRegression'):
+            self.assertBalanced(tool, self.boolResponse, BCR=True)
+        self.assertBalanced('J48', self.ordResponse, BCR=True)
+
+    def test_noBCR(self):
+        """Test that visitors which cannot weight their training data refuse to optimise on BCR."""
+        for tool in ('LinearRegression', 'KNN', 'NaiveBayes'):
+            self.assertRaises(ValueError, getattr(sklearn, tool), statsModel=None, BCR=True)
+            self.assertRaises(ValidationError, self.predictions, tool, self.ordResponse, BCR=True)
+
+    def tearDown(self):
+        """Delete the containers, their data sets and models, the reactions and the descriptors."""
+        ModelContainer.objects.filter(modelVisitorLibrary='sklearn').delete()
+        DataSet.objects.filter(pk__in=list(DataSet.objects.filter(
+            reactions__labGroup__title='narnia').values_list('pk', flat=True))).delete()
+        self.reactions.delete()
+        NumRxnDescriptor.objects.filter(heading__in=('testNumber', 'yield')).delete()
+        BoolRxnDescriptor.objects.filter(heading='outcome').delete()
+        OrdRxnDescriptor.objects.filter(heading='grade').delete()
+        self.modelSettings.disable()
+        shutil.rmtree(self.directory)
+
+
+suite = unittest.TestSuite([
+    loadTests(Visitors),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""Tests that the sparse arff export of reactions holds the instances of the dense export, leaving out only numeric zeros."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup
+from DRP.models import PerformedReaction, LabGroup, CategoricalDescriptorPermittedValue
+from DRP.models import BoolRxnDescriptor, NumRxnDescriptor, OrdRxnDescriptor, CatRxnDescriptor
+from DRP.models import BoolRxnDescriptorValue, NumRxnDescriptorValue, OrdRxnDescriptorValue, CatRxnDescriptorValue
+from django.contrib.auth.models import User
+from StringIO import StringIO
+import re
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+MANUAL = {'calculatorSoftware': 'manual', 'calculatorSoftwareVersion': '0'}
+DESCRIPTOR_TYPES = (BoolRxnDescriptor, NumRxnDescriptor, OrdRxnDescriptor, CatRxnDescriptor)
+VALUE = r'"[^"]*"|\?'
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+class SparseArff(DRPTestCase):
+
+    """Exports reactions with zero, missing and first nominal values as dense and sparse arff files."""
+
+    def setUp(self):
+        """Create reactions with numeric zeros, boolean falses, the first ordinal and categorical values, and strings which read as zero."""
+        labGroup = LabGroup.objects.get(title='narnia')
+        user = User.objects.get(username='Aslan')
+        flag = BoolRxnDescriptor.objects.create(name='flag', heading='sparseFlag', **MANUAL)
+        number = NumRxnDescriptor.objects.create(name='number', heading='sparseNumber', **MANUAL)
+        grade = OrdRxnDescriptor.objects.create(name='grade', heading='sparseGrade', minimum=0, maximum=3, **MANUAL)
+        colour = CatRxnDescriptor.objects.create(name='colour', heading='sparseColour', **MANUAL)
+        colours = [CategoricalDescriptorPermittedValue.objects.create(descriptor=colour, value=value) for value in ('white', 'red')]
+        rows = (('0', 0, False, 0), ('a, b', 0.0, True, 3), ('', 2.5, None, None), ('0.0', None, False, 0))
+        for i, (notes, numberValue, flagValue, gradeValue) in enumerate(rows):
+            reaction = PerformedReaction.objects.create(labGroup=labGroup, user=user, reference='0' * (i + 1), notes=notes)
+            NumRxnDescriptorValue.objects.create(reaction=reaction, descriptor=number, value=numberValue)
+            if flagValue is not None:
+                BoolRxnDescriptorValue.objects.create(reaction=reaction, descriptor=flag, value=flagValue)
+            OrdRxnDescriptorValue.objects.create(reaction=reaction, descriptor=grade, value=gradeValue)
+            if i != 2:
+                CatRxnDescriptorValue.objects.create(reaction=reaction, descriptor=colour, value=colours[i % 2])
+        PerformedReaction.objects.create(labGroup=labGroup, user=user, reference='blank')
+        self.reactions = PerformedReaction.objects.filter(labGroup=labGroup).order_by('pk')
+        headers = self.reactions.expandedArffHeaders()
+        self.columns = {header: j for j, header in enumerate(headers.keys())}
+        self.numeric = [header.split()[-1].lower() == 'numeric' for header in headers.values()]
+        self.assertTrue(any(self.numeric))
+        self.assertFalse(all(self.numeric))
+
+    def instances(self, sparse):
+        """Return the data lines of the expanded arff export."""
+        f = StringIO()
+        self.reactions.toArff(f, expanded=True, sparse=sparse)
+        return f.getvalue().split('\n@data\n', 1)[1].splitlines()
+
+    def parse(self, column, value):
+        """Return a value of an instance as a float if its attribute is numeric, a string otherwise, or None if missing."""
+        if value == '?':
+            return None
+        value = value[1:-1]
+        return float(value) if self.numeric[column] else value
+
+    def dense(self):
+        """Return the instances of the dense export as lists of parsed values."""
+        rows = []
+        for line in self.instances(sparse=False):
+            values = re.findall(VALUE, line)
+            self.assertEqual(','.join(values), line)
+            self.assertEqual(len(values), len(self.numeric))
+            rows.append([self.parse(j, value) for j, value in enumerate(values)])
+        return rows
+
+    def sparse(self):
+        """Return the instances of the sparse export as dictionaries of index to parsed value."""
+        rows = []
+        for line in self.instances(sparse=True):
+            self.assertTrue(line.startswith('{') and line.endswith('}'))
+            entries = re.findall(r'(\d+) ({})'.format(VALUE), line[1:-1])
+            self.assertEqual(','.join('{} {}'.format(j, value) for j, value in entries), line[1:-1])
+            indices = [int(j) for j, value in entries]
+            self.assertEqual(indices, sorted(set(indices)))
+            rows.append({j: self.parse(j, value) for j, value in zip(indices, (value for j, value in entries))})
+        return rows
+
+    def test_indices(self):
+        """Test that sparse indices count attributes from 0, up to the last attribute."""
+        sparse = self.sparse()
+        # the first attribute is nominal, so is written in every instance
+        self.assertFalse(self.numeric[0])
+        self.assertTrue(all(0 in row for row in sparse))
+        self.assertEqual(max(max(row) for row in sparse), len(self.numeric) - 1)
+
+    def test_zeros(self):
+        """Test that only numeric zeros are left out, and no written numeric value is zero."""
+        for denseRow, sparseRow in zip(self.dense(), self.sparse()):
+            omitted = set(range(len(denseRow))) - set(sparseRow)
+            self.assertEqual(omitted, set(j for j, value in enumerate(denseRow) if self.numeric[j] and value == 0))
+            self.assertFalse(any(self.numeric[j] and value == 0 for j, value in sparseRow.items()))
+        self.assertTrue(any(len(row) < len(self.numeric) for row in self.sparse()))
+
+    def test_nominal(self):
+        """Test that nominal and string attributes are always written, including false, zero and first values."""
+        sparse = self.sparse()
+        for j, numeric in enumerate(self.numeric):
+            if not numeric:
+                self.assertTrue(all(j in row for row in sparse))
+        for header, values in (('notes', ['0', 'a, b', '', '0.0', '']), ('sparseFlag_manual_0', ['False', 'True', None, 'False', None]),
+                               ('sparseGrade_manual_0', ['0', '3', None, '0', None]),
+                               ('sparseColour_manual_0', ['white', 'red', None, 'red', None])):
+            self.assertEqual([row[self.columns[header]] for row in sparse], values)
+
+    def test_matchesDense(self):
+        """Test that the sparse instances, with the left out values as zero, are the dense ones."""
+        dense = self.dense()
+        sparse = [[row.get(j, 0.0) for j in range(len(self.numeric))] for row in self.sparse()]
+        self.assertEqual(len(dense), self.reactions.count())
+        self.assertEqual(sparse, dense)
+
+    def tearDown(self):
+        """Delete the reactions and the descriptors."""
+        self.reactions.delete()
+        for descriptorType in DESCRIPTOR_TYPES:
+            descriptorType.objects.filter(heading__startswith='sparse').delete()
+
+
+suite = unittest.TestSuite([
+    loadTests(SparseArff),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
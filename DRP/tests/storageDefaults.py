@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""Tests that numeric reaction descriptor values equal to a storage default are not stored, but are read as that default."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup
+from DRP.models import PerformedReaction, LabGroup, NumRxnDescriptor, NumRxnDescriptorValue
+from DRP.models.querysets import ABSENT
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test.utils import override_settings
+from StringIO import StringIO
+import numpy as np
+import csv
+import tempfile
+import shutil
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+MANUAL = {'calculatorSoftware': 'manual', 'calculatorSoftwareVersion': '0'}
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+class StorageDefaults(DRPTestCase):
+
+    """Reads and prunes the values of numeric descriptors with and without a storage default."""
+
+    def setUp(self):
+        """Create a reaction with stored values, one with none, as if never calculated, and one with a stored missing value."""
+        labGroup = LabGroup.objects.get(title='narnia')
+        user = User.objects.get(username='Aslan')
+        NumRxnDescriptor.objects.create(name='defaulted', heading='defDefaulted', storageDefault=0, **MANUAL)
+        NumRxnDescriptor.objects.create(name='offset', heading='defOffset', storageDefault=1.5, **MANUAL)
+        NumRxnDescriptor.objects.create(name='plain', heading='defPlain', **MANUAL)
+        # csvHeader is annotated by the descriptors' managers
+        self.defaulted = NumRxnDescriptor.objects.get(heading='defDefaulted')
+        self.offset = NumRxnDescriptor.objects.get(heading='defOffset')
+        self.plain = NumRxnDescriptor.objects.get(heading='defPlain')
+        self.reactions = {}
+        for reference in ('stored', 'unstored', 'missing'):
+            self.reactions[reference] = PerformedReaction.objects.create(labGroup=labGroup, user=user, reference=reference)
+        NumRxnDescriptorValue.objects.create(reaction=self.reactions['stored'], descriptor=self.defaulted, value=2.5)
+        NumRxnDescriptorValue.objects.create(reaction=self.reactions['stored'], descriptor=self.plain, value=1)
+        NumRxnDescriptorValue.objects.create(reaction=self.reactions['missing'], descriptor=self.defaulted, value=None)
+        self.reactionSet = PerformedReaction.objects.filter(labGroup=labGroup)
+        self.headers = [self.defaulted.csvHeader, self.offset.csvHeader, self.plain.csvHeader]
+        # a reaction with no stored value takes the default whether or not its descriptors were ever calculated
+        self.expected = {'stored': (2.5, 1.5, 1), 'unstored': (0, 1.5, None), 'missing': (None, 1.5, None)}
+
+    def rows(self, whitelist=None):
+        """Return a dictionary of reaction reference to its values of the descriptors, as the expanded rows give them."""
+        return {row['reference']: tuple(row.get(header) for header in self.headers)
+                for row in self.reactionSet.rows(True, whitelist)}
+
+    def tuples(self, engine):
+        """Return a dictionary of reaction reference to its values of the descriptors, as an engine's row tuples give them."""
+        with override_settings(REACTION_ROW_ENGINE=engine):
+            return {row[0]: tuple(None if value is ABSENT else value for value in row[1:]) for row in self.reactionSet.rowTuples(['reference'] + self.headers, expanded=True)}
+
+    def array(self):
+        """Return a dictionary of reaction reference to its values of the descriptors, as the array of the reactions gives them."""
+        values = self.reactionSet.toNPArray(expanded=True, whitelistHeaders=self.headers)
+        index = self.reactionSet.expandedArffHeaderIndex(self.headers)
+        references = self.reactionSet.order_by('pk').values_list('reference', flat=True)
+        return {reference: tuple(None if np.isnan(row[index[header]]) else row[index[header]] for header in self.headers)
+                for reference, row in zip(references, values)}
+
+    def assertReaders(self, expected):
+        """Assert that each reader gives the expected values."""
+        self.assertEqual(self.rows(), expected)
+        self.assertEqual(self.rows(self.headers + ['reference']), expected)
+        self.assertEqual(self.tuples('rows'), expected)
+        self.assertEqual(self.tuples('pivot'), expected)
+        self.assertEqual(self.array(), expected)
+
+    def test_readers(self):
+        """Test that the rows, row engines and arrays fill in the storage default where no value is stored, and only there."""
+        self.assertReaders(self.expected)
+
+    def test_featureMatrix(self):
+        """Test that the rows and arrays read from the feature matrix fill in the storage default where no value is stored."""
+        directory = tempfile.mkdtemp()
+        try:
+            with override_settings(FEATURE_MATRIX_DIR=directory):
+                self.assertReaders(self.expected)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_export(self):
+        """Test that the csv export writes the storage default rather than a missing value."""
+        f = StringIO()
+        self.reactionSet.order_by('pk').toCsv(f, expanded=True, whitelistHeaders=self.headers)
+        rows = [tuple(row[header] for header in self.headers) for row in csv.DictReader(StringIO(f.getvalue()))]
+        # a stored missing value is written empty, as it always has been
+        self.assertEqual(rows, [('2.5', '1.5', '1.0'), ('0.0', '1.5', '?'), ('', '1.5', '?')])
+
+    def test_write(self):
+        """Test that writing the storage default deletes a stored value instead of storing it, and other values are written."""
+        self.assertIsNone(self.defaulted.updateOrNewValue(self.reactions['stored'], 0.0))
+        self.assertIsNone(self.defaulted.updateOrNewValue(self.reactions['unstored'], 0))
+        self.assertFalse(NumRxnDescriptorValue.objects.filter(descriptor=self.defaulted, value=0).exists())
+        value = self.offset.updateOrNewValue(self.reactions['unstored'], 0)
+        self.assertIsNone(value.pk)
+        self.assertEqual(value.value, 0)
+        value.save()
+        self.assertIsNone(self.plain.updateOrNewValue(self.reactions['stored'], 0))
+        self.assertEqual(NumRxnDescriptorValue.objects.get(descriptor=self.plain, reaction=self.reactions['stored']).value, 0)
+        self.assertFalse(self.plain.isStorageDefault(0))
+        self.assertFalse(self.defaulted.isStorageDefault(None))
+        self.assertReaders({'stored': (0, 1.5, 0), 'unstored': (0, 0, None), 'missing': (None, 1.5, None)})
+
+    def prune(self, *args):
+        """Run the command, returning what it wrote."""
+        stdout = StringIO()
+        call_command('prune_default_descriptor_values', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def stored(self):
+        """Return the set of (reaction reference, descriptor heading, value) of every stored value."""
+        return set(NumRxnDescriptorValue.objects.filter(reaction__in=self.reactionSet).values_list(
+            'reaction__performedreaction__reference', 'descriptor__heading', 'value'))
+
+    def test_prune(self):
+        """Test that pruning deletes only the values equal to their own descriptor's storage default, and changes nothing the readers give."""
+        # as they were stored before the descriptors had storage defaults
+        for descriptor, value in ((self.defaulted, 0), (self.offset, 1.5), (self.plain, 0)):
+            NumRxnDescriptorValue.objects.create(reaction=self.reactions['unstored'], descriptor=descriptor, value=value)
+        NumRxnDescriptorValue.objects.create(reaction=self.reactions['missing'], descriptor=self.offset, value=0)
+        expected = {'stored': (2.5, 1.5, 1), 'unstored': (0, 1.5, 0), 'missing': (None, 0, None)}
+        before = self.stored()
+        self.assertReaders(expected)
+        output = self.prune('--dry-run')
+        self.assertEqual(self.stored(), before)
+        self.assertIn('{}: 1 values'.format(self.defaulted.csvHeader), output)
+        self.assertIn('{}: 1 values'.format(self.offset.csvHeader), output)
+        self.assertNotIn(self.plain.csvHeader, output)
+        self.assertIn('Would delete 2 values in total.', output)
+        output = self.prune()
+        self.assertIn('Deleted 2 values in total.', output)
+        self.assertEqual(self.stored(), before - {('unstored', 'defDefaulted', 0), ('unstored', 'defOffset', 1.5)})
+        self.assertReaders(expected)
+        self.assertIn('Deleted 0 values in total.', self.prune())
+
+    def tearDown(self):
+        """Delete the reactions and the descriptors."""
+        self.reactionSet.delete()
+        NumRxnDescriptor.objects.filter(heading__startswith='def').delete()
+
+
+suite = unittest.TestSuite([
+    loadTests(StorageDefaults),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""Tests that the streamed csv and arff exports of reactions and compounds are those written in one go, and gzipped only when asked."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup, signsExampleLicense
+from DRP.models import PerformedReaction, LabGroup, Compound, CompoundRole, CompoundQuantity
+from DRP.models import NumRxnDescriptor, NumRxnDescriptorValue, BoolRxnDescriptor, BoolRxnDescriptorValue
+from DRP.views.reaction import visibleReactions
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import Client
+from django.test.utils import override_settings
+from StringIO import StringIO
+import csv
+import gzip
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+MANUAL = {'calculatorSoftware': 'manual', 'calculatorSoftwareVersion': '0'}
+
+
+def originalCsv(queryset, expanded=False, whitelistHeaders=None, missing='?'):
+    """Return the csv export as toCsv wrote it before exports were streamed."""
+    f = StringIO()
+    if expanded:
+        headers = queryset.expandedCsvHeaders(whitelistHeaders)
+    else:
+        headers = queryset.csvHeaders(whitelistHeaders)
+    writer = csv.DictWriter(f, fieldnames=headers, restval=missing)
+    writer.writeheader()
+    for row in queryset.rows(expanded):
+        writer.writerow({k: row.get(k, missing) for k in row.keys() if k in headers})
+    return f.getvalue()
+
+
+def originalArff(queryset, expanded=False, relationName='relation', whitelistHeaders=None, missing='?'):
+    """Return the arff export as toArff wrote it before exports were streamed."""
+    f = StringIO()
+    f.write('%arff file generated by the Dark Reactions Project provided by Haverford College\n')
+    f.write('\n@relation {}\n'.format(relationName))
+    if expanded:
+        headers = queryset.expandedArffHeaders(whitelistHeaders)
+    else:
+        headers = queryset.arffHeaders(whitelistHeaders)
+    f.write('\n'.join(headers.values()))
+    f.write('\n\n@data\n')
+    for row in queryset.rows(expanded, whitelistHeaders):
+        f.write(','.join(('"' + str(row.get(key)) + '"' if row.get(key) is not None else missing) for key in headers.keys()))
+        f.write('\n')
+    return f.getvalue()
+
+
+@createsUser('Aslan', 'old_magic')
+@signsExampleLicense('Aslan')
+@joinsLabGroup('Aslan', 'narnia')
+class StreamingExport(DRPTestCase):
+
+    """Downloads the reaction list and compound guide as csv and arff files, in chunks of two rows."""
+
+    def setUp(self):
+        """Create public reactions with descriptor values, some missing, and compounds, and log in as a staff member of their lab group."""
+        self.chunkSettings = override_settings(EXPORT_CHUNK_SIZE=2)
+        self.chunkSettings.enable()
+        labGroup = LabGroup.objects.get(title='narnia')
+        user = User.objects.get(username='Aslan')
+        user.is_staff = True
+        user.save()
+        number = NumRxnDescriptor.objects.create(name='number', heading='streamNumber', **MANUAL)
+        flag = BoolRxnDescriptor.objects.create(name='flag', heading='streamFlag', **MANUAL)
+        role = CompoundRole.objects.create(label='streamRole', description='streamRole')
+        compounds = []
+        for i, abbrev in enumerate(('water', 'ethanol', 'acetone', 'benzene', 'toluene')):
+            compound = Compound(abbrev=abbrev, name=abbrev, CSID=i + 1, custom=True, formula='H_{2}O', labGroup=labGroup,
+                                smiles='O' * (i + 1))
+            compound.save(calcDescriptors=False)
+            compounds.append(compound)
+        for i in range(5):
+            # quotes and commas, which the csv writer must escape
+            reaction = PerformedReaction.objects.create(labGroup=labGroup, user=user, reference='stream{}'.format(i), public=True,
+                                                        notes='a "quoted", note' if i % 2 else '')
+            if i != 3:
+                NumRxnDescriptorValue.objects.create(reaction=reaction, descriptor=number, value=None if i == 1 else i * 0.5)
+            if i % 3:
+                BoolRxnDescriptorValue.objects.create(reaction=reaction, descriptor=flag, value=i == 2)
+            for j, compound in enumerate(compounds[i % 3:]):
+                CompoundQuantity.objects.create(reaction=reaction, compound=compound, role=role, amount=j + 1)
+        self.reactions = PerformedReaction.objects.filter(labGroup=labGroup)
+        self.client = Client()
+        self.assertTrue(self.client.login(username='Aslan', password='old_magic'))
+
+    def download(self, url, params=None, **headers):
+        """Return a streamed response and its content, as a list of the chunks it was streamed in, decompressed if it was gzipped."""
+        response = self.client.get(url, params or {}, **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        chunks = list(response.streaming_content)
+        if response.get('Content-Encoding') == 'gzip':
+            chunks = [gzip.GzipFile(fileobj=StringIO(''.join(chunks))).read()]
+        return response, chunks
+
+    def reactionList(self):
+        """Return the reactions as the reaction list exports them."""
+        return visibleReactions(LabGroup.objects.get(title='narnia')).order_by('-insertedDateTime')
+
+    def assertExports(self, urlName, queryset):
+        """Assert that the csv and arff exports of a view, plain and expanded, are byte for byte those written in one go, and streamed in several chunks."""
+        for expanded in (False, True):
+            params = {'expanded': 1} if expanded else {}
+            for filetype, original in (('.csv', originalCsv), ('.arff', originalArff)):
+                response, chunks = self.download(reverse(urlName, kwargs={'filetype': filetype}), params)
+                self.assertEqual(''.join(chunks), original(queryset, expanded))
+                # the header, a chunk of two rows at a time, and what is left
+                self.assertGreater(len(chunks), 3)
+
+    def test_reactions(self):
+        """Test that the reaction list exports are those written in one go."""
+        self.assertExports('reactionlist_typed', self.reactionList())
+
+    def test_compounds(self):
+        """Test that the compound guide exports are those written in one go."""
+        self.assertExports('compoundguide', LabGroup.objects.get(title='narnia').compound_set.all())
+
+    def test_gzip(self):
+        """Test that an export is gzipped only when EXPORT_GZIP is set and the client accepts gzip, and varies on Accept-Encoding either way."""
+        url = reverse('reactionlist_typed', kwargs={'filetype': '.csv'})
+        expected = originalCsv(self.reactionList())
+        for gzipped, accepted, compressed in ((False, 'gzip', False), (True, None, False), (True, 'deflate', False),
+                                              (True, 'gzip', True), (True, 'deflate, gzip;q=1.0', True)):
+            headers = {} if accepted is None else {'HTTP_ACCEPT_ENCODING': accepted}
+            with override_settings(EXPORT_GZIP=gzipped):
+                response, chunks = self.download(url, **headers)
+            self.assertEqual(response.get('Content-Encoding'), 'gzip' if compressed else None)
+            self.assertIn('Accept-Encoding', response['Vary'])
+            self.assertEqual(response['Content-Disposition'], 'attachment; filename="reactions.csv"')
+            self.assertEqual(''.join(chunks), expected)
+
+    def tearDown(self):
+        """Delete the reactions, so that the compounds can be deleted along with the lab group, and the descriptors."""
+        CompoundQuantity.objects.filter(reaction__in=self.reactions).delete()
+        self.reactions.delete()
+        CompoundRole.objects.filter(label='streamRole').delete()
+        NumRxnDescriptor.objects.filter(heading='streamNumber').delete()
+        BoolRxnDescriptor.objects.filter(heading='streamFlag').delete()
+        self.chunkSettings.disable()
+
+
+suite = unittest.TestSuite([
+    loadTests(StreamingExport),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
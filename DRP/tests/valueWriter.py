@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Tests for the diff-based writer of descriptor values."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.tests.decorators import createsUser, joinsLabGroup, createsPerformedReaction, createsOrdRxnDescriptor
+from DRP.models import PerformedReaction, OrdRxnDescriptor, OrdRxnDescriptorValue
+from DRP.models.valueWriter import ValueWriter
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+
+@createsUser('Aslan', 'old_magic')
+@joinsLabGroup('Aslan', 'narnia')
+@createsPerformedReaction('narnia', 'Aslan', 'turkish_delight')
+@createsOrdRxnDescriptor('outcome', 1, 4)
+@createsOrdRxnDescriptor('purity', 1, 2)
+@createsOrdRxnDescriptor('manual', 1, 4)
+class WritesValues(DRPTestCase):
+
+    """Writes ordinal reaction descriptor values for two of three descriptors."""
+
+    def setUp(self):
+        """Set up a writer with a batch size of one, so that every statement is batched."""
+        self.reaction = PerformedReaction.objects.get(reference='turkish_delight')
+        self.descriptors = [OrdRxnDescriptor.objects.get(heading=heading) for heading in ('outcome', 'purity')]
+        self.writer = ValueWriter(OrdRxnDescriptorValue, self.descriptors, batchSize=1)
+
+    def write(self, *values):
+        """Write values for the writer's descriptors, in their order, leaving out any which are None."""
+        return self.writer.write([self.reaction], [OrdRxnDescriptorValue(reaction=self.reaction, descriptor=descriptor, value=value)
+                                                   for descriptor, value in zip(self.descriptors, values) if value is not None])
+
+    def stored(self):
+        """Return a dictionary of descriptor heading to stored value for the reaction."""
+        return dict(OrdRxnDescriptorValue.objects.filter(reaction=self.reaction).values_list('descriptor__heading', 'value'))
+
+    def counts(self, inserted=0, updated=0, deleted=0, unchanged=0):
+        """Return a dictionary of counts."""
+        return {'inserted': inserted, 'updated': updated, 'deleted': deleted, 'unchanged': unchanged}
+
+    def test_insert(self):
+        """Test that values which are not stored are inserted."""
+        self.assertEqual(self.write(1, 2), self.counts(inserted=2))
+        self.assertEqual(self.stored(), {'outcome': 1, 'purity': 2})
+
+    def test_unchanged(self):
+        """Test that values which are already stored are left alone."""
+        self.write(1, 2)
+        self.assertEqual(self.write(1, 2), self.counts(unchanged=2))
+        self.assertEqual(self.stored(), {'outcome': 1, 'purity': 2})
+
+    def test_update(self):
+        """Test that values which have changed are updated, each to its own value."""
+        self.write(1, 2)
+        self.assertEqual(self.write(3, 1), self.counts(updated=2))
+        self.assertEqual(self.stored(), {'outcome': 3, 'purity': 1})
+
+    def test_delete(self):
+        """Test that values which are no longer calculated are deleted."""
+        self.write(1, 2)
+        self.assertEqual(self.write(4, None), self.counts(updated=1, deleted=1))
+        self.assertEqual(self.stored(), {'outcome': 4})
+
+    def test_otherDescriptors(self):
+        """Test that the values of descriptors the writer was not set up for are left alone."""
+        OrdRxnDescriptorValue.objects.create(reaction=self.reaction, descriptor=OrdRxnDescriptor.objects.get(heading='manual'), value=3)
+        self.assertEqual(self.write(1, None), self.counts(inserted=1))
+        self.assertEqual(self.write(None, None), self.counts(deleted=1))
+        self.assertEqual(self.stored(), {'manual': 3})
+
+    def test_totals(self):
+        """Test that the writer keeps a running total of its counts."""
+        self.write(1, 2)
+        self.write(1, 3)
+        self.assertEqual(self.writer.counts, self.counts(inserted=2, updated=1, unchanged=1))
+
+
+suite = unittest.TestSuite([
+    loadTests(WritesValues),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""Tests for the long-lived Weka worker, using stubs which speak its protocol or stand in for java without Weka."""
+import unittest
+from DRPTestCase import DRPTestCase, runTests
+from DRP.ml_models import wekaWorker
+from DRP.ml_models.wekaWorker import WekaWorker, WekaError
+from django.test.utils import override_settings
+import tempfile
+import shutil
+import warnings
+import sys
+import os
+
+loadTests = unittest.TestLoader().loadTestsFromTestCase
+
+STUB_WORKER = r"""
+import sys
+for line in iter(sys.stdin.readline, ''):
+    fields = line.rstrip('\n').split('\t')
+    if fields[1] == 'crash':
+        sys.exit(1)
+    elif fields[1] == 'missing':
+        status, output = 'ERROR', 'ClassNotFoundException'
+    else:
+        status, output = 'OK', '|'.join(fields)
+    sys.stdout.write('{} {}\n{}'.format(status, len(output), output))
+    sys.stdout.flush()
+"""
+
+
+class StubWorker(DRPTestCase):
+
+    """Runs jobs through a stub worker."""
+
+    def setUp(self):
+        """Set up a worker running the stub."""
+        self.worker = WekaWorker([sys.executable, '-c', STUB_WORKER])
+
+    def test_output(self):
+        """Test that a job's output is returned, with its fields escaped in the request."""
+        self.assertEqual(self.worker.run('classify', ['weka.classifiers.trees.J48', '-t', 'a\tb\nc']),
+                         'classify|weka.classifiers.trees.J48|-t|a\\tb\\nc')
+
+    def test_outputs(self):
+        """Test that one worker runs a series of jobs."""
+        for i in range(3):
+            self.assertEqual(self.worker.run('select', ['Ranker', str(i)]), 'select|Ranker|{}'.format(i))
+
+    def test_error(self):
+        """Test that a job which fails raises an error, and the worker carries on."""
+        self.assertRaises(WekaError, self.worker.run, 'classify', ['missing'])
+        self.assertEqual(self.worker.run('classify', ['J48']), 'classify|J48')
+
+    def test_crash(self):
+        """Test that a worker which dies raises an error, and is replaced for the next job."""
+        self.assertRaises(WekaError, self.worker.run, 'classify', ['crash'])
+        self.assertEqual(self.worker.run('classify', ['J48']), 'classify|J48')
+
+    def tearDown(self):
+        """Stop the worker."""
+        self.worker.close()
+
+
+STUB_JAVA = """#!{}
+import sys
+sys.stdout.write(' '.join(sys.argv[1:]))
+"""
+
+FAILING_JAVAC = """#!{}
+import sys
+sys.exit(1)
+"""
+
+
+class CompileFallback(DRPTestCase):
+
+    """Runs jobs with WEKA_WORKER set where the worker cannot be compiled."""
+
+    def setUp(self):
+        """Put only a stub java, which prints its arguments, on the path."""
+        self.directory = tempfile.mkdtemp()
+        self.workerSettings = override_settings(WEKA_WORKER=True, TMP_DIR=self.directory,
+                                                WEKA_PATH={'3.6': os.path.join(self.directory, 'weka.jar')})
+        self.workerSettings.enable()
+        self.write('java', STUB_JAVA)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = self.directory
+
+    def write(self, name, script):
+        """Write an executable script to the directory on the path."""
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(script.format(sys.executable))
+        os.chmod(path, 0o755)
+
+    def assertFallsBack(self):
+        """Assert that jobs are run by starting java, with one warning that the worker could not be compiled and no build left behind."""
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            for i in range(2):
+                self.assertEqual(wekaWorker.runWeka('3.6', 'classify', ['J48', str(i)]), 'J48 {}'.format(i))
+        self.assertEqual(len(caught), 1)
+        self.assertIsNone(wekaWorker.worker('3.6'))
+        self.assertEqual([name for name in os.listdir(self.directory) if name.startswith('wekaWorker')], [])
+
+    def test_noJavac(self):
+        """Test that without javac each job starts java."""
+        self.assertFallsBack()
+
+    def test_compileFails(self):
+        """Test that if javac fails each job starts java."""
+        self.write('javac', FAILING_JAVAC)
+        self.assertFallsBack()
+
+    def tearDown(self):
+        """Restore the path, and forget that the worker could not be compiled."""
+        os.environ['PATH'] = self.path
+        wekaWorker._workers.pop((os.getpid(), '3.6'), None)
+        self.workerSettings.disable()
+        shutil.rmtree(self.directory)
+
+
+suite = unittest.TestSuite([
+    loadTests(StubWorker),
+    loadTests(CompileFallback),
+])
+
+if __name__ == '__main__':
+    runTests(suite)
+    # Runs the test- a good way to check that this particular test set works
+    # without having to run all the tests.
@@ -10,6 +10,12 @@ urls = [
     url('^(?P<filetype>.csv|.html|.arff)?$',
         DRP.views.reaction.ListPerformedReactions.as_view(), name='reactionlist_typed'),
     url('^/$', DRP.views.reaction.ListPerformedReactions.as_view(), name='reactionlist'),
+    url('^/export(?P<filetype>.csv|.arff)$',
+        DRP.views.reaction.ExportPerformedReactions.as_view(), name='reactionExport'),
+    url('^/export_(?P<job_id>\d+).json$',
+        DRP.views.reaction.ExportPerformedReactions.as_view(), name='reactionExportStatus'),
+    url('^/export_(?P<job_id>\d+)(?P<filetype>.csv|.arff)$',
+        DRP.views.reaction.downloadExport, name='reactionExportDownload'),
     url('^/add.html', DRP.views.reaction.createReaction, name='newReaction'),
     url('^/entry_(?P<rxn_id>\d+)/compoundquantities.html',
         DRP.views.reaction.addCompoundDetails, name="addCompoundDetails"),
@@ -11,10 +11,11 @@ from django.contrib.auth.decorators import login_required
 from django.core.urlresolvers import reverse_lazy as reverse
 from django.shortcuts import render, redirect
 from django.utils.http import urlencode
-from django.http import HttpResponse, Http404, HttpResponseForbidden
+from django.http import Http404, HttpResponseForbidden
 from django.template.loader import get_template
 from django.views.decorators.http import require_POST
 from django.template import RequestContext
+from helpers import streamingExport, exportChunkSize
 
 
 class CreateCompound(CreateView):
@@ -143,20 +144,11 @@ class ListCompound(ListView):
         if fileType in ('/', '.html', None):
             return super(ListCompound, self).dispatch(request, *args, **kwargs)
         elif fileType == '.csv':
-            response = HttpResponse(content_type='text/csv')
-            response['Content-Disposition'] = 'attachment; filename="compounds.csv"'
-            if 'expanded' in request.GET:
-                self.queryset.toCsv(response, True)
-            else:
-                self.queryset.toCsv(response)
+            response = streamingExport(request, self.queryset.csvChunks(
+                'expanded' in request.GET, chunkSize=exportChunkSize()), 'text/csv', 'compounds.csv')
         elif fileType == '.arff':
-            response = HttpResponse(content_type='text/vnd.weka.arff')
-            response[
-                'Content-Disposition'] = 'attachment; filename="compounds.arff"'
-            if 'expanded' in request.GET:
-                self.queryset.toArff(response, True)
-            else:
-                self.queryset.toArff(response)
+            response = streamingExport(request, self.queryset.arffChunks(
+                'expanded' in request.GET, chunkSize=exportChunkSize()), 'text/vnd.weka.arff', 'compounds.arff')
         else:
             raise RuntimeError(
                 'The user should not be able to provoke this code')
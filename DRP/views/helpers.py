@@ -1,6 +1,14 @@
 """A module of small useful functions for helpers."""
 from django.shortcuts import redirect as django_redir
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from django.conf import settings
+from DRP.models.querysets import EXPORT_CHUNK_SIZE
 import urllib
+import re
+
+acceptsGzip = re.compile(r'\bgzip\b')
 
 
 def redirect(url, *args, **kwargs):
@@ -10,3 +18,25 @@ def redirect(url, *args, **kwargs):
     if len(params) > 0:
         response['Location'] += '?' + urllib.urlencode(params)
     return response
+
+
+def streamingExport(request, chunks, contentType, fileName):
+    """
+    Return a streaming attachment response for an iterable of string chunks.
+
+    The response is gzipped as it is generated if EXPORT_GZIP is set and the client accepts it.
+    """
+    if getattr(settings, 'EXPORT_GZIP', False) and acceptsGzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        response = StreamingHttpResponse(
+            compress_sequence(chunks), content_type=contentType)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = StreamingHttpResponse(chunks, content_type=contentType)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(fileName)
+    return response
+
+
+def exportChunkSize():
+    """Return the number of rows in each chunk of a streamed export."""
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', EXPORT_CHUNK_SIZE)
@@ -1,8 +1,10 @@
 """A module containing views pertinent to the manipulation of reaction objects."""
 
 import urllib
-from django.views.generic import CreateView, ListView, UpdateView
-from DRP.models import PerformedReaction, OrdRxnDescriptorValue, CompoundQuantity
+import json
+from django.views.generic import CreateView, ListView, UpdateView, View
+from DRP.models import PerformedReaction, OrdRxnDescriptorValue, CompoundQuantity, ExportJob
+from DRP.models.ExportJob import DONE
 from DRP.models import NumRxnDescriptorValue, BoolRxnDescriptorValue, CatRxnDescriptorValue
 from DRP.forms import PerformedRxnForm, PerformedRxnDeleteForm
 from DRP.forms import NumRxnDescValFormFactory, OrdRxnDescValFormFactory, BoolRxnDescValFormFactory, CatRxnDescValFormFactory
@@ -14,13 +16,23 @@ from django.forms.models import modelformset_factory
 from DRP.forms import compoundQuantityFormFactory
 from django.forms.formsets import TOTAL_FORM_COUNT
 from django.shortcuts import render
-from helpers import redirect
-from django.http import HttpResponse, Http404, HttpResponseForbidden
+from helpers import redirect, streamingExport, exportChunkSize
+from django.http import HttpResponse, Http404, HttpResponseForbidden, FileResponse
+from django.core.urlresolvers import reverse
 from django.views.decorators.http import require_POST
 from django.core.exceptions import PermissionDenied
 from django.contrib import messages
 
 
+def visibleReactions(labGroup):
+    """Return the performed reactions which may be viewed with the given lab group selected."""
+    if labGroup is not None:
+        return PerformedReaction.objects.filter(
+            reaction_ptr__in=labGroup.reaction_set.all()) | PerformedReaction.objects.filter(public=True)
+    else:
+        return PerformedReaction.objects.filter(public=True)
+
+
 class ListPerformedReactions(ListView):
 
     """Standard list view of performed reactions, adjusted to deal with a few DRP idiosyncrasies."""
@@ -33,12 +45,7 @@ class ListPerformedReactions(ListView):
     @labGroupSelected  # sets self.labGroup
     def dispatch(self, request, filetype=None, *args, **kwargs):
         """Render the view according to the appropriate filetype."""
-        if self.labGroup is not None:
-            self.queryset = PerformedReaction.objects.filter(
-                reaction_ptr__in=self.labGroup.reaction_set.all()) | PerformedReaction.objects.filter(public=True)
-        else:
-            self.queryset = PerformedReaction.objects.filter(public=True)
-        self.queryset = self.queryset.order_by('-insertedDateTime')
+        self.queryset = visibleReactions(self.labGroup).order_by('-insertedDateTime')
 
         if filetype is None:
             response = super(ListPerformedReactions, self).dispatch(
@@ -52,21 +59,14 @@ class ListPerformedReactions(ListView):
                 request, *args, **kwargs)
         elif filetype == '.csv':
             self.paginate_by = None
-            response = HttpResponse(content_type='text/csv')
-            response['Content-Disposition'] = 'attachment; filename="reactions.csv"'
-            if 'expanded' in request.GET and request.user.is_authenticated() and user.is_staff:
-                self.queryset.toCsv(response, True)
-            else:
-                self.queryset.toCsv(response)
+            expanded = 'expanded' in request.GET and request.user.is_authenticated() and request.user.is_staff
+            response = streamingExport(request, self.queryset.csvChunks(
+                expanded, chunkSize=exportChunkSize()), 'text/csv', 'reactions.csv')
         elif filetype == '.arff':
             self.paginate_by = None
-            response = HttpResponse(content_type='text/vnd.weka.arff')
-            response[
-                'Content-Disposition'] = 'attachment; filename="reactions.arff"'
-            if 'expanded' in request.GET and request.user.is_authenticated() and user.is_staff:
-                self.queryset.toArff(response, True)
-            else:
-                self.queryset.toArff(response)
+            expanded = 'expanded' in request.GET and request.user.is_authenticated() and request.user.is_staff
+            response = streamingExport(request, self.queryset.arffChunks(
+                expanded, chunkSize=exportChunkSize()), 'text/vnd.weka.arff', 'reactions.arff')
         return response
 
     def get_context_data(self, **kwargs):
@@ -77,6 +77,58 @@ class ListPerformedReactions(ListView):
         return context
 
 
+class ExportPerformedReactions(View):
+
+    """Queue csv and arff exports of the reaction list to be rendered in the background, and report on their progress."""
+
+    @method_decorator(login_required)
+    @labGroupSelected  # sets self.labGroup
+    def dispatch(self, request, *args, **kwargs):
+        """Ensure that the user is logged in and has selected a lab group."""
+        return super(ExportPerformedReactions, self).dispatch(request, *args, **kwargs)
+
+    def post(self, request, filetype):
+        """Queue an export of the visible reactions, or find the existing export if the reactions have not changed."""
+        expanded = 'expanded' in request.POST and request.user.is_staff
+        job = ExportJob.objects.enqueue(visibleReactions(
+            self.labGroup), filetype.lstrip('.'), expanded, user=request.user)
+        return self.status(job)
+
+    def get(self, request, job_id):
+        """Report on the progress of an export."""
+        return self.status(visibleExportJob(request.user, job_id))
+
+    def status(self, job):
+        """Return a json description of an export job."""
+        status = {'id': job.pk, 'state': job.state, 'current': job.isCurrent,
+                  'url': reverse('reactionExportDownload', args=(job.pk, '.' + job.fileFormat)) if job.state == DONE else None,
+                  'error': job.error}
+        return HttpResponse(json.dumps(status), content_type='application/json')
+
+
+def visibleExportJob(user, job_id):
+    """Return an export job, raising a 404 unless the user may see every reaction in it."""
+    try:
+        job = ExportJob.objects.get(pk=job_id)
+    except ExportJob.DoesNotExist:
+        raise Http404("This export cannot be found")
+    if not job.visibleTo(user):
+        raise Http404("This export cannot be found")
+    return job
+
+
+@login_required
+def downloadExport(request, job_id, filetype):
+    """Send the rendered file of an export to a user who may see its reactions."""
+    job = visibleExportJob(request.user, job_id)
+    if job.state != DONE or filetype.lstrip('.') != job.fileFormat:
+        raise Http404("This export cannot be found")
+    contentType = 'text/vnd.weka.arff' if job.fileFormat == 'arff' else 'text/csv'
+    response = FileResponse(job.artifact.open('rb'), content_type=contentType)
+    response['Content-Disposition'] = 'attachment; filename="reactions{}"'.format(filetype)
+    return response
+
+
 @login_required
 @hasSignedLicense
 @userHasLabGroup